@@ -424,71 +424,7 @@ class DataManager:
         """
         conn = self.get_db_sqlite()
         try:
-            # 获取该虚拟机的现有状态
-            cursor = conn.execute(
-                "SELECT status_data FROM vm_status WHERE hs_name = ? AND vm_uuid = ?",
-                (hs_name, vm_uuid)
-            )
-            row = cursor.fetchone()
-            
-            # 解析现有状态列表
-            if row:
-                status_data_raw = json.loads(row["status_data"])
-                # 确保status_list是列表类型
-                if isinstance(status_data_raw, list):
-                    status_list = status_data_raw
-                elif isinstance(status_data_raw, dict):
-                    # 如果是字典，转换为包含单个元素的列表
-                    status_list = [status_data_raw]
-                    logger.warning(f"[DataManage] 虚拟机 {vm_uuid} 的状态数据格式异常（字典），已转换为列表")
-                else:
-                    # 其他情况，初始化为空列表
-                    status_list = []
-                    logger.warning(f"[DataManage] 虚拟机 {vm_uuid} 的状态数据格式未知，已重置为空列表")
-            else:
-                status_list = []
-
-            # 转换状态对象为字典
-            status_dict = status.__save__() if hasattr(status, '__save__') else status
-            
-            # 累加流量消耗：从数据库取出之前的flu_usage，加上当前的
-            if len(status_list) > 0:
-                # 获取最后一条状态记录中的flu_usage
-                last_status = status_list[-1]
-                previous_flu_usage = last_status.get('flu_usage', 0) if isinstance(last_status, dict) else 0
-                current_flu_usage = status_dict.get('flu_usage', 0) if isinstance(status_dict, dict) else 0
-                # 累加流量
-                status_dict['flu_usage'] = previous_flu_usage + current_flu_usage
-                logger.debug(f"[DataManage] 流量累加: 之前={previous_flu_usage}MB, 本次={current_flu_usage}MB, 累计={status_dict['flu_usage']}MB")
-            else:
-                logger.debug(f"[DataManage] 首次上报流量: {status_dict.get('flu_usage', 0)}MB")
-            
-            # 添加新状态到列表
-            status_list.append(status_dict)
-
-            # 限制状态历史记录数量（保留最近100条）
-            if len(status_list) > 43200:
-                status_list = status_list[-43200:]
-
-            # 序列化状态列表
-            status_data = json.dumps(status_list)
-            
-            # 更新或插入该虚拟机的状态（使用REPLACE语句，会更新recorded_at为当前时间）
-            if row:
-                # 更新现有记录
-                conn.execute(
-                    "UPDATE vm_status SET status_data = ?, recorded_at = CURRENT_TIMESTAMP WHERE hs_name = ? AND vm_uuid = ?",
-                    (status_data, hs_name, vm_uuid)
-                )
-                logger.debug(f"[DataManage] 更新虚拟机 {vm_uuid} 状态，记录数: {len(status_list)}")
-            else:
-                # 插入新记录
-                conn.execute(
-                    "INSERT INTO vm_status (hs_name, vm_uuid, status_data) VALUES (?, ?, ?)",
-                    (hs_name, vm_uuid, status_data)
-                )
-                logger.debug(f"[DataManage] 插入虚拟机 {vm_uuid} 状态，记录数: {len(status_list)}")
-            
+            self._add_vm_status(conn, hs_name, vm_uuid, status)
             conn.commit()
             logger.debug(f"[DataManage] 虚拟机 {vm_uuid} 状态保存成功")
             return True
@@ -501,6 +437,98 @@ class DataManager:
         finally:
             conn.close()
 
+    def add_vm_status_batch(self, hs_name: str, vm_status: Dict[str, Any]) -> bool:
+        """
+        批量添加虚拟机状态（一个连接、一个事务内完成）
+        :param hs_name: 主机名称
+        :param vm_status: 虚拟机UUID到状态对象（HWStatus）的映射
+        :return: 是否成功
+        """
+        if not vm_status:
+            return True
+        conn = self.get_db_sqlite()
+        try:
+            for vm_uuid, status in vm_status.items():
+                self._add_vm_status(conn, hs_name, vm_uuid, status)
+            conn.commit()
+            logger.debug(f"[DataManage] 批量保存虚拟机状态成功，主机: {hs_name}, 数量: {len(vm_status)}")
+            return True
+        except Exception as e:
+            logger.error(f"[DataManage] 批量添加虚拟机状态失败: {e}")
+            import traceback
+            traceback.print_exc()
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+    def _add_vm_status(self, conn: sqlite3.Connection, hs_name: str, vm_uuid: str, status: Any):
+        """在给定连接中追加一条虚拟机状态（不提交事务）"""
+        # 获取该虚拟机的现有状态
+        cursor = conn.execute(
+            "SELECT status_data FROM vm_status WHERE hs_name = ? AND vm_uuid = ?",
+            (hs_name, vm_uuid)
+        )
+        row = cursor.fetchone()
+
+        # 解析现有状态列表
+        if row:
+            status_data_raw = json.loads(row["status_data"])
+            # 确保status_list是列表类型
+            if isinstance(status_data_raw, list):
+                status_list = status_data_raw
+            elif isinstance(status_data_raw, dict):
+                # 如果是字典，转换为包含单个元素的列表
+                status_list = [status_data_raw]
+                logger.warning(f"[DataManage] 虚拟机 {vm_uuid} 的状态数据格式异常（字典），已转换为列表")
+            else:
+                # 其他情况，初始化为空列表
+                status_list = []
+                logger.warning(f"[DataManage] 虚拟机 {vm_uuid} 的状态数据格式未知，已重置为空列表")
+        else:
+            status_list = []
+
+        # 转换状态对象为字典
+        status_dict = status.__save__() if hasattr(status, '__save__') else status
+
+        # 累加流量消耗：从数据库取出之前的flu_usage，加上当前的
+        if len(status_list) > 0:
+            # 获取最后一条状态记录中的flu_usage
+            last_status = status_list[-1]
+            previous_flu_usage = last_status.get('flu_usage', 0) if isinstance(last_status, dict) else 0
+            current_flu_usage = status_dict.get('flu_usage', 0) if isinstance(status_dict, dict) else 0
+            # 累加流量
+            status_dict['flu_usage'] = previous_flu_usage + current_flu_usage
+            logger.debug(f"[DataManage] 流量累加: 之前={previous_flu_usage}MB, 本次={current_flu_usage}MB, 累计={status_dict['flu_usage']}MB")
+        else:
+            logger.debug(f"[DataManage] 首次上报流量: {status_dict.get('flu_usage', 0)}MB")
+
+        # 添加新状态到列表
+        status_list.append(status_dict)
+
+        # 限制状态历史记录数量（保留最近100条）
+        if len(status_list) > 43200:
+            status_list = status_list[-43200:]
+
+        # 序列化状态列表
+        status_data = json.dumps(status_list)
+
+        # 更新或插入该虚拟机的状态（使用REPLACE语句，会更新recorded_at为当前时间）
+        if row:
+            # 更新现有记录
+            conn.execute(
+                "UPDATE vm_status SET status_data = ?, recorded_at = CURRENT_TIMESTAMP WHERE hs_name = ? AND vm_uuid = ?",
+                (status_data, hs_name, vm_uuid)
+            )
+            logger.debug(f"[DataManage] 更新虚拟机 {vm_uuid} 状态，记录数: {len(status_list)}")
+        else:
+            # 插入新记录
+            conn.execute(
+                "INSERT INTO vm_status (hs_name, vm_uuid, status_data) VALUES (?, ?, ?)",
+                (hs_name, vm_uuid, status_data)
+            )
+            logger.debug(f"[DataManage] 插入虚拟机 {vm_uuid} 状态，记录数: {len(status_list)}")
+
     def set_vm_status(self, hs_name: str, vm_status: Dict[str, List[Any]]) -> bool:
         """保存虚拟机状态"""
         conn = self.get_db_sqlite()
@@ -1,6 +1,7 @@
 import json
 import secrets
 import traceback
+from contextlib import nullcontext
 
 from loguru import logger
 
@@ -12,6 +13,7 @@ from MainObject.Config.VMConfig import VMConfig
 from MainObject.Config.WebProxy import WebProxy
 from MainObject.Public.ZMessage import ZMessage
 from HostModule.DataManager import DataManager
+from HostModule.PoolManager import PoolManager
 
 
 class HostManage:
@@ -22,6 +24,9 @@ class HostManage:
         self.bearer: str = ""  # 先初始化saving变量
         self.saving = DataManager("./DataSaving/hostmanage.db")
         self.proxys: HttpManager | None = None
+        # 是否为后台服务进程：仅服务进程启动代理管理器与各主机服务（websockify、电源订阅等），
+        # 其余进程只读加载配置
+        self.service: bool = True
         # 删除 self.web_all，不再使用全局代理列表
         self.set_conf()
 
@@ -80,7 +85,8 @@ class HostManage:
             hs_conf.server_name = hs_name
             self.engine[hs_name] = HEConfig[hs_type]["Imported"](hs_conf, db=self.saving)
             self.engine[hs_name].HSCreate()
-            self.engine[hs_name].HSLoader()
+            if self.service:
+                self.engine[hs_name].HSLoader()
             # 保存主机配置到数据库
             self.saving.set_hs_config(hs_name, hs_conf)
             return ZMessage(success=True, message="主机添加成功")
@@ -121,8 +127,9 @@ class HostManage:
             # 恢复虚拟机配置（状态数据已在数据库中）
             self.engine[hs_name].vm_saving = old_vm_saving
 
-            self.engine[hs_name].HSUnload()
-            self.engine[hs_name].HSLoader()
+            if self.service:
+                self.engine[hs_name].HSUnload()
+                self.engine[hs_name].HSLoader()
             # 保存主机配置到数据库
             self.saving.set_hs_config(hs_name, hs_conf)
             return ZMessage(success=True, message="主机更新成功")
@@ -136,6 +143,8 @@ class HostManage:
         try:
             if hs_name not in self.engine:
                 return ZMessage(success=False, message="主机未找到")
+            if not self.service:
+                return ZMessage(success=False, message="主机服务仅在后台服务进程中运行")
             if hs_flag:
                 self.engine[hs_name].HSLoader()
             else:
@@ -147,8 +156,12 @@ class HostManage:
             return ZMessage(success=False, message=f"修改主机状态失败: {str(e)}")
 
     # 加载信息 ###################################################################
-    def all_load(self):
-        """从数据库加载所有信息"""
+    def all_load(self, service: bool = True):
+        """
+        从数据库加载所有信息
+        :param service: 是否为后台服务进程，否则只读加载，不启动Caddy与主机服务
+        """
+        self.service = service
         try:
             # 加载全局日志
             self.logger = []
@@ -156,77 +169,88 @@ class HostManage:
             for log_data in global_logs:
                 self.logger.append(ZMessage(**log_data) if isinstance(log_data, dict) else log_data)
 
-            # 启动Http实例
-            self.proxys = HttpManager()
-            # 不再调用 global_get，因为代理配置现在在虚拟机中
-            self.proxys.config_all()
-            self.proxys.launch_web()
+            # 启动Http实例（仅后台服务进程）
+            if service:
+                self.proxys = HttpManager()
+                # 不再调用 global_get，因为代理配置现在在虚拟机中
+                self.proxys.config_all()
+                self.proxys.launch_web()
+            else:
+                self.proxys = None
+                logger.warning("[HostManage] 非后台服务进程，只读加载配置，不启动代理与主机服务")
 
             # 删除全局代理配置的加载，不再使用 web_all
 
-            # 加载所有主机配置
-            host_configs = self.saving.all_hs_config()
-            for host_config in host_configs:
-                hs_name = host_config["hs_name"]
-
-                # 重建HSConfig对象
-                hs_conf_data = dict(host_config)
-                hs_conf_data["extend_data"] = json.loads(host_config["extend_data"]) if host_config[
-                    "extend_data"] else {}
-                # 解析新字段的JSON数据
-                hs_conf_data["system_maps"] = json.loads(host_config["system_maps"]) if host_config.get(
-                    "system_maps") else {}
-                hs_conf_data["images_maps"] = json.loads(host_config["images_maps"]) if host_config.get(
-                    "images_maps") else {}
-                hs_conf_data["public_addr"] = json.loads(host_config["public_addr"]) if host_config.get(
-                    "public_addr") else []
-                hs_conf_data["server_dnss"] = json.loads(host_config["server_dnss"]) if host_config.get(
-                    "server_dnss") else []
-                hs_conf_data["ipaddr_maps"] = json.loads(host_config["ipaddr_maps"]) if host_config.get(
-                    "ipaddr_maps") else {}
-                hs_conf_data["ipaddr_dnss"] = json.loads(host_config["ipaddr_dnss"]) if host_config.get(
-                    "ipaddr_dnss") else ["119.29.29.29", "223.5.5.5"]
-
-                # 移除数据库字段，只保留配置字段
-                for field in ["id", "hs_name", "created_at", "updated_at"]:
-                    hs_conf_data.pop(field, None)
-
-                hs_conf = HSConfig(**hs_conf_data)
-                # 设置server_name（关键！）=================
-                hs_conf.server_name = hs_name
-
-                # 获取主机完整数据
-                host_full_data = self.saving.get_ap_server(hs_name)
-
-                # 转换 vm_saving 字典为 VMConfig 对象
-                vm_saving_converted = {}
-                for vm_uuid, vm_config in host_full_data["vm_saving"].items():
-                    if isinstance(vm_config, dict):
-                        vm_saving_converted[vm_uuid] = VMConfig(**vm_config)
-                    else:
-                        vm_saving_converted[vm_uuid] = vm_config
-                    for web_data in vm_saving_converted[vm_uuid].web_all:
-                        self.proxys.create_web(
-                            (web_data.lan_port, web_data.lan_addr),
-                            web_data.web_addr, is_https=web_data.is_https
+            # 加载所有主机配置（代理路由在批量上下文内收集，结束时一次推送）
+            with self.proxys.batch() if self.proxys else nullcontext():
+                host_configs = self.saving.all_hs_config()
+                for host_config in host_configs:
+                    hs_name = host_config["hs_name"]
+
+                    # 重建HSConfig对象
+                    hs_conf_data = dict(host_config)
+                    hs_conf_data["extend_data"] = json.loads(host_config["extend_data"]) if host_config[
+                        "extend_data"] else {}
+                    # 解析新字段的JSON数据
+                    hs_conf_data["system_maps"] = json.loads(host_config["system_maps"]) if host_config.get(
+                        "system_maps") else {}
+                    hs_conf_data["images_maps"] = json.loads(host_config["images_maps"]) if host_config.get(
+                        "images_maps") else {}
+                    hs_conf_data["public_addr"] = json.loads(host_config["public_addr"]) if host_config.get(
+                        "public_addr") else []
+                    hs_conf_data["server_dnss"] = json.loads(host_config["server_dnss"]) if host_config.get(
+                        "server_dnss") else []
+                    hs_conf_data["ipaddr_maps"] = json.loads(host_config["ipaddr_maps"]) if host_config.get(
+                        "ipaddr_maps") else {}
+                    hs_conf_data["ipaddr_dnss"] = json.loads(host_config["ipaddr_dnss"]) if host_config.get(
+                        "ipaddr_dnss") else ["119.29.29.29", "223.5.5.5"]
+
+                    # 移除数据库字段，只保留配置字段
+                    for field in ["id", "hs_name", "created_at", "updated_at"]:
+                        hs_conf_data.pop(field, None)
+
+                    hs_conf = HSConfig(**hs_conf_data)
+                    # 设置server_name（关键！）=================
+                    hs_conf.server_name = hs_name
+
+                    # 获取主机完整数据
+                    host_full_data = self.saving.get_ap_server(hs_name)
+
+                    # 转换 vm_saving 字典为 VMConfig 对象
+                    vm_saving_converted = {}
+                    for vm_uuid, vm_config in host_full_data["vm_saving"].items():
+                        if isinstance(vm_config, dict):
+                            vm_saving_converted[vm_uuid] = VMConfig(**vm_config)
+                        else:
+                            vm_saving_converted[vm_uuid] = vm_config
+                        for web_data in vm_saving_converted[vm_uuid].web_all:
+                            if self.proxys is None:
+                                break
+                            self.proxys.create_web(
+                                (web_data.lan_port, web_data.lan_addr),
+                                web_data.web_addr, is_https=web_data.is_https
+                            )
+
+                    # 创建BaseServer实例（状态数据由DataManage立即保存）=================
+                    if hs_conf.server_type in HEConfig:
+                        server_class = HEConfig[hs_conf.server_type]["Imported"]
+                        self.engine[hs_name] = server_class(
+                            hs_conf,
+                            db=self.saving,
+                            vm_saving=vm_saving_converted
                         )
-
-                # 创建BaseServer实例（状态数据由DataManage立即保存）=================
-                if hs_conf.server_type in HEConfig:
-                    server_class = HEConfig[hs_conf.server_type]["Imported"]
-                    self.engine[hs_name] = server_class(
-                        hs_conf,
-                        db=self.saving,
-                        vm_saving=vm_saving_converted
-                    )
-                    self.engine[hs_name].HSLoader()
+                        if service:
+                            self.engine[hs_name].HSLoader()
         except Exception as e:
             logger.error(f"加载数据时出错: {e}")
             traceback.print_exc()
 
     # 保存信息 ###################################################################
     def all_save(self) -> bool:
-        """保存所有信息到数据库"""
+        """保存所有信息到数据库（非后台服务进程为只读，不写入）"""
+        if not self.service:
+            logger.warning("只读实例不保存配置，修改请求应由后台服务进程处理")
+            return False
         try:
             success = True
             # 保存全局日志
@@ -247,8 +271,10 @@ class HostManage:
 
     # 退出程序 ###################################################################
     def all_exit(self):
-        for server in self.engine:
-            self.engine[server].HSUnload()
+        if self.service:
+            for server in self.engine:
+                self.engine[server].HSUnload()
+        PoolManager.shutdown()
 
     # 扫描虚拟机 #################################################################
     def vms_scan(self, hs_name: str, prefix: str = "") -> ZMessage:
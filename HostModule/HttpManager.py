@@ -1,19 +1,27 @@
 import os
+import re
+import json
 import time
-import signal
+import bisect
 import random
+import hashlib
+import threading
 import traceback
 import subprocess
+import urllib.error
+import urllib.request
 from pathlib import Path
+from contextlib import contextmanager
 from HostModule.DataManager import DataManager
 
 
 class HttpManager:
     # 初始化 #####################################################################################
     def __init__(self,
-                 config_name="HttpManage.txt",
+                 config_name="HttpManage.json",
                  proxys_type="tty",
-                 proxys_addr="127.0.0.1"):
+                 proxys_addr="127.0.0.1",
+                 debounce=0.05):
         # 初始化二进制进程和配置文件 =======================
         self.proxys_port = 0
         self.proxys_addr = proxys_addr
@@ -37,6 +45,24 @@ class HttpManager:
         #   }
         # } ================================================
         self.proxys_list = {}
+        # 管理接口状态: { srv端口: [(优先级, 路由ID), ...] } ===
+        # 与Caddy中各服务器routes数组顺序一致，用于计算插入位置
+        self.admin_live: dict[str, list[tuple[int, str]]] = {}
+        # 各服务器已推送的automatic_https.skip列表: { srv端口: [域名] } ====
+        self.admin_skip: dict[str, list[str]] = {}
+        self.admin_conf = {}
+        self.admin_lock = threading.RLock()
+        self.admin_timeout = 5
+        self.submit_timeout = 30  # 等待合并推送完成的最长时间(秒)
+        # 变更合并: 防抖窗口(秒)内的变更一次推送 ============
+        self.debounce = debounce
+        self.pending = []  # [(推送函数, 回滚函数, 提交时间)]
+        self.flush_wait = None  # 当前窗口的等待对象
+        self.batch_depth = 0
+        self.batch_lock = threading.Lock()
+        self.stats = {"flushes": 0, "changes": 0, "coalesced": 0, "failed": 0,
+                      "last_changes": 0, "last_push_ms": 0.0,
+                      "last_latency_ms": 0.0, "max_latency_ms": 0.0}
         # 设置二进制路径 ===================================
         if os.name == 'nt':
             self.binary_path += ".exe"
@@ -51,90 +77,152 @@ class HttpManager:
               f"管理端口: {self.manage_port}，"
               f"配置文件: {self.config_file}")
 
-    # 生成完整的Caddy配置文件 ####################################################################
+    # 生成完整的Caddy配置（仅启动或管理接口不可用时使用）#########################
+    # 每条路由带有"@id"，之后的增删均通过管理接口按ID逐条修改，不再整体重载
+    # ###########################################################################
     def config_all(self):
-        # 使用实例的管理端口生成全局配置
-        config = f"{{\n\tadmin localhost:{self.manage_port}\n}}\n\n"
-        # 生成普通代理配置 #######################################################################
-        for domain, proxy_info in self.proxys_list.items():
-            port, ip = proxy_info["target"]
-            is_https = proxy_info.get("is_https", True)
-            listen_port = proxy_info.get("listen_port")
-            should_add_port = listen_port not in (None, 0, 80, 443)
-            if domain.startswith("/") or domain == "":
-                url = f"*:{listen_port}"
-            elif should_add_port:
-                protocol = "https" if is_https else "http"
-                url = f"{protocol}://{domain}:{listen_port}"
-            else:
-                url = domain if is_https else f"http://{domain}"
-            # 后端目标协议
-            backend_protocol = "https" if is_https else "http"
-            if domain.find("/") > -1:  # 存在子路径
-                sub_path = "/" + "/".join(domain.split("/")[1:])
-                config += (
-                    f"{url} "
-                    f"{{\n\t@secret path {sub_path}\n"
-                    f"\treverse_proxy "
-                    f"{backend_protocol}://{ip}:{port}\n"
-                    f"}}\n\n")
-            else:
-                config += (
-                    f"{url} "
-                    f"{{\n\treverse_proxy "
-                    f"{backend_protocol}://{ip}:{port}\n"
-                    f"}}\n\n")
-        # 生成SSH代理配置 ########################################################################
-        if self.proxys_sshd:
+        servers = {}
+        with self.admin_lock:
+            self.admin_live = {}
+            for domain, proxy_info in self.proxys_list.items():
+                port, route = self.web_route(domain, proxy_info)
+                self.route_insert(servers, port, route)
             for listen_port, token_dict in self.proxys_sshd.items():
-                config += ":%s {\n" % listen_port
+                servers.setdefault(self.server_name(listen_port), self.server_body(listen_port))
                 if self.proxys_type == "vmk":
-                    # 静态文件代理
-                    config += f"\thandle_path /static/* {{\n"
-                    config += f"\t\troot * VNCConsole/vSphere\n"
-                    config += f"\t\tfile_server\n"
-                    config += f"\t}}\n"
-                    config += f"\t@websockets {{\n"
-                    config += f"\theader Connection *Upgrade*\n"
-                    config += f"\theader Upgrade websocket\n"
-                    config += f"\t}}\n"
-                for token, (target_ip, target_port) in token_dict.items():
-                    # TTY代理 ====================================================================
-                    if self.proxys_type == "tty":
-                        config += f"\thandle_path /{token}* {{\n"
-                        config += f"\t\treverse_proxy http://{target_ip}:{target_port} {{\n"
-                        config += f"\t\theader_up Host {{http.axio.host}}\n"
-                        config += f"\t\theader_up X-Real-IP {{http.axio.remote.host}}\n"
-                        config += f"\t\theader_up X-Forwarded-For {{http.axio.remote.host}}\n"
-                        config += f"\t\theader_up REMOTE-HOST {{http.axio.remote.host}}\n"
-                        config += f"\t\theader_up Connection {{http.axio.header.Connection}}\n"
-                        config += f"\t\theader_up Upgrade {{http.axio.header.Upgrade}}\n"
-                        config += f"\t}}\n"
-                        config += f"\t}}\n"
-                    # VMK代理 ====================================================================
-                    elif self.proxys_type == "vmk":
-                        # 生成 ticket_path =================================
-                        ticket_path = str(target_port)
-                        if "/" in str(target_port):
-                            ticket_path = str(target_port).split("/")[1]
-                            target_port = str(target_port).split("/")[0]
-                        # WebSocket 反向代理
-                        config += f"\thandle_path /{token}/ws/* {{\n"
-                        config += f"\t\treverse_proxy https://{target_ip}:{target_port} {{\n"
-                        config += f"\t\t\theader_up Host {{http.axio.host}}\n"
-                        config += f"\t\t\theader_up X-Real-IP {{http.axio.remote.host}}\n"
-                        config += f"\t\t\theader_up X-Forwarded-For {{http.axio.remote.host}}\n"
-                        config += f"\t\t\theader_up REMOTE-HOST {{http.axio.remote.host}}\n"
-                        config += f"\t\t\theader_up Connection {{http.axio.header.Connection}}\n"
-                        config += f"\t\t\theader_up Upgrade {{http.axio.header.Upgrade}}\n"
-                        # config += f"\t\t\theader_up X-Target-Path /ticket/{ticket_path}\n"
-                        config += f"\t\t\ttransport http {{\n"
-                        config += f"\t\t\t\ttls_insecure_skip_verify\n"
-                        config += f"\t\t\t}}\n"
-                        config += f"\t\t}}\n"
-                        config += f"\t}}\n"
-                        # 返回 test.html 模板
-                        html_template = f'''<!DOCTYPE html PUBLIC"-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+                    self.route_insert(servers, listen_port, self.vmk_static(listen_port))
+                for token, target in token_dict.items():
+                    for route in self.vnc_routes(token, target):
+                        self.route_insert(servers, listen_port, route)
+            self.admin_skip = {}
+            for name, server in servers.items():
+                skip = self.web_skip(server["listen"][0].lstrip(":"))
+                if skip:
+                    server["automatic_https"] = {"skip": skip}
+                    self.admin_skip[name] = skip
+            config = {"admin": {"listen": f"localhost:{self.manage_port}"},
+                      "apps": {"http": {"servers": servers}}}
+            # 保存配置文件 ======================================================
+            self.config_file.write_text(
+                json.dumps(config, ensure_ascii=False, indent=1), encoding="utf-8")
+            self.admin_conf = config
+        return True
+
+    # 服务器名称与结构 ###########################################################
+    @staticmethod
+    def server_name(port) -> str:
+        return f"srv{port}"
+
+    @staticmethod
+    def server_body(port) -> dict:
+        return {"listen": [f":{port}"], "routes": []}
+
+    # 路由ID（域名/令牌中的特殊字符替换后附加短哈希，避免冲突）###################
+    @staticmethod
+    def route_id(kind: str, name: str) -> str:
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+        return f"{kind}_{re.sub(r'[^0-9A-Za-z]', '_', name)[:48]}_{digest}"
+
+    # 路由优先级：带路径 < 仅域名 < 无匹配（同端口下依次匹配）####################
+    @staticmethod
+    def route_rank(route: dict) -> int:
+        match = (route.get("match") or [{}])[0]
+        if "path" in match:
+            return 0
+        if "host" in match:
+            return 1
+        return 2
+
+    # 按优先级插入路由并记录位置，返回插入下标 ###################################
+    def route_insert(self, servers: dict, port, route: dict) -> int:
+        name = self.server_name(port)
+        server = servers.setdefault(name, self.server_body(port))
+        ranks = self.admin_live.setdefault(name, [])
+        rank = self.route_rank(route)
+        index = bisect.bisect_right([item[0] for item in ranks], rank)
+        ranks.insert(index, (rank, route["@id"]))
+        server["routes"].insert(index, route)
+        return index
+
+    # 反向代理处理器 =============================================================
+    @staticmethod
+    def proxy_handler(target_ip, target_port, tls=False,
+                      insecure=False, headers=False) -> dict:
+        handler = {"handler": "reverse_proxy",
+                   "upstreams": [{"dial": f"{target_ip}:{target_port}"}]}
+        if tls:
+            handler["transport"] = {"protocol": "http", "tls": {}}
+            if insecure:
+                handler["transport"]["tls"]["insecure_skip_verify"] = True
+        if headers:
+            handler["headers"] = {"request": {"set": {
+                "Host": ["{http.axio.host}"],
+                "X-Real-IP": ["{http.axio.remote.host}"],
+                "X-Forwarded-For": ["{http.axio.remote.host}"],
+                "REMOTE-HOST": ["{http.axio.remote.host}"],
+                "Connection": ["{http.axio.header.Connection}"],
+                "Upgrade": ["{http.axio.header.Upgrade}"]}}}
+        return handler
+
+    # 普通代理路由 ###############################################################
+    # :return: (监听端口, 路由)
+    # ###########################################################################
+    def web_route(self, domain: str, proxy_info: dict) -> tuple[int, dict]:
+        port, ip = proxy_info["target"]
+        is_https = proxy_info.get("is_https", True)
+        listen_port = proxy_info.get("listen_port")
+        if listen_port in (None, 0) or (
+                listen_port in (80, 443) and not domain.startswith("/") and domain != ""):
+            listen_port = 443 if is_https else 80
+        match = {}
+        host = domain.split("/")[0]
+        if host:
+            match["host"] = [host]
+        if domain.find("/") > -1:  # 存在子路径
+            sub_path = "/" + "/".join(domain.split("/")[1:])
+            match["path"] = [sub_path, sub_path.rstrip("/") + "/*"]
+        route = {"@id": self.route_id("web", domain),
+                 "handle": [self.proxy_handler(ip, port, tls=is_https)],
+                 "terminal": True}
+        if match:
+            route["match"] = [match]
+        return int(listen_port), route
+
+    # 非HTTPS域名列表（automatic_https.skip）#####################################
+    # Caddy对80以外端口上带域名匹配的服务器自动启用HTTPS，is_https=False的
+    # 自定义端口代理需列入skip，才能保持明文HTTP
+    # ###########################################################################
+    def web_skip(self, port) -> list[str]:
+        skip = set()
+        with self.admin_lock:
+            for domain, proxy_info in self.proxys_list.items():
+                host = domain.split("/")[0]
+                if not host or proxy_info.get("is_https", True):
+                    continue
+                listen_port = self.web_route(domain, proxy_info)[0]
+                if listen_port != 80 and str(listen_port) == str(port):
+                    skip.add(host)
+        return sorted(skip)
+
+    # VNC/TTY代理路由 ############################################################
+    # :param target: [目标IP, 目标端口(vmk时为"端口/票据")]
+    # ###########################################################################
+    def vnc_routes(self, token: str, target) -> list[dict]:
+        target_ip, target_port = target
+        # TTY代理（查询参数固定为arg=令牌，供共享ttyd按令牌选择会话）============
+        if self.proxys_type == "tty":
+            return [{"@id": self.route_id("tty", token),
+                     "match": [{"path": [f"/{token}*"]}],
+                     "handle": [{"handler": "rewrite", "uri": f"?arg={token}",
+                                 "strip_path_prefix": f"/{token}"},
+                                self.proxy_handler(target_ip, target_port, headers=True)],
+                     "terminal": True}]
+        # VMK代理 ================================================================
+        ticket_path = str(target_port)
+        if "/" in str(target_port):
+            ticket_path = str(target_port).split("/")[1]
+            target_port = str(target_port).split("/")[0]
+        html_template = f'''<!DOCTYPE html PUBLIC"-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
                         <html xmlns="http://www.w3.org/1999/xhtml">
                         <head>
                         <meta http-equiv="content-type" content="text/html; charset=utf-8" />
@@ -155,75 +243,305 @@ class HttpManager:
                         </script>
                         </body>
                         </html>'''
-                        config += f"\thandle_path /{token} {{\n"
-                        config += f"\t\theader Content-Type text/html;charset=utf-8\n"
-                        config += f"\t\trespond `{html_template}` 200\n"
-                        config += f"\t}}\n"
-                config += "}\n\n"
-        # 保存配置文件 ###########################################################################
-        self.config_file.write_text(config)
-        return True
+        # WebSocket 反向代理 + 返回控制台页面
+        return [{"@id": self.route_id("vmk", token) + "_ws",
+                 "match": [{"path": [f"/{token}/ws/*"]}],
+                 "handle": [{"handler": "rewrite", "strip_path_prefix": f"/{token}/ws"},
+                            self.proxy_handler(target_ip, target_port, tls=True,
+                                               insecure=True, headers=True)],
+                 "terminal": True},
+                {"@id": self.route_id("vmk", token),
+                 "match": [{"path": [f"/{token}"]}],
+                 "handle": [{"handler": "static_response", "status_code": 200,
+                             "headers": {"Content-Type": ["text/html;charset=utf-8"]},
+                             "body": html_template}],
+                 "terminal": True}]
+
+    # 静态文件代理（vmk）=========================================================
+    def vmk_static(self, port) -> dict:
+        return {"@id": f"vmk_static_{port}",
+                "match": [{"path": ["/static/*"]}],
+                "handle": [{"handler": "rewrite", "strip_path_prefix": "/static"},
+                           {"handler": "file_server", "root": "VNCConsole/vSphere"}],
+                "terminal": True}
+
+    # 调用Caddy管理接口 ##########################################################
+    # :return: (是否成功, 响应内容或错误信息)
+    # ###########################################################################
+    def admin_call(self, method: str, path: str, body=None) -> tuple[bool, str]:
+        data = None if body is None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            f"http://localhost:{self.manage_port}{path}", data=data, method=method,
+            headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.admin_timeout) as response:
+                return True, response.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            return False, f"{e.code} {e.read().decode('utf-8', 'replace').strip()}"
+        except (urllib.error.URLError, OSError) as e:
+            return False, str(e)
+
+    # 增量添加或替换路由 #########################################################
+    def route_apply(self, port, routes: list[dict]) -> bool:
+        with self.admin_lock:
+            name = self.server_name(port)
+            base = f"/config/apps/http/servers/{name}"
+            # 端口尚未建立服务器：整体写入该服务器 ===============================
+            if name not in self.admin_live:
+                server = {name: self.server_body(port)}
+                for route in routes:
+                    self.route_insert(server, port, route)
+                skip = self.web_skip(port)
+                if skip:
+                    server[name]["automatic_https"] = {"skip": skip}
+                ok, err = self.admin_call("PUT", base, server[name])
+                if ok and skip:
+                    self.admin_skip[name] = skip
+                return ok or self.admin_fail("PUT", base, err)
+            for route in routes:
+                ranks = self.admin_live[name]
+                # 同ID已存在：按ID原地替换 ======================================
+                if any(item[1] == route["@id"] for item in ranks):
+                    path = f"/id/{route['@id']}"
+                    ok, err = self.admin_call("PATCH", path, route)
+                else:
+                    index = self.route_insert({}, port, route)
+                    path = f"{base}/routes" + (
+                        "" if index == len(ranks) - 1 else f"/{index}")
+                    ok, err = self.admin_call(
+                        "POST" if index == len(ranks) - 1 else "PUT", path, route)
+                if not ok:
+                    return self.admin_fail("ADD", path, err)
+            return True
+
+    # 增量删除路由（服务器无路由且非VNC端口时一并删除）###########################
+    def route_delete(self, port, route_ids: list[str]) -> bool:
+        with self.admin_lock:
+            name = self.server_name(port)
+            ranks = self.admin_live.get(name, [])
+            for route_id in route_ids:
+                if not any(item[1] == route_id for item in ranks):
+                    continue
+                ok, err = self.admin_call("DELETE", f"/id/{route_id}")
+                if not ok:
+                    return self.admin_fail("DELETE", f"/id/{route_id}", err)
+                ranks[:] = [item for item in ranks if item[1] != route_id]
+            if name in self.admin_live and not ranks \
+                    and str(port) not in self.proxys_sshd:
+                ok, err = self.admin_call("DELETE", f"/config/apps/http/servers/{name}")
+                if not ok:
+                    return self.admin_fail("DELETE", name, err)
+                del self.admin_live[name]
+                self.admin_skip.pop(name, None)
+            return True
+
+    # 同步服务器的automatic_https.skip（服务器尚未建立时由route_apply整体写入）====
+    def skip_apply(self, port) -> bool:
+        with self.admin_lock:
+            name = self.server_name(port)
+            skip = self.web_skip(port)
+            if name not in self.admin_live or skip == self.admin_skip.get(name, []):
+                return True
+            path = f"/config/apps/http/servers/{name}/automatic_https"
+            ok, err = self.admin_call("POST", path, {"skip": skip})
+            if not ok:
+                return self.admin_fail("POST", path, err)
+            self.admin_skip[name] = skip
+            return True
+
+    # 管理接口失败：回退为完整配置重新加载 =======================================
+    def admin_fail(self, method: str, path: str, err: str) -> bool:
+        print(f"Caddy管理接口{method} {path}失败: {err}，改为完整加载配置")
+        return self.reload_web()
+
+    # 提交一项路由变更（防抖合并）###############################################
+    # 窗口内的多项变更合并为一次推送：仅一项时按ID增量修改，多项时整体/load一次；
+    # batch()上下文内的变更在退出时统一推送，此时立即返回True
+    # :param apply: 单项变更的增量推送函数
+    # :param undo: 推送失败时回滚内存配置的函数
+    # :return: 推送是否成功
+    # ###########################################################################
+    def submit(self, apply, undo) -> bool:
+        with self.batch_lock:
+            self.pending.append((apply, undo, time.perf_counter()))
+            if self.batch_depth > 0:
+                return True
+            if self.debounce <= 0:
+                waiter = None
+            else:
+                if self.flush_wait is None:
+                    self.flush_wait = {"done": threading.Event(), "ok": False}
+                    timer = threading.Timer(self.debounce, self.flush)
+                    timer.daemon = True
+                    timer.start()
+                waiter = self.flush_wait
+        if waiter is None:
+            return self.flush()
+        if not waiter["done"].wait(self.submit_timeout):
+            print(f"等待Caddy配置推送超时（{self.submit_timeout}秒）")
+            return False
+        return waiter["ok"]
+
+    # 持有管理锁执行（回滚函数在推送线程中修改内存配置时使用）=================
+    def locked(self, func):
+        def wrapper():
+            with self.admin_lock:
+                return func()
+        return wrapper
+
+    # 批量变更上下文 ############################################################
+    # with http.batch():
+    #     http.create_web(...)
+    # ###########################################################################
+    @contextmanager
+    def batch(self):
+        with self.batch_lock:
+            self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.batch_lock:
+                self.batch_depth -= 1
+                depth = self.batch_depth
+            if depth == 0:
+                self.flush()
+
+    # 推送所有待处理变更 #########################################################
+    def flush(self) -> bool:
+        with self.batch_lock:
+            pending, self.pending = self.pending, []
+            waiter, self.flush_wait = self.flush_wait, None
+        ok = True
+        if pending:
+            started = time.perf_counter()
+            ok = pending[0][0]() if len(pending) == 1 else self.reload_web()
+            if not ok:
+                for _, undo, _ in reversed(pending):
+                    undo()
+            # 记录推送指标 ======================================================
+            done = time.perf_counter()
+            with self.batch_lock:
+                self.stats["flushes"] += 1
+                self.stats["changes"] += len(pending)
+                self.stats["coalesced"] += len(pending) - 1
+                self.stats["failed"] += 0 if ok else len(pending)
+                self.stats["last_changes"] = len(pending)
+                self.stats["last_push_ms"] = round((done - started) * 1000, 2)
+                self.stats["last_latency_ms"] = round((done - pending[0][2]) * 1000, 2)
+                self.stats["max_latency_ms"] = max(
+                    self.stats["max_latency_ms"], self.stats["last_latency_ms"])
+            print(f"Caddy配置已推送: {len(pending)}项变更"
+                  f"（合并{len(pending) - 1}项），"
+                  f"推送耗时{self.stats['last_push_ms']}ms，"
+                  f"最长等待{self.stats['last_latency_ms']}ms"
+                  + ("" if ok else "，推送失败已回滚"))
+        if waiter is not None:
+            waiter["ok"] = ok
+            waiter["done"].set()
+        return ok
+
+    # 推送统计 ==================================================================
+    def flush_stats(self) -> dict:
+        with self.batch_lock:
+            return dict(self.stats, pending=len(self.pending))
 
     # 初始化VNC代理管理 ##########################################################################
     def launch_vnc(self,
                    port: int = random.randint(8000, 9000)):
-        self.proxys_port = port
-        if str(self.proxys_port) not in self.proxys_sshd:
-            self.proxys_sshd[str(self.proxys_port)] = {}
+        with self.admin_lock:
+            self.proxys_port = port
+            if str(self.proxys_port) not in self.proxys_sshd:
+                self.proxys_sshd[str(self.proxys_port)] = {}
 
     # 关闭SSH代理的管理 ##########################################################################
     def closed_vnc(self, port: int):
-        if str(port) in self.proxys_sshd:
-            del self.proxys_sshd[str(port)]
+        with self.admin_lock:
+            if str(port) in self.proxys_sshd:
+                route_ids = [route["@id"] for token, target in self.proxys_sshd[str(port)].items()
+                             for route in self.vnc_routes(token, target)]
+                if self.proxys_type == "vmk":
+                    route_ids.append(self.vmk_static(port)["@id"])
+                del self.proxys_sshd[str(port)]
+                if self.server_name(port) in self.admin_live:
+                    self.route_delete(port, route_ids)
 
     # 添加SSH的代理配置 ##########################################################################
     def create_vnc(self, token, target_ip, target_port, path=""):
         try:
-            # 检查是否已有相同token的配置 ======================
-            for port, token_dict in self.proxys_sshd.items():
-                if token in token_dict:
-                    print(f"令牌 {token} 的SSH代理配置已存在")
-                    return False
-            # 如SSH未启动则启动 ================================
-            if self.proxys_port == 0:
-                self.launch_vnc()
-            # 添加到SSH代理配置 ================================
             proxy_conf = [target_ip, str(target_port)]
             if path != "":
                 proxy_conf[1] += "/" + path
-            proxy_port = str(self.proxys_port)
-            self.proxys_sshd[proxy_port][token] = proxy_conf
+            with self.admin_lock:
+                # 检查是否已有相同token的配置（目标一致时视为已添加，如复用的终端会话）
+                for port, token_dict in self.proxys_sshd.items():
+                    if token in token_dict:
+                        if token_dict[token] == proxy_conf:
+                            return True
+                        print(f"令牌 {token} 的SSH代理配置已存在")
+                        return False
+                # 如SSH未启动则启动 ============================
+                if self.proxys_port == 0:
+                    self.launch_vnc()
+                # 添加到SSH代理配置 ============================
+                proxy_port = str(self.proxys_port)
+                self.proxys_sshd[proxy_port][token] = proxy_conf
+                routes = self.vnc_routes(token, proxy_conf)
+                if self.proxys_type == "vmk" and \
+                        self.server_name(proxy_port) not in self.admin_live:
+                    routes.insert(0, self.vmk_static(proxy_port))
             print(f"SSH代理已添加: "
                   f"/{token} -> {target_ip}:{target_port}"
-                  f" (统一端口: {str(self.proxys_port)})")
-            # 重新生成配置文件 =================================
-            self.config_all()
-            # 重载Caddy配置 ====================================
-            return self.reload_web()
+                  f" (统一端口: {proxy_port})")
+            # 通过管理接口增量添加路由（合并推送）=============
+            return self.submit(
+                lambda: self.route_apply(proxy_port, routes),
+                self.locked(lambda: self.proxys_sshd.get(proxy_port, {}).pop(token, None)))
 
         except Exception as e:
             print(f"添加SSH代理配置时发生错误: {str(e)}")
             traceback.print_exc()
             return False
 
+    # 删除SSH的代理配置 ##########################################################################
+    def remove_vnc(self, token):
+        try:
+            with self.admin_lock:
+                found = next((port for port, token_dict in self.proxys_sshd.items()
+                              if token in token_dict), None)
+                if found is None:
+                    print(f"未找到令牌 {token} 的SSH代理配置")
+                    return False
+                proxy_port = found
+                backup = self.proxys_sshd[proxy_port].pop(token)
+            route_ids = [route["@id"] for route in self.vnc_routes(token, backup)]
+            print(f"SSH代理已删除: /{token} (统一端口: {proxy_port})")
+            # 通过管理接口按ID删除路由（合并推送，失败时回滚）
+            return self.submit(
+                lambda: self.route_delete(proxy_port, route_ids),
+                self.locked(lambda: self.proxys_sshd.setdefault(
+                    proxy_port, {}).setdefault(token, backup)))
+        except Exception as e:
+            print(f"删除SSH代理配置时发生错误: {str(e)}")
+            traceback.print_exc()
+            return False
+
     # 添加代理配置 ###############################################################################
     def create_web(self, target, domain, is_https=True, listen_port=None, persistent=True):
         """添加代理配置"""
         try:
-            # 检查域名是否已存在
-            if domain in self.proxys_list:
-                print(f"域名 {domain} 的配置已存在")
-                return False
-
-            # 添加到内存配置
-            self.proxys_list[domain] = {
-                "target": target,
-                "is_https": is_https,
-                "listen_port": listen_port
-            }
-
-            # 重新生成配置文件
-            self.config_all()
+            with self.admin_lock:
+                # 检查域名是否已存在
+                if domain in self.proxys_list:
+                    print(f"域名 {domain} 的配置已存在")
+                    return False
+
+                # 添加到内存配置
+                self.proxys_list[domain] = {
+                    "target": target,
+                    "is_https": is_https,
+                    "listen_port": listen_port
+                }
+                port, route = self.web_route(domain, self.proxys_list[domain])
 
             # 保存到数据库（只有persistent为True时才写入）
             # if persistent:
@@ -231,48 +549,44 @@ class HttpManager:
             # else:
             #     print(f"代理 {domain} 为临时代理，不写入数据库")
 
-            # 重载Caddy配置
-            return self.reload_web()
+            # 通过管理接口增量添加路由（合并推送，失败时回滚）
+            # 先更新skip再添加路由，避免非HTTPS域名短暂启用自动HTTPS
+            return self.submit(
+                lambda: self.skip_apply(port) and self.route_apply(port, [route]),
+                self.locked(lambda: self.proxys_list.pop(domain, None)))
 
         except Exception as e:
             print(f"添加代理配置时发生错误: {str(e)}")
             # 回滚
-            if domain in self.proxys_list:
-                del self.proxys_list[domain]
+            with self.admin_lock:
+                self.proxys_list.pop(domain, None)
             return False
 
     # 删除代理配置 ###############################################################################
     def remove_web(self, domain):
         """删除代理配置"""
         try:
-            # 检查域名是否存在
-            if domain not in self.proxys_list:
-                print(f"未找到匹配的代理配置: {domain}")
-                print(f"当前已有的域名: {list(self.proxys_list.keys())}")
-                return False
-
-            # 备份配置（用于回滚）
-            backup = self.proxys_list[domain]
+            with self.admin_lock:
+                # 检查域名是否存在
+                if domain not in self.proxys_list:
+                    print(f"未找到匹配的代理配置: {domain}")
+                    print(f"当前已有的域名: {list(self.proxys_list.keys())}")
+                    return False
 
-            # 从内存配置中删除
-            del self.proxys_list[domain]
+                # 备份配置（用于回滚）
+                backup = self.proxys_list[domain]
 
-            # 重新生成配置文件
-            self.config_all()
+                # 从内存配置中删除
+                del self.proxys_list[domain]
 
             # 从数据库删除（不写入JSON文件）
             # self.global_del(domain)
 
-            # 重载Caddy配置
-            result = self.reload_web()
-
-            if not result:
-                # 回滚
-                self.proxys_list[domain] = backup
-                self.config_all()
-                # self.global_set(domain, backup)
-
-            return result
+            # 通过管理接口按ID删除路由（合并推送，失败时回滚）
+            port, route = self.web_route(domain, backup)
+            return self.submit(
+                lambda: self.route_delete(port, [route["@id"]]) and self.skip_apply(port),
+                self.locked(lambda: self.proxys_list.setdefault(domain, backup)))
 
         except Exception as e:
             print(f"删除代理配置时发生错误: {str(e)}")
@@ -280,9 +594,10 @@ class HttpManager:
 
     # 启动Caddy服务 ##############################################################################
     def launch_web(self):
-        """启动Caddy服务"""
+        """启动Caddy服务（使用完整渲染的JSON配置）"""
         try:
-            cmd = [self.binary_path, "run", "--config", str(self.config_file), "--adapter", "caddyfile"]
+            self.config_all()
+            cmd = [self.binary_path, "run", "--config", str(self.config_file)]
 
             print(" ".join(cmd))
             self.binary_proc = subprocess.Popen(cmd, shell=True)
@@ -321,30 +636,16 @@ class HttpManager:
 
     # 重载Caddy配置 ##############################################################################
     def reload_web(self):
-        """重载Caddy配置"""
+        """完整渲染配置并通过管理接口/load加载，管理接口不可用时启动服务"""
         try:
-            # 尝试重载配置（无论binary_proc状态如何）
-            if os.name == 'nt':
-                # 使用实例的管理端口进行重载
-                reload_cmd = [self.binary_path, "reload", "--config",
-                              str(self.config_file), "--adapter", "caddyfile",
-                              "--address", f"localhost:{self.manage_port}"]
-                print("重载服务命令:", " ".join(reload_cmd))
-                result = subprocess.run(reload_cmd, capture_output=True, text=True)
-                if result.returncode == 0:
-                    print(f"Caddy配置已重载（管理端口: {self.manage_port}）")
-                    return True
-                else:
-                    print(f"重载失败，尝试启动服务: {result.stderr}")
-                    return self.launch_web()
-            else:
-                # Linux/Mac: 如果有进程引用则发送信号
-                if self.binary_proc and self.binary_proc.poll() is None:
-                    self.binary_proc.send_signal(signal.SIGUSR1)
-                    print(f"Caddy配置已重载（管理端口: {self.manage_port}）")
-                    return True
-                else:
-                    return self.launch_web()
+            with self.admin_lock:
+                self.config_all()
+                ok, err = self.admin_call("POST", "/load", self.admin_conf)
+            if ok:
+                print(f"Caddy配置已重载（管理端口: {self.manage_port}）")
+                return True
+            print(f"重载失败，尝试启动服务: {err}")
+            return self.launch_web()
         except Exception as e:
             print(f"重载Caddy配置时发生错误: {str(e)}")
             return False
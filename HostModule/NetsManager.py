@@ -1,19 +1,57 @@
 import requests
 import json
+import time
 import hashlib
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, List
 from loguru import logger
 
 
 class NetsManager:
     """爱快路由器管理类"""
 
-    def __init__(self, base_url: str, username: str, password: str):
+    # 共享客户端: {(地址, 用户名, 密码): NetsManager} ###########################
+    clients: Dict[tuple, "NetsManager"] = {}
+    clients_lock = threading.Lock()
+
+    # 列表缓存对应的接口: {缓存名称: (func_name, 列表字段, 查询参数)}
+    lists = {
+        "dhcp": ("dhcp_static", "static_data", {
+            "TYPE": "static_total,static_data", "ORDER_BY": "", "ORDER": ""}),
+        "port": ("dnat", "data", {
+            "TYPE": "total,data", "ORDER_BY": "", "ORDER": ""}),
+        "arps": ("arp", "data", {
+            "TYPE": "total,data", "ORDER_BY": "ip_addr_int",
+            "orderType": "IP", "ORDER": "asc"}),
+    }
+
+    # 请求无响应时允许重新登录后重试的操作（重复提交不会产生副作用）
+    RETRY_ACTIONS = ("show", "del")
+
+    def __init__(self, base_url: str, username: str, password: str, ttl: int = 60):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
         self.sess_key = None
         self.session = requests.Session()
+        self.lock = threading.RLock()
+        # 列表缓存: {缓存名称: (获取时间, 条目列表)}，写操作时同步更新
+        self.ttl = ttl
+        self.cache: Dict[str, tuple] = {}
+        self.stats = {"login": 0, "calls": 0, "cached": 0}
+
+    # 获取共享客户端 #########################################################################
+    # 同一台爱快路由器只保留一个客户端，复用sess_key和列表缓存
+    # ########################################################################################
+    @classmethod
+    def shared(cls, base_url: str, username: str, password: str) -> "NetsManager":
+        key = (base_url.rstrip('/'), username, password)
+        with cls.clients_lock:
+            client = cls.clients.get(key)
+            if client is None:
+                client = cls(base_url, username, password)
+                cls.clients[key] = client
+            return client
 
     # 登录WEB调用方法 ########################################################################
     def login(self) -> bool:
@@ -30,6 +68,7 @@ class NetsManager:
                 "remember_password": ""
             }
             # 发送登录请求
+            self.stats["login"] += 1
             response = self.session.post(
                 f"{self.base_url}/Action/login",
                 json=login_data,
@@ -79,7 +118,8 @@ class NetsManager:
     # 内部API调用方法 ########################################################################
     def posts(self, func_name: str, action: str, param: Dict[str, Any]) -> Optional[Dict]:
         """
-        内部API调用方法
+        内部API调用方法（未登录时自动登录，会话失效时重新登录并重试一次）
+        请求异常（无响应）时只重试查询和删除，添加类请求可能已生效，重试会产生重复条目
         
         Args:
             func_name: 功能名称
@@ -89,10 +129,23 @@ class NetsManager:
         Returns:
             Optional[Dict]: API响应结果
         """
-        if not self.sess_key:
-            logger.warning("请先登录")
-            return None
+        with self.lock:
+            if not self.sess_key and not self.login():
+                logger.warning("爱快登录失败")
+                return None
+            result = self.calls(func_name, action, param)
+            if result is None and action not in self.RETRY_ACTIONS:
+                return None
+            if result is None or self.expired(result):
+                logger.info("爱快会话已失效，重新登录")
+                self.sess_key = None
+                if not self.login():
+                    return None
+                result = self.calls(func_name, action, param)
+            return result
 
+    # 发送一次API请求 ========================================================================
+    def calls(self, func_name: str, action: str, param: Dict[str, Any]) -> Optional[Dict]:
         try:
             api_data = {
                 "func_name": func_name,
@@ -100,6 +153,7 @@ class NetsManager:
                 "param": param
             }
 
+            self.stats["calls"] += 1
             response = self.session.post(
                 f"{self.base_url}/Action/call",
                 json=api_data,
@@ -116,51 +170,123 @@ class NetsManager:
             logger.error(f"API调用异常: {e}")
             return None
 
+    # 判断会话是否失效 =======================================================================
+    @staticmethod
+    def expired(result: Dict) -> bool:
+        message = str(result.get("ErrMsg", "")).lower()
+        return result.get("Result") == 10014 or "login" in message \
+            or "登录" in message
+
+    # 获取列表（带缓存）######################################################################
+    # :param name: 缓存名称 dhcp/port/arps
+    # :param force: 忽略缓存重新获取
+    # :return: 条目列表，获取失败返回None
+    # ########################################################################################
+    def get_list(self, name: str, force: bool = False) -> Optional[List[Dict]]:
+        with self.lock:
+            cached = self.cache.get(name)
+            if not force and cached and time.time() - cached[0] < self.ttl:
+                self.stats["cached"] += 1
+                return cached[1]
+            func_name, field, param = self.lists[name]
+            result = self.posts(func_name, "show", param)
+            if not result or result.get("ErrMsg") != "Success":
+                self.cache.pop(name, None)
+                return None
+            items = (result.get("Data") or {}).get(field) or []
+            self.cache[name] = (time.time(), items)
+            return items
+
+    # 标记缓存失效 ===========================================================================
+    def invalidate(self, name: str = None):
+        with self.lock:
+            if name is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(name, None)
+
+    # 写操作后更新缓存 =======================================================================
+    # 新增条目没有ID，删除时需要ID会重新获取列表
+    # ========================================================================================
+    def cache_add(self, name: str, item: Dict):
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached:
+                cached[1].append(item)
+
+    def cache_del(self, name: str, ids: List[str]):
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached:
+                self.cache[name] = (cached[0], [
+                    i for i in cached[1] if str(i.get("id")) not in ids])
+
+    # 在列表中查找条目ID =====================================================================
+    # :param match: 条目匹配函数
+    # :return: 匹配的条目列表，缓存中存在未分配ID的匹配条目时重新获取
+    # ========================================================================================
+    def find_ids(self, name: str, match) -> List[Dict]:
+        items = self.get_list(name)
+        found = [i for i in items or [] if match(i)]
+        if items is None or any(not i.get("id") for i in found) or not found:
+            items = self.get_list(name, force=True)
+            found = [i for i in items or [] if match(i)]
+        return found
+
+    # 批量删除条目 ===========================================================================
+    # 爱快的del接口支持逗号分隔的多个ID，一次请求完成
+    # ========================================================================================
+    def del_items(self, name: str, items: List[Dict], extra: Dict = None) -> bool:
+        if not items:
+            return True
+        ids = [str(i.get("id")) for i in items]
+        param = {"id": ",".join(ids)}
+        param.update(extra or {})
+        logger.info(f"🔍 准备删除{name} - 提交参数: {json.dumps(param, ensure_ascii=False)}")
+        result = self.posts(self.lists[name][0], "del", param)
+        success = result is not None and result.get("ErrMsg") == "Success"
+        if success:
+            self.cache_del(name, ids)
+        else:
+            # 缓存可能已过期（条目被外部删除），下次重新获取
+            self.invalidate(name)
+            logger.error(result)
+        return success
+
     # 获取静态IP4列表 ########################################################################
     def get_dhcp(self) -> Optional[Dict]:
-        param = {
-            "TYPE": "static_total,static_data",
-            "ORDER_BY": "",
-            "ORDER": ""
-        }
-
-        result = self.posts("dhcp_static", "show", param)
-        if result and result.get("ErrMsg") == "Success":
-            logger.info(f"✅ 获取静态IP列表成功，共{result['Data'].get('static_total', 0)}条")
-            return result
+        items = self.get_list("dhcp", force=True)
+        if items is not None:
+            logger.info(f"✅ 获取静态IP列表成功，共{len(items)}条")
+            return {"ErrMsg": "Success",
+                    "Data": {"static_total": len(items), "static_data": items}}
         else:
             logger.error("❌ 获取静态IP列表失败")
             return None
 
     # 获取端口映射列表 #######################################################################
     def get_port(self) -> Optional[Dict]:
-        param = {
-            "TYPE": "total,data",
-            "ORDER_BY": "",
-            "ORDER": ""
-        }
-
-        result = self.posts("dnat", "show", param)
-        if result and result.get("ErrMsg") == "Success":
-            logger.info(f"✅ 获取端口映射列表成功，共{result['Data'].get('total', 0)}条")
-            return result
+        items = self.get_list("port", force=True)
+        if items is not None:
+            logger.info(f"✅ 获取端口映射列表成功，共{len(items)}条")
+            return {"ErrMsg": "Success", "Data": {"total": len(items), "data": items}}
         else:
             logger.error("❌ 获取端口映射列表失败")
             return None
 
+    # 获取已使用的外部端口（带缓存）##########################################################
+    def wan_ports(self) -> Optional[List[int]]:
+        items = self.get_list("port")
+        if items is None:
+            return None
+        return [int(i.get("wan_port", 0) or 0) for i in items if isinstance(i, dict)]
+
     # 获取ARP列表 ############################################################################
     def get_arps(self) -> Optional[Dict]:
-        param = {
-            "TYPE": "total,data",
-            "ORDER_BY": "ip_addr_int",
-            "orderType": "IP",
-            "ORDER": "asc",
-        }
-
-        result = self.posts("arp", "show", param)
-        if result and result.get("ErrMsg") == "Success":
-            logger.info(f"✅ 获取ARP列表成功，共{result['Data'].get('total', 0)}条")
-            return result
+        items = self.get_list("arps", force=True)
+        if items is not None:
+            logger.info(f"✅ 获取ARP列表成功，共{len(items)}条")
+            return {"ErrMsg": "Success", "Data": {"total": len(items), "data": items}}
         else:
             logger.error("❌ 获取ARP列表失败")
             return None
@@ -186,6 +312,7 @@ class NetsManager:
         result = self.posts("dhcp_static", "add", param)
         success = result is not None and result.get("ErrMsg") == "Success"
         if success:
+            self.cache_add("dhcp", {"ip_addr": lan_addr, "mac": mac_addr})
             logger.info(f"✅ 静态IP添加成功: {lan_addr} -> {mac_addr}")
         else:
             logger.error(f"❌ 静态IP添加失败: {lan_addr} -> {mac_addr}")
@@ -195,46 +322,27 @@ class NetsManager:
 
     # 静态IP4删除方法 ########################################################################
     def del_dhcp(self, lan_addr: str, mac: str = None) -> bool:
-        # 通过get_dhcp查找entry_id
         if not lan_addr and not mac:
             logger.warning("必须提供ip_addr或mac中的一个")
             return False
-
-        # 获取DHCP列表
-        dhcp_list = self.get_dhcp()
-        if not dhcp_list or 'Data' not in dhcp_list:
-            logger.error("无法获取DHCP列表")
+        return self.del_dhcp_all([lan_addr] if lan_addr else [], [mac] if mac else [])
+
+    # 批量删除静态IP4 ########################################################################
+    # :param lan_addrs: IP地址列表
+    # :param macs: MAC地址列表（与IP地址任一匹配即删除）
+    # ########################################################################################
+    def del_dhcp_all(self, lan_addrs: List[str], macs: List[str] = None) -> bool:
+        addrs, macs = set(lan_addrs or []), set(macs or [])
+        items = self.find_ids("dhcp", lambda i: i.get("ip_addr") in addrs
+                              or i.get("mac") in macs)
+        if not items:
+            logger.error(f"未找到匹配的DHCP条目: {sorted(addrs | macs)}")
             return False
-
-        # 查找匹配的条目
-        entry_id = None
-        for item in dhcp_list['Data'].get('static_data', []):
-            if (lan_addr and item.get('ip_addr') == lan_addr) or \
-                    (mac and item.get('mac') == mac):
-                entry_id = item.get('id')
-                logger.info(f"找到匹配的DHCP条目: ID={entry_id}, IP={item.get('ip_addr')}, MAC={item.get('mac')}")
-                break
-
-        if not entry_id:
-            identifier = lan_addr or mac
-            logger.error(f"未找到匹配的DHCP条目: {identifier}")
-            return False
-
-        param = {"id": entry_id}
-        logger.info(f"🔍 准备删除DHCP - 提交参数: {json.dumps(param, ensure_ascii=False)}")
-
-        result = self.posts("dhcp_static", "del", param)
-        success = result is not None and result.get("ErrMsg") == "Success"
-        logger.debug(result)
-        if result and result.get('ErrMsg') == "Success":
-            success = True
+        success = self.del_items("dhcp", items)
         if success:
-            identifier = entry_id or lan_addr or mac
-            logger.info(f"✅ 静态IP删除成功: {identifier}")
+            logger.info(f"✅ 静态IP删除成功: {[i.get('ip_addr') for i in items]}")
         else:
-            identifier = entry_id or lan_addr or mac
-            logger.error(f"❌ 静态IP删除失败: {identifier}")
-
+            logger.error(f"❌ 静态IP删除失败: {[i.get('ip_addr') for i in items]}")
         return success
 
     # TCP/UDP转发设置 ########################################################################
@@ -253,53 +361,55 @@ class NetsManager:
         result = self.posts("dnat", "add", param)
         success = result is not None and result.get("ErrMsg") == "Success"
         if success:
+            self.cache_add("port", {"wan_port": wan_port, "lan_port": lan_port,
+                                    "lan_addr": lan_addr})
             logger.info(f"✅ 端口转发添加成功: 外部端口{wan_port} -> {lan_addr}:{lan_port}")
         else:
             logger.error(f"❌ 端口转发添加失败: 外部端口{wan_port} -> {lan_addr}:{lan_port}")
         return success
 
+    # 逐条添加TCP/UDP转发 ##################################################################
+    # 爱快的add接口一次只接受一条规则，这里在同一会话和锁内依次提交
+    # :param rules: [(wan_port, lan_port, lan_addr, comment)]
+    # :return: 每条规则的添加结果
+    # ########################################################################################
+    def add_port_list(self, rules: List[tuple]) -> List[bool]:
+        with self.lock:
+            return [self.add_port(*rule) for rule in rules]
+
     # TCP/UDP转发删除 ########################################################################
     def del_port(self, lan_port: int, lan_addr: str = None) -> bool:
-
-        # 通过get_port查找entry_id
         if not lan_port and not lan_addr:
             logger.warning("必须提供lan_port或lan_addr中的一个")
             return False
-
-        # 获取端口映射列表
-        port_list = self.get_port()
-        if not port_list or 'Data' not in port_list:
-            logger.error("无法获取端口映射列表")
-            return False
-
-        # 查找匹配的条目
-        entry_id = None
-        for item in port_list['Data'].get('data', []):
-            if (lan_port and lan_addr and
-                item.get('lan_port') == lan_port and
-                item.get('lan_addr') == lan_addr) or \
-                    (lan_port and not lan_addr and item.get('lan_port') == lan_port) or \
-                    (lan_addr and not lan_port and item.get('lan_addr') == lan_addr):
-                entry_id = item.get('id')
-                logger.info(
-                    f"找到匹配的端口映射条目: ID={entry_id}, WAN端口={item.get('wan_port')}, LAN地址={item.get('lan_addr')}:{item.get('lan_port')}")
-                break
-
-        if not entry_id:
-            identifier = f"{lan_addr or ''}:{lan_port or ''}"
+        return self.del_port_all([(lan_port, lan_addr)])
+
+    # 批量删除TCP/UDP转发 ####################################################################
+    # 每条规则只删除第一条匹配的条目（与del_port一致），全部ID在一次请求中删除
+    # :param rules: [(lan_port, lan_addr)]，其中一项为空时只按另一项匹配
+    # ########################################################################################
+    def del_port_all(self, rules: List[tuple]) -> bool:
+        def match(item: Dict, lan_port, lan_addr) -> bool:
+            return (not lan_port or str(item.get('lan_port')) == str(lan_port)) and \
+                (not lan_addr or item.get('lan_addr') == lan_addr)
+
+        rules = [rule for rule in rules if rule[0] or rule[1]]
+        found = self.find_ids("port", lambda i: any(
+            match(i, *rule) for rule in rules)) if rules else []
+        items = []
+        for rule in rules:
+            item = next((i for i in found if match(i, *rule)
+                         and all(i is not x for x in items)), None)
+            if item is not None:
+                items.append(item)
+        identifier = [f"{lan_addr or ''}:{lan_port or ''}" for lan_port, lan_addr in rules]
+        if not items:
             logger.error(f"未找到匹配的端口映射条目: {identifier}")
             return False
-
-        param = {"id": entry_id}
-        logger.info(f"🔍 准备删除端口映射 - 提交参数: {json.dumps(param, ensure_ascii=False)}")
-
-        result = self.posts("dnat", "del", param)
-        success = result is not None and result.get("ErrMsg") == "Success"
+        success = self.del_items("port", items)
         if success:
-            identifier = f"{lan_addr}:{lan_port}"
             logger.info(f"✅ 端口转发删除成功: {identifier}")
         else:
-            identifier = f"{lan_addr}:{lan_port}"
             logger.error(f"❌ 端口转发删除失败: {identifier}")
         return success
 
@@ -317,6 +427,7 @@ class NetsManager:
         result = self.posts("arp", "add", param)
         success = result is not None and result.get("success", False)
         if success:
+            self.cache_add("arps", {"ip_addr": lan_addr, "mac": mac_addr})
             logger.info(f"✅ ARP绑定添加成功: {lan_addr} -> {mac_addr}")
         else:
             logger.error(f"❌ ARP绑定添加失败: {lan_addr} -> {mac_addr}")
@@ -324,48 +435,52 @@ class NetsManager:
 
     # ARP解绑方法 ############################################################################
     def del_arps(self, lan_addr: str, mac_addr: str = None) -> bool:
-        # 通过get_arp查找entry_id和ip_addr
         if not lan_addr and not mac_addr:
             logger.warning("必须提供ip_addr或mac中的一个")
             return False
-
-        # 获取ARP列表
-        arp_list = self.get_arps()
-        if not arp_list or 'Data' not in arp_list:
-            logger.error("无法获取ARP列表")
-            return False
-
-        # 查找匹配的条目
-        target_id = None
-        target_ip = None
-        for item in arp_list['Data'].get('data', []):
-            if (lan_addr and item.get('ip_addr') == lan_addr) or \
-                    (mac_addr and item.get('mac') == mac_addr):
-                target_id = item.get('id')
-                target_ip = item.get('ip_addr')
-                logger.info(f"找到匹配的ARP条目: ID={target_id}, IP={target_ip}, MAC={item.get('mac')}")
-                break
-
-        if not target_id or not target_ip:
-            identifier = lan_addr or mac_addr
-            logger.error(f"未找到匹配的ARP条目: {identifier}")
+        return self.del_arps_all([lan_addr] if lan_addr else [],
+                              [mac_addr] if mac_addr else [])
+
+    # 批量ARP解绑 ############################################################################
+    def del_arps_all(self, lan_addrs: List[str], macs: List[str] = None) -> bool:
+        addrs, macs = set(lan_addrs or []), set(macs or [])
+        items = [i for i in self.find_ids(
+            "arps", lambda i: i.get("ip_addr") in addrs or i.get("mac") in macs)
+            if i.get("ip_addr")]
+        if not items:
+            logger.error(f"未找到匹配的ARP条目: {sorted(addrs | macs)}")
             return False
-
-        param = {
-            "id": target_id,
-            "ip_addr": target_ip
-        }
-        logger.info(f"🔍 准备删除ARP - 提交参数: {json.dumps(param, ensure_ascii=False)}")
-
-        result = self.posts("arp", "del", param)
-        success = result is not None and result.get("ErrMsg") == "Success"
+        success = self.del_items("arps", items, {
+            "ip_addr": ",".join(i["ip_addr"] for i in items)})
         if success:
-            logger.info(f"✅ ARP绑定删除成功: ID={target_id}, IP={target_ip}")
+            logger.info(f"✅ ARP绑定删除成功: {[i['ip_addr'] for i in items]}")
         else:
-            logger.error(f"❌ ARP绑定删除失败: ID={target_id}, IP={target_ip}")
-            logger.error(result)
+            logger.error(f"❌ ARP绑定删除失败: {[i['ip_addr'] for i in items]}")
         return success
 
+    # 逐条静态绑定（DHCP + ARP）############################################################
+    # 爱快的add接口一次只接受一条，这里在同一会话和锁内依次提交
+    # :param binds: [(ip, mac, comment, dns1, dns2)]
+    # :return: 是否全部成功
+    # ########################################################################################
+    def add_bind_list(self, binds: List[tuple]) -> bool:
+        success = True
+        with self.lock:
+            for lan_addr, mac_addr, comment, dns1, dns2 in binds:
+                success &= self.add_dhcp(lan_addr, mac_addr, comment, dns1, dns2)
+                success &= self.add_arps(lan_addr, mac_addr)
+        return success
+
+    # 批量解除静态绑定 #######################################################################
+    # 每种列表只删除一次（逗号分隔的ID）
+    # ########################################################################################
+    def del_bind_all(self, lan_addrs: List[str]) -> bool:
+        if not lan_addrs:
+            return True
+        with self.lock:
+            success = self.del_dhcp_all(lan_addrs)
+            return self.del_arps_all(lan_addrs) and success
+
 
 # 使用示例
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+import pickle
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from loguru import logger
+from MainObject.Config.HSConfig import HSConfig
+from MainObject.Public.ZMessage import ZMessage
+
+# 是否运行在工作进程中（工作进程内不再转发，直接执行）
+IN_WORKER = False
+# 工作进程内缓存的宿主机实例: {server_name: (配置快照, 实例)}
+WORKER_HOSTS: dict = {}
+
+
+# 工作进程初始化 ###############################################################
+# 工作进程退出时（进程池关闭）卸载缓存的宿主机实例，注销会话并停止保活线程
+################################################################################
+def pool_init():
+    global IN_WORKER
+    IN_WORKER = True
+    multiprocessing.util.Finalize(None, pool_exit, exitpriority=10)
+
+
+# 工作进程退出清理 =============================================================
+def pool_exit():
+    for snapshot, server in list(WORKER_HOSTS.values()):
+        pool_unload(server)
+    WORKER_HOSTS.clear()
+
+
+# 只停止本进程内的会话与线程，不调用HSUnload，避免影响主进程的控制台等资源
+def pool_unload(server):
+    try:
+        server.power_exit()
+        if getattr(server, "esxi_api", None) is not None:
+            server.esxi_api.close()
+    except Exception as e:
+        logger.warning(f"[PoolManager] 工作进程卸载宿主机失败: {e}")
+
+
+# 工作进程执行入口 #############################################################
+# :param hs_config: 宿主机配置（pickle传入）
+# :param vm_saving: 虚拟机配置字典（pickle传入）
+# :param method: 方法名称
+# :return: (执行结果, 执行后的vm_saving, 执行期间产生的日志)
+################################################################################
+def pool_exec(hs_config: HSConfig, vm_saving: dict, method: str, args: tuple, kwargs: dict):
+    from MainObject.Server.HSEngine import HEConfig
+    snapshot = pickle.dumps(hs_config.__save__())
+    cached = WORKER_HOSTS.get(hs_config.server_name)
+    if cached is None or cached[0] != snapshot:
+        if cached is not None:
+            pool_unload(cached[1])  # 配置已变更，注销旧实例的会话
+        server = HEConfig[hs_config.server_type]["Imported"](hs_config)
+        WORKER_HOSTS[hs_config.server_name] = (snapshot, server)
+    else:
+        server = cached[1]
+    server.vm_saving = vm_saving
+    # 工作进程不直接写数据库，日志带回主进程保存
+    logs = []
+
+    def logs_set(in_logs) -> bool:
+        logs.append(in_logs)
+        return True
+
+    server.logs_set = logs_set
+    server.data_set = lambda: True
+    result = getattr(server, method)(*args, **kwargs)
+    return result, server.vm_saving, logs
+
+
+class PoolManager:
+    # 后端进程池 #################################################################
+    # 将CPU密集的后端操作（SOAP反序列化、备份打包等）放到独立进程执行，
+    # 避免长时间占用GIL阻塞其他API请求，每种后端类型使用独立的进程池
+    # HEConfig中配置: "Isolate": {"workers": 2, "methods": ["VMBackup"]}
+    # 使用spawn方式启动，工作进程会重新导入主模块
+    # ############################################################################
+    pools: dict[str, ProcessPoolExecutor] = {}
+    lock = threading.Lock()
+
+    # 获取后端的隔离配置 =========================================================
+    @staticmethod
+    def get_conf(server_type: str) -> dict:
+        from MainObject.Server.HSEngine import HEConfig
+        return HEConfig.get(server_type, {}).get("Isolate") or {}
+
+    # 获取或创建进程池 ===========================================================
+    @classmethod
+    def get_pool(cls, server_type: str) -> ProcessPoolExecutor:
+        with cls.lock:
+            pool = cls.pools.get(server_type)
+            if pool is None:
+                workers = int(cls.get_conf(server_type).get("workers", 2))
+                pool = ProcessPoolExecutor(
+                    max_workers=max(1, workers),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=pool_init)
+                cls.pools[server_type] = pool
+                logger.info(f"[PoolManager] {server_type} 进程池已创建，"
+                            f"工作进程: {workers}")
+            return pool
+
+    # 为宿主机实例安装转发 #######################################################
+    # 将配置中的方法替换为在进程池中执行的版本
+    # ############################################################################
+    @classmethod
+    def bind(cls, server) -> list[str]:
+        if IN_WORKER or server.hs_config is None:
+            return []
+        methods = cls.get_conf(server.hs_config.server_type).get("methods", [])
+        for method in methods:
+            if hasattr(server, method):
+                setattr(server, method, cls.make_call(server, method))
+        return methods
+
+    # 生成转发函数 ===============================================================
+    @classmethod
+    def make_call(cls, server, method: str):
+        def call(*args, **kwargs):
+            return cls.execute(server, method, *args, **kwargs)
+
+        call.__name__ = method
+        return call
+
+    # 在进程池中执行 #############################################################
+    # 执行后按字段合并：只把工作进程修改过的字段写回当前配置，主进程在此期间
+    # 对同一虚拟机其他字段的修改保留；工作进程新建的虚拟机直接加入
+    # ############################################################################
+    @classmethod
+    def execute(cls, server, method: str, *args, **kwargs):
+        server_type = server.hs_config.server_type
+        sent = {k: cls.dump(v) for k, v in server.vm_saving.items()}
+        try:
+            future = cls.get_pool(server_type).submit(
+                pool_exec, server.hs_config, dict(server.vm_saving),
+                method, args, kwargs)
+            result, vm_saving, logs = future.result()
+        except BrokenProcessPool as e:
+            with cls.lock:
+                cls.pools.pop(server_type, None)
+            logger.error(f"[PoolManager] {server_type} 工作进程异常退出: {e}")
+            return ZMessage(success=False, action=method,
+                            message=f"工作进程异常退出: {e}")
+        except Exception as e:
+            logger.error(f"[PoolManager] {method} 执行失败: {e}")
+            traceback.print_exc()
+            return ZMessage(success=False, action=method, message=str(e))
+        # 合并虚拟机配置 =========================================================
+        changed = False
+        for vm_uuid, vm_conf in vm_saving.items():
+            before, after = sent.get(vm_uuid), cls.dump(vm_conf)
+            if before == after:
+                continue
+            current = server.vm_saving.get(vm_uuid)
+            if before is None:
+                server.vm_saving[vm_uuid] = vm_conf  # 工作进程新建
+            elif current is None:
+                continue  # 执行期间已在主进程中删除
+            elif isinstance(after, dict) and all(hasattr(current, k) for k in after):
+                for key, value in after.items():
+                    if before.get(key) != value:
+                        setattr(current, key, getattr(vm_conf, key))
+            else:
+                server.vm_saving[vm_uuid] = vm_conf
+            changed = True
+        for vm_uuid in set(sent) - set(vm_saving):
+            server.vm_saving.pop(vm_uuid, None)
+            changed = True
+        for log in logs:
+            server.logs_set(log)
+        if changed:
+            server.data_set()
+        return result
+
+    # 虚拟机配置快照用于比较（字段字典，无__save__时为序列化字节）=============
+    @staticmethod
+    def dump(vm_conf) -> dict | bytes:
+        if hasattr(vm_conf, "__save__"):  # 经序列化复制，避免与运行中的配置共享引用
+            return pickle.loads(pickle.dumps(vm_conf.__save__()))
+        return pickle.dumps(vm_conf)
+
+    # 关闭全部进程池 #############################################################
+    @classmethod
+    def shutdown(cls):
+        with cls.lock:
+            pools, cls.pools = cls.pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+import time
+import threading
+from typing import Callable, Optional
+from loguru import logger
+from MainObject.Config.VMPowers import VMPowers
+
+
+class PowerCache:
+    # 虚拟机电源状态缓存 #########################################################
+    # 由后端事件流实时更新，定时对账只覆盖对账开始之后没有事件更新过的条目
+    # 格式: {vm_uuid: (VMPowers, 更新时间, 来源)}
+    # ############################################################################
+    def __init__(self):
+        self.states: dict[str, tuple[VMPowers, float, str]] = {}
+        self.lock = threading.Lock()
+
+    # 设置状态 ###################################################################
+    def set(self, vm_uuid: str, state: VMPowers, source: str = "event"):
+        with self.lock:
+            self.states[vm_uuid] = (state, time.time(), source)
+
+    # 获取状态 ###################################################################
+    def get(self, vm_uuid: str) -> Optional[VMPowers]:
+        with self.lock:
+            item = self.states.get(vm_uuid)
+        return item[0] if item else None
+
+    # 删除状态 ###################################################################
+    def drop(self, vm_uuid: str):
+        with self.lock:
+            self.states.pop(vm_uuid, None)
+
+    # 对账结果写入 ###############################################################
+    # :param states: {vm_uuid: VMPowers}，轮询得到的完整状态
+    # :param since: 本次轮询开始时间，之后由事件更新的条目不覆盖
+    # ############################################################################
+    def sync(self, states: dict[str, VMPowers], since: float):
+        now = time.time()
+        with self.lock:
+            for vm_uuid, state in states.items():
+                item = self.states.get(vm_uuid)
+                if item and item[1] >= since:
+                    continue
+                if item and item[0] != state:
+                    logger.debug(f"[PowerCache] {vm_uuid} 对账修正: "
+                                 f"{item[0].name} -> {state.name}")
+                self.states[vm_uuid] = (state, now, "poll")
+            # 轮询中已不存在的虚拟机
+            for vm_uuid in [k for k, v in self.states.items()
+                            if k not in states and v[1] < since]:
+                del self.states[vm_uuid]
+
+    # 导出全部状态 ###############################################################
+    def all(self) -> dict[str, VMPowers]:
+        with self.lock:
+            return {k: v[0] for k, v in self.states.items()}
+
+
+class PowerWatcher:
+    # 电源状态订阅 ###############################################################
+    # 事件线程：调用watch(update, stopping)阻塞消费后端事件流，断开后自动重连
+    # 对账线程：每interval秒调用check()获取全部状态，修正漏掉的事件
+    # :param name: 日志名称（宿主机名称）
+    # :param cache: 状态缓存
+    # :param watch: 事件订阅函数，每收到事件调用update(vm_uuid, VMPowers|None)
+    # :param check: 对账函数，返回 {vm_uuid: VMPowers}
+    # :param close: 中断阻塞中的事件流
+    # :param interval: 对账间隔（秒）
+    # :param backoff: 断线重连等待（秒）
+    # ############################################################################
+    def __init__(self, name: str, cache: PowerCache,
+                 watch: Callable, check: Callable = None,
+                 close: Callable = None,
+                 interval: int = 300, backoff: int = 5):
+        self.name = name
+        self.cache = cache
+        self.watch = watch
+        self.check = check
+        self.close = close
+        self.interval = max(10, interval)
+        self.backoff = max(1, backoff)
+        self.stopping = threading.Event()
+        self.threads: list[threading.Thread] = []
+        self.events = 0
+
+    # 启动订阅 ###################################################################
+    def start(self):
+        if self.threads:
+            return
+        self.stopping.clear()
+        self.threads = [threading.Thread(
+            target=self.run_watch, daemon=True, name=f"power-{self.name}")]
+        if self.check is not None:
+            self.threads.append(threading.Thread(
+                target=self.run_check, daemon=True, name=f"check-{self.name}"))
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"[{self.name}] 电源状态订阅已启动")
+
+    # 停止订阅 ###################################################################
+    def stop(self, timeout: float = 5):
+        self.stopping.set()
+        if self.close is not None:
+            try:
+                self.close()
+            except Exception as e:
+                logger.debug(f"[{self.name}] 关闭事件流: {e}")
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        logger.info(f"[{self.name}] 电源状态订阅已停止")
+
+    # 事件回调 ===================================================================
+    def update(self, vm_uuid: str, state: Optional[VMPowers]):
+        self.events += 1
+        if state is None:
+            self.cache.drop(vm_uuid)
+            return
+        logger.debug(f"[{self.name}] 电源事件: {vm_uuid} -> {state.name}")
+        self.cache.set(vm_uuid, state, "event")
+
+    # 事件线程 ===================================================================
+    def run_watch(self):
+        while not self.stopping.is_set():
+            try:
+                self.watch(self.update, self.stopping)
+            except Exception as e:
+                if self.stopping.is_set():
+                    break
+                logger.warning(f"[{self.name}] 事件流断开: {e}，"
+                               f"{self.backoff}秒后重连")
+            # 重连前立即对账一次，补齐断线期间的状态变化
+            if self.stopping.wait(self.backoff):
+                break
+            self.run_once()
+
+    # 对账线程 ===================================================================
+    def run_check(self):
+        while not self.stopping.is_set():
+            self.run_once()
+            if self.stopping.wait(self.interval):
+                break
+
+    # 执行一次对账 ===============================================================
+    def run_once(self):
+        if self.check is None:
+            return
+        since = time.time()
+        try:
+            states = self.check()
+        except Exception as e:
+            logger.warning(f"[{self.name}] 电源状态对账失败: {e}")
+            return
+        if states is not None:
+            self.cache.sync(states, since)
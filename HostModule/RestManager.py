@@ -629,6 +629,11 @@ class RestManager:
 
             # 统计运行中的虚拟机数量
             for vm_uuid in server.vm_saving.keys():
+                power = server.power_get(vm_uuid)
+                if power is not None:
+                    if power == VMPowers.STARTED:
+                        running_vms += 1
+                    continue
                 vm_status_list = all_vm_status.get(vm_uuid, [])
                 if vm_status_list:
                     # 获取最新的状态
@@ -918,6 +923,8 @@ class RestManager:
 
         # 检查是否强制刷新缓存
         force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+        # 控制台会话指标实时读取，不参与缓存
+        consoles = server.remote_stats()
 
         import time
         current_time = int(time.time())
@@ -929,6 +936,7 @@ class RestManager:
             return self.api_response(200, 'success', {
                 'status': cached_status,
                 'source': 'cached',
+                'consoles': consoles,
                 'cached_at': cache_time,
                 'age_seconds': current_time - cache_time
             })
@@ -938,6 +946,7 @@ class RestManager:
             return self.api_response(200, 'success', {
                 'status': {},
                 'source': 'no_data',
+                'consoles': consoles,
                 'message': '暂无主机状态数据，请等待定时任务更新'
             })
 
@@ -953,6 +962,7 @@ class RestManager:
                 return self.api_response(200, 'success', {
                     'status': status_data,
                     'source': 'fresh' if force_refresh else 'auto_refreshed',
+                    'consoles': consoles,
                     'cached_at': current_time,
                     'cache_duration': 60
                 })
@@ -1015,6 +1025,11 @@ class RestManager:
             except (TypeError, AttributeError):
                 return str(obj)
 
+        # 从 DataManage 获取全部状态（一次读取数据库）=====================
+        all_vm_status = {}
+        if server.save_data and server.hs_config.server_name:
+            all_vm_status = server.save_data.get_vm_status(server.hs_config.server_name)
+
         vms_data = {}
         for vm_uuid, vm_config in server.vm_saving.items():
             # 权限过滤：普通用户只能看到自己拥有的虚拟机
@@ -1022,14 +1037,16 @@ class RestManager:
                 owners = getattr(vm_config, 'own_all', [])
                 if current_username not in owners:
                     continue  # 跳过不属于当前用户的虚拟机
-            # 从 DataManage 获取状态（直接从数据库读取）=================
-            status = None
-            if server.save_data and server.hs_config.server_name:
-                all_vm_status = server.save_data.get_vm_status(server.hs_config.server_name)
-                status = all_vm_status.get(vm_uuid, [])
-                # 只取最新的一条状态
-                if status and len(status) > 0:
-                    status = [status[-1]]
+            status = all_vm_status.get(vm_uuid, [])
+            # 只取最新的一条状态，电源状态以事件缓存为准
+            power = server.power_get(vm_uuid)
+            if status and len(status) > 0:
+                status = [dict(status[-1])]
+                if power is not None:
+                    status[0]['ac_status'] = power.name
+            elif power is not None:
+                # 尚无上报数据：仅提供事件缓存中的电源状态（on_update=0表示未上报）
+                status = [HWStatus(ac_status=power, on_update=0).__save__()]
             vms_data[vm_uuid] = {
                 'uuid': vm_uuid,
                 'config': serialize_obj(vm_config),
@@ -1912,7 +1929,8 @@ class RestManager:
         if not server:
             return self.api_response(404, '主机不存在')
         try:
-            result = server.VMRemote(vm_uuid)
+            result = server.VMRemote(
+                vm_uuid, user=user_data.get('username', ''))
             if not result.success:
                 return self.api_response(400, result.message)
             console_url = result.message
@@ -1,3 +1,4 @@
+import os
 import random
 import socket
 import threading
@@ -10,12 +11,207 @@ try:
 except ImportError:
     PARAMIKO_AVAILABLE = False
 
+from loguru import logger
+
+
+class SSHDPool:
+    """
+    SSH 连接池：同一台主机（地址、端口、用户）只保持一条 Transport，
+    命令执行、SFTP 和端口转发都在其上打开新的 Channel，不再重复密钥交换
+    """
+
+    # 共享连接: {(主机, 端口, 用户名, 密码): SSHDPool}
+    pools: dict = {}
+    pools_lock = threading.Lock()
+    pools_pid = os.getpid()
+    reaper: Optional[threading.Thread] = None
+    keepalive = 30  # 保活间隔（秒）
+    idle = 300  # 空闲超过该时间且无人借用时关闭（秒）
+
+    def __init__(self, hostname: str, username: str, password: str, port: int = 22):
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.port = port
+        self.ssh_client: Optional[paramiko.SSHClient] = None
+        self.users = 0  # 长期借用者数量（端口转发等）
+        self.used = time.time()
+        self.lock = threading.Lock()
+        self.stats = {"connect": 0, "reuse": 0, "reconnect": 0,
+                      "failed": 0, "channels": 0}
+
+    @classmethod
+    def shared(cls, hostname: str, username: str, password: str,
+               port: int = 22) -> "SSHDPool":
+        """获取主机对应的共享连接"""
+        key = (hostname, int(port), username, password)
+        with cls.pools_lock:
+            # fork 出的工作进程不能使用父进程的 Transport 线程，重新建池
+            if cls.pools_pid != os.getpid():
+                cls.pools, cls.pools_pid, cls.reaper = {}, os.getpid(), None
+            pool = cls.pools.get(key)
+            if pool is None:
+                pool = cls(hostname, username, password, port)
+                cls.pools[key] = pool
+            if cls.reaper is None or not cls.reaper.is_alive():
+                cls.reaper = threading.Thread(
+                    target=cls._reap_loop, name="SSHDPool-reaper", daemon=True)
+                cls.reaper.start()
+            return pool
+
+    def active(self) -> bool:
+        """Transport 是否可用"""
+        if self.ssh_client is None:
+            return False
+        transport = self.ssh_client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def client(self, timeout: int = 30) -> "paramiko.SSHClient":
+        """
+        获取共享的 SSHClient，连接断开时自动重连
+
+        调用方只能在其上打开 Channel（exec_command/open_sftp/get_transport），
+        不能调用 close()
+        """
+        if not PARAMIKO_AVAILABLE:
+            raise RuntimeError("paramiko 库未安装")
+        with self.lock:
+            self.used = time.time()
+            if self.active():
+                self.stats["reuse"] += 1
+                return self.ssh_client
+            if self.ssh_client is not None:
+                self.stats["reconnect"] += 1
+                self._close_client()
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(
+                    hostname=self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    timeout=timeout,
+                    allow_agent=False,
+                    look_for_keys=False
+                )
+            except Exception:
+                self.stats["failed"] += 1
+                client.close()
+                raise
+            client.get_transport().set_keepalive(self.keepalive)
+            self.ssh_client = client
+            self.stats["connect"] += 1
+            logger.debug(f"[SSHDPool] 已连接 {self.username}@{self.hostname}:{self.port}")
+            return client
+
+    def open_session(self, timeout: int = 30):
+        """在共享 Transport 上打开会话 Channel，打开失败时重连一次"""
+        for attempt in range(2):
+            try:
+                channel = self.client(timeout).get_transport().open_session(timeout=timeout)
+                self.stats["channels"] += 1
+                return channel
+            except Exception:
+                if attempt:
+                    raise
+                # Transport 可能已被对端关闭但尚未被检测到，丢弃后重试
+                self.drop()
+
+    def execute(self, command: str, timeout: int = 30) -> Tuple[bool, str, str]:
+        """
+        执行远程命令
+
+        :return: (success, stdout, stderr)
+        """
+        try:
+            channel = self.open_session(timeout)
+        except Exception as e:
+            return False, "", f"SSH 连接失败: {str(e)}"
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            stdout = channel.makefile("rb").read().decode('utf-8', errors='replace')
+            stderr = channel.makefile_stderr("rb").read().decode('utf-8', errors='replace')
+            return channel.recv_exit_status() == 0, stdout, stderr
+        except Exception as e:
+            return False, "", f"命令执行失败: {str(e)}"
+        finally:
+            channel.close()
+            self.used = time.time()
+
+    def open_sftp(self, timeout: int = 30) -> "paramiko.SFTPClient":
+        """在共享 Transport 上打开 SFTP（用完后调用方关闭 SFTPClient 即可）"""
+        self.stats["channels"] += 1
+        return self.client(timeout).open_sftp()
+
+    def acquire(self, timeout: int = 30) -> "paramiko.SSHClient":
+        """长期借用连接，借用期间不会被空闲回收"""
+        client = self.client(timeout)
+        with self.lock:
+            self.users += 1
+        return client
+
+    def release(self):
+        """归还长期借用"""
+        with self.lock:
+            self.users = max(0, self.users - 1)
+            self.used = time.time()
+
+    def drop(self):
+        """关闭当前 Transport，下次使用时重连"""
+        with self.lock:
+            self._close_client()
+
+    def _close_client(self):
+        if self.ssh_client is not None:
+            try:
+                self.ssh_client.close()
+            except Exception:
+                pass
+            self.ssh_client = None
+
+    @classmethod
+    def reap(cls, now: float = None) -> int:
+        """关闭空闲且无人借用的连接，返回关闭数量"""
+        now = time.time() if now is None else now
+        with cls.pools_lock:
+            pools = list(cls.pools.values())
+        closed = 0
+        for pool in pools:
+            with pool.lock:
+                if pool.ssh_client is None or pool.users > 0 \
+                        or now - pool.used < cls.idle:
+                    continue
+                pool._close_client()
+                closed += 1
+                logger.debug(f"[SSHDPool] 空闲关闭 {pool.username}@{pool.hostname}:{pool.port}")
+        return closed
+
+    @classmethod
+    def _reap_loop(cls):
+        while True:
+            time.sleep(max(1, cls.idle // 5))
+            try:
+                cls.reap()
+            except Exception as e:
+                logger.warning(f"[SSHDPool] 回收空闲连接失败: {e}")
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """各主机连接复用统计: {"user@host:port": stats}"""
+        with cls.pools_lock:
+            pools = list(cls.pools.values())
+        return {f"{pool.username}@{pool.hostname}:{pool.port}": dict(
+            pool.stats, active=pool.active(), users=pool.users) for pool in pools}
+
 
 class SSHDManager:
-    """SSH 转发管理类，支持远程命令执行和端口转发"""
+    """SSH 转发管理类，支持远程命令执行和端口转发（连接借用自 SSHDPool）"""
     
     def __init__(self):
         self.ssh_client: Optional[paramiko.SSHClient] = None
+        self.ssh_pool: Optional[SSHDPool] = None
         self.forward_threads: list = []  # 存储转发线程
         self.remote_port = 0  # 远程端口
         self.local_port = 0  # 本地端口
@@ -49,17 +245,9 @@ class SSHDManager:
         
         with self._lock:
             try:
-                self.ssh_client = paramiko.SSHClient()
-                self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                self.ssh_client.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=timeout,
-                    allow_agent=False,
-                    look_for_keys=False
-                )
+                # 同一主机共用一条 Transport，已连接时不再握手
+                self.ssh_pool = SSHDPool.shared(hostname, username, password, port)
+                self.ssh_client = self.ssh_pool.acquire(timeout)
                 
                 self.hostname = hostname
                 self.username = username
@@ -72,6 +260,7 @@ class SSHDManager:
             except Exception as e:
                 self._connected = False
                 self.ssh_client = None
+                self.ssh_pool = None
                 return False, f"SSH 连接失败: {str(e)}"
     
     def _close_unlocked(self):
@@ -79,14 +268,11 @@ class SSHDManager:
         # 停止端口转发
         self.stop_port_forward()
         
-        # 关闭 SSH 连接
-        if self.ssh_client:
-            try:
-                self.ssh_client.close()
-            except Exception:
-                pass
-            finally:
-                self.ssh_client = None
+        # 归还 SSH 连接（由连接池负责空闲关闭）
+        if self.ssh_pool and self.ssh_client:
+            self.ssh_pool.release()
+        self.ssh_client = None
+        self.ssh_pool = None
         
         self._connected = False
     
@@ -108,17 +294,7 @@ class SSHDManager:
         if not self.is_connected():
             return False, "", "SSH 未连接"
         
-        try:
-            stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
-            exit_status = stdout.channel.recv_exit_status()
-            
-            stdout_data = stdout.read().decode('utf-8')
-            stderr_data = stderr.read().decode('utf-8')
-            
-            return exit_status == 0, stdout_data, stderr_data
-            
-        except Exception as e:
-            return False, "", f"命令执行失败: {str(e)}"
+        return self.ssh_pool.execute(command, timeout)
     
     def _find_available_local_port(self, start: int = 9000, end: int = 9999) -> int:
         """
@@ -217,7 +393,7 @@ class SSHDManager:
                 return False, f"无法在 {local_port_range[0]}-{local_port_range[1]} 范围内找到可用端口", 0
             
             try:
-                transport = self.ssh_client.get_transport()
+                transport = self.ssh_pool.client().get_transport()
                 
                 # 启动转发线程
                 forward_thread = threading.Thread(
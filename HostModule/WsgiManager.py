@@ -0,0 +1,214 @@
+import os
+import time
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    from waitress import wasyncore
+    from waitress.server import create_server
+    from waitress.channel import HTTPChannel
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+
+class WsgiHandler(WSGIRequestHandler):
+    # 请求处理器 #################################################################
+    # timeout为读取请求的超时时间（秒），避免慢连接长期占用工作线程
+    # ############################################################################
+    timeout = 30
+
+    def log_request(self, code="-", size="-"):
+        logger.debug(f"[WSGI] {self.address_string()} "
+                     f"{self.requestline} {code}")
+
+
+class WsgiServer(BaseWSGIServer):
+    # 备用WSGI服务器（未安装waitress时使用）######################################
+    # 使用有界线程池处理请求，替代Flask开发服务器的每连接一线程
+    # werkzeug的请求处理器不支持keep-alive，每个请求后关闭连接
+    # :param workers: 工作线程数量
+    # ############################################################################
+    multithread = True
+    request_queue_size = 128
+
+    def __init__(self, host: str, port: int, app, workers: int = 16):
+        super().__init__(host, port, app, handler=WsgiHandler)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="wsgi")
+
+    # 将连接交给线程池 ===========================================================
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_thread, request, client_address)
+
+    # 线程池中处理连接 ===========================================================
+    def process_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class WsgiManager:
+    # 生产模式服务管理 ###########################################################
+    # 优先使用waitress（多线程、keep-alive），未安装时退回WsgiServer
+    # 负责处理SIGINT/SIGTERM并优雅退出：停止监听 -> 等待进行中的请求 -> 退出回调
+    # :param app: Flask应用
+    # :param workers: 工作线程数量
+    # :param keepalive: keep-alive空闲连接保持秒数
+    # :param grace: 优雅退出时等待进行中请求的最长秒数
+    # ############################################################################
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 1880,
+                 workers: int = 16, keepalive: int = 5, grace: int = 30):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.keepalive = max(1, keepalive)
+        self.grace = max(0, grace)
+        self.server = None
+        self.closing = threading.Event()
+        self.on_close: list = []
+
+    # 启动服务（阻塞直到退出）####################################################
+    def serve(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.on_signal)
+            signal.signal(signal.SIGTERM, self.on_signal)
+        try:
+            if WAITRESS_AVAILABLE:
+                self.serve_waitress()
+            else:
+                logger.warning("[WSGI] 未安装waitress，使用备用服务器（不支持keep-alive）")
+                self.serve_werkzeug()
+        finally:
+            self.closed()
+
+    # 使用waitress运行 ===========================================================
+    def serve_waitress(self):
+        socket_map = {}
+        self.server = create_server(
+            self.app, map=socket_map,
+            host=self.host, port=self.port,
+            threads=self.workers,
+            channel_timeout=self.keepalive,
+            cleanup_interval=min(30, self.keepalive),
+            ident="OpenIDCS")
+        logger.info(f"[WSGI] 生产模式已启动: http://{self.host}:{self.port} "
+                    f"(工作线程: {self.workers}, keep-alive: {self.keepalive}s)")
+        while not self.closing.is_set():
+            wasyncore.loop(timeout=1.0, map=socket_map, count=1)
+        # 只关闭监听socket，保留trigger供工作线程唤醒事件循环
+        wasyncore.dispatcher.close(self.server)
+        deadline = time.time() + self.grace
+        while time.time() < deadline:
+            channels = [c for c in socket_map.values()
+                        if isinstance(c, HTTPChannel)]
+            if not channels:
+                break
+            # 空闲的keep-alive连接立即关闭，处理中的请求继续完成
+            for channel in channels:
+                if not channel.requests:
+                    channel.will_close = True
+            wasyncore.loop(timeout=0.1, map=socket_map, count=1)
+        else:
+            logger.warning(f"[WSGI] {self.grace}秒内仍有请求未完成，强制退出")
+        self.server.task_dispatcher.shutdown(timeout=1)
+        wasyncore.close_all(socket_map)
+
+    # 使用备用服务器运行 =========================================================
+    def serve_werkzeug(self):
+        self.server = WsgiServer(
+            self.host, self.port, self.app, workers=self.workers)
+        logger.info(f"[WSGI] 生产模式已启动: http://{self.host}:{self.port} "
+                    f"(工作线程: {self.workers})")
+        self.server.serve_forever()
+        self.server.server_close()
+        drain = threading.Thread(
+            target=self.server.executor.shutdown,
+            kwargs={"wait": True}, daemon=True)
+        drain.start()
+        drain.join(self.grace)
+        if drain.is_alive():
+            logger.warning(f"[WSGI] {self.grace}秒内仍有请求未完成，强制退出")
+
+    # 收到退出信号 ###############################################################
+    def on_signal(self, signum, frame):
+        logger.info(f"[WSGI] 收到信号 {signum}，开始优雅退出...")
+        self.stop()
+
+    # 停止接收新请求 #############################################################
+    def stop(self):
+        if self.closing.is_set():
+            return
+        self.closing.set()
+        if isinstance(self.server, WsgiServer):
+            # shutdown()会等待serve_forever退出，必须在其他线程中调用
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    # 执行退出回调 ###############################################################
+    def closed(self):
+        self.closing.set()
+        for callback in self.on_close:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"[WSGI] 退出回调执行失败: {e}")
+        logger.info("[WSGI] 服务已停止")
+        self.server = None
+
+
+class ServiceLock:
+    # 后台服务锁 #################################################################
+    # 同一数据目录只允许一个进程运行定时任务等后台服务
+    # 进程退出时系统自动释放文件锁
+    # ############################################################################
+    def __init__(self, path: str = "./DataSaving/service.lock"):
+        self.path = path
+        self.handle = None
+
+    # 尝试获取锁 #################################################################
+    def acquire(self) -> bool:
+        if self.handle is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        handle = open(self.path, "a+")
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self.handle = handle
+        return True
+
+    # 释放锁 #####################################################################
+    def release(self):
+        if self.handle is None:
+            return
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        self.handle.close()
+        self.handle = None
@@ -0,0 +1,254 @@
+"""
+HttpManager 测试脚本
+使用本地 http.server 模拟 Caddy 管理接口，记录 PUT/POST/PATCH/DELETE 请求，
+验证按优先级插入路由、按ID替换、清空后删除服务器、失败时回退 /load 等行为
+"""
+
+import sys
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HostModule.HttpManager import HttpManager
+
+
+class FakeCaddy(ThreadingHTTPServer):
+    """Caddy管理接口替身：维护一份JSON配置并记录每次请求"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeCaddyHandler)
+        self.config = {"apps": {"http": {"servers": {}}}}
+        self.records = []  # [(方法, 路径)]
+        self.fail = set()  # 需返回错误的(方法, 路径)
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def routes(self, name: str) -> list[str]:
+        server = self.config["apps"]["http"]["servers"].get(name)
+        return None if server is None else [route["@id"] for route in server["routes"]]
+
+    # 按@id查找路由所在的数组与下标 ==========================================
+    def find_id(self, route_id: str):
+        for server in self.config["apps"]["http"]["servers"].values():
+            for index, route in enumerate(server["routes"]):
+                if route.get("@id") == route_id:
+                    return server["routes"], index
+        return None, None
+
+    # 执行一次管理请求，返回HTTP状态码 ========================================
+    def apply(self, method: str, path: str, body) -> int:
+        if method == "POST" and path == "/load":
+            self.config = body
+            return 200
+        if path.startswith("/id/"):
+            parent, index = self.find_id(path[4:])
+            if parent is None:
+                return 404
+            if method == "PATCH":
+                parent[index] = body
+            elif method == "DELETE":
+                del parent[index]
+            else:
+                return 405
+            return 200
+        parts = path.strip("/").split("/")[1:]
+        parent = self.config
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent.get(part)
+            if parent is None:
+                return 404
+        key = parts[-1]
+        if isinstance(parent, list):
+            parent.insert(int(key), body)  # PUT到数组下标：插入
+        elif isinstance(parent.get(key), list) and method == "POST":
+            parent[key].append(body)  # POST到数组：追加
+        elif method == "PUT":
+            if key in parent:
+                return 409
+            parent[key] = body
+        elif method == "DELETE":
+            if key not in parent:
+                return 404
+            del parent[key]
+        else:
+            parent[key] = body
+        return 200
+
+
+class FakeCaddyHandler(BaseHTTPRequestHandler):
+    def handle_one(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server = self.server
+        with server.lock:
+            server.records.append((self.command, self.path))
+            status = 500 if (self.command, self.path) in server.fail \
+                else server.apply(self.command, self.path, body)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_PUT = do_POST = do_PATCH = do_DELETE = handle_one
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def caddy_env(debounce=0.0, proxys_type="tty"):
+    """在临时目录中创建HttpManager并指向管理接口替身"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        caddy = FakeCaddy()
+        try:
+            http = HttpManager(proxys_type=proxys_type, debounce=debounce)
+            http.manage_port = caddy.server_address[1]
+            http.launch_web = lambda: False  # 不启动真实Caddy进程
+            yield http, caddy
+        finally:
+            caddy.shutdown()
+            caddy.server_close()
+            os.chdir(cwd)
+
+
+def test_insert_by_priority():
+    """带路径路由插入到仅域名路由之前，同优先级按添加顺序追加"""
+    with caddy_env() as (http, caddy):
+        assert http.create_web((80, "10.0.0.2"), "a.com", is_https=False)
+        assert http.create_web((80, "10.0.0.3"), "a.com/sub", is_https=False)
+        assert http.create_web((80, "10.0.0.4"), "b.com", is_https=False)
+        assert http.create_web((80, "10.0.0.5"), "c.com/x", is_https=False)
+        base = "/config/apps/http/servers/srv80"
+        assert caddy.records == [("PUT", base), ("PUT", f"{base}/routes/0"),
+                                 ("POST", f"{base}/routes"), ("PUT", f"{base}/routes/1")], \
+            caddy.records
+        expect = [http.route_id("web", name) for name in ("a.com/sub", "c.com/x", "a.com", "b.com")]
+        assert caddy.routes("srv80") == expect, caddy.routes("srv80")
+        assert [item[1] for item in http.admin_live["srv80"]] == expect
+        print("✅ 路由按优先级插入到正确位置")
+
+
+def test_patch_existing():
+    """同ID路由再次推送时按ID原地替换"""
+    with caddy_env() as (http, caddy):
+        assert http.create_web((80, "10.0.0.2"), "a.com", is_https=False)
+        port, route = http.web_route("a.com", {"target": (8080, "10.0.0.9"), "is_https": False})
+        assert http.route_apply(port, [route])
+        assert caddy.records[-1] == ("PATCH", f"/id/{route['@id']}"), caddy.records
+        dial = caddy.config["apps"]["http"]["servers"]["srv80"]["routes"][0]["handle"][0]
+        assert dial["upstreams"] == [{"dial": "10.0.0.9:8080"}], dial
+        print("✅ 已存在的路由按ID替换")
+
+
+def test_remove_empty_server():
+    """普通端口路由清空后删除服务器，VNC统一端口保留"""
+    with caddy_env() as (http, caddy):
+        assert http.create_web((80, "10.0.0.2"), "d.com", is_https=False, listen_port=8080)
+        assert http.remove_web("d.com")
+        assert caddy.records[-2:] == [
+            ("DELETE", f"/id/{http.route_id('web', 'd.com')}"),
+            ("DELETE", "/config/apps/http/servers/srv8080")], caddy.records
+        assert caddy.routes("srv8080") is None and "srv8080" not in http.admin_live
+        http.launch_vnc(8090)
+        assert http.create_vnc("tok1", "127.0.0.1", 7681)
+        assert http.remove_vnc("tok1")
+        assert caddy.records[-1] == ("DELETE", f"/id/{http.route_id('tty', 'tok1')}")
+        assert caddy.routes("srv8090") == []
+        print("✅ 清空的普通端口服务器已删除，VNC端口保留")
+
+
+def test_load_fallback():
+    """增量修改失败时改为 /load 完整加载，内存配置保持一致"""
+    with caddy_env() as (http, caddy):
+        assert http.create_web((80, "10.0.0.2"), "a.com", is_https=False)
+        caddy.fail.add(("PUT", "/config/apps/http/servers/srv80/routes/0"))
+        assert http.create_web((80, "10.0.0.3"), "a.com/sub", is_https=False)
+        assert caddy.records[-1] == ("POST", "/load"), caddy.records
+        assert caddy.routes("srv80") == [http.route_id("web", "a.com/sub"),
+                                         http.route_id("web", "a.com")]
+        # /load也失败时回滚内存配置
+        caddy.fail.add(("POST", "/load"))
+        caddy.fail.add(("PUT", "/config/apps/http/servers/srv80/routes/1"))
+        assert not http.create_web((80, "10.0.0.4"), "b.com/x", is_https=False)
+        assert "b.com/x" not in http.proxys_list
+        print("✅ 管理接口失败时回退为完整加载")
+
+
+def test_http_custom_port():
+    """自定义端口上的非HTTPS域名列入automatic_https.skip，保持明文HTTP"""
+    with caddy_env() as (http, caddy):
+        base = "/config/apps/http/servers/srv8080"
+        assert http.create_web((80, "10.0.0.2"), "a.com", is_https=False, listen_port=8080)
+        server = caddy.config["apps"]["http"]["servers"]["srv8080"]
+        assert server["automatic_https"] == {"skip": ["a.com"]}, server
+        # HTTPS域名不改变skip；新的非HTTPS域名先更新skip再添加路由
+        assert http.create_web((443, "10.0.0.3"), "s.com", is_https=True, listen_port=8080)
+        assert ("POST", f"{base}/automatic_https") not in caddy.records
+        assert http.create_web((80, "10.0.0.4"), "b.com", is_https=False, listen_port=8080)
+        assert caddy.records[-2:] == [("POST", f"{base}/automatic_https"),
+                                      ("POST", f"{base}/routes")], caddy.records
+        assert server["automatic_https"] == {"skip": ["a.com", "b.com"]}
+        assert http.remove_web("a.com")
+        assert server["automatic_https"] == {"skip": ["b.com"]}
+        # 80端口不会自动启用HTTPS，无需skip；完整加载时同样生成skip
+        assert http.create_web((80, "10.0.0.5"), "c.com", is_https=False)
+        assert "automatic_https" not in caddy.config["apps"]["http"]["servers"]["srv80"]
+        assert http.reload_web()
+        servers = caddy.config["apps"]["http"]["servers"]
+        assert servers["srv8080"]["automatic_https"] == {"skip": ["b.com"]}
+        assert "automatic_https" not in servers["srv80"]
+        print("✅ 自定义端口的非HTTPS域名已跳过自动HTTPS")
+
+
+def test_concurrent_coalesce():
+    """并发添加/删除时合并推送，内存配置与管理接口最终一致"""
+    with caddy_env(debounce=0.02) as (http, caddy):
+        http.launch_vnc(8090)
+        threads = [threading.Thread(target=http.create_web,
+                                    args=((80, "10.0.1.%d" % i), f"h{i}.com"),
+                                    kwargs={"is_https": False}) for i in range(20)]
+        threads += [threading.Thread(target=http.create_vnc,
+                                     args=(f"tok{i}", "127.0.0.1", 7681)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        remove = [threading.Thread(target=http.remove_web, args=(f"h{i}.com",))
+                  for i in range(0, 20, 2)]
+        for thread in remove:
+            thread.start()
+        for thread in remove:
+            thread.join()
+        assert len(http.proxys_list) == 10 and len(http.proxys_sshd["8090"]) == 20
+        assert sorted(caddy.routes("srv80")) == sorted(
+            http.route_id("web", f"h{i}.com") for i in range(1, 20, 2))
+        assert len(caddy.routes("srv8090")) == 20
+        stats = http.flush_stats()
+        assert stats["failed"] == 0 and stats["coalesced"] > 0, stats
+        print(f"✅ 并发变更合并推送: {stats['flushes']}次推送/{stats['changes']}项变更")
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("HttpManager 管理接口测试")
+    print("=" * 60)
+    test_insert_by_priority()
+    test_patch_existing()
+    test_remove_empty_server()
+    test_load_fallback()
+    test_http_custom_port()
+    test_concurrent_coalesce()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
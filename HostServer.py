@@ -31,14 +31,11 @@ static_folder = os.path.join(project_root, 'static')
 app = Flask(__name__, template_folder=template_folder, static_folder=static_folder)
 app.secret_key = secrets.token_hex(32)
 
-# 全局主机管理实例
-hs_manage = HostManage()
-
-# 数据库实例
-db = DataManager()
-
-# 全局REST管理器实例
-rest_manager = RestManager(hs_manage, db)
+# 全局主机管理实例、数据库实例、REST管理器实例（在init_app中创建）
+# 进程池以spawn方式启动时会把本文件作为__mp_main__重新导入，不能在导入时创建
+hs_manage: HostManage = None
+db: DataManager = None
+rest_manager: RestManager = None
 
 # 认证装饰器（保持向后兼容）###################################################
 # 需要登录或Bearer Token认证的装饰器
@@ -63,6 +60,22 @@ def require_auth(f):
     return decorated
 
 
+# 只读实例拒绝修改请求 #########################################################
+# 非后台服务进程不保存主机/虚拟机配置，修改主机、虚拟机、代理和Token的请求
+# 须由持有服务锁的后台服务进程处理，否则修改会在返回成功后丢失
+################################################################################
+READONLY_PATHS = ('/api/server/', '/api/client/', '/api/admin/', '/api/hosts/',
+                  '/api/token/', '/api/system/save', '/api/system/load')
+
+
+@app.before_request
+def reject_readonly():
+    if not hs_manage.service and request.method in ('POST', 'PUT', 'PATCH', 'DELETE') \
+            and request.path.startswith(READONLY_PATHS):
+        return rest_manager.api_response(
+            503, '当前为只读实例（非后台服务进程），请通过后台服务修改配置', None)
+
+
 # 统一API响应格式包装器 #######################################################
 def api_response_wrapper(code=200, msg='成功', data=None):
     return rest_manager.api_response(code, msg, data)
@@ -1688,8 +1701,13 @@ def api_get_translations(lang_code):
 # ============================================================================
 # 定时任务
 # ============================================================================
+cron_stopped = threading.Event()
+
+
 def cron_scheduler():
     """定时任务调度器，每分钟执行一次exe_cron"""
+    if cron_stopped.is_set():
+        return
     try:
         hs_manage.exe_cron()
     except Exception as e:
@@ -1697,6 +1715,8 @@ def cron_scheduler():
         logger.error(f"[Cron] 执行定时任务出错: {e}")
 
     # 设置下一次执行（60秒后）
+    if cron_stopped.is_set():
+        return
     timer = threading.Timer(60, cron_scheduler)
     timer.daemon = True  # 设为守护线程，主程序退出时自动结束
     timer.start()
@@ -1725,15 +1745,29 @@ def start_cron_scheduler():
     logger.info("[Cron] 定时任务已启动（后台运行），每60秒执行一次")
 
 
+def stop_cron_scheduler():
+    """停止定时任务调度器（不再安排下一次执行）"""
+    cron_stopped.set()
+    logger.info("[Cron] 定时任务调度器已停止")
+
+
 # ============================================================================
 # 启动服务
 # ============================================================================
-def init_app():
-    """初始化应用"""
-    # 加载已保存的配置
+def init_app(service: bool = True):
+    """
+    初始化应用
+    :param service: 是否为后台服务进程（负责代理管理器、主机服务与定时任务）
+    """
+    global hs_manage, db, rest_manager
+    hs_manage = HostManage()
+    db = DataManager()
+    rest_manager = RestManager(hs_manage, db)
+
+    # 加载已保存的配置（非服务进程只读加载）
     try:
         logger.info("正在加载系统配置...")
-        hs_manage.all_load()
+        hs_manage.all_load(service=service)
         logger.info("系统配置加载完成")
     except Exception as e:
         logger.error(f"加载配置失败: {e}")
@@ -1792,7 +1826,10 @@ def init_app():
     except Exception as e:
         logger.error(f"初始化admin用户失败: {e}")
 
-    # 启动定时任务调度器
+    # 启动定时任务调度器（仅后台服务进程）
+    if not service:
+        logger.warning("[Cron] 其他进程已持有后台服务锁，本进程不运行定时任务")
+        return
     try:
         start_cron_scheduler()
         logger.info("定时任务调度器启动成功")
@@ -1800,6 +1837,35 @@ def init_app():
         logger.error(f"启动定时任务调度器失败: {e}")
 
 
+# 解析启动参数 ###############################################################
+# 命令行参数优先，未指定时读取环境变量
+################################################################################
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description="OpenIDCS Server")
+    parser.add_argument(
+        "--production", action="store_true",
+        default=os.environ.get("FLASK_ENV", "") == "production",
+        help="使用生产模式WSGI服务器启动")
+    parser.add_argument(
+        "--host", default=os.environ.get("HOST_SERVER_ADDR", "0.0.0.0"),
+        help="监听地址")
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("HOST_SERVER_PORT", 1880)),
+        help="监听端口")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("HOST_SERVER_WORKERS", 16)),
+        help="生产模式工作线程数量")
+    parser.add_argument(
+        "--keepalive", type=int, default=int(os.environ.get("HOST_SERVER_KEEPALIVE", 5)),
+        help="生产模式keep-alive空闲保持秒数（最小1秒）")
+    parser.add_argument(
+        "--grace", type=int, default=int(os.environ.get("HOST_SERVER_GRACE", 30)),
+        help="优雅退出时等待进行中请求的最长秒数")
+    # 忽略未知参数（如Windows多进程启动时附加的参数）
+    return parser.parse_known_args()[0]
+
+
 if __name__ == '__main__':
     try:
         # 在Windows系统上支持多进程
@@ -1808,6 +1874,9 @@ if __name__ == '__main__':
         
         # 检测是否为打包后的环境
         is_frozen = getattr(sys, 'frozen', False)
+        args = parse_args()
+        # 打包后始终使用生产模式，避免 Nuitka 兼容性问题
+        is_production = args.production or is_frozen
         
         # ===== 首先配置 logger，确保日志系统正常工作 =====
         # 移除默认的 handler
@@ -1843,25 +1912,41 @@ if __name__ == '__main__':
         logger.info(f"项目根目录: {project_root}")
         logger.info("=" * 60)
         
+        # 获取后台服务锁，同一数据目录只有一个进程运行定时任务
+        from HostModule.WsgiManager import WsgiManager, ServiceLock
+        service_lock = ServiceLock(os.path.join(log_dir, "service.lock"))
+        is_service = service_lock.acquire()
+        
         # 初始化应用
         logger.info("正在初始化应用...")
-        init_app()
+        init_app(service=is_service)
         
         logger.info(f"\n{'=' * 60}")
         logger.info(f"OpenIDCS Server 启动中...")
-        logger.info(f"运行模式: {'打包模式' if is_frozen else '开发模式'}")
-        logger.info(f"访问地址: http://127.0.0.1:1880")
+        logger.info(f"运行模式: {'生产模式' if is_production else '开发模式'}")
+        logger.info(f"访问地址: http://127.0.0.1:{args.port}")
         logger.info(f"访问Token: {hs_manage.bearer}")
         logger.info(f"{'=' * 60}\n")
         
-        # 打包后禁用调试模式，避免 Nuitka 兼容性问题
-        if is_frozen:
-            logger.info("使用生产模式启动 Flask 服务器...")
-            app.run(host='0.0.0.0', port=1880, debug=False, use_reloader=False)
+        if is_production:
+            logger.info("使用生产模式启动 WSGI 服务器...")
+            wsgi_server = WsgiManager(
+                app, host=args.host, port=args.port,
+                workers=args.workers, keepalive=args.keepalive,
+                grace=args.grace)
+            # 优雅退出：停止定时任务 -> 保存数据 -> 卸载主机 -> 释放服务锁
+            # 非服务进程未启动代理与主机服务，all_exit仅关闭连接池
+            if is_service:
+                wsgi_server.on_close.append(stop_cron_scheduler)
+                wsgi_server.on_close.append(hs_manage.all_save)
+            wsgi_server.on_close.append(hs_manage.all_exit)
+            if is_service:
+                wsgi_server.on_close.append(service_lock.release)
+            wsgi_server.serve()
         else:
             # 开发环境可以使用调试模式
             logger.info("使用调试模式启动 Flask 服务器...")
-            app.run(host='0.0.0.0', port=1880, debug=True, use_reloader=False)
+            app.run(host=args.host, port=args.port, debug=True, use_reloader=False)
     except KeyboardInterrupt:
         logger.info("\n程序被用户中断")
         sys.exit(0)
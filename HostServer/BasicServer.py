@@ -12,6 +12,8 @@ from loguru import logger
 from random import randint
 from HostModule.HttpManager import HttpManager
 from HostModule.NetsManager import NetsManager
+from HostModule.PowerWatcher import PowerCache, PowerWatcher
+from HostModule.PoolManager import PoolManager
 from VNCConsole.VNCSManager import WebsocketUI
 from VNCConsole.VNCSManager import VNCSManager
 from MainObject.Config.HSConfig import HSConfig
@@ -28,6 +30,8 @@ from MainObject.Config.IPConfig import IPConfig
 from MainObject.Server.HSStatus import HSStatus
 from HostServer.OCInterfaceAPI import SSHTerminal
 from HostServer.OCInterfaceAPI import PortForward
+from HostServer.OCInterfaceAPI.IPTablesAPI import IPTablesAPI
+from HostServer.OCInterfaceAPI.PortRegistry import PortRegistry
 
 
 class BasicServer:
@@ -43,11 +47,17 @@ class BasicServer:
         # 网络管理 =======================================================
         self.http_manager = None
         self.port_forward = None
+        self.port_records: PortRegistry | None = None  # 端口转发登记表
         self.web_terminal = None
+        # 电源状态 =======================================================
+        self.power_cache = PowerCache()
+        self.power_watch: PowerWatcher | None = None
         # 加载数据 =======================================================
         self.__load__(**kwargs)
         # 日志系统配置 ===================================================
         self.init_log()
+        # 进程池隔离 =====================================================
+        PoolManager.bind(self)
 
     # 转换字典 ######################################################################
     def __save__(self):
@@ -219,10 +229,55 @@ class BasicServer:
         """判断是否为远程主机"""
         return self.hs_config.server_addr not in ["localhost", "127.0.0.1", ""]
 
+    # 启动电源状态订阅 ##############################################################
+    # 子类实现power_event后生效，对账间隔由extend_data["power_check"]配置
+    # ###############################################################################
+    def power_init(self) -> bool:
+        if type(self).power_event is BasicServer.power_event:
+            return False
+        if self.power_watch is not None:
+            return True
+        interval = int(self.hs_config.extend_data.get("power_check", 300))
+        self.power_watch = PowerWatcher(
+            self.hs_config.server_name, self.power_cache,
+            watch=self.power_event, check=self.power_check,
+            close=self.power_close, interval=interval)
+        self.power_watch.start()
+        return True
+
+    # 停止电源状态订阅 ##############################################################
+    def power_exit(self):
+        if self.power_watch is not None:
+            self.power_watch.stop()
+            self.power_watch = None
+
+    # 获取缓存的电源状态 ############################################################
+    # :return: VMPowers，未订阅或未知时返回None
+    # ###############################################################################
+    def power_get(self, vm_uuid: str) -> VMPowers | None:
+        return self.power_cache.get(vm_uuid)
+
     # ###############################################################################
     # 可重载方法 ####################################################################
     # ###############################################################################
 
+    # 电源事件订阅 ##################################################################
+    # 阻塞消费后端事件流，每个事件调用update(vm_uuid, VMPowers)，删除时传入None
+    # 事件流断开时返回或抛出异常，由PowerWatcher负责重连
+    # ###############################################################################
+    def power_event(self, update, stopping) -> None:
+        raise NotImplementedError
+
+    # 电源状态对账 ##################################################################
+    # :return: {vm_uuid: VMPowers}，返回None表示本次跳过
+    # ###############################################################################
+    def power_check(self) -> dict[str, VMPowers] | None:
+        return None
+
+    # 中断电源事件流 ################################################################
+    def power_close(self):
+        pass
+
     # 获取虚拟机配置 ################################################################
     def VMSelect(self, select: str) -> VMConfig | None:
         if select in self.vm_saving:
@@ -257,22 +312,9 @@ class BasicServer:
 
     # 端口映射 ######################################################################
     def PortsMap(self, map_info: PortData, flag=True) -> ZMessage:
-        nc_server = NetsManager(
-            self.hs_config.i_kuai_addr,
-            self.hs_config.i_kuai_user,
-            self.hs_config.i_kuai_pass)
-        nc_server.login()
-        # 提取端口列表 ==============================================================
-        port_result = nc_server.get_port()
-        wan_list = []
-        # 检查端口是否被占用 ========================================================
-        if port_result and isinstance(port_result, dict):
-            now_list = port_result.get('Data', {})
-            if isinstance(now_list, dict):
-                now_list = now_list.get('data', [])
-                if isinstance(now_list, list):
-                    wan_list = [int(i.get("wan_port", 0)) \
-                                for i in now_list if isinstance(i, dict)]
+        nc_server = self.nets_conn()
+        # 提取端口列表（共享客户端缓存，添加后同步更新）============================
+        wan_list = nc_server.wan_ports() or []
         # 检查端口范围是否正确 ======================================================
         if self.hs_config.ports_start == "" or self.hs_config.ports_close == "":
             return ZMessage(
@@ -328,6 +370,11 @@ class BasicServer:
                     success=False, action="ProxyMap",
                     message="当主机为远程IP时，必须先添加NAT映射才能代理<br/>"
                             "当前映射的本地端口缺少NAT映射，请先添加映射")
+        # 代理管理器仅在后台服务进程中运行 ========================================
+        if in_apis is None:
+            return ZMessage(success=False,
+                            action="ProxyMap",
+                            message="代理管理仅在后台服务进程中可用")
         # 检查变量存在 ==============================================================
         if not hasattr(vm_config, 'web_all') or vm_config.web_all is None:
             vm_config.web_all = []
@@ -374,15 +421,19 @@ class BasicServer:
                 message=str(e)
             )
 
+    # 爱快共享客户端 ################################################################
+    # 同一路由器的所有宿主机共用，会话失效时自动重新登录
+    # ###############################################################################
+    def nets_conn(self) -> NetsManager:
+        return NetsManager.shared(
+            self.hs_config.i_kuai_addr,
+            self.hs_config.i_kuai_user,
+            self.hs_config.i_kuai_pass)
+
     # 网络静态绑定 ##################################################################
     def NetiKuai(self, ip, mac, uuid, flag=True, dns1=None, dns2=None) -> ZMessage:
         try:
-            nc_server = NetsManager(
-                self.hs_config.i_kuai_addr,
-                self.hs_config.i_kuai_user,
-                self.hs_config.i_kuai_pass
-            )
-            nc_server.login()
+            nc_server = self.nets_conn()
             if flag:
                 nc_server.add_dhcp(
                     ip, mac, comment=uuid, lan_dns1=dns1, lan_dns2=dns2
@@ -422,7 +473,9 @@ class BasicServer:
             cfg_full = "DataSaving/" + cfg_name + ".cfg"
             if os.path.exists(cfg_full):
                 os.remove(cfg_full)
-            tp_remote = WebsocketUI(self.hs_config.remote_port, cfg_name)
+            # extend_data["vnc_idle"]: 控制台会话空闲断开秒数，0为不限制
+            tp_remote = WebsocketUI(self.hs_config.remote_port, cfg_name,
+                                    int(self.hs_config.extend_data.get("vnc_idle", 0)))
             self.vm_remote = VNCSManager(tp_remote)
             self.vm_remote.start()
             return True
@@ -430,6 +483,15 @@ class BasicServer:
             logger.warning(f"VNC服务启动失败: {str(e)}")
             return False
 
+    # 远程控制台会话指标 ============================================================
+    # :return: {token: {"target", "sessions", "bytes_in", "bytes_out", ...}}，
+    #          非VNC控制台或websockify未运行时为空
+    # ###############################################################################
+    def remote_stats(self) -> dict:
+        if isinstance(self.vm_remote, VNCSManager):
+            return self.vm_remote.exec.get_stats()
+        return {}
+
     # 远程桌面TTY连接初始化 =========================================================
     def VMLoader_TTY(self) -> bool:
         if not self.web_terminal:
@@ -437,13 +499,21 @@ class BasicServer:
         # 初始化HttpManager
         if not self.http_manager:
             hostname = getattr(self.hs_config, 'server_name', '')
-            config_filename = f"vnc-{hostname}.txt"
+            config_filename = f"vnc-{hostname}.json"
             self.http_manager = HttpManager(config_filename)
             self.http_manager.launch_vnc(self.hs_config.remote_port)
             self.http_manager.launch_web()
-        # 初始化端口转发管理器
+        # 终端会话被回收时同步删除代理路由 ===========================
+        if self.web_terminal.on_close is None:
+            self.web_terminal.on_close = self.http_manager.remove_vnc
+        # 初始化端口转发管理器：extend_data["nat_backend"]为iptables/nftables时
+        # 使用内核NAT，否则使用PortRelay转发守护进程
         if not self.port_forward:
-            self.port_forward = PortForward.PortForward(self.hs_config)
+            if self.hs_config.extend_data.get("nat_backend", "") in (
+                    "iptables", "nftables", "nft"):
+                self.port_forward = IPTablesAPI(self.hs_config)
+            else:
+                self.port_forward = PortForward.PortForward(self.hs_config)
         return True
 
     # 网络动态绑定 ##################################################################
@@ -455,48 +525,44 @@ class BasicServer:
         return ZMessage(success=False, action="IPCreate")
 
     # 通过爱快绑定 ==================================================================
+    # 所有网卡的绑定通过共享客户端批量提交，解绑时每种列表只删除一次
+    # ===============================================================================
     def IPBinder_ROS(self, vm_conf: VMConfig, flag=True) -> ZMessage:
-        # 创建网卡 ==================================================================
-        # 遍历所有网络适配器->绑定静态IP ============================================
-        all_success = True
-        error_message = ""
-
-        for nic_name, nic_conf in vm_conf.nic_all.items():
-            try:
-                logger.info(
-                    f"[API] 绑定静态IP: {nic_conf.ip4_addr} -> {nic_conf.mac_addr}")
-                nc_result = self.NetiKuai(
-                    nic_conf.ip4_addr,
-                    nic_conf.mac_addr,
-                    vm_conf.vm_uuid,
-                    flag=flag,
-                    dns1=self.hs_config.ipaddr_dnss[0],
-                    dns2=self.hs_config.ipaddr_dnss[1]
-                )
-                if nc_result.success:
-                    logger.success(f"[API] 静态IP绑定成功: {nic_conf.ip4_addr}")
-                else:
-                    logger.warning(f"[API] 静态IP绑定失败: {nc_result.message}")
-                    all_success = False
-                    if not error_message:
-                        error_message = nc_result.message
-            except Exception as e:
-                logger.error(f"[API] 静态IP绑定异常: {str(e)}")
-                all_success = False
-                if not error_message:
-                    error_message = str(e)
+        nics = [nic_conf for nic_conf in vm_conf.nic_all.values()
+                if nic_conf.ip4_addr]
+        if not nics:
+            return ZMessage(success=True, action="NCStatic",
+                            message="没有需要绑定的网卡")
+        try:
+            nc_server = self.nets_conn()
+            logger.info(
+                f"[API] {'绑定' if flag else '解绑'}静态IP: " + ", ".join(
+                    f"{nic.ip4_addr} -> {nic.mac_addr}" for nic in nics))
+            if flag:
+                success = nc_server.add_bind_list([
+                    (nic.ip4_addr, nic.mac_addr, vm_conf.vm_uuid,
+                     self.hs_config.ipaddr_dnss[0],
+                     self.hs_config.ipaddr_dnss[1]) for nic in nics])
+            else:
+                success = nc_server.del_bind_all([nic.ip4_addr for nic in nics])
+        except Exception as e:
+            logger.error(f"[API] 静态IP绑定异常: {str(e)}")
+            return ZMessage(success=False, action="NCStatic",
+                            message=f"部分网卡IP绑定失败: {str(e)}")
 
-        if all_success:
+        if success:
+            logger.success(f"[API] 静态IP绑定成功: {len(nics)} 个网卡")
             return ZMessage(
                 success=True,
                 action="NCStatic",
                 message="所有网卡IP绑定成功"
             )
         else:
+            logger.warning("[API] 静态IP绑定失败")
             return ZMessage(
                 success=False,
                 action="NCStatic",
-                message=f"部分网卡IP绑定失败: {error_message}"
+                message="部分网卡IP绑定失败"
             )
 
     # 手动实现绑定 ==================================================================
@@ -513,22 +579,18 @@ class BasicServer:
 
     # 通过爱快绑定 ==================================================================
     def IPUpdate_ROS(self, vm_conf: VMConfig, vm_last: VMConfig) -> ZMessage:
+        nc_server = self.nets_conn()
         # 删除旧的网络绑定 ==========================================================
         if vm_last is not None:
-            for nic_name in vm_last.nic_all:
-                nic_data = vm_last.nic_all[nic_name]
-                self.NetiKuai(
-                    nic_data.ip4_addr, nic_data.mac_addr,
-                    vm_last.vm_uuid, False)
+            nc_server.del_bind_all([
+                nic_data.ip4_addr for nic_data in vm_last.nic_all.values()
+                if nic_data.ip4_addr])
         # 添加新的网络绑定 ==========================================================
-        for nic_name in vm_conf.nic_all:
-            nic_data = vm_conf.nic_all[nic_name]
-            self.NetiKuai(
-                nic_data.ip4_addr, nic_data.mac_addr,
-                vm_conf.vm_uuid, True,
-                nic_data.dns_addr[0] if len(nic_data.dns_addr) > 0 else "119.29.29.29",
-                nic_data.dns_addr[1] if len(nic_data.dns_addr) > 1 else "223.5.5.5"
-            )
+        nc_server.add_bind_list([(
+            nic_data.ip4_addr, nic_data.mac_addr, vm_conf.vm_uuid,
+            nic_data.dns_addr[0] if len(nic_data.dns_addr) > 0 else "119.29.29.29",
+            nic_data.dns_addr[1] if len(nic_data.dns_addr) > 1 else "223.5.5.5"
+        ) for nic_data in vm_conf.nic_all.values()])
         return ZMessage(success=True, action="VMUpdate")
 
     # 手动实现绑定 ==================================================================
@@ -540,11 +602,12 @@ class BasicServer:
     # ###############################################################################
 
     # 同步端口转发配置（TTY容器专用）################################################
+    # 一次列出实际规则，与配置做集合差异；有差异时整体提交一次并批量校验，
+    # 结果写入端口转发登记表
+    # ###############################################################################
     def syn_port_TTY(self):
+        is_remote = self.web_flag()
         try:
-            # 判断是否为远程主机
-            is_remote = self.web_flag()
-
             # 如果是远程主机，先建立SSH连接
             if is_remote:
                 success, message = self.port_forward.connect_ssh()
@@ -552,92 +615,71 @@ class BasicServer:
                     logger.error(f"SSH连接失败，无法同步端口转发: {message}")
                     return
 
-            # 获取系统中已有的端口转发
-            existing_forwards = self.port_forward.list_ports(is_remote)
-            existing_map = {}  # {(lan_addr, lan_port): forward_info}
-            for forward in existing_forwards:
-                key = (forward.lan_addr, forward.lan_port)
-                existing_map[key] = forward
-
-            # 获取配置中需要的端口转发
-            required_forwards = {}  # {(lan_addr, lan_port): (wan_port, vm_name)}
+            # 获取配置中需要的端口转发 {(协议, 外部端口): PortConfig}
+            required = {}
             for vm_name, vm_conf in self.vm_saving.items():
-                if not hasattr(vm_conf, 'nat_all'):
-                    continue
-
-                for port_data in vm_conf.nat_all:
-                    key = (port_data.lan_addr, port_data.lan_port)
-                    required_forwards[key] = (port_data.wan_port, vm_name)
-
-            # 删除不需要的转发
-            removed_count = 0
-            for key, forward in existing_map.items():
-                if key not in required_forwards:
-                    # 这个转发不在配置中，删除它
-                    if self.port_forward.remove_port_forward(
-                            forward.wan_port, forward.protocol, is_remote
-                    ):
-                        removed_count += 1
-                        logger.info(
-                            f"删除多余的端口转发: {forward.protocol} "
-                            f"{forward.wan_port} -> "
-                            f"{forward.lan_addr}:{forward.lan_port}"
-                        )
-
-            # 添加缺少的转发
-            added_count = 0
-            for key, (wan_port, vm_name) in required_forwards.items():
-                lan_addr, lan_port = key
-
-                # 检查是否已存在
-                if key in existing_map:
-                    existing_forward = existing_map[key]
-                    # 如果wan_port不同，需要先删除旧的再添加新的
-                    if existing_forward.wan_port != wan_port:
-                        self.port_forward.remove_port_forward(
-                            existing_forward.wan_port,
-                            existing_forward.protocol,
-                            is_remote
-                        )
-                        logger.info(
-                            f"端口映射变更，删除旧转发: "
-                            f"{existing_forward.protocol} "
-                            f"{existing_forward.wan_port} -> "
-                            f"{lan_addr}:{lan_port}"
-                        )
-                    else:
-                        # 端口转发已存在且配置正确，跳过
-                        continue
-
-                # 添加新的端口转发
-                success, error = self.port_forward.add_port_forward(
-                    lan_addr, lan_port, wan_port, "TCP", is_remote, vm_name
-                )
-
-                if success:
-                    added_count += 1
-                    logger.info(
-                        f"添加端口转发: TCP {wan_port} -> "
-                        f"{lan_addr}:{lan_port} ({vm_name})"
-                    )
-                else:
-                    logger.error(
-                        f"添加端口转发失败: TCP {wan_port} -> "
-                        f"{lan_addr}:{lan_port}, 错误: {error}"
-                    )
-
+                for port_data in getattr(vm_conf, 'nat_all', []):
+                    rule = PortForward.PortConfig(
+                        int(port_data.wan_port), port_data.lan_addr,
+                        int(port_data.lan_port), "TCP", vm_name)
+                    required[(rule.protocol, rule.wan_port)] = rule
+
+            # 获取系统中已有的端口转发，并校验登记表
+            existing = self.port_list(is_remote)
+            registry = self.port_registry()
+            drift = registry.drift(existing)
+            if drift:
+                logger.warning(f"端口转发与登记表不一致: {len(drift)} 条，重新同步")
+
+            same = PortForward.PortConfig.same
+            missing = [key for key, rule in required.items()
+                       if key not in existing or not same(existing[key], rule)]
+            extra = [key for key in existing if key not in required]
+            error, reasons = "", {}
+            if missing or extra:
+                # 一次提交完整规则集，再列出一次批量校验
+                success, error, changes = self.port_forward.sync_rules(
+                    list(required.values()), is_remote)
+                reasons = changes.get("failed", {})
+                if not success:
+                    logger.warning(f"端口转发同步未完全成功: {error}")
+                existing = self.port_list(is_remote)
+
+            failed = {key: reasons.get(f"{key[0]}:{key[1]}", error or "未生效")
+                      for key, rule in required.items()
+                      if key not in existing or not same(existing[key], rule)}
+            registry.record(
+                [rule for key, rule in existing.items() if key in required],
+                failed, type(self.port_forward).__name__)
+            for (protocol, wan_port), reason in failed.items():
+                rule = required[(protocol, wan_port)]
+                logger.error(
+                    f"添加端口转发失败: {protocol} {wan_port} -> "
+                    f"{rule.lan_addr}:{rule.lan_port}, 错误: {reason}")
             logger.info(
-                f"端口转发同步完成: 删除 {removed_count} 个，"
-                f"添加 {added_count} 个"
-            )
-
-            # 关闭SSH连接
-            if is_remote:
-                self.port_forward.close_ssh()
+                f"端口转发同步完成: 删除 {len(extra)} 个，"
+                f"添加 {len(missing) - len(failed)} 个"
+                + (f"，失败 {len(failed)} 个" if failed else ""))
         except Exception as e:
             logger.error(f"同步端口转发时出错: {str(e)}")
             import traceback
             traceback.print_exc()
+        finally:
+            # 关闭SSH连接
+            if is_remote:
+                self.port_forward.close_ssh()
+
+    # 列出实际端口转发 {(协议, 外部端口): PortConfig} ===============================
+    def port_list(self, is_remote: bool) -> dict:
+        return {(forward.protocol.upper(), int(forward.wan_port)): forward
+                for forward in self.port_forward.list_ports(is_remote)}
+
+    # 端口转发登记表 ================================================================
+    def port_registry(self) -> PortRegistry:
+        if self.port_records is None:
+            self.port_records = PortRegistry(os.path.join(
+                "DataSaving", f"forwards-{self.hs_config.server_name}.json"))
+        return self.port_records
 
     # 更新网络配置（TTY容器专用）####################################################
     def IPUpdate_TTY(self, vm_conf: VMConfig, vm_last: VMConfig) -> ZMessage:
@@ -681,6 +723,9 @@ class BasicServer:
                 "TCP", is_remote, map_info.nat_tips)
 
             if success:
+                self.port_registry().put(PortForward.PortConfig(
+                    int(map_info.wan_port), map_info.lan_addr, int(map_info.lan_port),
+                    "TCP", map_info.nat_tips), type(self.port_forward).__name__)
                 hs_message = f"端口 {map_info.wan_port} 成功映射到 {map_info.lan_addr}:{map_info.lan_port}"
                 hs_success = True
             else:
@@ -692,6 +737,7 @@ class BasicServer:
         else:
             self.port_forward.remove_port_forward(
                 map_info.wan_port, "TCP", is_remote)
+            self.port_registry().drop("TCP", map_info.wan_port)
             hs_message = f"端口 {map_info.wan_port} 映射已删除"
             hs_success = True
 
@@ -798,6 +844,7 @@ class BasicServer:
     # 读取宿主机 ####################################################################
     def HSLoader(self) -> ZMessage:
         self.VMLoader()
+        self.power_init()
         hs_result = ZMessage(
             success=True,
             action="HSLoader",
@@ -807,6 +854,9 @@ class BasicServer:
 
     # 卸载宿主机 ####################################################################
     def HSUnload(self) -> ZMessage:
+        self.power_exit()
+        if self.web_terminal:
+            self.web_terminal.stop_all()
         hs_result = ZMessage(
             success=True,
             action="HSUnload",
@@ -1223,7 +1273,8 @@ class BasicServer:
         )
 
     # 虚拟机控制台 ##################################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         try:
             if vm_uuid not in self.vm_saving:
                 return ZMessage(
@@ -2,14 +2,19 @@
 # 提供LXD容器的创建、管理和监控功能
 ################################################################################
 import os
+import json
+import time
 import datetime
 import traceback
 from pylxd import Client
+from ws4py.client import WebSocketBaseClient
 from loguru import logger
 from copy import deepcopy
 from typing import Optional, Tuple
 from pylxd.exceptions import NotFound
 from HostServer.BasicServer import BasicServer
+from HostServer.OCInterfaceAPI.CGroupStats import CGroupStats
+from HostServer.LXContainerAPI.LXDInstances import LXDInstances
 from MainObject.Config.HSConfig import HSConfig
 from MainObject.Config.IMConfig import IMConfig
 from MainObject.Config.SDConfig import SDConfig
@@ -21,6 +26,17 @@ from MainObject.Public.ZMessage import ZMessage
 from MainObject.Config.VMConfig import VMConfig
 
 
+# LXD事件流客户端 ##############################################################
+# 由 client.events() 创建，收到的每条事件交给on_event回调
+################################################################################
+class LXDEvents(WebSocketBaseClient):
+    on_event = None
+
+    def received_message(self, message):
+        if self.on_event is not None:
+            self.on_event(json.loads(message.data.decode("utf-8")))
+
+
 class HostServer(BasicServer):
     # 宿主机服务 ###############################################################
     def __init__(self, config: HSConfig, **kwargs):
@@ -31,6 +47,11 @@ class HostServer(BasicServer):
         self.web_terminal = None
         self.http_manager = None
         self.port_forward = None
+        self.cgroup_stats = CGroupStats()
+        self.instances = LXDInstances(
+            self.lxd_fetch,
+            ttl=int(self.hs_config.extend_data.get("inventory_ttl", 10)))
+        self.power_socket = None
 
     # 转换下划线 ###############################################################
     @staticmethod
@@ -131,6 +152,19 @@ class HostServer(BasicServer):
                 message=f"Failed to connect to LXD: {str(e)}"
             )
 
+    # 获取全部实例及状态 #######################################################
+    # 一次 GET /1.0/instances?recursion=2，旧版本LXD使用 /1.0/containers
+    ###########################################################################
+    def lxd_fetch(self) -> list:
+        client, result = self.lxd_conn()
+        if not result.success:
+            raise ConnectionError(result.message)
+        if client.has_api_extension("instances"):
+            response = client.api.instances.get(params={"recursion": 2})
+        else:
+            response = client.api.containers.get(params={"recursion": 2})
+        return response.json().get("metadata") or []
+
     # 同步端口转发配置 #########################################################
     def syn_port(self):
         return self.syn_port_TTY()
@@ -246,6 +280,22 @@ class HostServer(BasicServer):
                 logger.warning(f"[{self.hs_config.server_name}] 获取远程主机状态失败: {e}，使用本地状态")
                 return super().Crontabs()
 
+            # 采集容器状态并批量保存（每个周期只获取一次实例清单）
+            try:
+                since = time.time()
+                if self.instances.refresh(force=True):
+                    self.power_cache.sync(self.lxd_power(), since)
+                vm_status = self.lxd_status()
+                if vm_status and self.save_data and self.hs_config.server_name:
+                    if self.save_data.add_vm_status_batch(
+                            self.hs_config.server_name, vm_status):
+                        logger.debug(f"[{self.hs_config.server_name}] Crontabs: {len(vm_status)} 个容器状态已保存")
+                    else:
+                        logger.warning(f"[{self.hs_config.server_name}] Crontabs: 容器状态批量保存失败")
+            except Exception as e:
+                logger.error(f"[{self.hs_config.server_name}] Crontabs: 容器状态采集失败: {e}")
+                traceback.print_exc()
+
         except Exception as e:
             logger.error(f"[{self.hs_config.server_name}] Crontabs 执行失败: {e}")
             return super().Crontabs()
@@ -253,6 +303,85 @@ class HostServer(BasicServer):
         # 通用操作 =============================================================
         return super().Crontabs()
 
+    # 采集容器状态 #############################################################
+    # 本地主机直接读取cgroup，远程主机使用实例清单中的累计计数
+    # :return: {vm_uuid: HWStatus}
+    ###########################################################################
+    def lxd_status(self) -> dict[str, HWStatus]:
+        names = {self.set_uuid(vm_uuid, True): vm_uuid
+                 for vm_uuid in self.vm_saving}
+        if not self.web_flag() and self.cgroup_stats.available():
+            running = [item["name"] for item in self.instances.all()
+                       if item["name"] in names
+                       and self.instances.power(item) == VMPowers.STARTED]
+            return {names[name]: hw_status for name, hw_status
+                    in self.cgroup_stats.lxc_status(running).items()}
+        return self.instances.status(self.cgroup_stats, names)
+
+    # 容器电源状态 #############################################################
+    # :return: {vm_uuid: VMPowers}，来自实例清单
+    ###########################################################################
+    def lxd_power(self) -> dict[str, VMPowers]:
+        names = {self.set_uuid(vm_uuid, True): vm_uuid
+                 for vm_uuid in self.vm_saving}
+        return {names[item["name"]]: self.instances.power(item)
+                for item in self.instances.all() if item["name"] in names}
+
+    # 电源事件订阅 #############################################################
+    # 订阅 /1.0/events 的lifecycle事件，如instance-started、container-stopped
+    ###########################################################################
+    power_actions = {
+        "started": VMPowers.STARTED,
+        "restarted": VMPowers.STARTED,
+        "resumed": VMPowers.STARTED,
+        "paused": VMPowers.SUSPEND,
+        "stopped": VMPowers.STOPPED,
+        "shutdown": VMPowers.STOPPED,
+        "deleted": None,
+    }
+
+    def power_event(self, update, stopping) -> None:
+        client, result = self.lxd_conn()
+        if not result.success:
+            raise ConnectionError(result.message)
+
+        def on_event(event: dict):
+            if event.get("type") != "lifecycle":
+                return
+            metadata = event.get("metadata") or {}
+            kind, _, action = metadata.get("action", "").partition("-")
+            if kind not in ("instance", "container") \
+                    or action not in self.power_actions:
+                return
+            vm_uuid = self.set_uuid(
+                metadata.get("source", "").rsplit("/", 1)[-1], True)
+            if vm_uuid in self.vm_saving:
+                update(vm_uuid, self.power_actions[action])
+
+        socket = client.events(websocket_client=LXDEvents)
+        if "?" not in socket.resource:
+            socket.resource += "?type=lifecycle"
+        socket.on_event = on_event
+        self.power_socket = socket
+        try:
+            socket.connect()
+            socket.run()
+        finally:
+            self.power_socket = None
+
+    # 电源状态对账 #############################################################
+    def power_check(self) -> dict[str, VMPowers] | None:
+        if not self.instances.refresh(force=True):
+            return None
+        return self.lxd_power()
+
+    # 中断电源事件流 ===========================================================
+    def power_close(self):
+        socket = self.power_socket
+        if socket is not None:
+            socket.close()
+            socket.close_connection()
+
     # 宿主机状态 ###############################################################
     def HSStatus(self) -> HWStatus:
         # 专用操作 =============================================================
@@ -339,6 +468,7 @@ class HostServer(BasicServer):
     # 卸载宿主机 ###############################################################
     def HSUnload(self) -> ZMessage:
         # 专用操作 =============================================================
+        self.power_exit()
         if self.web_terminal:
             self.web_terminal = None
 
@@ -365,7 +495,11 @@ class HostServer(BasicServer):
 
         try:
             # 获取所有容器列表
-            containers = client.containers.all()
+            if not self.instances.refresh(force=True):
+                return ZMessage(
+                    success=False, action="VScanner",
+                    message="获取容器列表失败")
+            containers = self.instances.all()
 
             # 使用主机配置的filter_name作为前缀过滤
             filter_prefix = self.hs_config.filter_name if self.hs_config else ""
@@ -374,7 +508,7 @@ class HostServer(BasicServer):
             added_count = 0
 
             for container in containers:
-                container_name = container.name
+                container_name = container["name"]
 
                 # 前缀过滤
                 if filter_prefix and not container_name.startswith(filter_prefix):
@@ -700,6 +834,7 @@ class HostServer(BasicServer):
 
             # 创建容器
             container = client.containers.create(config, wait=True)
+            self.instances.invalidate()
 
             # 安装系统（从模板）
             install_result = self.VMSetups(vm_conf)
@@ -903,6 +1038,7 @@ class HostServer(BasicServer):
 
             # 删除容器
             container.delete(wait=True)
+            self.instances.invalidate()
 
             logger.info(f"Container {vm_name} deleted successfully")
 
@@ -1370,7 +1506,8 @@ class HostServer(BasicServer):
             message="LXD containers do not support ISO mounting")
 
     # 虚拟机控制台 ##############################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         """生成 Web Terminal 访问 URL"""
         # 专用操作 ==============================================================
         if vm_uuid not in self.vm_saving:
@@ -1415,7 +1552,7 @@ class HostServer(BasicServer):
         # 启动tty会话web
         tty_port, token = self.web_terminal.open_tty(
             self.hs_config, wan_port, HostServer.set_uuid(vm_uuid),
-            vm_type="lxclxd")
+            vm_type="lxclxd", user=user)
         if tty_port <= 0:
             return ZMessage(
                 success=False,
@@ -1429,14 +1566,14 @@ class HostServer(BasicServer):
             target_ip = "127.0.0.1"  # ttyd运行在本机
             success = self.http_manager.create_vnc(token, target_ip, tty_port)
             if not success:
-                self.web_terminal.stop_tty(tty_port)  # 清理tty
+                self.web_terminal.stop_tty(tty_port, token)  # 清理tty
                 return ZMessage(
                     success=False,
                     action="VCRemote",
                     message="添加SSH代理失败")
         except Exception as e:
             logger.error(f"SSH代理配置失败: {str(e)}")
-            self.web_terminal.stop_tty(tty_port)
+            self.web_terminal.stop_tty(tty_port, token)
             return ZMessage(
                 success=False,
                 action="VCRemote",
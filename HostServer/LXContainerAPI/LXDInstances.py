@@ -0,0 +1,142 @@
+import time
+import threading
+from typing import Callable, Optional
+from loguru import logger
+from MainObject.Config.VMPowers import VMPowers
+from MainObject.Public.HWStatus import HWStatus
+from HostServer.OCInterfaceAPI.CGroupStats import CGroupStats
+
+
+# LXD 实例清单缓存 ##########################################################
+# 通过一次 GET /1.0/instances?recursion=2 获取全部实例的配置和运行状态
+# （CPU、内存、磁盘、网络），采集、扫描和电源对账共用同一份结果
+# :param fetch: 获取实例列表的函数，返回recursion=2的metadata
+# :param ttl: 缓存有效期（秒）
+###########################################################################
+class LXDInstances:
+    powers = {
+        "Running": VMPowers.STARTED,
+        "Frozen": VMPowers.SUSPEND,
+        "Stopped": VMPowers.STOPPED,
+        "Error": VMPowers.CRASHED,
+    }
+
+    def __init__(self, fetch: Callable[[], list], ttl: int = 10):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.update = 0.0
+        # {实例名称: 实例信息}，仅包含容器
+        self.items: dict[str, dict] = {}
+
+    # 刷新清单 ##################################################################
+    # :param force: 忽略缓存有效期强制刷新
+    # :return: 是否刷新成功（失败时继续使用旧数据）
+    ###########################################################################
+    def refresh(self, force: bool = False) -> bool:
+        with self.lock:
+            if not force and time.time() - self.update < self.ttl:
+                return True
+            try:
+                instances = self.fetch() or []
+            except Exception as e:
+                logger.warning(f"[LXDInstances] 获取实例列表失败: {e}")
+                return False
+            self.items = {item["name"]: item for item in instances
+                          if item.get("name")
+                          and item.get("type", "container") == "container"}
+            self.update = time.time()
+            return True
+
+    # 标记缓存失效 ##############################################################
+    # 创建、删除容器后调用，下次访问时重新获取
+    ###########################################################################
+    def invalidate(self):
+        with self.lock:
+            self.update = 0.0
+
+    # 获取全部容器 ##############################################################
+    def all(self) -> list[dict]:
+        self.refresh()
+        with self.lock:
+            return list(self.items.values())
+
+    # 按名称获取容器 ############################################################
+    def get(self, name: str) -> Optional[dict]:
+        self.refresh()
+        with self.lock:
+            return self.items.get(name)
+
+    # 容器电源状态 ##############################################################
+    @classmethod
+    def power(cls, item: dict) -> VMPowers:
+        status = (item.get("state") or {}).get("status") or item.get("status")
+        return cls.powers.get(status, VMPowers.UNKNOWN)
+
+    # 生成容器状态 ##############################################################
+    # 累计计数交给CGroupStats计算CPU使用率、带宽和本周期流量
+    # :param stats: 保存上一次采集计数的CGroupStats
+    # :param names: {LXD容器名称: vm_uuid}，只采集其中运行中的容器
+    # :param now: 采集时间（秒），默认为当前时间
+    # :return: {vm_uuid: HWStatus}
+    ###########################################################################
+    def status(self, stats: CGroupStats, names: dict[str, str],
+               now: float = None) -> dict[str, HWStatus]:
+        results = {}
+        for item in self.all():
+            vm_uuid = names.get(item["name"])
+            if vm_uuid is None or self.power(item) != VMPowers.STARTED:
+                continue
+            state = item.get("state") or {}
+            config = item.get("expanded_config") or item.get("config") or {}
+            devices = item.get("expanded_devices") or item.get("devices") or {}
+            rx = tx = 0
+            for nic_name, nic in (state.get("network") or {}).items():
+                if nic_name == "lo":
+                    continue
+                counters = nic.get("counters") or {}
+                rx += counters.get("bytes_received", 0)
+                tx += counters.get("bytes_sent", 0)
+            memory = state.get("memory") or {}
+            mem_total = memory.get("total", 0) \
+                or self.parse_size(config.get("limits.memory", ""))
+            disk = (state.get("disk") or {}).get("root") or {}
+            hw_status = stats.make_status(
+                vm_uuid,
+                int((state.get("cpu") or {}).get("usage", 0) / 1000),
+                self.parse_cpus(config.get("limits.cpu", "")),
+                memory.get("usage", 0), mem_total, 0, rx, tx, now)
+            # LXD只提供根磁盘的已用空间（不是IO计数），与hdd_total对应
+            hw_status.hdd_usage = int(disk.get("usage", 0) / (1024 * 1024))
+            hw_status.hdd_total = int(
+                (disk.get("total", 0) or self.parse_size(
+                    (devices.get("root") or {}).get("size", ""))) / (1024 * 1024))
+            results[vm_uuid] = hw_status
+        stats.prune(results)
+        return results
+
+    # 解析CPU限制（"2" 或 "0-3,6"）=============================================
+    @staticmethod
+    def parse_cpus(value: str) -> int:
+        value = str(value).strip()
+        if value.isdigit():
+            return max(1, int(value))
+        count = 0
+        for part in value.split(","):
+            low, _, high = part.partition("-")
+            if low.strip().isdigit() and high.strip().isdigit():
+                count += int(high) - int(low) + 1
+            elif low.strip().isdigit():
+                count += 1
+        return max(1, count)
+
+    # 解析LXD容量字符串（字节）=================================================
+    @staticmethod
+    def parse_size(value: str) -> int:
+        units = {"KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+                 "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4}
+        value = str(value).strip()
+        for unit in sorted(units, key=len, reverse=True):
+            if value.endswith(unit) and value[:-len(unit)].strip().isdigit():
+                return int(value[:-len(unit)]) * units[unit]
+        return int(value) if value.isdigit() else 0
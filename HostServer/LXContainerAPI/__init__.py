@@ -0,0 +1,8 @@
+"""
+LXD API模块
+提供LXD实例清单的缓存与批量查询
+"""
+
+from .LXDInstances import LXDInstances
+
+__all__ = ['LXDInstances']
@@ -0,0 +1,244 @@
+"""
+LXD 实例清单测试脚本
+使用本地 http.server 模拟 LXD REST API（/1.0 与 /1.0/instances?recursion=2），
+通过 pylxd 客户端验证 lxd_fetch 一次获取全部实例、容器扫描（前缀过滤与名称规范化）、
+电源状态对账写入缓存，以及远程主机按累计计数计算容器状态
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from pylxd import Client
+from MainObject.Config.HSConfig import HSConfig
+from MainObject.Config.VMPowers import VMPowers
+from HostServer.LXContainer import HostServer
+
+MB = 1024 * 1024
+
+
+class FakeLXD(ThreadingHTTPServer):
+    """LXD REST API替身：内存中的实例列表，记录每次请求"""
+    daemon_threads = True
+
+    def __init__(self, extensions=("instances",)):
+        super().__init__(("127.0.0.1", 0), FakeLXDHandler)
+        self.extensions = list(extensions)  # 不含instances时模拟旧版LXD
+        self.instances = {}
+        self.records = []  # [(路径, 查询参数)]
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, path: str) -> int:
+        return sum(1 for item in self.records if item[0] == path)
+
+    def add(self, name: str, status="Running", kind="container", cpu_ns=0,
+            mem=256 * MB, disk=512 * MB, rx=0, tx=0) -> dict:
+        self.instances[name] = {
+            "name": name, "type": kind, "status": status,
+            "expanded_config": {"limits.cpu": "0-1", "limits.memory": "2GiB"},
+            "expanded_devices": {"root": {"path": "/", "type": "disk", "size": "10GiB"}},
+            "state": {"status": status,
+                      "cpu": {"usage": cpu_ns},
+                      "memory": {"usage": mem, "total": 0},
+                      "disk": {"root": {"usage": disk, "total": 0}},
+                      "network": {"lo": {"counters": {"bytes_received": 999 * MB,
+                                                      "bytes_sent": 999 * MB}},
+                                  "eth0": {"counters": {"bytes_received": rx,
+                                                        "bytes_sent": tx}}}}}
+        return self.instances[name]
+
+    # 处理一次请求，返回metadata =============================================
+    def route(self, path: str, query: dict):
+        if path == "/1.0":
+            return {"api_extensions": self.extensions, "auth": "trusted",
+                    "api_version": "1.0", "environment": {"server": "lxd"}}
+        if path == "/1.0/instances" and "instances" not in self.extensions:
+            return None
+        if path in ("/1.0/instances", "/1.0/containers"):
+            items = [item for item in self.instances.values()
+                     if path == "/1.0/instances" or item["type"] == "container"]
+            if query.get("recursion") == "2":
+                return items
+            return [f"{path}/{item['name']}" for item in items]
+        return None
+
+
+class FakeLXDHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        with server.lock:
+            server.records.append((url.path, query))
+            metadata = server.route(url.path, query)
+        if metadata is None:
+            status, body = 404, {"type": "error", "error": "not found", "error_code": 404}
+        else:
+            status, body = 200, {"type": "sync", "status": "Success",
+                                 "status_code": 200, "metadata": metadata}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDB:
+    """记录保存的虚拟机配置和日志"""
+
+    def __init__(self):
+        self.saved = []
+        self.logs = []
+
+    def set_vm_saving(self, server_name, vm_saving) -> bool:
+        self.saved.append(sorted(vm_saving))
+        return True
+
+    def add_hs_logger(self, server_name, log):
+        self.logs.append(log)
+
+
+@contextmanager
+def lxd_env(extensions=("instances",), server_addr="lxd.test"):
+    """在临时目录中创建LXD宿主机，客户端指向REST替身"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        os.makedirs("DataSaving")
+        lxd = FakeLXD(extensions)
+        try:
+            config = HSConfig(server_name="lxd-test", server_type="LXContainer",
+                              server_addr=server_addr, filter_name="oc",
+                              extend_data={"inventory_ttl": 60})
+            db = FakeDB()
+            server = HostServer(config, db=db)
+            server.lxd_client = Client(endpoint=lxd.endpoint)
+            yield server, lxd, db
+        finally:
+            lxd.shutdown()
+            lxd.server_close()
+            os.chdir(cwd)
+
+
+def test_fetch_and_detect():
+    """一次recursion=2请求获取全部实例，扫描按前缀过滤并规范化名称"""
+    with lxd_env() as (server, lxd, db):
+        lxd.add("oc_web")
+        lxd.add("oc-db", status="Stopped")
+        lxd.add("other")
+        lxd.add("oc-vm", kind="virtual-machine")
+        items = server.lxd_fetch()
+        assert lxd.records[-1] == ("/1.0/instances", {"recursion": "2"}), lxd.records
+        assert {item["name"] for item in items} == {"oc_web", "oc-db", "other", "oc-vm"}
+        result = server.VMDetect()
+        assert result.success, result.message
+        assert result.results["scanned"] == 2 and result.results["added"] == 2, result.results
+        assert sorted(server.vm_saving) == ["oc-db", "oc-web"] and db.saved == [["oc-db", "oc-web"]]
+        assert len(db.logs) == 2
+        # 再次扫描不重复添加；缓存有效期内读取不再请求
+        before = lxd.count("/1.0/instances")
+        assert server.VMDetect().results["added"] == 0
+        assert lxd.count("/1.0/instances") == before + 1
+        server.lxd_power()
+        server.instances.get("oc_web")
+        assert lxd.count("/1.0/instances") == before + 1, lxd.records
+        print("✅ lxd_fetch一次获取全部实例，扫描过滤并规范化名称")
+
+
+def test_old_lxd():
+    """旧版LXD（无instances扩展）改用 /1.0/containers?recursion=2"""
+    with lxd_env(extensions=()) as (server, lxd, db):
+        lxd.add("oc-a")
+        lxd.add("oc-vm", kind="virtual-machine")
+        items = server.lxd_fetch()
+        assert [item["name"] for item in items] == ["oc-a"], items
+        assert lxd.count("/1.0/instances") == 0
+        assert lxd.records[-1] == ("/1.0/containers", {"recursion": "2"}), lxd.records
+        print("✅ 旧版LXD使用containers接口")
+
+
+def test_power_cache():
+    """对账写入电源缓存：事件更新的条目不被覆盖，已删除的容器移除"""
+    with lxd_env() as (server, lxd, db):
+        lxd.add("oc-a")
+        lxd.add("oc-b", status="Stopped")
+        lxd.add("oc-c", status="Frozen")
+        assert server.VMDetect().success
+        # 与Crontabs相同：刷新一次清单后对账
+        since = time.time()
+        assert server.instances.refresh(force=True)
+        server.power_cache.sync(server.lxd_power(), since)
+        assert server.power_cache.all() == {"oc-a": VMPowers.STARTED,
+                                            "oc-b": VMPowers.STOPPED,
+                                            "oc-c": VMPowers.SUSPEND}
+        # 对账开始后收到的事件优先于轮询结果
+        since = time.time()
+        server.power_cache.set("oc-b", VMPowers.STARTED)
+        del lxd.instances["oc-c"]
+        states = server.power_check()
+        assert states == {"oc-a": VMPowers.STARTED, "oc-b": VMPowers.STOPPED}, states
+        server.power_cache.sync(states, since)
+        assert server.power_get("oc-b") == VMPowers.STARTED
+        assert server.power_get("oc-c") is None
+        print("✅ 电源状态对账写入缓存")
+
+
+def test_remote_status():
+    """远程主机按清单中的累计计数计算CPU、带宽，磁盘为根磁盘已用空间"""
+    with lxd_env() as (server, lxd, db):
+        lxd.add("oc-a", cpu_ns=10 * 10 ** 9, rx=100 * MB, tx=50 * MB)
+        lxd.add("oc-b", status="Stopped")
+        assert server.VMDetect().success
+        server.instances.refresh(force=True)
+        first = server.lxd_status()
+        assert set(first) == {"oc-a"}, first
+        status = first["oc-a"]
+        assert status.cpu_total == 2 and status.mem_usage == 256 and status.mem_total == 2048
+        assert status.hdd_usage == 512 and status.hdd_total == 10240
+        assert status.cpu_usage == 0 and status.network_d == 0
+        # 10秒后：CPU 5秒，收20MB发10MB ========================================
+        lxd.add("oc-a", cpu_ns=15 * 10 ** 9, rx=120 * MB, tx=60 * MB)
+        server.instances.refresh(force=True)
+        second = server.instances.status(server.cgroup_stats, {"oc-a": "oc-a"},
+                                         now=server.cgroup_stats.samples["oc-a"][0] + 10)
+        status = second["oc-a"]
+        assert status.cpu_usage == 50, status.cpu_usage
+        assert status.network_d == 16 and status.network_u == 8 and status.flu_usage == 30
+        assert status.hdd_usage == 512
+        print("✅ 远程容器状态按累计计数计算")
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("LXD 实例清单测试")
+    print("=" * 60)
+    test_fetch_and_detect()
+    test_old_lxd()
+    test_power_cache()
+    test_remote_status()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ from MainObject.Config.PortData import PortData
 from MainObject.Public.HWStatus import HWStatus
 from HostServer.OCInterfaceAPI.OCIConnects import OCIConnects
 from HostServer.OCInterfaceAPI.PortForward import PortForward
+from HostServer.OCInterfaceAPI.CGroupStats import CGroupStats
 from docker.errors import NotFound
 
 
@@ -32,11 +33,16 @@ class HostServer(BasicServer):
         self.ssh_forwards = None
         self.http_manager = None
         self.port_forward = None
+        self.cgroup_stats = CGroupStats()
 
     # 连接到 Docker 服务器 #####################################################
     def api_conn(self) -> tuple:
         if not self.oci_connects:
-            self.oci_connects = OCIConnects(self.hs_config)
+            # 连接池需容纳并发采集线程、事件流和其他API请求
+            workers = int(self.hs_config.extend_data.get("stats_workers", 8))
+            self.oci_connects = OCIConnects(
+                self.hs_config, pool_size=workers + 4,
+                check=int(self.hs_config.extend_data.get("docker_check", 30)))
         return self.oci_connects.connect_docker()
 
     # 同步端口转发配置 #########################################################
@@ -192,43 +198,42 @@ class HostServer(BasicServer):
                 logger.warning(f"[{self.hs_config.server_name}] Crontabs: Docker连接失败，跳过容器状态采集")
                 return True
 
-            # 遍历vm_saving中的所有容器
-            for vm_uuid, vm_config in self.vm_saving.items():
-                try:
-                    # 获取容器对象
-                    container = self.oci_connects.get_container(vm_uuid)
-                    if not container:
-                        logger.debug(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 不存在，跳过")
-                        continue
-
-                    # 检查容器是否在运行
-                    container.reload()
-                    if container.status != "running":
-                        logger.debug(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 未运行，跳过")
-                        continue
-
-                    # 获取容器统计信息（stream=False表示只获取一次）
-                    stats = container.stats(stream=False)
-
-                    # 解析统计信息并创建HWStatus对象
-                    hw_status = self.get_info(stats, vm_uuid)
-
-                    # 保存到数据库
-                    if self.save_data and self.hs_config.server_name:
-                        success = self.save_data.add_vm_status(
-                            self.hs_config.server_name,
-                            vm_uuid,
-                            hw_status
-                        )
-                        if success:
-                            logger.debug(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 状态已保存")
-                        else:
-                            logger.warning(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 状态保存失败")
-
-                except Exception as e:
-                    logger.error(f"[{self.hs_config.server_name}] Crontabs: 处理容器 {vm_uuid} 时出错: {e}")
-                    traceback.print_exc()
-                    continue
+            # 本地主机直接读取cgroup，远程主机并发调用stats接口
+            if not self.web_flag() and self.cgroup_stats.available():
+                states = self.oci_connects.state_containers()
+                running = {name: item["id"] for name, item in states.items()
+                           if name in self.vm_saving and item["state"] == "running"}
+                vm_status = self.cgroup_stats.docker_status(running)
+                all_stats = vm_status
+            else:
+                workers = int(self.hs_config.extend_data.get("stats_workers", 8))
+                all_stats, states = self.oci_connects.stats_containers(
+                    set(self.vm_saving.keys()), workers=workers)
+                # 解析统计信息并创建HWStatus对象
+                vm_status = {}
+                for vm_uuid, stats in all_stats.items():
+                    try:
+                        vm_status[vm_uuid] = self.get_info(stats, vm_uuid)
+                    except Exception as e:
+                        logger.error(f"[{self.hs_config.server_name}] Crontabs: 处理容器 {vm_uuid} 时出错: {e}")
+                        traceback.print_exc()
+            for vm_uuid in self.vm_saving:
+                if vm_uuid not in states:
+                    logger.debug(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 不存在，跳过")
+                elif vm_uuid not in all_stats:
+                    logger.debug(f"[{self.hs_config.server_name}] Crontabs: 容器 {vm_uuid} 未运行，跳过")
+
+            # 批量保存到数据库
+            if vm_status and self.save_data and self.hs_config.server_name:
+                success = self.save_data.add_vm_status_batch(
+                    self.hs_config.server_name, vm_status)
+                if success:
+                    logger.debug(f"[{self.hs_config.server_name}] Crontabs: {len(vm_status)} 个容器状态已保存")
+                else:
+                    logger.warning(f"[{self.hs_config.server_name}] Crontabs: 容器状态批量保存失败")
+            # 连接复用统计
+            logger.debug(f"[{self.hs_config.server_name}] Docker连接: "
+                         f"{self.oci_connects.conn_stats()}")
 
             return True
 
@@ -313,6 +318,7 @@ class HostServer(BasicServer):
     # 卸载宿主机 ###############################################################
     def HSUnload(self) -> ZMessage:
         # 专用操作 =============================================================
+        self.power_exit()
         if self.web_terminal:
             self.web_terminal = None
         # 断开 Docker 连接 =====================================================
@@ -325,6 +331,53 @@ class HostServer(BasicServer):
         # 通用操作 =============================================================
         return super().HSUnload()
 
+    # 电源事件订阅 #############################################################
+    # Docker事件动作到电源状态的映射，destroy表示容器已删除
+    ###########################################################################
+    power_actions = {
+        "start": VMPowers.STARTED,
+        "restart": VMPowers.STARTED,
+        "unpause": VMPowers.STARTED,
+        "pause": VMPowers.SUSPEND,
+        "die": VMPowers.STOPPED,
+        "oom": VMPowers.CRASHED,
+        "destroy": None,
+    }
+
+    def power_event(self, update, stopping) -> None:
+        def on_event(name: str, action: str):
+            if name in self.vm_saving and action in self.power_actions:
+                update(name, self.power_actions[action])
+
+        self.api_conn()
+        self.oci_connects.events_containers(on_event)
+
+    # 电源状态对账 #############################################################
+    def power_check(self) -> dict[str, VMPowers] | None:
+        client, result = self.api_conn()
+        if not result.success:
+            return None
+        states = self.oci_connects.state_containers()
+        return {name: self.power_state(item["state"])
+                for name, item in states.items() if name in self.vm_saving}
+
+    # 中断电源事件流 ===========================================================
+    def power_close(self):
+        if self.oci_connects:
+            self.oci_connects.close_events()
+
+    # Docker容器状态转换 =======================================================
+    @staticmethod
+    def power_state(state: str) -> VMPowers:
+        return {
+            "running": VMPowers.STARTED,
+            "restarting": VMPowers.ON_OPEN,
+            "paused": VMPowers.SUSPEND,
+            "created": VMPowers.STOPPED,
+            "exited": VMPowers.STOPPED,
+            "dead": VMPowers.CRASHED,
+        }.get(state, VMPowers.UNKNOWN)
+
     # 网络检查 #################################################################
     # 检查并自动分配虚拟机网卡IP地址
     # :param vm_conf: 虚拟机配置对象
@@ -1303,7 +1356,8 @@ class HostServer(BasicServer):
             message="Docker containers do not support ISO mounting")
 
     # 虚拟机远程访问 ###########################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         # 专用操作 =============================================================
         if vm_uuid not in self.vm_saving:
             return ZMessage(
@@ -1340,7 +1394,7 @@ class HostServer(BasicServer):
             public_ip = "127.0.0.1"  # 默认使用本地
         # 3. 启动tty会话web ====================================================
         tty_port, token = self.web_terminal.open_tty(
-            self.hs_config, wan_port, vm_uuid)
+            self.hs_config, wan_port, vm_uuid, user=user)
         if tty_port <= 0:
             return ZMessage(
                 success=False,
@@ -1353,7 +1407,7 @@ class HostServer(BasicServer):
             target_ip = "127.0.0.1"  # ttyd运行在本机
             success = self.http_manager.create_vnc(token, target_ip, tty_port)
             if not success:
-                self.web_terminal.stop_tty(tty_port)  # 清理tty
+                self.web_terminal.stop_tty(tty_port, token)  # 清理tty
                 return ZMessage(
                     success=False,
                     action="VCRemote",
@@ -1361,7 +1415,7 @@ class HostServer(BasicServer):
         except Exception as e:
             logger.error(f"SSH代理配置失败: {str(e)}")
             traceback.print_exc()
-            self.web_terminal.stop_tty(tty_port)
+            self.web_terminal.stop_tty(tty_port, token)
             return ZMessage(
                 success=False,
                 action="VCRemote",
@@ -0,0 +1,237 @@
+import os
+import time
+from loguru import logger
+from MainObject.Config.VMPowers import VMPowers
+from MainObject.Public.HWStatus import HWStatus
+
+
+# cgroup v2 容器状态采集类 ##################################################
+# 本地Docker/LXD宿主机直接读取cgroupfs和/proc，不经过容器API
+# 速率（CPU、网络）和本周期流量、磁盘IO由两次采集之间的差值计算
+# :param cg_root: cgroup v2 挂载点（测试时可指向伪造的目录树）
+# :param proc_root: proc 挂载点
+###########################################################################
+class CGroupStats:
+    def __init__(self, cg_root: str = "/sys/fs/cgroup", proc_root: str = "/proc"):
+        self.cg_root = cg_root
+        self.proc_root = proc_root
+        # 上一次采集的原始计数: {名称: (时间, cpu_usec, rx, tx, io_bytes)}
+        self.samples: dict[str, tuple] = {}
+
+    # 是否为cgroup v2统一层级 ##################################################
+    def available(self) -> bool:
+        return os.path.isfile(os.path.join(self.cg_root, "cgroup.controllers"))
+
+    # 查找Docker容器的cgroup目录 ################################################
+    # 兼容systemd和cgroupfs两种cgroup驱动
+    ###########################################################################
+    def docker_path(self, container_id: str) -> str | None:
+        return self.find_path([
+            f"system.slice/docker-{container_id}.scope",
+            f"docker/{container_id}",
+        ])
+
+    # 查找LXC/LXD容器的cgroup目录 ###############################################
+    def lxc_path(self, name: str) -> str | None:
+        return self.find_path([
+            f"lxc.payload.{name}",
+            f"lxc.payload/{name}",
+            f"lxc/{name}",
+        ])
+
+    # 返回第一个存在的cgroup目录 ================================================
+    def find_path(self, candidates: list[str]) -> str | None:
+        for candidate in candidates:
+            path = os.path.join(self.cg_root, candidate)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    # 读取 key value 格式的文件 =================================================
+    @staticmethod
+    def read_keys(path: str) -> dict[str, int]:
+        values = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1].isdigit():
+                        values[parts[0]] = int(parts[1])
+        except OSError:
+            pass
+        return values
+
+    # 读取单值文件 ==============================================================
+    @staticmethod
+    def read_value(path: str) -> str:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    # 读取CPU累计使用时间（微秒）和可用核心数 ###################################
+    def read_cpu(self, path: str) -> tuple[int, int]:
+        usage = self.read_keys(os.path.join(path, "cpu.stat")).get("usage_usec", 0)
+        cores = os.cpu_count() or 1
+        limit = self.read_value(os.path.join(path, "cpu.max")).split()
+        if len(limit) == 2 and limit[0].isdigit() and int(limit[1]) > 0:
+            cores = max(1, -(-int(limit[0]) // int(limit[1])))
+        return usage, cores
+
+    # 读取内存用量和上限（字节）#################################################
+    def read_mem(self, path: str) -> tuple[int, int]:
+        current = self.read_value(os.path.join(path, "memory.current"))
+        limit = self.read_value(os.path.join(path, "memory.max"))
+        current = int(current) if current.isdigit() else 0
+        if limit.isdigit():
+            return current, int(limit)
+        # 未设置上限时使用宿主机内存总量
+        meminfo = self.read_keys_kb(os.path.join(self.proc_root, "meminfo"))
+        return current, meminfo.get("MemTotal:", 0)
+
+    # 读取 /proc/meminfo（kB转换为字节）=========================================
+    @staticmethod
+    def read_keys_kb(path: str) -> dict[str, int]:
+        values = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2 and parts[1].isdigit():
+                        values[parts[0]] = int(parts[1]) * 1024
+        except OSError:
+            pass
+        return values
+
+    # 读取磁盘IO累计字节数 ######################################################
+    def read_io(self, path: str) -> int:
+        total = 0
+        try:
+            with open(os.path.join(path, "io.stat")) as f:
+                for line in f:
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition("=")
+                        if key in ("rbytes", "wbytes") and value.isdigit():
+                            total += int(value)
+        except OSError:
+            pass
+        return total
+
+    # 查找容器内的一个进程 ######################################################
+    # cgroup v2 中进程只存在于叶子节点，根目录为空时向下查找
+    ###########################################################################
+    def read_pid(self, path: str) -> int:
+        for root, dirs, files in os.walk(path):
+            procs = self.read_value(os.path.join(root, "cgroup.procs"))
+            if procs:
+                first = procs.split()[0]
+                if first.isdigit():
+                    return int(first)
+        return 0
+
+    # 读取容器网络命名空间的收发字节数 ##########################################
+    def read_net(self, pid: int) -> tuple[int, int]:
+        rx = tx = 0
+        if pid <= 0:
+            return rx, tx
+        try:
+            with open(os.path.join(self.proc_root, str(pid), "net", "dev")) as f:
+                for line in f.readlines()[2:]:
+                    name, _, data = line.partition(":")
+                    fields = data.split()
+                    if name.strip() == "lo" or len(fields) < 9:
+                        continue
+                    rx += int(fields[0])
+                    tx += int(fields[8])
+        except (OSError, ValueError):
+            pass
+        return rx, tx
+
+    # 由原始计数生成HWStatus ####################################################
+    # 与上一次采集比较计算CPU使用率、带宽、本周期流量和磁盘IO（MB）
+    # :param name: 容器名称（用于保存上一次采集）
+    # :param cpu_usec: CPU累计使用时间（微秒）
+    # :param io_bytes: 磁盘累计读写字节数
+    # :param rx: 累计接收字节数
+    # :param tx: 累计发送字节数
+    # :param now: 采集时间（秒），默认为当前时间
+    ###########################################################################
+    def make_status(self, name: str, cpu_usec: int, cores: int,
+                    mem_used: int, mem_total: int, io_bytes: int,
+                    rx: int, tx: int, now: float = None) -> HWStatus:
+        now = time.time() if now is None else now
+        hw_status = HWStatus()
+        hw_status.on_update = int(now)
+        hw_status.ac_status = VMPowers.STARTED
+        hw_status.cpu_total = cores
+        hw_status.mem_usage = int(mem_used / (1024 * 1024))
+        hw_status.mem_total = int(mem_total / (1024 * 1024))
+        last = self.samples.get(name)
+        self.samples[name] = (now, cpu_usec, rx, tx, io_bytes)
+        if last is None or now <= last[0]:
+            return hw_status
+        interval = now - last[0]
+        # 计数器重置（容器重启）时跳过本次速率
+        cpu_delta = cpu_usec - last[1]
+        rx_delta = rx - last[2]
+        tx_delta = tx - last[3]
+        io_delta = io_bytes - last[4]
+        if cpu_delta >= 0:
+            # 与Docker统计口径一致：100表示占满一个核心
+            hw_status.cpu_usage = int(cpu_delta / (interval * 1e6) * 100)
+        if rx_delta >= 0 and tx_delta >= 0:
+            rx_mb = rx_delta / (1024 * 1024)
+            tx_mb = tx_delta / (1024 * 1024)
+            hw_status.flu_usage = int(rx_mb + tx_mb)
+            hw_status.network_d = int(rx_mb / interval * 8)
+            hw_status.network_u = int(tx_mb / interval * 8)
+        if io_delta >= 0:
+            # 与vSpherePerf一致：本周期读写的MB
+            hw_status.hdd_usage = int(io_delta / (1024 * 1024))
+        return hw_status
+
+    # 读取单个cgroup目录的状态 ##################################################
+    def read_status(self, name: str, path: str, now: float = None) -> HWStatus:
+        cpu_usec, cores = self.read_cpu(path)
+        mem_used, mem_total = self.read_mem(path)
+        rx, tx = self.read_net(self.read_pid(path))
+        return self.make_status(
+            name, cpu_usec, cores, mem_used, mem_total,
+            self.read_io(path), rx, tx, now)
+
+    # 采集Docker容器状态 ########################################################
+    # :param containers: {容器名称: 容器完整ID}
+    # :return: {容器名称: HWStatus}
+    ###########################################################################
+    def docker_status(self, containers: dict[str, str], now: float = None) -> dict[str, HWStatus]:
+        results = {}
+        for name, container_id in containers.items():
+            path = self.docker_path(container_id)
+            if path is None:
+                logger.debug(f"[CGroupStats] 未找到容器 {name} 的cgroup目录")
+                continue
+            results[name] = self.read_status(name, path, now)
+        self.prune(results)
+        return results
+
+    # 采集LXC/LXD容器状态 #######################################################
+    # :param names: 容器名称列表
+    # :return: {容器名称: HWStatus}
+    ###########################################################################
+    def lxc_status(self, names, now: float = None) -> dict[str, HWStatus]:
+        results = {}
+        for name in names:
+            path = self.lxc_path(name)
+            if path is None:
+                logger.debug(f"[CGroupStats] 未找到容器 {name} 的cgroup目录")
+                continue
+            results[name] = self.read_status(name, path, now)
+        self.prune(results)
+        return results
+
+    # 清理已不存在容器的历史采集 ================================================
+    def prune(self, current: dict):
+        for name in list(self.samples):
+            if name not in current:
+                del self.samples[name]
@@ -1,3 +1,4 @@
+import re
 import random
 import subprocess
 from loguru import logger
@@ -5,19 +6,287 @@ from loguru import logger
 from MainObject.Config.HSConfig import HSConfig
 from MainObject.Public.ZMessage import ZMessage
 from HostModule.SSHDManager import SSHDManager
+from HostServer.OCInterfaceAPI.PortForward import PortConfig
 
 
 class IPTablesAPI:
-    """IPTables端口映射管理API"""
+    """
+    内核NAT端口映射管理API
 
-    def __init__(self, hs_config: HSConfig):
+    全部映射放在专用链（iptables）或专用表（nftables）中，期望的规则集
+    渲染为一次 iptables-restore --noflush / nft -f 事务提交，
+    与解析得到的当前快照做差异，无变化时不执行任何写操作
+    """
+
+    CHAIN_NAT = "OPENIDCS-DNAT"  # nat表专用链，由PREROUTING跳转
+    CHAIN_FWD = "OPENIDCS-FWD"  # filter表专用链，由FORWARD跳转
+    NFT_TABLE = "openidcs"  # nftables专用表
+    # 注释格式: 内网IP-外部端口-内网端口#虚拟机名（与旧版直接写入PREROUTING的规则一致）
+    COMMENT = re.compile(r'^(\d+\.\d+\.\d+\.\d+)-(\d+)-(\d+)(?:#(.*))?$')
+    # 一次进程调用内输出nat和filter两张表
+    SAVE_CMD = "iptables-save -t nat; iptables-save -t filter"
+
+    def __init__(self, hs_config: HSConfig, backend: str = ""):
         """
         初始化 IPTables API
-        
+
         :param hs_config: 宿主机配置对象
+        :param backend: iptables / nftables，默认读取extend_data["nat_backend"]，
+                        未指定时优先使用iptables
         """
         self.hs_config = hs_config
         self.ssh_forward = None
+        backend = backend or self.hs_config.extend_data.get("nat_backend", "")
+        self.backend = "nftables" if backend in ("nft", "nftables") else "iptables"
+        self.stats = {"snapshot": 0, "apply": 0, "added": 0, "removed": 0}
+
+    # 执行命令 #################################################################
+    def execute_command(self, cmd: str, is_remote: bool = False,
+                        stdin: str = None) -> tuple[bool, str, str]:
+        """
+        执行命令
+        :param cmd: 命令字符串
+        :param is_remote: 是否为远程执行
+        :param stdin: 标准输入内容（远程时通过here-document传入）
+        :return: (是否成功, stdout, stderr)
+        """
+        try:
+            if is_remote:
+                if not self.ssh_forward:
+                    return False, "", "SSH连接未建立"
+                if stdin is not None:
+                    cmd = f"{cmd} <<'OPENIDCS_EOF'\n{stdin}\nOPENIDCS_EOF"
+                return self.ssh_forward.execute_command(cmd)
+            result = subprocess.run(
+                cmd, shell=True, capture_output=True, text=True,
+                input=stdin, timeout=60)
+            return result.returncode == 0, result.stdout, result.stderr
+        except subprocess.TimeoutExpired:
+            return False, "", "命令执行超时"
+        except Exception as e:
+            return False, "", str(e)
+
+    # 读取当前规则快照 #########################################################
+    # :return: ({(协议, 外部端口): PortConfig}, 状态)
+    #          状态 lines: {(协议, 外部端口): [专用链中的原始规则行]}
+    #               legacy: 旧版直接写在PREROUTING/FORWARD中的映射规则行
+    #                       （其DNAT映射同时计入返回的规则，整体重写时迁入专用链）
+    #               jumps: 已存在的跳转规则 {(表, 链)}
+    #               ready: 专用链/表及跳转规则是否齐全
+    ###########################################################################
+    def snapshot(self, is_remote: bool = False) -> tuple[dict, dict]:
+        self.stats["snapshot"] += 1
+        if self.backend == "nftables":
+            success, stdout, stderr = self.execute_command(
+                f"nft list table ip {self.NFT_TABLE}", is_remote)
+            # 表不存在时nft返回非0，视为空快照
+            return self.parse_nft(stdout if success else ""), \
+                {"lines": {}, "legacy": {}, "jumps": set(), "ready": success}
+        success, stdout, stderr = self.execute_command(self.SAVE_CMD, is_remote)
+        if not success:
+            raise RuntimeError(f"读取iptables规则失败: {stderr.strip()}")
+        return self.parse_save(stdout)
+
+    # 解析iptables-save输出 ====================================================
+    def parse_save(self, output: str) -> tuple[dict, dict]:
+        rules, lines, table = {}, {}, ""
+        legacy = {"nat": [], "filter": []}
+        legacy_rules = {}
+        chains, jumps = set(), set()
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith("*"):
+                table = line[1:]
+                continue
+            if line.startswith(":"):
+                chains.add((table, line[1:].split()[0]))
+                continue
+            if not line.startswith("-A "):
+                continue
+            args = self.split_args(line)
+            chain, target = args[1], self.arg(args, "-j")
+            if chain in ("PREROUTING", "FORWARD"):
+                if target in (self.CHAIN_NAT, self.CHAIN_FWD):
+                    jumps.add((table, chain))
+                elif table in legacy and self.COMMENT.match(self.arg(args, "--comment")):
+                    legacy[table].append(line)
+                    # 旧版映射仍然生效：计入当前规则（专用链中已有同端口映射时以专用链为准）
+                    rule = self.parse_dnat(args) if chain == "PREROUTING" else None
+                    if rule is not None:
+                        legacy_rules[(rule.protocol, rule.wan_port)] = rule
+                continue
+            if (table, chain) not in (("nat", self.CHAIN_NAT), ("filter", self.CHAIN_FWD)):
+                continue
+            if chain == self.CHAIN_FWD:
+                # FORWARD放行规则通过注释中的外部端口关联到映射
+                match = self.COMMENT.match(self.arg(args, "--comment"))
+                if match:
+                    protocol = self.arg(args, "-p").upper() or "TCP"
+                    lines.setdefault((protocol, int(match.group(2))), []).append(line)
+                continue
+            rule = self.parse_dnat(args)
+            if rule is None:
+                continue
+            key = (rule.protocol, rule.wan_port)
+            lines.setdefault(key, []).append(line)
+            rules[key] = rule
+        for key, rule in legacy_rules.items():
+            rules.setdefault(key, rule)
+        ready = {("nat", self.CHAIN_NAT), ("filter", self.CHAIN_FWD)} <= chains \
+            and {("nat", "PREROUTING"), ("filter", "FORWARD")} <= jumps
+        return rules, {"lines": lines, "legacy": legacy, "jumps": jumps, "ready": ready}
+
+    # 解析单条DNAT规则 =========================================================
+    # :return: PortConfig，非DNAT或端口无效时返回None
+    ###########################################################################
+    def parse_dnat(self, args: list[str]) -> PortConfig | None:
+        lan_addr, _, lan_port = self.arg(args, "--to-destination").partition(":")
+        wan_port = self.arg(args, "--dport")
+        if self.arg(args, "-j") != "DNAT" or not wan_port.isdigit() or not lan_port.isdigit():
+            return None
+        match = self.COMMENT.match(self.arg(args, "--comment"))
+        protocol = self.arg(args, "-p").upper() or "TCP"
+        return PortConfig(
+            wan_port=int(wan_port), lan_addr=lan_addr, lan_port=int(lan_port),
+            protocol=protocol, vm_name=(match.group(4) or "") if match else "")
+
+    # 解析nft list table输出 ===================================================
+    def parse_nft(self, output: str) -> dict:
+        rules = {}
+        pattern = re.compile(
+            r'(tcp|udp) dport (\d+) .*?dnat to (\d+\.\d+\.\d+\.\d+):(\d+)'
+            r'(?: comment "([^"]*)")?')
+        for line in output.splitlines():
+            found = pattern.search(line)
+            if not found:
+                continue
+            protocol, wan_port, lan_addr, lan_port, comment = found.groups()
+            match = self.COMMENT.match(comment or "")
+            rules[(protocol.upper(), int(wan_port))] = PortConfig(
+                wan_port=int(wan_port), lan_addr=lan_addr, lan_port=int(lan_port),
+                protocol=protocol.upper(), vm_name=(match.group(4) or "") if match else "")
+        return rules
+
+    @staticmethod
+    def split_args(line: str) -> list[str]:
+        """按空格拆分iptables-save行（保留引号内的空格）"""
+        return [part.strip('"') for part in re.findall(r'"[^"]*"|\S+', line)]
+
+    @staticmethod
+    def arg(args: list[str], name: str) -> str:
+        return args[args.index(name) + 1] if name in args[:-1] else ""
+
+    # 渲染单条映射 #############################################################
+    def comment(self, rule: PortConfig) -> str:
+        comment = f"{rule.lan_addr}-{rule.wan_port}-{rule.lan_port}"
+        return f"{comment}#{rule.vm_name}" if rule.vm_name else comment
+
+    def render_rule(self, rule: PortConfig) -> tuple[str, str]:
+        """:return: (nat表规则, filter表规则)"""
+        protocol = rule.protocol.lower()
+        comment = self.comment(rule).replace('"', "")
+        return (
+            f'-A {self.CHAIN_NAT} -p {protocol} -m {protocol} '
+            f'--dport {rule.wan_port} -m comment --comment "{comment}" '
+            f'-j DNAT --to-destination {rule.lan_addr}:{rule.lan_port}',
+            f'-A {self.CHAIN_FWD} -d {rule.lan_addr}/32 -p {protocol} '
+            f'-m {protocol} --dport {rule.lan_port} -m comment --comment "{comment}" '
+            f'-j ACCEPT')
+
+    # 渲染iptables-restore事务 =================================================
+    # full: 声明专用链（--noflush下声明即清空）并写入全部规则
+    # 否则只写入差异：按快照中的原始行删除（-D），再添加（-A）
+    ###########################################################################
+    def render_iptables(self, adds: list, dels: list, state: dict,
+                        full: bool = False) -> str:
+        tables = {"nat": ["*nat"], "filter": ["*filter"]}
+        if full:
+            tables["nat"].append(f":{self.CHAIN_NAT} - [0:0]")
+            tables["filter"].append(f":{self.CHAIN_FWD} - [0:0]")
+            if ("nat", "PREROUTING") not in state["jumps"]:
+                tables["nat"].append(f"-I PREROUTING 1 -j {self.CHAIN_NAT}")
+            if ("filter", "FORWARD") not in state["jumps"]:
+                tables["filter"].append(f"-I FORWARD 1 -j {self.CHAIN_FWD}")
+            # 清理旧版直接写入PREROUTING/FORWARD的映射
+            for table, lines in state["legacy"].items():
+                tables[table] += ["-D" + line[2:] for line in lines]
+        else:
+            for rule in dels:
+                for line in state["lines"].get(
+                        (rule.protocol.upper(), int(rule.wan_port)), []):
+                    table = "nat" if line.split()[1] == self.CHAIN_NAT else "filter"
+                    tables[table].append("-D" + line[2:])
+        for rule in adds:
+            nat_line, fwd_line = self.render_rule(rule)
+            tables["nat"].append(nat_line)
+            tables["filter"].append(fwd_line)
+        return "\n".join(tables["nat"] + ["COMMIT"]
+                         + tables["filter"] + ["COMMIT"]) + "\n"
+
+    # 渲染nft事务：整表替换（仅影响专用表）====================================
+    def render_nft(self, rules: list) -> str:
+        nat, fwd = [], []
+        for rule in rules:
+            protocol = rule.protocol.lower()
+            comment = self.comment(rule).replace('"', "")
+            nat.append(f'        {protocol} dport {rule.wan_port} '
+                       f'dnat to {rule.lan_addr}:{rule.lan_port} comment "{comment}"')
+            fwd.append(f'        ip daddr {rule.lan_addr} {protocol} dport {rule.lan_port} '
+                       f'accept comment "{comment}"')
+        return "\n".join([
+            f"table ip {self.NFT_TABLE} {{}}",
+            f"delete table ip {self.NFT_TABLE}",
+            f"table ip {self.NFT_TABLE} {{",
+            "    chain prerouting {",
+            "        type nat hook prerouting priority -100; policy accept;",
+            *nat,
+            "    }",
+            "    chain forward {",
+            "        type filter hook forward priority 0; policy accept;",
+            *fwd,
+            "    }",
+            "}"]) + "\n"
+
+    # 提交事务 #################################################################
+    def apply(self, script: str, is_remote: bool = False) -> tuple[bool, str]:
+        self.stats["apply"] += 1
+        cmd = "nft -f -" if self.backend == "nftables" else "iptables-restore --noflush"
+        success, stdout, stderr = self.execute_command(cmd, is_remote, stdin=script)
+        return success, stderr.strip()
+
+    # 同步完整规则集 ###########################################################
+    # :param rules: 期望的全部映射
+    # :param full: 强制整体重写（专用链缺失或存在旧版规则时自动启用）
+    # :return: (是否成功, 错误信息, {"added", "removed"})
+    ###########################################################################
+    def sync_rules(self, rules: list[PortConfig], is_remote: bool = False,
+                   full: bool = False) -> tuple[bool, str, dict]:
+        try:
+            current, state = self.snapshot(is_remote)
+        except Exception as e:
+            return False, str(e), {"added": 0, "removed": 0}
+        wanted = {(rule.protocol.upper(), int(rule.wan_port)): rule for rule in rules}
+        dels = [rule for key, rule in current.items()
+                if key not in wanted or not rule.same(wanted[key])]
+        adds = [rule for key, rule in wanted.items()
+                if key not in current or not current[key].same(rule)]
+        full = full or not state["ready"] or any(state["legacy"].values())
+        changes = {"added": len(adds), "removed": len(dels)}
+        if not adds and not dels and not full:
+            return True, "", changes
+        if self.backend == "nftables":
+            script = self.render_nft(list(wanted.values()))
+        elif full:
+            script = self.render_iptables(list(wanted.values()), [], state, True)
+        else:
+            script = self.render_iptables(adds, dels, state)
+        success, error = self.apply(script, is_remote)
+        if success:
+            self.stats["added"] += len(adds)
+            self.stats["removed"] += len(dels)
+            logger.info(f"NAT规则同步完成({self.backend}): "
+                        f"添加 {len(adds)} 条，删除 {len(dels)} 条")
+        return success, error, changes
 
     # 获取已分配的端口列表 #####################################################
     def get_host_ports(self, is_remote: bool = False) -> set[int]:
@@ -26,38 +295,15 @@ class IPTablesAPI:
         :param is_remote: 是否为远程主机
         :return: 端口集合
         """
+        return {rule.wan_port for rule in self.list_ports(is_remote)}
+
+    # 列出全部映射 #############################################################
+    def list_ports(self, is_remote: bool = False) -> list[PortConfig]:
         try:
-            if is_remote:
-                # 远程执行
-                success, stdout, stderr = self.ssh_forward.execute_command(
-                    "iptables -t nat -L PREROUTING -n --line-numbers"
-                )
-                if not success:
-                    return set()
-                output = stdout
-            else:
-                # 本地执行
-                result = subprocess.run(
-                    ["iptables", "-t", "nat", "-L", "PREROUTING", "-n", "--line-numbers"],
-                    capture_output=True, text=True, check=True)
-                output = result.stdout
-            
-            ports = set()
-            for line in output.split('\n'):
-                # 查找 DNAT 规则中的 dpt (destination port)
-                if 'dpt:' in line:
-                    parts = line.split()
-                    for part in parts:
-                        if part.startswith('dpt:'):
-                            port = part.replace('dpt:', '')
-                            if port.isdigit():
-                                ports.add(int(port))
-            return ports
-        except subprocess.CalledProcessError:
-            return set()
+            return list(self.snapshot(is_remote)[0].values())
         except Exception as e:
             logger.warning(f"获取主机端口失败: {str(e)}")
-            return set()
+            return []
 
     # 执行iptables命令 #########################################################
     def execute_iptables_command(self, cmd: list[str], is_remote: bool = False) -> tuple[bool, str]:
@@ -85,14 +331,16 @@ class IPTablesAPI:
             return False, str(e)
 
     # 分配可用端口 ##############################################################
-    def allocate_port(self) -> int:
+    def allocate_port(self, is_remote: bool = None) -> int:
         """
         自动分配可用端口
+        :param is_remote: 是否为远程主机，默认根据server_addr判断
         :return: 分配的端口号
         """
-        is_remote = (self.hs_config.server_addr not in ["localhost", "127.0.0.1", ""] and 
-                    not self.hs_config.server_addr.startswith("ssh://"))
-        
+        if is_remote is None:
+            is_remote = (self.hs_config.server_addr not in ["localhost", "127.0.0.1", ""] and
+                         not self.hs_config.server_addr.startswith("ssh://"))
+
         wan_port = random.randint(self.hs_config.ports_start, self.hs_config.ports_close)
         existing_ports = self.get_host_ports(is_remote)
         max_attempts = 100
@@ -102,110 +350,85 @@ class IPTablesAPI:
             attempts += 1
         return wan_port
 
+    # 修改单条映射：快照 + 一次事务 ============================================
+    def change_rule(self, rule: PortConfig, flag: bool,
+                    is_remote: bool = False) -> tuple[bool, str]:
+        try:
+            current, state = self.snapshot(is_remote)
+        except Exception as e:
+            return False, str(e)
+        key = (rule.protocol.upper(), int(rule.wan_port))
+        old = current.pop(key, None)
+        if flag:
+            current[key] = rule
+        elif old is None:
+            return False, f"未找到端口 {rule.wan_port} 的映射"
+        if self.backend == "nftables":
+            return self.apply(self.render_nft(list(current.values())), is_remote)
+        if not state["ready"] or any(state["legacy"].values()):
+            return self.apply(self.render_iptables(
+                list(current.values()), [], state, True), is_remote)
+        return self.apply(self.render_iptables(
+            [rule] if flag else [], [old] if old else [], state), is_remote)
+
     # 添加端口映射规则 #########################################################
-    def add_port_mapping(self, container_ip: str, lan_port: int, wan_port: int, 
-                         is_remote: bool = False, vm_name: str = "") -> tuple[bool, str]:
+    def add_port_mapping(self, container_ip: str, lan_port: int, wan_port: int,
+                         is_remote: bool = False, vm_name: str = "",
+                         protocol: str = "TCP") -> tuple[bool, str]:
         """
-        添加端口映射规则
+        添加端口映射规则（DNAT与FORWARD放行在同一事务中提交）
         :param container_ip: 容器IP地址
         :param lan_port: 容器端口
         :param wan_port: 主机端口
         :param is_remote: 是否为远程主机
         :param vm_name: 虚拟机名（用于注释）
+        :param protocol: 协议类型（TCP/UDP）
         :return: (是否成功, 错误信息)
         """
-        # 构建注释：源IP-端口-目标端口#虚拟机名
-        comment = f"{container_ip}-{wan_port}-{lan_port}#{vm_name}" if vm_name else f"{container_ip}-{wan_port}-{lan_port}"
-        
-        # 1. PREROUTING DNAT 规则
-        success, error = self.execute_iptables_command([
-            "iptables", "-t", "nat", "-A", "PREROUTING",
-            "-p", "tcp", "--dport", str(wan_port),
-            "-j", "DNAT", "--to-destination",
-            f"{container_ip}:{lan_port}",
-            "-m", "comment", "--comment", comment
-        ], is_remote)
-        
-        if not success:
-            return False, f"添加 PREROUTING 规则失败: {error}"
-        
-        # 2. OUTPUT DNAT 规则
-        # success, error = self.execute_iptables_command([
-        #     "iptables", "-t", "nat", "-A", "OUTPUT",
-        #     "-p", "tcp", "--dport", str(wan_port),
-        #     "-j", "DNAT", "--to-destination",
-        #     f"{container_ip}:{lan_port}",
-        #     "-m", "comment", "--comment", comment
-        # ], is_remote)
-        
-        if not success:
-            # 回滚 PREROUTING 规则
-            self.remove_port_mapping(container_ip, lan_port, wan_port, is_remote)
-            return False, f"添加 OUTPUT 规则失败: {error}"
-        
-        # 3. FORWARD 规则
-        success, error = self.execute_iptables_command([
-            "iptables", "-A", "FORWARD",
-            "-p", "tcp", "-d", container_ip,
-            "--dport", str(lan_port),
-            "-j", "ACCEPT",
-            "-m", "comment", "--comment", comment
-        ], is_remote)
-        
+        success, error = self.change_rule(PortConfig(
+            wan_port, container_ip, lan_port, protocol.upper(), vm_name), True, is_remote)
         if not success:
-            # 回滚前面的规则
-            self.remove_port_mapping(container_ip, lan_port, wan_port, is_remote)
-            return False, f"添加 FORWARD 规则失败: {error}"
-        
+            return False, f"添加端口映射失败: {error}"
         logger.info(
             f"端口映射已添加: 主机 {wan_port} -> 容器 {container_ip}:{lan_port}")
-        
         return True, ""
 
     # 删除端口映射规则 #########################################################
-    def remove_port_mapping(self, container_ip: str, lan_port: int, wan_port: int, 
-                            is_remote: bool = False) -> bool:
+    def remove_port_mapping(self, container_ip: str, lan_port: int, wan_port: int,
+                            is_remote: bool = False, protocol: str = "TCP") -> bool:
         """
         删除端口映射规则
         :param container_ip: 容器IP地址
         :param lan_port: 容器端口
         :param wan_port: 主机端口
         :param is_remote: 是否为远程主机
+        :param protocol: 协议类型（TCP/UDP）
         :return: 是否成功
         """
-        # 1. 删除 FORWARD 规则
-        # self.execute_iptables_command([
-        #     "iptables", "-D", "FORWARD",
-        #     "-p", "tcp", "-d", container_ip,
-        #     "--dport", str(lan_port),
-        #     "-j", "ACCEPT"
-        # ], is_remote)
-        
-        # 2. 删除 OUTPUT DNAT 规则
-        # self.execute_iptables_command([
-        #     "iptables", "-t", "nat", "-D", "OUTPUT",
-        #     "-p", "tcp", "--dport", str(wan_port),
-        #     "-j", "DNAT", "--to-destination",
-        #     f"{container_ip}:{lan_port}"
-        # ], is_remote)
-        
-        # 3. 删除 PREROUTING DNAT 规则
-        self.execute_iptables_command([
-            "iptables", "-t", "nat", "-D", "PREROUTING",
-            "-p", "tcp", "--dport", str(wan_port),
-            "-j", "DNAT", "--to-destination",
-            f"{container_ip}:{lan_port}"
-        ], is_remote)
-        
-        logger.info(
-            f"端口映射已删除: 主机 {wan_port} -> 容器 {container_ip}:{lan_port}")
-        
+        success, error = self.change_rule(PortConfig(
+            wan_port, container_ip, lan_port, protocol.upper()), False, is_remote)
+        if not success:
+            logger.warning(f"删除端口映射失败: {error}")
+            return False
+        logger.info(f"端口映射已删除: 主机 {wan_port}" + (
+            f" -> 容器 {container_ip}:{lan_port}" if container_ip else ""))
         return True
 
+    # 与PortForward相同的接口，便于作为TTY容器的端口转发后端 ==================
+    def add_port_forward(self, container_ip: str, lan_port: int, wan_port: int,
+                         protocol: str = "TCP", is_remote: bool = False,
+                         vm_name: str = "") -> tuple[bool, str]:
+        return self.add_port_mapping(
+            container_ip, lan_port, wan_port, is_remote, vm_name, protocol)
+
+    def remove_port_forward(self, wan_port: int, protocol: str = "TCP",
+                            is_remote: bool = False) -> bool:
+        return self.remove_port_mapping("", 0, wan_port, is_remote, protocol)
+
     # 连接SSH ##################################################################
-    def connect_ssh(self) -> tuple[bool, str]:
+    def connect_ssh(self, port: int = 22) -> tuple[bool, str]:
         """
-        连接SSH（用于远程端口映射）
+        连接SSH（用于远程端口映射，复用SSHDPool中该主机的连接）
         :return: (是否成功, 消息)
         """
         self.ssh_forward = SSHDManager()
@@ -213,17 +436,17 @@ class IPTablesAPI:
             hostname=self.hs_config.server_addr,
             username=self.hs_config.server_user,
             password=self.hs_config.server_pass,
-            port=22
+            port=port
         )
-        
+
         if not success:
             return False, message
-        
+
         return True, "SSH连接成功"
 
     # 关闭SSH连接 ##############################################################
     def close_ssh(self):
-        """关闭SSH连接"""
+        """归还SSH连接"""
         if self.ssh_forward:
             self.ssh_forward.close()
             self.ssh_forward = None
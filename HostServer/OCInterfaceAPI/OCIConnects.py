@@ -1,6 +1,9 @@
 import os
+import time
 import random
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
 try:
@@ -21,15 +24,26 @@ from HostModule.SSHDManager import SSHDManager
 # Docker/OpenContainer Initiative 容器操作API封装类 #########################
 class OCIConnects:
     # 初始化 OCI 容器 API ######################################################
+    # 每台宿主机保持一个长期复用的DockerClient，超过check秒未确认时先ping，
+    # 失效后自动重建连接（包括SSH转发）
     # :param hs_config: 宿主机配置对象
+    # :param pool_size: HTTP连接池大小（需大于并发采集数）
+    # :param check: 健康检查间隔（秒）
     ###########################################################################
-    def __init__(self, hs_config: HSConfig):
+    def __init__(self, hs_config: HSConfig, pool_size: int = 10, check: int = 30):
         self.hs_config = hs_config
         self.docker_client = None
         self.ssh_forward = SSHDManager()
+        self.event_stream = None
+        self.pool_size = max(1, pool_size)
+        self.check = check
+        self.checked = 0.0
+        self.lock = threading.RLock()
+        self.stats = {"connect": 0, "reuse": 0, "reconnect": 0,
+                      "failed": 0, "connect_ms": 0.0}
     
     # 连接到 Docker 服务器 #####################################################
-    # 支持本地、远程TCP和SSH转发
+    # 支持本地、远程TCP和SSH转发，已连接时复用
     # :return: (Docker客户端对象, 操作结果消息)
     ###########################################################################
     def connect_docker(self) -> tuple[docker.DockerClient | None, ZMessage]:
@@ -38,41 +52,96 @@ class OCIConnects:
                 success=False, action="connect_docker",
                 message="docker SDK未安装")
         
-        try:
-            # 如果已经连接，直接返回
+        with self.lock:
+            # 如果已经连接且健康，直接返回
             if self.docker_client is not None:
-                return self.docker_client, ZMessage(success=True, action="connect_docker")
-            
+                if time.time() - self.checked < self.check or self.alive():
+                    self.stats["reuse"] += 1
+                    return self.docker_client, ZMessage(success=True, action="connect_docker")
+                self.stats["reconnect"] += 1
+                logger.warning("Docker连接已失效，重新连接")
+                self.reset_docker()
+            return self.create_docker()
+
+    # 建立新的 Docker 连接 =====================================================
+    def create_docker(self) -> tuple[docker.DockerClient | None, ZMessage]:
+        try:
+            start = time.perf_counter()
             # 判断连接方式
             server_addr = self.hs_config.server_addr
             
             # SSH 转发模式
             if server_addr.startswith("ssh://"):
-                return self._connect_via_ssh(server_addr)
+                client, result = self._connect_via_ssh(server_addr)
             
             # 本地连接模式
             elif server_addr in ["localhost", "127.0.0.1", ""]:
                 logger.info("连接到本地Docker服务器")
-                self.docker_client = docker.from_env()
+                self.docker_client = docker.from_env(max_pool_size=self.pool_size)
+                client, result = self.docker_client, ZMessage(success=True, action="connect_docker")
             
             # 远程 TLS 连接模式
             else:
-                return self._connect_via_tls(server_addr)
+                client, result = self._connect_via_tls(server_addr)
+            if not result.success:
+                self.stats["failed"] += 1
+                return client, result
             
             # 测试连接
             self.docker_client.ping()
-            logger.info("成功连接到Docker服务器")
+            self.checked = time.time()
+            self.stats["connect"] += 1
+            self.stats["connect_ms"] = (time.perf_counter() - start) * 1000
+            logger.info(f"成功连接到Docker服务器，耗时 {self.stats['connect_ms']:.0f}ms")
             
             return self.docker_client, ZMessage(success=True, action="connect_docker")
             
         except Exception as e:
             logger.error(f"连接到Docker服务器失败: {str(e)}")
-            self.docker_client = None
-            self.ssh_forward.close()
+            self.stats["failed"] += 1
+            self.reset_docker()
             return None, ZMessage(
                 success=False, action="connect_docker",
                 message=f"连接到Docker失败: {str(e)}")
 
+    # 检查连接是否可用 =========================================================
+    def alive(self) -> bool:
+        try:
+            self.docker_client.ping()
+            self.checked = time.time()
+            return True
+        except Exception as e:
+            logger.debug(f"Docker连接检查失败: {str(e)}")
+            return False
+
+    # 下次使用前重新检查连接（操作出现连接异常时调用）===========================
+    def recheck(self):
+        self.checked = 0.0
+
+    # 关闭当前连接和SSH转发 ====================================================
+    def reset_docker(self):
+        if self.docker_client is not None:
+            try:
+                self.docker_client.close()
+            except Exception as e:
+                logger.debug(f"关闭Docker连接: {str(e)}")
+        self.docker_client = None
+        self.checked = 0.0
+        self.ssh_forward.close()
+
+    # 连接复用统计 #############################################################
+    def conn_stats(self) -> dict:
+        total = self.stats["connect"] + self.stats["reuse"]
+        return {
+            "connect": self.stats["connect"],
+            "reuse": self.stats["reuse"],
+            "reconnect": self.stats["reconnect"],
+            "failed": self.stats["failed"],
+            "reuse_rate": round(self.stats["reuse"] / total, 4) if total else 0.0,
+            "connect_ms": round(self.stats["connect_ms"], 1),
+            "pool_size": self.pool_size,
+        }
+
     # 通过SSH转发连接到远程Docker ##############################################
     # :param server_addr: SSH服务器地址（格式: ssh://hostname）
     # :return: (Docker客户端对象, 操作结果消息)
@@ -126,7 +195,8 @@ class OCIConnects:
         # 连接到本地转发的端口
         self.docker_client = docker.DockerClient(
             base_url=f"tcp://127.0.0.1:{local_port}",
-            timeout=60
+            timeout=60,
+            max_pool_size=self.pool_size
         )
         
         return self.docker_client, ZMessage(success=True, action="connect_docker")
@@ -163,7 +233,8 @@ class OCIConnects:
         
         self.docker_client = docker.DockerClient(
             base_url=endpoint,
-            tls=tls_config
+            tls=tls_config,
+            max_pool_size=self.pool_size
         )
         
         return self.docker_client, ZMessage(success=True, action="connect_docker")
@@ -172,11 +243,8 @@ class OCIConnects:
     # :return: 操作结果消息
     ###########################################################################
     def disconnect_docker(self) -> ZMessage:
-        if self.docker_client:
-            self.docker_client.close()
-            self.docker_client = None
-        if self.ssh_forward:
-            self.ssh_forward.close()
+        with self.lock:
+            self.reset_docker()
         return ZMessage(success=True, action="disconnect_docker", message="Docker连接已断开")
 
     # 构建 Docker 容器配置 #####################################################
@@ -282,6 +350,89 @@ class OCIConnects:
             logger.error(f"列出容器失败: {str(e)}")
             return []
 
+    # 订阅容器事件 ##############################################################
+    # 阻塞读取 /events 事件流，直到连接断开或调用close_events
+    # :param callback: 回调函数 callback(容器名称, 事件动作)
+    ###########################################################################
+    def events_containers(self, callback):
+        client, result = self.connect_docker()
+        if not result.success:
+            raise ConnectionError(result.message)
+        self.event_stream = client.events(
+            decode=True, filters={"type": "container"})
+        try:
+            for event in self.event_stream:
+                actor = event.get("Actor") or {}
+                name = (actor.get("Attributes") or {}).get("name", "")
+                action = event.get("Action") or event.get("status", "")
+                if name and action:
+                    callback(name, action)
+        finally:
+            self.event_stream = None
+            # 事件流中断可能是Docker重启或转发断开，重连前先检查连接
+            self.recheck()
+
+    # 中断容器事件订阅 ##########################################################
+    def close_events(self):
+        if self.event_stream is not None:
+            self.event_stream.close()
+
+    # 列出所有容器的名称和状态 ##################################################
+    # 使用低级API一次返回全部容器摘要，避免逐个inspect
+    # :return: {容器名称: {"id": 容器ID, "state": 运行状态}}
+    ###########################################################################
+    def state_containers(self) -> dict[str, dict]:
+        client, result = self.connect_docker()
+        if not result.success:
+            return {}
+
+        try:
+            states = {}
+            for item in client.api.containers(all=True):
+                for name in item.get("Names") or []:
+                    states[name.lstrip("/")] = {
+                        "id": item.get("Id", ""),
+                        "state": item.get("State", ""),
+                    }
+            return states
+        except Exception as e:
+            logger.error(f"列出容器状态失败: {str(e)}")
+            self.recheck()
+            return {}
+
+    # 并发获取容器统计信息 ######################################################
+    # Docker计算一次统计采样约需1~2秒，使用有界线程池并发采集
+    # :param names: 需要采集的容器名称（为空则采集全部运行中的容器）
+    # :param workers: 最大并发数量
+    # :return: ({容器名称: 统计信息}, {容器名称: 运行状态})
+    ###########################################################################
+    def stats_containers(self, names=None, workers: int = 8) -> tuple[dict, dict]:
+        client, result = self.connect_docker()
+        if not result.success:
+            return {}, {}
+
+        states = self.state_containers()
+        targets = {
+            name: info["id"] for name, info in states.items()
+            if info["state"] == "running" and (names is None or name in names)
+        }
+        if not targets:
+            return {}, states
+
+        def fetch(container_id: str):
+            try:
+                return client.api.stats(container_id, stream=False)
+            except Exception as e:
+                logger.warning(f"获取容器{container_id[:12]}统计信息失败: {str(e)}")
+                self.recheck()
+                return None
+
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(workers, len(targets))),
+                thread_name_prefix="oci-stats") as pool:
+            samples = dict(zip(targets, pool.map(fetch, targets.values())))
+        return {k: v for k, v in samples.items() if v}, states
+
     # 获取指定容器对象 ##########################################################
     # :param container_name: 容器名称
     # :return: 容器对象，不存在返回None
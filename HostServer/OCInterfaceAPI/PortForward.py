@@ -1,5 +1,11 @@
-import re
+import io
+import os
+import sys
+import json
+import time
+import shlex
 import random
+import posixpath
 import subprocess
 from loguru import logger
 from typing import Optional
@@ -7,30 +13,42 @@ from typing import Optional
 from MainObject.Config.HSConfig import HSConfig
 from MainObject.Public.ZMessage import ZMessage
 from HostModule.SSHDManager import SSHDManager
+from HostServer.OCInterfaceAPI import PortRelay
 
 
 class PortConfig:
     """端口转发信息"""
 
     def __init__(self, wan_port: int, lan_addr: str, lan_port: int,
-                 protocol: str = "TCP", vm_name: str = "", pid: int = 0):
+                 protocol: str = "TCP", vm_name: str = "", pid: int = 0,
+                 conns: int = 0, bytes_in: int = 0, bytes_out: int = 0):
         self.wan_port = wan_port  # 外部端口
         self.lan_addr = lan_addr  # 内部IP地址
         self.lan_port = lan_port  # 内部端口
         self.protocol = protocol  # 协议类型（TCP/UDP）
         self.vm_name = vm_name  # 虚拟机名称
-        self.pid = pid  # socat进程ID
+        self.pid = pid  # 转发守护进程ID
+        self.conns = conns  # 累计连接数
+        self.bytes_in = bytes_in  # 客户端 -> 内网字节数
+        self.bytes_out = bytes_out  # 内网 -> 客户端字节数
+
+    def same(self, other: "PortConfig") -> bool:
+        """转发目标是否相同"""
+        return self.lan_addr == other.lan_addr and int(self.lan_port) == int(other.lan_port)
 
 
 class PortForward:
-    """基于socat的端口转发管理API"""
+    """端口转发管理API：每台主机一个PortRelay守护进程承载全部规则"""
+    RELAY_ARGV_MAX = 32 * 1024  # 远程控制请求放在命令行参数中的最大长度（Linux单参数上限128KiB）
+
     def __init__(self, hs_config: HSConfig):
         """
-        初始化 Socat 端口转发 API
+        初始化端口转发 API
         :param hs_config: 宿主机配置对象
         """
         self.hs_config = hs_config
         self.ssh_forward = None
+        self.relay_ready: set[bool] = set()  # 已确认守护进程可用的位置（是否远程）
 
     # 执行命令 #################################################################
     def execute_command(self, cmd: str, is_remote: bool = False) -> tuple[bool, str, str]:
@@ -61,120 +79,27 @@ class PortForward:
     # 列出所有端口转发 #########################################################
     def list_ports(self, is_remote: bool = False) -> list[PortConfig]:
         """
-        列出当前所有socat端口转发
+        列出转发守护进程中的全部端口转发
         :param is_remote: 是否为远程主机
-        :return: 端口转发信息列表
+        :return: 端口转发信息列表（含连接数和字节数统计）
         """
-        # 执行 ps -ef | grep socat，过滤掉grep和watch等命令
-        success, stdout, stderr = self.execute_command(
-            "ps -ef | grep 'socat TCP\\|socat UDP' | grep -v grep | grep -v watch", is_remote
-        )
-
-        if not success:
-            logger.warning(f"获取socat进程列表失败: {stderr}")
+        response = self.relay_call({"op": "list"}, is_remote)
+        if not response.get("ok"):
+            logger.warning(f"获取端口转发列表失败: {response.get('error', '')}")
             return []
-
         forwards = []
-
-        # 解析每一行输出
-        # 示例输出: root 108104 1 0 15:10 ? 00:00:00 socat TCP-LISTEN:24203,reuseaddr,fork TCP:172.19.0.100:22
-        for line in stdout.strip().split('\n'):
-            if not line:
-                continue
-
-            try:
-                # 提取PID和命令
-                parts = line.split()
-                if len(parts) < 8:
-                    continue
-
-                # 查找socat命令的位置（必须是独立的socat，不是路径的一部分）
-                socat_index = -1
-                for i, part in enumerate(parts):
-                    if part == 'socat' or part.endswith('/socat'):
-                        socat_index = i
-                        break
-
-                if socat_index == -1:
-                    continue
-
-                # 获取socat命令参数
-                # 格式: socat TCP-LISTEN:2222,reuseaddr,fork TCP:172.17.0.2:22
-                # 或: socat UDP-LISTEN:2222,reuseaddr,fork UDP:172.17.0.2:22
-                cmd_parts = parts[socat_index:]
-
-                if len(cmd_parts) < 3:
-                    continue
-
-                # 解析监听端口（第一个参数）
-                listen_part = cmd_parts[1]  # TCP-LISTEN:24203,reuseaddr,fork
-                forward_part = cmd_parts[2]  # TCP:172.19.0.100:22
-
-                # 验证这是一个端口转发命令（必须包含LISTEN和目标地址）
-                if 'LISTEN:' not in listen_part:
-                    continue
-
-                # 提取协议和端口
-                protocol = "TCP"
-                wan_port = 0
-
-                # 解析监听部分
-                if "TCP-LISTEN:" in listen_part:
-                    protocol = "TCP"
-                    port_match = re.search(r'TCP-LISTEN:(\d+)', listen_part)
-                    if port_match:
-                        wan_port = int(port_match.group(1))
-                elif "UDP-LISTEN:" in listen_part:
-                    protocol = "UDP"
-                    port_match = re.search(r'UDP-LISTEN:(\d+)', listen_part)
-                    if port_match:
-                        wan_port = int(port_match.group(1))
-
-                if wan_port == 0:
-                    continue
-
-                # 解析转发目标
-                lan_addr = ""
-                lan_port = 0
-
-                if protocol == "TCP" and "TCP:" in forward_part:
-                    # 匹配 TCP:IP:PORT 格式，IP可以是任意格式（包括点分十进制）
-                    target_match = re.search(r'TCP:([0-9.]+):(\d+)', forward_part)
-                    if target_match:
-                        lan_addr = target_match.group(1)
-                        lan_port = int(target_match.group(2))
-                elif protocol == "UDP" and "UDP:" in forward_part:
-                    target_match = re.search(r'UDP:([0-9.]+):(\d+)', forward_part)
-                    if target_match:
-                        lan_addr = target_match.group(1)
-                        lan_port = int(target_match.group(2))
-
-                if not lan_addr or lan_port == 0:
-                    continue
-
-                # PID通常在第2列（索引1）
-                try:
-                    pid = int(parts[1])
-                except (ValueError, IndexError):
-                    logger.warning(f"无法解析PID: {line}")
-                    continue
-
-                forward_info = PortConfig(
-                    wan_port=wan_port,
-                    lan_addr=lan_addr,
-                    lan_port=lan_port,
-                    protocol=protocol,
-                    pid=pid
-                )
-                forwards.append(forward_info)
-                logger.debug(
-                    f"发现端口转发: {protocol} {wan_port} -> {lan_addr}:{lan_port} (PID: {pid})"
-                )
-
-            except Exception as e:
-                logger.warning(f"解析socat进程行失败: {line}, 错误: {str(e)}")
-                continue
-
+        for rule in response.get("rules", []):
+            forwards.append(PortConfig(
+                wan_port=rule["wan_port"],
+                lan_addr=rule["lan_addr"],
+                lan_port=rule["lan_port"],
+                protocol=rule["protocol"],
+                vm_name=rule.get("vm_name", ""),
+                pid=response.get("pid", 0),
+                conns=rule.get("conns", 0),
+                bytes_in=rule.get("bytes_in", 0),
+                bytes_out=rule.get("bytes_out", 0)
+            ))
         return forwards
 
     # 获取已分配的端口列表 #####################################################
@@ -221,36 +146,13 @@ class PortForward:
         if protocol not in ["TCP", "UDP"]:
             return False, f"不支持的协议类型: {protocol}"
 
-        # 构建socat命令
-        # 格式: nohup socat TCP-LISTEN:2222,reuseaddr,fork TCP:172.17.0.2:22 > /dev/null 2>&1 &
-        cmd = (
-            f"nohup socat {protocol}-LISTEN:{wan_port},reuseaddr,fork "
-            f"{protocol}:{container_ip}:{lan_port} > /dev/null 2>&1 &"
-        )
-
-        # 执行命令
-        success, stdout, stderr = self.execute_command(cmd, is_remote)
-
-        if not success:
-            return False, f"启动socat失败: {stderr}"
-
-        # 等待一小段时间确保进程启动
-        import time
-        time.sleep(0.5)
-
-        # 验证端口转发是否成功创建
-        forwards = self.list_ports(is_remote)
-        found = False
-        for forward in forwards:
-            if (forward.wan_port == wan_port and
-                    forward.lan_addr == container_ip and
-                    forward.lan_port == lan_port and
-                    forward.protocol == protocol):
-                found = True
-                break
-
-        if not found:
-            return False, f"端口转发创建后未找到对应进程"
+        # 守护进程在返回前完成监听，失败时直接返回原因，无需再次查询进程列表
+        response = self.relay_call({
+            "op": "add", "protocol": protocol, "wan_port": wan_port,
+            "lan_addr": container_ip, "lan_port": lan_port,
+            "vm_name": vm_name}, is_remote)
+        if not response.get("ok"):
+            return False, f"添加端口转发失败: {response.get('error', '')}"
 
         logger.info(
             f"端口转发已添加: {protocol} {wan_port} -> {container_ip}:{lan_port}"
@@ -263,74 +165,41 @@ class PortForward:
     def remove_port_forward(self, wan_port: int, protocol: str = "TCP",
                             is_remote: bool = False) -> bool:
         """
-        删除端口转发规则
+        删除端口转发规则（同时断开该规则上的现有连接）
         :param wan_port: 主机端口
         :param protocol: 协议类型（TCP/UDP）
         :param is_remote: 是否为远程主机
         :return: 是否成功
         """
         protocol = protocol.upper()
-
-        # 查找对应的socat进程
-        logger.info(f"正在查找端口 {wan_port} ({protocol}) 的转发进程...")
-        forwards = self.list_ports(is_remote)
-
-        logger.debug(f"当前共有 {len(forwards)} 个端口转发")
-        for forward in forwards:
-            logger.debug(
-                f"  - {forward.protocol} {forward.wan_port} -> "
-                f"{forward.lan_addr}:{forward.lan_port} (PID: {forward.pid})"
-            )
-
-        target_pids = []
-        for forward in forwards:
-            if forward.wan_port == wan_port and forward.protocol == protocol:
-                target_pids.append(forward.pid)
-                logger.info(
-                    f"找到匹配的转发: {forward.protocol} {forward.wan_port} -> "
-                    f"{forward.lan_addr}:{forward.lan_port} (PID: {forward.pid})"
-                )
-
-        if not target_pids:
-            logger.warning(f"未找到端口 {wan_port} ({protocol}) 的转发进程")
+        response = self.relay_call(
+            {"op": "del", "protocol": protocol, "wan_port": wan_port}, is_remote)
+        if not response.get("ok"):
+            logger.warning(
+                f"未找到端口 {wan_port} ({protocol}) 的转发: {response.get('error', '')}")
             return False
-
-        # 杀死进程
-        all_success = True
-        for pid in target_pids:
-            logger.info(f"正在终止进程 PID {pid}...")
-            cmd = f"kill {pid}"
-            success, stdout, stderr = self.execute_command(cmd, is_remote)
-
-            if success:
-                logger.info(f"kill命令执行成功: PID {pid}")
-
-                # 验证进程是否真的被终止
-                import time
-                time.sleep(0.5)
-
-                # 检查进程是否还存在
-                check_cmd = f"ps -p {pid} -o pid="
-                check_success, check_stdout, check_stderr = self.execute_command(check_cmd, is_remote)
-
-                if check_success and check_stdout.strip():
-                    # 进程还存在，尝试强制终止
-                    logger.warning(f"进程 {pid} 仍在运行，尝试强制终止...")
-                    force_cmd = f"kill -9 {pid}"
-                    force_success, force_stdout, force_stderr = self.execute_command(force_cmd, is_remote)
-
-                    if force_success:
-                        logger.info(f"已强制终止进程: PID {pid}")
-                    else:
-                        logger.error(f"强制终止进程失败: PID {pid}, 错误: {force_stderr}")
-                        all_success = False
-                else:
-                    logger.info(f"已成功停止端口转发进程: PID {pid} ({protocol} {wan_port})")
-            else:
-                logger.warning(f"停止进程失败: PID {pid}, 错误: {stderr}")
-                all_success = False
-
-        return all_success
+        logger.info(f"已删除端口转发: {protocol} {wan_port}")
+        return True
+
+    # 同步完整规则集 ###########################################################
+    # 守护进程在一次请求内删除多余规则、添加缺少的规则
+    # :param rules: 期望的全部转发
+    # :return: (是否成功, 错误信息, {"added", "removed", "failed": {"协议:端口": 原因}})
+    ###########################################################################
+    def sync_rules(self, rules: list[PortConfig],
+                   is_remote: bool = False) -> tuple[bool, str, dict]:
+        response = self.relay_call({"op": "sync", "rules": [{
+            "protocol": rule.protocol.upper(), "wan_port": int(rule.wan_port),
+            "lan_addr": rule.lan_addr, "lan_port": int(rule.lan_port),
+            "vm_name": rule.vm_name} for rule in rules]}, is_remote)
+        changes = {"added": response.get("added", 0),
+                   "removed": response.get("removed", 0),
+                   "failed": response.get("failed") or {}}
+        if not response.get("ok"):
+            return False, response.get("error", ""), changes
+        if changes["failed"]:
+            return False, f"{len(changes['failed'])} 条规则添加失败", changes
+        return True, "", changes
 
     # 删除指定容器的所有端口转发 ################################################
     def remove_container_forwards(self, container_ip: str, is_remote: bool = False) -> int:
@@ -350,10 +219,169 @@ class PortForward:
 
         return removed_count
 
+    # 守护进程目录 ############################################################
+    # 可通过extend_data["relay_path"]指定，本地默认DataSaving，远程默认/var/lib/openidcs
+    ###########################################################################
+    def relay_path(self, is_remote: bool = False) -> str:
+        path = self.hs_config.extend_data.get("relay_path", "")
+        if path:
+            return path
+        return "/var/lib/openidcs" if is_remote else os.path.abspath("DataSaving")
+
+    # 守护进程控制地址（Windows本地使用TCP回环端口）=========================
+    def relay_ctrl(self, is_remote: bool = False) -> str:
+        if not is_remote and os.name == "nt":
+            return f"127.0.0.1:{int(self.hs_config.extend_data.get('relay_ctrl', 40100))}"
+        join = posixpath.join if is_remote else os.path.join
+        return join(self.relay_path(is_remote), "relay.sock")
+
+    # 发送控制请求 #############################################################
+    # 首次调用时确认守护进程已启动且版本一致，否则(重新)部署并启动
+    # :return: 守护进程响应，不可达时包含 down=True
+    ###########################################################################
+    def relay_call(self, request: dict, is_remote: bool = False) -> dict:
+        if is_remote not in self.relay_ready:
+            ping = self.relay_send({"op": "ping"}, is_remote)
+            if ping.get("ok") and ping.get("version") != PortRelay.RELAY_VERSION:
+                logger.info(f"端口转发守护进程版本变更，重新启动: {ping.get('version')}")
+                if not self.relay_stop(ping.get("pid", 0), is_remote):
+                    return {"ok": False, "down": True, "error": "旧版端口转发守护进程未退出"}
+                ping = {"down": True}
+            if ping.get("down") and not self.relay_start(is_remote):
+                return {"ok": False, "down": True, "error": "端口转发守护进程启动失败"}
+            self.relay_ready.add(is_remote)
+        response = self.relay_send(request, is_remote)
+        if response.get("down"):
+            # 守护进程意外退出，重启一次（规则由状态文件恢复）
+            self.relay_ready.discard(is_remote)
+            if self.relay_start(is_remote):
+                self.relay_ready.add(is_remote)
+                response = self.relay_send(request, is_remote)
+        return response
+
+    # 停止守护进程并等待退出 #################################################
+    # 旧进程仍持有监听端口和控制套接字，需等待其不可达且进程退出后再启动新进程
+    # :return: 是否已退出
+    ###########################################################################
+    def relay_stop(self, pid: int, is_remote: bool = False) -> bool:
+        self.relay_send({"op": "quit"}, is_remote)
+        for _ in range(50):
+            if self.relay_send({"op": "ping"}, is_remote).get("down") \
+                    and not self.relay_alive(pid, is_remote):
+                return True
+            time.sleep(0.1)
+        logger.error(f"端口转发守护进程未退出: {pid}" + (" (远程)" if is_remote else ""))
+        return False
+
+    # 守护进程是否仍在运行（Windows本地无法探测时以控制端口不可达为准）=======
+    def relay_alive(self, pid: int, is_remote: bool = False) -> bool:
+        if not pid:
+            return False
+        if is_remote:
+            return self.execute_command(f"kill -0 {int(pid)}", True)[0]
+        if os.name == "nt":
+            return False
+        try:
+            # 本进程启动的守护进程退出后需回收，否则一直以僵尸进程存在
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return False
+        except ChildProcessError:
+            pass
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def relay_send(self, request: dict, is_remote: bool = False) -> dict:
+        ctrl = self.relay_ctrl(is_remote)
+        if not is_remote:
+            try:
+                return PortRelay.relay_call(ctrl, request)
+            except OSError as e:
+                return {"ok": False, "down": True, "error": str(e)}
+            except ValueError as e:
+                return {"ok": False, "error": str(e)}
+        script = posixpath.join(self.relay_path(True), "PortRelay.py")
+        payload = json.dumps(request)
+        if len(payload) <= self.RELAY_ARGV_MAX:
+            success, stdout, stderr = self.execute_command(
+                f"python3 {script} --control {ctrl} --call "
+                f"{shlex.quote(payload)}", True)
+        else:
+            # 大请求（如上千条规则的sync）超过单个参数长度上限，通过SFTP上传后从文件读取
+            call = posixpath.join(self.relay_path(True), f"call-{random.randrange(1 << 32):08x}.json")
+            try:
+                sftp = self.ssh_forward.ssh_pool.open_sftp()
+                try:
+                    sftp.putfo(io.BytesIO(payload.encode("utf-8")), call)
+                finally:
+                    sftp.close()
+            except Exception as e:
+                return {"ok": False, "down": True, "error": f"上传控制请求失败: {e}"}
+            success, stdout, stderr = self.execute_command(
+                f"python3 {script} --control {ctrl} --call @{call}; rm -f {call}", True)
+        lines = stdout.strip().splitlines()
+        try:
+            return json.loads(lines[-1])
+        except (ValueError, IndexError):
+            return {"ok": False, "down": True, "error": stderr.strip() or stdout}
+
+    # 部署并启动守护进程 #######################################################
+    # 旧版每条规则一个socat进程，启动前先停止它们以释放端口，
+    # 规则随后由syn_port_TTY按配置重新添加
+    ###########################################################################
+    def relay_start(self, is_remote: bool = False) -> bool:
+        path = self.relay_path(is_remote)
+        ctrl = self.relay_ctrl(is_remote)
+        kill_cmd = "pkill -f '^socat (TCP|UDP)-LISTEN:'"
+        try:
+            if is_remote:
+                if not self.ssh_forward or not self.ssh_forward.ssh_pool:
+                    return False
+                script = posixpath.join(path, "PortRelay.py")
+                self.execute_command(f"mkdir -p {path}", True)
+                sftp = self.ssh_forward.ssh_pool.open_sftp()
+                try:
+                    sftp.put(PortRelay.__file__, script)
+                finally:
+                    sftp.close()
+                self.execute_command(kill_cmd, True)
+                self.execute_command(
+                    f"nohup python3 {script} --control {ctrl} "
+                    f"--state {posixpath.join(path, 'relay.json')} "
+                    f">> {posixpath.join(path, 'relay.log')} 2>&1 &", True)
+            else:
+                os.makedirs(path, exist_ok=True)
+                if os.name != "nt":
+                    self.execute_command(kill_cmd)
+                with open(os.path.join(path, "relay.log"), "ab") as log_file:
+                    subprocess.Popen(
+                        [sys.executable, PortRelay.__file__, "--control", ctrl,
+                         "--state", os.path.join(path, "relay.json")],
+                        stdin=subprocess.DEVNULL, stdout=log_file,
+                        stderr=subprocess.STDOUT, close_fds=True,
+                        **({"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+                           if os.name == "nt" else {"start_new_session": True}))
+        except Exception as e:
+            logger.error(f"启动端口转发守护进程失败: {str(e)}")
+            return False
+        # 等待控制套接字就绪
+        for _ in range(50):
+            if self.relay_send({"op": "ping"}, is_remote).get("ok"):
+                logger.info(f"端口转发守护进程已启动: {ctrl}"
+                            + (" (远程)" if is_remote else ""))
+                return True
+            time.sleep(0.1)
+        logger.error(f"端口转发守护进程未就绪: {ctrl}")
+        return False
+
     # 连接SSH ##################################################################
     def connect_ssh(self, port: int = 22) -> tuple[bool, str]:
         """
-        连接SSH（用于远程端口转发）
+        连接SSH（用于远程端口转发，复用SSHDPool中该主机的连接）
         :return: (是否成功, 消息)
         """
         self.ssh_forward = SSHDManager()
@@ -371,7 +399,7 @@ class PortForward:
 
     # 关闭SSH连接 ##############################################################
     def close_ssh(self):
-        """关闭SSH连接"""
+        """归还SSH连接"""
         if self.ssh_forward:
             self.ssh_forward.close()
             self.ssh_forward = None
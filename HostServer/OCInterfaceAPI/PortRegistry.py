@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import threading
+from loguru import logger
+
+from HostServer.OCInterfaceAPI.PortForward import PortConfig
+
+
+# 端口转发登记表 ##############################################################
+# 持久化记录每台主机已生效的转发规则及其句柄（PortRelay进程ID或NAT后端名称），
+# syn_port_TTY以集合差异对账，不再逐条查询进程列表
+# :param path: 登记表文件路径
+###############################################################################
+class PortRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.rules: dict[str, dict] = {}  # {"协议:外部端口": 规则}
+        self.failed: dict[str, str] = {}  # {"协议:外部端口": 失败原因}
+        self.updated = 0.0
+        self.load()
+
+    @staticmethod
+    def key(protocol: str, wan_port: int) -> str:
+        return f"{protocol.upper()}:{int(wan_port)}"
+
+    # 读取登记表 ###############################################################
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+            self.rules = data.get("rules", {})
+            self.failed = data.get("failed", {})
+            self.updated = data.get("updated", 0.0)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[PortRegistry] 读取登记表失败: {self.path} {e}")
+
+    # 保存登记表（先写临时文件再替换）#########################################
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp = f"{self.path}.tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump({"rules": self.rules, "failed": self.failed,
+                       "updated": self.updated}, file, ensure_ascii=False, indent=2)
+        os.replace(temp, self.path)
+
+    # 记录一次对账结果 #########################################################
+    # :param rules: 校验后实际生效的规则
+    # :param failed: {(协议, 外部端口): 失败原因}
+    # :param handle: 默认句柄（规则未携带进程ID时使用）
+    ###########################################################################
+    def record(self, rules: list[PortConfig], failed: dict = None, handle: str = ""):
+        with self.lock:
+            self.rules = {self.key(rule.protocol, rule.wan_port): self.entry(rule, handle)
+                          for rule in rules}
+            self.failed = {self.key(*key): reason for key, reason in (failed or {}).items()}
+            self.updated = time.time()
+            self.save()
+
+    # 登记/注销单条规则 ========================================================
+    def put(self, rule: PortConfig, handle: str = ""):
+        with self.lock:
+            key = self.key(rule.protocol, rule.wan_port)
+            self.rules[key] = self.entry(rule, handle)
+            self.failed.pop(key, None)
+            self.updated = time.time()
+            self.save()
+
+    def drop(self, protocol: str, wan_port: int):
+        with self.lock:
+            key = self.key(protocol, wan_port)
+            if self.rules.pop(key, None) is None and self.failed.pop(key, None) is None:
+                return
+            self.updated = time.time()
+            self.save()
+
+    @staticmethod
+    def entry(rule: PortConfig, handle: str = "") -> dict:
+        return {"protocol": rule.protocol.upper(), "wan_port": int(rule.wan_port),
+                "lan_addr": rule.lan_addr, "lan_port": int(rule.lan_port),
+                "vm_name": rule.vm_name, "handle": str(rule.pid or handle)}
+
+    # 登记表与实际状态的差异 ###################################################
+    # :param live: {(协议, 外部端口): PortConfig}
+    # :return: 登记为已生效但实际缺失或目标不一致的规则键
+    ###########################################################################
+    def drift(self, live: dict) -> list[tuple]:
+        with self.lock:
+            rules = list(self.rules.values())
+        missing = []
+        for rule in rules:
+            key = (rule["protocol"], rule["wan_port"])
+            found = live.get(key)
+            if found is None or found.lan_addr != rule["lan_addr"] \
+                    or int(found.lan_port) != rule["lan_port"]:
+                missing.append(key)
+        return missing
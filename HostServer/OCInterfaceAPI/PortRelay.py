@@ -0,0 +1,525 @@
+"""
+端口转发守护进程
+
+单个asyncio事件循环持有全部TCP/UDP监听，替代每条规则一个socat进程
+（以及socat为每个客户端连接fork的子进程）。规则通过本地控制套接字
+热添加/删除，每条规则统计连接数和双向字节数，Linux下TCP使用splice
+在内核中搬运数据。
+
+只依赖标准库，可直接复制到远程主机运行:
+    python3 PortRelay.py --control /var/lib/openidcs/relay.sock \\
+                         --state /var/lib/openidcs/relay.json
+    python3 PortRelay.py --control /var/lib/openidcs/relay.sock \\
+                         --call '{"op": "list"}'
+    python3 PortRelay.py --control /var/lib/openidcs/relay.sock \\
+                         --call @/var/lib/openidcs/call.json   # 从文件读取请求
+
+控制协议: 每个连接发送一行JSON请求，返回一行JSON响应
+    ping                                  -> {"ok", "version", "pid"}
+    list                                  -> {"ok", "rules": [...]}
+    add  protocol/wan_port/lan_addr/lan_port/vm_name
+    del  protocol/wan_port
+    sync rules: [...]                     -> 替换为给定的完整规则集
+    quit
+"""
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import signal
+import asyncio
+import logging
+import argparse
+
+RELAY_VERSION = 1
+CHUNK = 65536  # 单次搬运的最大字节数
+CONNECT_TIMEOUT = 10  # 连接内网目标的超时（秒）
+UDP_IDLE = 60  # UDP会话空闲回收时间（秒）
+CONTROL_LIMIT = 16 * 1024 * 1024  # 单条控制请求的最大长度（sync携带完整规则集）
+SPLICE = sys.platform.startswith("linux") and hasattr(os, "splice")
+
+logger = logging.getLogger("PortRelay")
+
+
+# 单条转发规则 ################################################################
+class RelayRule:
+    def __init__(self, protocol: str, wan_port: int, lan_addr: str,
+                 lan_port: int, vm_name: str = ""):
+        self.protocol = protocol.upper()
+        self.wan_port = int(wan_port)
+        self.lan_addr = lan_addr
+        self.lan_port = int(lan_port)
+        self.vm_name = vm_name
+        self.listener = None  # TCP监听socket或UDPListener
+        self.tasks: set = set()  # accept及各连接的任务
+        self.conns = 0  # 累计连接（UDP为会话）数
+        self.active = 0  # 当前连接数
+        self.bytes_in = 0  # 客户端 -> 内网
+        self.bytes_out = 0  # 内网 -> 客户端
+        self.created = time.time()
+
+    @property
+    def key(self) -> tuple:
+        return self.protocol, self.wan_port
+
+    def same(self, spec: dict) -> bool:
+        return self.lan_addr == spec["lan_addr"] \
+            and self.lan_port == int(spec["lan_port"])
+
+    def spec(self) -> dict:
+        return {"protocol": self.protocol, "wan_port": self.wan_port,
+                "lan_addr": self.lan_addr, "lan_port": self.lan_port,
+                "vm_name": self.vm_name}
+
+    def info(self) -> dict:
+        return dict(self.spec(), conns=self.conns, active=self.active,
+                    bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+                    created=int(self.created))
+
+
+# UDP监听：按客户端地址建立到内网的会话 ######################################
+class UDPListener(asyncio.DatagramProtocol):
+    def __init__(self, rule: RelayRule):
+        self.rule = rule
+        self.transport = None
+        self.sessions: dict = {}  # {客户端地址: UDPSession}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.rule.bytes_in += len(data)
+        session = self.sessions.get(addr)
+        if session is None:
+            session = UDPSession(self, addr)
+            self.sessions[addr] = session
+            self.rule.conns += 1
+            self.rule.active += 1
+            asyncio.get_running_loop().create_task(session.open())
+        session.send(data)
+
+    def expire(self, now: float):
+        for session in list(self.sessions.values()):
+            if now - session.used > UDP_IDLE:
+                session.close()
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            session.close()
+        if self.transport:
+            self.transport.close()
+
+
+class UDPSession(asyncio.DatagramProtocol):
+    def __init__(self, listener: UDPListener, addr: tuple):
+        self.listener = listener
+        self.addr = addr
+        self.transport = None
+        self.pending: list = []  # 上游建立前收到的数据报
+        self.used = time.monotonic()
+        self.closed = False
+
+    async def open(self):
+        rule = self.listener.rule
+        try:
+            await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: self, remote_addr=(rule.lan_addr, rule.lan_port))
+        except OSError as e:
+            logger.warning(f"UDP {rule.wan_port} -> {rule.lan_addr}:{rule.lan_port}: {e}")
+            self.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending.clear()
+
+    def send(self, data: bytes):
+        self.used = time.monotonic()
+        if self.transport is None:
+            self.pending.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        self.used = time.monotonic()
+        self.listener.rule.bytes_out += len(data)
+        if self.listener.transport:
+            self.listener.transport.sendto(data, self.addr)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.listener.sessions.pop(self.addr, None)
+        self.listener.rule.active -= 1
+        if self.transport:
+            self.transport.close()
+
+
+# 转发守护进程 ################################################################
+class PortRelay:
+    def __init__(self, control: str, state: str = ""):
+        self.control = control
+        self.state = state
+        self.rules: dict = {}  # {(协议, 外部端口): RelayRule}
+        self.lock = None  # asyncio.Lock，在事件循环中创建
+        self.stop = None  # asyncio.Event
+
+    # 添加规则（已存在且目标相同时直接返回）==================================
+    async def add(self, spec: dict) -> RelayRule:
+        rule = RelayRule(spec.get("protocol", "TCP"), spec["wan_port"],
+                         spec["lan_addr"], spec["lan_port"], spec.get("vm_name", ""))
+        if rule.protocol not in ("TCP", "UDP"):
+            raise ValueError(f"不支持的协议类型: {rule.protocol}")
+        old = self.rules.get(rule.key)
+        if old is not None:
+            if old.same(spec):
+                old.vm_name = rule.vm_name or old.vm_name
+                return old
+            self.remove(old.protocol, old.wan_port)
+        loop = asyncio.get_running_loop()
+        if rule.protocol == "TCP":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                if os.name != "nt":
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("0.0.0.0", rule.wan_port))
+                sock.listen(512)
+                sock.setblocking(False)
+            except OSError:
+                sock.close()
+                raise
+            rule.listener = sock
+            self.spawn(rule, self.accept(rule, sock))
+        else:
+            _, listener = await loop.create_datagram_endpoint(
+                lambda: UDPListener(rule), local_addr=("0.0.0.0", rule.wan_port))
+            rule.listener = listener
+        self.rules[rule.key] = rule
+        logger.info(f"添加转发: {rule.protocol} {rule.wan_port} -> "
+                    f"{rule.lan_addr}:{rule.lan_port} {rule.vm_name}")
+        return rule
+
+    # 删除规则并断开其上的全部连接 ============================================
+    def remove(self, protocol: str, wan_port: int) -> bool:
+        rule = self.rules.pop((protocol.upper(), int(wan_port)), None)
+        if rule is None:
+            return False
+        # 先取消accept和连接任务（注销fd监听），再关闭监听
+        for task in list(rule.tasks):
+            task.cancel()
+        if isinstance(rule.listener, socket.socket):
+            asyncio.get_running_loop().remove_reader(rule.listener.fileno())
+        if rule.listener is not None:
+            rule.listener.close()
+        logger.info(f"删除转发: {rule.protocol} {rule.wan_port}")
+        return True
+
+    # 替换为完整规则集 ========================================================
+    async def sync(self, specs: list) -> dict:
+        wanted = {(s.get("protocol", "TCP").upper(), int(s["wan_port"])): s
+                  for s in specs}
+        removed = [key for key in list(self.rules) if key not in wanted]
+        for protocol, wan_port in removed:
+            self.remove(protocol, wan_port)
+        added, failed = 0, {}
+        for key, spec in wanted.items():
+            rule = self.rules.get(key)
+            if rule is not None and rule.same(spec):
+                continue
+            try:
+                await self.add(spec)
+                added += 1
+            except (OSError, ValueError, KeyError) as e:
+                failed[f"{key[0]}:{key[1]}"] = str(e)
+        return {"added": added, "removed": len(removed), "failed": failed}
+
+    def spawn(self, rule: RelayRule, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        rule.tasks.add(task)
+        task.add_done_callback(rule.tasks.discard)
+        return task
+
+    # TCP转发 #################################################################
+    async def accept(self, rule: RelayRule, sock: socket.socket):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                client, _ = await loop.sock_accept(sock)
+            except asyncio.CancelledError:
+                raise
+            except OSError as e:
+                if rule.listener is not sock or sock.fileno() < 0:
+                    return
+                logger.warning(f"TCP {rule.wan_port} accept失败: {e}")
+                await asyncio.sleep(0.1)
+                continue
+            self.spawn(rule, self.connect(rule, client))
+
+    async def connect(self, rule: RelayRule, client: socket.socket):
+        loop = asyncio.get_running_loop()
+        rule.conns += 1
+        rule.active += 1
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            client.setblocking(False)
+            upstream.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(
+                upstream, (rule.lan_addr, rule.lan_port)), CONNECT_TIMEOUT)
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            await asyncio.gather(
+                self.pipe(client, upstream, rule, "bytes_in"),
+                self.pipe(upstream, client, rule, "bytes_out"))
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"TCP {rule.wan_port} -> {rule.lan_addr}:{rule.lan_port}: {e}")
+        finally:
+            rule.active -= 1
+            client.close()
+            upstream.close()
+
+    # 单向搬运数据，结束后半关闭对端写方向 ====================================
+    async def pipe(self, src: socket.socket, dst: socket.socket,
+                   rule: RelayRule, field: str):
+        try:
+            if SPLICE:
+                await self.pipe_splice(src, dst, rule, field)
+            else:
+                await self.pipe_copy(src, dst, rule, field)
+        except OSError:
+            pass
+        finally:
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    # 通用路径：复用同一块缓冲区，不为每个数据块分配bytes ====================
+    async def pipe_copy(self, src, dst, rule: RelayRule, field: str):
+        loop = asyncio.get_running_loop()
+        buffer = bytearray(CHUNK)
+        view = memoryview(buffer)
+        while True:
+            size = await loop.sock_recv_into(src, buffer)
+            if not size:
+                return
+            await loop.sock_sendall(dst, view[:size])
+            setattr(rule, field, getattr(rule, field) + size)
+
+    # Linux路径：socket -> pipe -> socket，数据不经过用户态 ==================
+    async def pipe_splice(self, src, dst, rule: RelayRule, field: str):
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        pipe_r, pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            while True:
+                try:
+                    size = os.splice(src.fileno(), pipe_w, CHUNK, flags=flags)
+                except BlockingIOError:
+                    await self.wait_fd(src.fileno())
+                    continue
+                except OSError as e:
+                    # 内核不支持该类socket的splice时回退到普通拷贝
+                    if e.errno in (errno.EINVAL, errno.ENOSYS):
+                        return await self.pipe_copy(src, dst, rule, field)
+                    raise
+                if not size:
+                    return
+                pending = size
+                while pending:
+                    try:
+                        pending -= os.splice(pipe_r, dst.fileno(), pending, flags=flags)
+                    except BlockingIOError:
+                        await self.wait_fd(dst.fileno(), write=True)
+                setattr(rule, field, getattr(rule, field) + size)
+        finally:
+            os.close(pipe_r)
+            os.close(pipe_w)
+
+    @staticmethod
+    async def wait_fd(fd: int, write: bool = False):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        watch, unwatch = (loop.add_writer, loop.remove_writer) if write \
+            else (loop.add_reader, loop.remove_reader)
+        watch(fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            unwatch(fd)
+
+    # UDP空闲会话回收 =========================================================
+    async def expire(self):
+        while True:
+            await asyncio.sleep(UDP_IDLE / 2)
+            now = time.monotonic()
+            for rule in list(self.rules.values()):
+                if isinstance(rule.listener, UDPListener):
+                    rule.listener.expire(now)
+
+    # 控制套接字 ##############################################################
+    async def handle(self, reader, writer):
+        try:
+            request = json.loads((await reader.readline()).decode() or "{}")
+            response = await self.dispatch(request)
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        try:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, "version": RELAY_VERSION, "pid": os.getpid(),
+                    "rules": len(self.rules), "splice": SPLICE}
+        if op == "list":
+            return {"ok": True, "pid": os.getpid(),
+                    "rules": [rule.info() for rule in self.rules.values()]}
+        if op == "quit":
+            self.stop.set()
+            return {"ok": True}
+        async with self.lock:
+            if op == "add":
+                try:
+                    await self.add(request)
+                    result = {"ok": True}
+                except (OSError, ValueError, KeyError) as e:
+                    result = {"ok": False, "error": str(e)}
+            elif op == "del":
+                result = {"ok": True} if self.remove(
+                    request.get("protocol", "TCP"), request["wan_port"]) \
+                    else {"ok": False, "error": "规则不存在"}
+            elif op == "sync":
+                result = dict(await self.sync(request.get("rules", [])), ok=True)
+            else:
+                return {"ok": False, "error": f"未知操作: {op}"}
+            self.save()
+            return result
+
+    # 规则持久化（守护进程重启后恢复）========================================
+    def save(self):
+        if not self.state:
+            return
+        temp = f"{self.state}.tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump([rule.spec() for rule in self.rules.values()], file)
+        os.replace(temp, self.state)
+
+    def load(self) -> list:
+        if not self.state or not os.path.exists(self.state):
+            return []
+        try:
+            with open(self.state, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取规则文件失败: {e}")
+            return []
+
+    async def serve(self):
+        self.lock = asyncio.Lock()
+        self.stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        host, port = split_control(self.control)
+        inode = None
+        if host is None:
+            if os.path.exists(self.control):
+                os.unlink(self.control)
+            server = await asyncio.start_unix_server(
+                self.handle, path=self.control, limit=CONTROL_LIMIT)
+            os.chmod(self.control, 0o600)
+            inode = os.stat(self.control).st_ino
+        else:
+            server = await asyncio.start_server(
+                self.handle, host, port, limit=CONTROL_LIMIT)
+        for sig in (getattr(signal, "SIGTERM", None), getattr(signal, "SIGINT", None)):
+            try:
+                loop.add_signal_handler(sig, self.stop.set)
+            except (NotImplementedError, RuntimeError, TypeError):
+                pass
+        result = await self.sync(self.load())
+        if result["failed"]:
+            logger.warning(f"恢复规则失败: {result['failed']}")
+        logger.info(f"端口转发守护进程已启动: {self.control} "
+                    f"({len(self.rules)} 条规则, splice={SPLICE})")
+        expire = loop.create_task(self.expire())
+        try:
+            await self.stop.wait()
+        finally:
+            # 先释放全部监听端口再关闭控制套接字：控制端不可达即表示端口已释放
+            expire.cancel()
+            for protocol, wan_port in list(self.rules):
+                self.remove(protocol, wan_port)
+            server.close()
+            # 仅删除自己创建的套接字文件（新进程可能已在同一路径重新创建）
+            if host is None:
+                try:
+                    if os.stat(self.control).st_ino == inode:
+                        os.unlink(self.control)
+                except OSError:
+                    pass
+
+
+# 解析控制地址: Unix套接字路径或 host:port ===================================
+def split_control(control: str) -> tuple:
+    if ":" in control and not control.startswith("/") and os.sep not in control:
+        host, _, port = control.rpartition(":")
+        return host or "127.0.0.1", int(port)
+    return None, None
+
+
+# 发送控制请求（同步调用，供管理端和命令行使用）=============================
+# :raises OSError: 守护进程未运行或连接失败
+###############################################################################
+def relay_call(control: str, request: dict, timeout: float = 30) -> dict:
+    host, port = split_control(control)
+    if host is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = control
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = (host, port)
+    with sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.decode() or "{}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenIDCS端口转发守护进程")
+    parser.add_argument("--control", required=True, help="控制套接字路径或host:port")
+    parser.add_argument("--state", default="", help="规则持久化文件")
+    parser.add_argument("--call", default="",
+                        help="发送一条JSON控制请求后退出，@路径表示从文件读取请求")
+    args = parser.parse_args()
+    if args.call:
+        try:
+            if args.call.startswith("@"):
+                with open(args.call[1:], "r", encoding="utf-8") as f:
+                    request = json.load(f)
+            else:
+                request = json.loads(args.call)
+            response = relay_call(args.control, request)
+        except OSError as e:
+            print(json.dumps({"ok": False, "down": True, "error": str(e)}))
+            sys.exit(2)
+        print(json.dumps(response))
+        sys.exit(0 if response.get("ok") else 1)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(PortRelay(args.control, args.state).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,122 @@
 import os
+import time
+import shlex
+import psutil
 import random
+import shutil
+import signal
+import socket
 import string
+import threading
 import subprocess
 import platform
+from collections import deque
 from loguru import logger
 
 from MainObject.Config.HSConfig import HSConfig
+from HostModule.SSHDManager import SSHDPool
+
+
+# ttyd端口租约池 ##############################################################
+# 从配置的端口段中租出端口，租出前检测是否已被其他程序占用；
+# 被占用或启动失败的端口隔离一段时间后再放回池中
+# :param first: 起始端口
+# :param last: 结束端口（含）
+###############################################################################
+class PortLease:
+    quarantine = 300  # 隔离时间(秒)
+
+    def __init__(self, first: int, last: int):
+        self.lock = threading.Lock()
+        ports = list(range(first, last + 1))
+        random.shuffle(ports)
+        self.free = deque(ports)
+        self.used: set[int] = set()
+        self.held: dict[int, float] = {}  # {端口: 隔离到期时间}
+
+    # 解析端口段 "7000-8000" ==================================================
+    @staticmethod
+    def parse(text: str) -> tuple[int, int]:
+        first, _, last = str(text).partition("-")
+        return int(first), int(last or first)
+
+    # 检测端口是否可绑定 ======================================================
+    @staticmethod
+    def is_free(port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(("0.0.0.0", port))
+                return True
+            except OSError:
+                return False
+
+    # 租出端口 #################################################################
+    # :return: 端口，池已耗尽时返回-1
+    ###########################################################################
+    def lease(self) -> int:
+        with self.lock:
+            now = time.time()
+            for port, until in list(self.held.items()):
+                if until <= now:
+                    del self.held[port]
+                    self.free.append(port)
+            for _ in range(len(self.free)):
+                port = self.free.popleft()
+                if self.is_free(port):
+                    self.used.add(port)
+                    return port
+                self.held[port] = now + self.quarantine
+            return -1
+
+    # 归还端口 #################################################################
+    # :param broken: 端口无法使用（如ttyd绑定失败），归还后先隔离
+    ###########################################################################
+    def release(self, port: int, broken: bool = False):
+        with self.lock:
+            if port not in self.used:
+                return
+            self.used.discard(port)
+            if broken:
+                self.held[port] = time.time() + self.quarantine
+            else:
+                self.free.append(port)
 
 
 class SSHTerminal:
-    """Web Terminal (ttyd) 管理API - 修改为直接启动ttyd进程"""
+    """Web Terminal (ttyd) 管理API - 端口租约、会话复用与空闲回收
+
+    extend_data 配置项:
+        tty_ports: ttyd端口段，默认 "7000-8000"
+        tty_idle:  无客户端连接的会话保留秒数，默认1800，0为不回收
+        tty_mode:  process（每会话一个ttyd进程，默认）
+                   shared（所有会话共用一个ttyd进程，按URL参数中的token启动会话，不支持Windows）
+    """
+
+    sshpass_path = None  # sshpass路径缓存（""为未找到），只查找一次
+    control_path = None  # SSH主连接套接字目录缓存（""为不可用）
 
     def __init__(self, hs_config: HSConfig):
         self.hs_config = hs_config
         self.ttyd_processes = {}  # 存储ttyd进程 {port: process}
-        self.ttyd_tokens = {}  # 存储token映射 {port: token}
+        self.ttyd_sessions: dict[str, dict] = {}  # {token: 会话信息}
+        self.ttyd_reuse: dict[tuple, str] = {}  # {(主机, 虚拟机, 类型, 端口, 用户): token}
+        self.on_close = None  # 会话关闭回调 on_close(token)，用于删除代理路由
+        self.lock = threading.RLock()
+        # 读取配置 =======================================================
+        extend = hs_config.extend_data
+        self.tty_idle = int(extend.get("tty_idle", 1800))
+        self.tty_mode = extend.get("tty_mode", "process")
+        if self.tty_mode == "shared" and platform.system().lower() == "windows":
+            logger.warning("TTY-共享模式不支持Windows，改为每会话独立进程")
+            self.tty_mode = "process"
+        self.port_pool = PortLease(*PortLease.parse(extend.get("tty_ports", "7000-8000")))
+        # 共享模式：会话启动文件目录与共享ttyd端口 =======================
+        self.share_dir = os.path.join(
+            os.getcwd(), "DataSaving", f"ttyd-{hs_config.server_name}")
+        self.share_port = -1
+        # 空闲回收线程 ===================================================
+        self.reaper = None
+        self.reap_stop = threading.Event()
         # 根据系统获取ttyd可执行文件路径
         self.ttyd_path = self.path_tty()
 
@@ -50,102 +152,351 @@ class SSHTerminal:
             logger.warning(f"ttyd未找到: {ttyd_path}")
             return ""
 
+    # 获取sshpass路径（缓存结果，不再每次启动会话都执行which）############
+    @staticmethod
+    def path_pass() -> str:
+        if SSHTerminal.sshpass_path is None:
+            if platform.system().lower() == "windows":
+                sshpass_path = os.path.join(
+                    os.getcwd(), "HostConfig",
+                    "winptyexec", "sshpass.exe")
+                SSHTerminal.sshpass_path = \
+                    sshpass_path if os.path.exists(sshpass_path) else ""
+            else:  # linux / macos
+                SSHTerminal.sshpass_path = shutil.which("sshpass") or ""
+        return SSHTerminal.sshpass_path
+
+    # 获取SSH主连接套接字目录 ##########################################
+    # 使用当前用户私有的0700目录，避免其他本地用户在公共/tmp中抢先创建同名套接字
+    # :return: 目录路径，无法确保目录私有时返回""（不复用主连接）
+    # ###################################################################
+    @staticmethod
+    def path_ctrl() -> str:
+        if SSHTerminal.control_path is None:
+            ctrl_dir = os.path.join(os.path.expanduser("~"), ".ssh", "openidcs-ctl")
+            try:
+                os.makedirs(os.path.dirname(ctrl_dir), mode=0o700, exist_ok=True)
+                os.makedirs(ctrl_dir, mode=0o700, exist_ok=True)
+                os.chmod(ctrl_dir, 0o700)
+                if os.stat(ctrl_dir).st_uid != os.getuid():
+                    raise PermissionError("目录属于其他用户")
+                SSHTerminal.control_path = ctrl_dir
+            except OSError as e:
+                logger.warning(f"TTY-SSH主连接目录不可用，不复用主连接: {ctrl_dir} {e}")
+                SSHTerminal.control_path = ""
+        return SSHTerminal.control_path
+
+    # 构造 ssh 命令 #####################################################
+    def make_cmd(self, hs_conf: HSConfig, vm_port: str,
+                 vm_uuid: str, vm_type: str) -> str:
+        # 自动输入密码支持：检测 sshpass ================================
+        ssh_port = 22  # 固定为22，如需动态可在hs_conf增加字段
+        password = hs_conf.server_pass
+        auto_cmd = ""
+        sshpass_path = self.path_pass()
+        if sshpass_path:
+            if platform.system().lower() == "windows":
+                auto_cmd = f'"{sshpass_path}" -p "{password}"'
+            else:
+                auto_cmd = f"{shlex.quote(sshpass_path)} -p {shlex.quote(password)}"
+        # 构造 ssh 命令 ===================================================
+        ssh_cmd = "ssh -tt -o StrictHostKeyChecking=no"
+        # 同一主机的终端会话复用一条SSH主连接（Windows OpenSSH不支持）=====
+        # %C为连接参数的哈希，套接字路径长度固定
+        if platform.system().lower() != "windows" and self.path_ctrl():
+            ctrl_path = shlex.quote(os.path.join(self.path_ctrl(), "%C"))
+            ssh_cmd += (" -o ControlMaster=auto"
+                        f" -o ControlPath={ctrl_path}"
+                        f" -o ControlPersist={SSHDPool.idle}")
+        ssh_cmd += f" root@{hs_conf.server_addr}"
+        # 检查是否需要自动输入密码 ========================================
+        if (hs_conf.server_addr == "" or
+            hs_conf.server_pass == "") \
+                and auto_cmd != "":
+            ssh_cmd += f" -p {vm_port}"
+        else:  # 直接使用docker exec进入虚拟机内部 ------------------------
+            if vm_type == "docker":
+                ssh_cmd += f" -p {ssh_port} docker exec -it {vm_uuid} bash"
+            else:
+                ssh_cmd += f" -p {ssh_port} lxc exec {vm_uuid} bash"
+            if auto_cmd:
+                ssh_cmd = f"{auto_cmd} {ssh_cmd}"
+        return ssh_cmd
+
     # 启动 ttyd SSH会话 #################################################################
+    # 同一主机/虚拟机/用户已有存活会话时直接复用，不再启动新进程
     # :param hs_conf: 主机配置信息
     # :param vm_port: 远程SSHD端口
     # :param vm_uuid: 虚拟机的UUID
+    # :param user: 发起终端的用户（区分复用缓存）
     # :return: (port, token)
     # ###################################################################################
     def open_tty(self,
                  hs_conf: HSConfig,
                  vm_port: str,
                  vm_uuid: str,
-                 vm_type: str = "docker") -> tuple[int, str]:
+                 vm_type: str = "docker",
+                 user: str = "") -> tuple[int, str]:
         # 检查ttyd可执行文件是否存在 ====================================================
         if not self.ttyd_path:
             logger.error("ttyd可执行文件未找到")
             return -1, ""
-        # 生成随机端口和token ===========================================================
-        rand_port = random.randint(7000, 8000)
-        rand_pass = ''.join(random.sample(string.ascii_letters + string.digits, 32))
-        # 启动ttyd进程 ==================================================================
-        try:
-            # 自动输入密码支持：检测 sshpass ============================================
-            ssh_port = 22  # 固定为22，如需动态可在hs_conf增加字段
-            password = hs_conf.server_pass
-            auto_cmd = ""
-            if platform.system().lower() == "windows":
-                sshpass_path = os.path.join(
-                    os.getcwd(), "HostConfig",
-                    "winptyexec", "sshpass.exe")
-                if os.path.exists(sshpass_path):
-                    auto_cmd = f'"{sshpass_path}" -p "{password}"'
-            else:  # linux / macos
-                # 检查系统是否有 sshpass 命令
-                which_result = subprocess.run(
-                    ["which", "sshpass"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL)
-                if which_result.returncode == 0:
-                    auto_cmd = "sshpass -p '{}'".format(password)
-            # 构造 ssh 命令 ===============================================================
-            ssh_cmd = f"ssh -tt -o StrictHostKeyChecking=no root@{hs_conf.server_addr}"
-            # 检查是否需要自动输入密码 ====================================================
-            if (hs_conf.server_addr == "" or
-                hs_conf.server_pass == "") \
-                    and auto_cmd != "":
-                ssh_cmd += f" -p {vm_port}"
-            else:  # 直接使用docker exec进入虚拟机内部 ------------------------------------
-                if vm_type == "docker":
-                    ssh_cmd += f" -p {ssh_port} docker exec -it {vm_uuid} bash"
+        key = (hs_conf.server_addr, vm_uuid, vm_type, str(vm_port), user)
+        with self.lock:
+            # 复用已有会话 ==============================================================
+            token = self.ttyd_reuse.get(key)
+            if token is not None:
+                if self.tty_alive(token):
+                    session = self.ttyd_sessions[token]
+                    session["used"] = time.time()
+                    logger.info(f"TTY-复用会话 {session['port']} -> "
+                                f"{hs_conf.server_addr}:{vm_port}/{vm_uuid}")
+                    return session["port"], token
+                self.stop_token(token, "（进程已退出）")
+            # 生成token并启动会话 =======================================================
+            token = ''.join(random.sample(string.ascii_letters + string.digits, 32))
+            process = None
+            try:
+                ssh_cmd = self.make_cmd(hs_conf, vm_port, vm_uuid, vm_type)
+                if self.tty_mode == "shared":
+                    tty_port = self.open_share(token, ssh_cmd)
                 else:
-                    ssh_cmd += f" -p {ssh_port} lxc exec {vm_uuid} bash"
-                if auto_cmd:
-                    ssh_cmd = f"{auto_cmd} {ssh_cmd}"
-            # 启动ttyd进程 ================================================================
-            tty_cmd = [self.ttyd_path, "--writable", "-w",
-                       "C:\\" if platform.system().lower() == "windows" else "/",
-                       "-p", str(rand_port), ssh_cmd]
-            tty_cmd = " ".join(tty_cmd)  # 重要！！否则无法正常启动
-            logger.info(f"TTY-启动命令: {' '.join(tty_cmd)}")
-            # 启动ttyd进程 ================================================================
+                    tty_port, process = self.open_proc(ssh_cmd)
+            except Exception as e:
+                logger.error(f"TTY-启动失败: {str(e)}")
+                return -1, ""
+            if tty_port <= 0:
+                return -1, ""
+            now = time.time()
+            self.ttyd_sessions[token] = {
+                "port": tty_port, "key": key, "process": process,
+                "opened": now, "used": now}
+            self.ttyd_reuse[key] = token
+            self.reap_init()
+        logger.info(
+            f"TTY-启动成功 " +
+            f"{tty_port} -> {hs_conf.server_addr}:{vm_port}/{vm_uuid}")
+        return tty_port, token
+
+    # 启动ttyd进程并等待端口就绪 ########################################
+    # 端口被抢占或ttyd启动失败时隔离该端口并换一个端口重试
+    # :param command: ttyd执行的命令
+    # :param options: 附加的ttyd参数
+    # :return: (port, process)，失败返回(-1, None)
+    # ###################################################################
+    def open_ttyd(self, command: list[str], options: list[str] = None):
+        is_windows = platform.system().lower() == "windows"
+        for _ in range(3):
+            tty_port = self.port_pool.lease()
+            if tty_port <= 0:
+                logger.error("TTY-端口池已耗尽")
+                return -1, None
+            tty_cmd = [self.ttyd_path, "--writable", *(options or []), "-w",
+                       "C:\\" if is_windows else "/",
+                       "-p", str(tty_port)]
+            if is_windows:
+                tty_cmd = " ".join(tty_cmd + command)  # 重要！！否则无法正常启动
+            else:
+                tty_cmd += command
+            logger.info(f"TTY-启动ttyd: 端口{tty_port}")
             process = subprocess.Popen(
                 tty_cmd,
-                # shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                encoding='gbk',  # Windows中文系统常用编码
-                errors='replace',  # 替换无法解码的字符
-                text=True,
-            )
-            # 存储进程信息
-            self.ttyd_processes[rand_port] = process
-            self.ttyd_tokens[rand_port] = rand_pass
-            logger.info(
-                f"TTY-启动成功 " +
-                f"{rand_port} -> {hs_conf.server_addr}:{vm_port}/{vm_uuid}")
-            return rand_port, rand_pass
-        except Exception as e:
-            logger.error(f"TTY-启动失败: {str(e)}")
-            return -1, ""
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+            if self.wait_port(tty_port, process):
+                self.ttyd_processes[tty_port] = process
+                return tty_port, process
+            logger.warning(f"TTY-端口{tty_port}上ttyd未能启动，更换端口重试")
+            self.kill_proc(process)
+            self.port_pool.release(tty_port, broken=True)
+        return -1, None
+
+    # 等待ttyd开始监听 ==================================================
+    @staticmethod
+    def wait_port(port: int, process, timeout: float = 3) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                return False
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.2).close()
+                return True
+            except OSError:
+                time.sleep(0.05)
+        return False
+
+    # 结束进程 ==========================================================
+    @staticmethod
+    def kill_proc(process):
+        try:
+            process.terminate()
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    # 独立模式：每个会话一个ttyd进程 ####################################
+    def open_proc(self, ssh_cmd: str):
+        if platform.system().lower() == "windows":
+            return self.open_ttyd([ssh_cmd])
+        return self.open_ttyd(["sh", "-c", ssh_cmd])
+
+    # 共享模式：所有会话共用一个ttyd进程 ################################
+    # ttyd以--url-arg启动，浏览器连接时的?arg=<token>（由代理路由注入）
+    # 作为启动脚本参数，脚本按token执行会话目录中对应的ssh命令，
+    # 并记录终端进程ID，用于判断会话是否有客户端连接以及关闭会话
+    # :return: 共享ttyd端口，失败返回-1
+    # ###################################################################
+    def open_share(self, token: str, ssh_cmd: str) -> int:
+        os.makedirs(self.share_dir, exist_ok=True)
+        path = os.path.join(self.share_dir, token)
+        with open(path, "w") as f:
+            f.write(f"exec {ssh_cmd}\n")
+        os.chmod(path, 0o600)  # 含主机密码
+        if not self.share_alive():
+            # 共享ttyd已退出：归还旧端口后在新端口上重新启动
+            if self.ttyd_processes.pop(self.share_port, None) is not None:
+                self.port_pool.release(self.share_port)
+            script = (
+                'case "$1" in ""|*[!A-Za-z0-9]*) echo "invalid session"; exit 1;; esac; '
+                f'f={shlex.quote(self.share_dir)}/"$1"; '
+                '[ -f "$f" ] || { echo "session expired"; exit 1; }; '
+                'echo $$ >> "$f.pids"; exec sh "$f"')
+            self.share_port, _ = self.open_ttyd(
+                ["sh", "-c", script, "ttyd-share"], ["--url-arg"])
+            if self.share_port <= 0:
+                os.remove(path)
+        return self.share_port
+
+    # 共享ttyd进程是否存活 ==============================================
+    def share_alive(self) -> bool:
+        process = self.ttyd_processes.get(self.share_port)
+        return process is not None and process.poll() is None
+
+    # 共享模式下会话的存活终端进程 ======================================
+    def share_pids(self, token: str) -> list[int]:
+        try:
+            with open(os.path.join(self.share_dir, token + ".pids")) as f:
+                pids = [int(line) for line in f if line.strip().isdigit()]
+        except OSError:
+            return []
+        return [pid for pid in pids if psutil.pid_exists(pid)]
+
+    # 会话进程是否存活 ==================================================
+    def tty_alive(self, token: str) -> bool:
+        session = self.ttyd_sessions.get(token)
+        if session is None:
+            return False
+        if session["process"] is not None:
+            return session["process"].poll() is None
+        return self.share_alive() and \
+            os.path.exists(os.path.join(self.share_dir, token))
+
+    # 会话是否有客户端连接（ttyd为每个连接启动一个终端子进程）============
+    def tty_busy(self, token: str) -> bool:
+        session = self.ttyd_sessions[token]
+        if session["process"] is None:
+            return bool(self.share_pids(token))
+        try:
+            return bool(psutil.Process(session["process"].pid).children())
+        except psutil.Error:
+            return False
 
     # 停止 ttyd 会话 #####################################################
-    def stop_tty(self, port: int):
+    def stop_tty(self, port: int, token: str = None):
         """
-        停止指定端口的ttyd进程
+        停止ttyd会话
         :param port: ttyd进程监听的端口
+        :param token: 会话token，为空时停止该端口上的全部会话
         """
-        if port in self.ttyd_processes:
-            process = None
-            try:
-                process = self.ttyd_processes[port]
-                process.terminate()
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                if process:
-                    process.kill()
-            finally:
-                del self.ttyd_processes[port]
-                if port in self.ttyd_tokens:
-                    del self.ttyd_tokens[port]
+        with self.lock:
+            if token is not None:
+                self.stop_token(token)
+                return
+            tokens = [t for t, s in self.ttyd_sessions.items() if s["port"] == port]
+            for t in tokens:
+                self.stop_token(t)
+            if not tokens and port in self.ttyd_processes:
+                self.kill_proc(self.ttyd_processes.pop(port))
+                self.port_pool.release(port)
                 logger.info(f"已停止端口{port}上ttyd会话")
+
+    # 按token停止会话 ===================================================
+    def stop_token(self, token: str, reason: str = ""):
+        with self.lock:
+            session = self.ttyd_sessions.pop(token, None)
+            if session is None:
+                return
+            if self.ttyd_reuse.get(session["key"]) == token:
+                del self.ttyd_reuse[session["key"]]
+            tty_port = session["port"]
+            if session["process"] is not None:
+                self.kill_proc(session["process"])
+                self.ttyd_processes.pop(tty_port, None)
+                self.port_pool.release(tty_port)
+            else:
+                # 终端进程为会话首进程，按进程组结束（含sshpass/ssh子进程）
+                for pid in self.share_pids(token):
+                    try:
+                        os.killpg(pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+                for name in (token, token + ".pids"):
+                    try:
+                        os.remove(os.path.join(self.share_dir, name))
+                    except OSError:
+                        pass
+        if self.on_close is not None:
+            try:
+                self.on_close(token)
+            except Exception as e:
+                logger.warning(f"TTY-会话关闭回调失败: {str(e)}")
+        logger.info(f"已停止端口{tty_port}上ttyd会话{reason}")
+
+    # 停止全部会话及共享ttyd进程 ########################################
+    def stop_all(self):
+        self.reap_stop.set()
+        with self.lock:
+            for token in list(self.ttyd_sessions):
+                self.stop_token(token)
+            for tty_port, process in list(self.ttyd_processes.items()):
+                self.kill_proc(process)
+                self.port_pool.release(tty_port)
+            self.ttyd_processes.clear()
+            self.share_port = -1
+
+    # 启动空闲回收线程 ==================================================
+    def reap_init(self):
+        if self.reaper is not None and self.reaper.is_alive():
+            return
+        self.reap_stop.clear()
+        self.reaper = threading.Thread(
+            target=self.reap_loop, daemon=True,
+            name=f"ttyd-reap-{self.hs_config.server_name}")
+        self.reaper.start()
+
+    def reap_loop(self):
+        interval = max(5, min(60, self.tty_idle // 4)) if self.tty_idle else 60
+        while not self.reap_stop.wait(interval):
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logger.warning(f"TTY-空闲回收失败: {str(e)}")
+
+    # 回收会话 ###########################################################
+    # 进程已退出的会话立即清理；无客户端连接超过tty_idle秒的会话关闭
+    # :return: 已关闭的token列表
+    # ###################################################################
+    def reap_idle(self) -> list[str]:
+        now = time.time()
+        closed = []
+        with self.lock:
+            for token, session in list(self.ttyd_sessions.items()):
+                if not self.tty_alive(token):
+                    self.stop_token(token, "（进程已退出）")
+                    closed.append(token)
+                elif self.tty_busy(token):
+                    session["used"] = now
+                elif self.tty_idle and now - session["used"] > self.tty_idle:
+                    self.stop_token(token, "（空闲回收）")
+                    closed.append(token)
+        return closed
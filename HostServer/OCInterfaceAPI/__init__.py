@@ -1,5 +1,6 @@
 from .OCIConnects import OCIConnects
 from .IPTablesAPI import IPTablesAPI
 from .SSHTerminal import SSHTerminal
+from .CGroupStats import CGroupStats
 
-__all__ = ['OCIConnects', 'IPTablesAPI', 'SSHTerminal']
\ No newline at end of file
+__all__ = ['OCIConnects', 'IPTablesAPI', 'SSHTerminal', 'CGroupStats']
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+CGroupStats 测试脚本
+在临时目录中伪造 cgroup v2 目录树（cpu.stat、memory.*、io.stat、cgroup.procs）
+和 /proc/<pid>/net/dev，验证容器目录查找、两次采集之间的CPU使用率、带宽、
+本周期流量与磁盘IO，以及计数器重置和已删除容器的处理
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from HostServer.OCInterfaceAPI.CGroupStats import CGroupStats
+
+MB = 1024 * 1024
+
+
+class FakeTree:
+    """临时的cgroup v2与/proc目录树"""
+
+    def __init__(self, path: str):
+        self.cg_root = os.path.join(path, "cgroup")
+        self.proc_root = os.path.join(path, "proc")
+        os.makedirs(self.cg_root)
+        self.write(os.path.join(self.cg_root, "cgroup.controllers"), "cpu io memory")
+        self.write(os.path.join(self.proc_root, "meminfo"), "MemTotal:  8388608 kB\n")
+
+    @staticmethod
+    def write(path: str, text: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+
+    # 写入一个容器的累计计数（进程位于叶子节点init.scope中）=====================
+    def container(self, relative: str, pid: int, cpu_usec: int, mem: int,
+                  rbytes: int, wbytes: int, rx: int, tx: int, cpu_max="max 100000"):
+        path = os.path.join(self.cg_root, relative)
+        self.write(os.path.join(path, "cpu.stat"), f"usage_usec {cpu_usec}\nuser_usec 0\n")
+        self.write(os.path.join(path, "cpu.max"), cpu_max)
+        self.write(os.path.join(path, "memory.current"), str(mem))
+        self.write(os.path.join(path, "memory.max"), "max")
+        self.write(os.path.join(path, "io.stat"),
+                   f"8:0 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1\n"
+                   f"8:16 rbytes=0 wbytes=0 rios=0 wios=0\n")
+        self.write(os.path.join(path, "cgroup.procs"), "")
+        self.write(os.path.join(path, "init.scope", "cgroup.procs"), f"{pid}\n")
+        self.write(os.path.join(self.proc_root, str(pid), "net", "dev"),
+                   "Inter-|   Receive                  |  Transmit\n"
+                   " face |bytes packets errs drop fifo frame compressed multicast|"
+                   "bytes packets errs drop fifo colls carrier compressed\n"
+                   f"    lo: 999999 10 0 0 0 0 0 0 999999 10 0 0 0 0 0 0\n"
+                   f"  eth0: {rx} 100 0 0 0 0 0 0 {tx} 100 0 0 0 0 0 0\n")
+
+
+def test_docker_deltas():
+    """Docker容器：第一次采集只有累计值，第二次按差值计算速率和本周期IO"""
+    with tempfile.TemporaryDirectory() as path:
+        tree = FakeTree(path)
+        stats = CGroupStats(tree.cg_root, tree.proc_root)
+        assert stats.available()
+        relative = "system.slice/docker-abc123.scope"
+        tree.container(relative, 4242, cpu_usec=1_000_000, mem=256 * MB,
+                       rbytes=100 * MB, wbytes=50 * MB, rx=10 * MB, tx=5 * MB,
+                       cpu_max="200000 100000")
+        first = stats.docker_status({"web": "abc123"}, now=1000.0)["web"]
+        assert first.cpu_total == 2 and first.mem_usage == 256 and first.mem_total == 8192
+        assert first.cpu_usage == 0 and first.hdd_usage == 0 and first.flu_usage == 0
+        # 10秒内：CPU 5秒（50%）、读写30MB、收20MB发10MB ========================
+        tree.container(relative, 4242, cpu_usec=6_000_000, mem=300 * MB,
+                       rbytes=120 * MB, wbytes=60 * MB, rx=30 * MB, tx=15 * MB,
+                       cpu_max="200000 100000")
+        second = stats.docker_status({"web": "abc123"}, now=1010.0)["web"]
+        assert second.cpu_usage == 50, second.cpu_usage
+        assert second.hdd_usage == 30, second.hdd_usage
+        assert second.flu_usage == 30, second.flu_usage
+        assert second.network_d == 16 and second.network_u == 8, \
+            (second.network_d, second.network_u)
+        assert second.mem_usage == 300
+        print("✅ CPU使用率、带宽、本周期流量和磁盘IO按差值计算")
+
+
+def test_counter_reset_and_prune():
+    """容器重启后计数器变小时跳过本次速率，已删除容器的历史被清理"""
+    with tempfile.TemporaryDirectory() as path:
+        tree = FakeTree(path)
+        stats = CGroupStats(tree.cg_root, tree.proc_root)
+        tree.container("lxc.payload.c1", 5001, cpu_usec=9_000_000, mem=MB,
+                       rbytes=500 * MB, wbytes=0, rx=50 * MB, tx=50 * MB)
+        tree.container("lxc.payload.c2", 5002, cpu_usec=0, mem=MB,
+                       rbytes=0, wbytes=0, rx=0, tx=0)
+        stats.lxc_status(["c1", "c2"], now=2000.0)
+        tree.container("lxc.payload.c1", 5001, cpu_usec=1_000_000, mem=MB,
+                       rbytes=2 * MB, wbytes=0, rx=MB, tx=MB)
+        result = stats.lxc_status(["c1", "missing"], now=2010.0)
+        assert set(result) == {"c1"}, result
+        status = result["c1"]
+        assert status.cpu_usage == 0 and status.hdd_usage == 0 and status.flu_usage == 0
+        assert set(stats.samples) == {"c1"}, stats.samples
+        # 重置后的采集作为新的基准
+        tree.container("lxc.payload.c1", 5001, cpu_usec=2_000_000, mem=MB,
+                       rbytes=12 * MB, wbytes=0, rx=MB, tx=MB)
+        status = stats.lxc_status(["c1"], now=2020.0)["c1"]
+        assert status.cpu_usage == 10 and status.hdd_usage == 10, \
+            (status.cpu_usage, status.hdd_usage)
+        print("✅ 计数器重置时跳过速率，已删除容器的历史被清理")
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("CGroupStats 容器状态采集测试")
+    print("=" * 60)
+    test_docker_deltas()
+    test_counter_reset_and_prune()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+IPTablesAPI 测试脚本
+使用伪造的 iptables-save 输出（含旧版直接写入 PREROUTING/FORWARD 的映射），
+验证旧版映射计入端口列表，并在整体重写时迁入专用链而不是被删除
+"""
+
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from MainObject.Config.HSConfig import HSConfig
+from HostServer.OCInterfaceAPI.IPTablesAPI import IPTablesAPI
+
+# 旧版规则：映射直接写在PREROUTING/FORWARD中，尚无专用链
+LEGACY_SAVE = """# Generated by iptables-save
+*nat
+:PREROUTING ACCEPT [0:0]
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A PREROUTING -p tcp -m tcp --dport 30001 -m comment --comment "10.0.0.2-30001-22#vm-a" -j DNAT --to-destination 10.0.0.2:22
+-A PREROUTING -p tcp -m tcp --dport 30002 -m comment --comment "10.0.0.3-30002-80#vm-b" -j DNAT --to-destination 10.0.0.3:80
+-A POSTROUTING -s 10.0.0.0/24 -j MASQUERADE
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A FORWARD -d 10.0.0.2/32 -p tcp -m tcp --dport 22 -m comment --comment "10.0.0.2-30001-22#vm-a" -j ACCEPT
+-A FORWARD -d 10.0.0.3/32 -p tcp -m tcp --dport 80 -m comment --comment "10.0.0.3-30002-80#vm-b" -j ACCEPT
+COMMIT
+"""
+
+
+class FakeIPTables(IPTablesAPI):
+    """以固定的iptables-save输出代替真实命令，记录提交的restore事务"""
+
+    def __init__(self, save_output: str):
+        super().__init__(HSConfig(server_name="iptables-test"), backend="iptables")
+        self.save_output = save_output
+        self.scripts = []
+
+    def execute_command(self, cmd: str, is_remote: bool = False,
+                        stdin: str = None) -> tuple[bool, str, str]:
+        if cmd == self.SAVE_CMD:
+            return True, self.save_output, ""
+        self.scripts.append(stdin)
+        return True, "", ""
+
+
+def test_legacy_listed():
+    """旧版映射计入端口列表与端口占用检查"""
+    api = FakeIPTables(LEGACY_SAVE)
+    ports = {(rule.wan_port, rule.lan_addr, rule.lan_port, rule.vm_name)
+             for rule in api.list_ports()}
+    assert ports == {(30001, "10.0.0.2", 22, "vm-a"), (30002, "10.0.0.3", 80, "vm-b")}, ports
+    assert api.get_host_ports() == {30001, 30002}
+    print("✅ 旧版映射已计入端口列表")
+
+
+def test_legacy_migrated_on_add():
+    """添加一条映射时整体重写，旧版映射迁入专用链"""
+    api = FakeIPTables(LEGACY_SAVE)
+    success, error = api.add_port_forward("10.0.0.9", 80, 30009)
+    assert success, error
+    script = api.scripts[-1]
+    for port in (30001, 30002, 30009):
+        assert f"-A {api.CHAIN_NAT} -p tcp -m tcp --dport {port} " in script, port
+    assert f"-I PREROUTING 1 -j {api.CHAIN_NAT}" in script
+    assert script.count("-D PREROUTING") == 2 and script.count("-D FORWARD") == 2
+    assert '--comment "10.0.0.2-30001-22#vm-a"' in script
+    print("✅ 旧版映射在整体重写时迁入专用链")
+
+
+def test_legacy_remove():
+    """删除旧版映射时仅移除该映射，其余旧版映射保留"""
+    api = FakeIPTables(LEGACY_SAVE)
+    assert api.remove_port_forward(30001)
+    script = api.scripts[-1]
+    added = [line for line in script.splitlines() if line.startswith("-A ")]
+    assert not any("--dport 30001 " in line for line in added), added
+    assert script.count("-D PREROUTING") == 2
+    assert f"-A {api.CHAIN_NAT} -p tcp -m tcp --dport 30002 " in script
+    print("✅ 删除旧版映射时其余映射保留")
+
+
+def test_dedicated_chain_wins():
+    """专用链与旧版规则端口相同时以专用链为准"""
+    save = LEGACY_SAVE.replace(
+        ":POSTROUTING ACCEPT [0:0]\n",
+        ":POSTROUTING ACCEPT [0:0]\n:OPENIDCS-DNAT - [0:0]\n"
+        "-A OPENIDCS-DNAT -p tcp -m tcp --dport 30001 -m comment "
+        "--comment \"10.0.0.7-30001-22#vm-c\" -j DNAT --to-destination 10.0.0.7:22\n")
+    rules = {rule.wan_port: rule for rule in FakeIPTables(save).list_ports()}
+    assert rules[30001].lan_addr == "10.0.0.7" and rules[30002].lan_addr == "10.0.0.3"
+    print("✅ 专用链映射优先于旧版映射")
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("IPTablesAPI 旧版规则迁移测试")
+    print("=" * 60)
+    test_legacy_listed()
+    test_legacy_migrated_on_add()
+    test_legacy_remove()
+    test_dedicated_chain_wins()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,14 @@ import os
 import time
 import shutil
 import datetime
-import paramiko
 import traceback
 from loguru import logger
 from copy import deepcopy
 from proxmoxer import ProxmoxAPI
 from typing import Optional, Tuple
 from HostServer.BasicServer import BasicServer
+from HostModule.SSHDManager import SSHDPool
+from HostServer.ProxmoxQemuAPI import PVEInventory, PVEMetrics
 from MainObject.Config.HSConfig import HSConfig
 from MainObject.Config.IMConfig import IMConfig
 from MainObject.Config.SDConfig import SDConfig
@@ -26,6 +27,16 @@ class HostServer(BasicServer):
         super().__load__(**kwargs)
         # Proxmox 客户端连接
         self.proxmox = None
+        # 电源状态订阅使用的 VMID -> vm_uuid 映射
+        self.power_vmids: dict[str, str] = {}
+        # 集群虚拟机清单缓存
+        self.inventory = PVEInventory(
+            self.inventory_fetch, node=self.hs_config.launch_path,
+            ttl=int(self.hs_config.extend_data.get("inventory_ttl", 10)))
+        # 虚拟机性能采集
+        self.metrics = PVEMetrics(
+            self.inventory, self.api_get,
+            workers=int(self.hs_config.extend_data.get("stats_workers", 4)))
 
     # 连接到 Proxmox 服务器 ####################################################
     def api_conn(self) -> Tuple[Optional[ProxmoxAPI], ZMessage]:
@@ -57,28 +68,36 @@ class HostServer(BasicServer):
                 success=False, action="_connect_proxmox",
                 message=f"Failed to connect to Proxmox: {str(e)}")
 
+    # 发送GET请求 ##############################################################
+    # :param path: API路径，如 cluster/resources
+    ###########################################################################
+    def api_get(self, path: str, **params):
+        client, result = self.api_conn()
+        if not result.success:
+            raise ConnectionError(result.message)
+        return client.get(path, **params)
+
+    # 获取共享SSH连接 #########################################################
+    # qm/qemu-img等命令和截图下载复用同一条Transport
+    ###########################################################################
+    def ssh_pool(self) -> SSHDPool:
+        return SSHDPool.shared(
+            self.hs_config.server_addr,
+            self.hs_config.server_user,
+            self.hs_config.server_pass)
+
+    # 获取集群虚拟机资源 #######################################################
+    def inventory_fetch(self) -> list:
+        return self.api_get("cluster/resources", type="vm")
+
     # 分配新的VMID #############################################################
     def new_vmid(self) -> int:
         """分配新的VMID"""
         try:
-            # 连接Proxmox API ==================================================
-            client, result = self.api_conn()
-            if not result.success:
-                logger.warning("无法连接Proxmox，使用默认VMID 100")
-                return 100  # 默认起始VMID
-            
-            # 获取所有现有的VMID ===============================================
-            vms = client.nodes(self.hs_config.launch_path).qemu.get()
-            now_vmid = [vm['vmid'] for vm in vms]
-            
-            # 从100开始查找可用的VMID ===========================================
-            vmid = 100
-            while vmid in now_vmid:
-                vmid += 1
-            
+            # 从集群清单中查找可用的VMID（包含其他节点和LXC）==================
+            vmid = self.inventory.new_vmid()
             logger.info(f"分配新VMID: {vmid}")
             return vmid
-            
         except Exception as e:
             logger.error(f"分配VMID失败: {str(e)}")
             traceback.print_exc()
@@ -92,26 +111,17 @@ class HostServer(BasicServer):
                 cached_vmid = vm_conf.vm_data['vmid']
                 if cached_vmid:
                     return cached_vmid
-
-            # 如果配置中没有，从API获取
-            client, result = self.api_conn()
-            if not result.success or not client:
-                logger.error(f"无法连接到Proxmox获取VMID: {result.message}")
-                return None
             # 获取虚拟机名称（处理下划线转横线的情况）
             vm_name = vm_conf.vm_uuid.replace('_', '-')
-            # 从API获取所有虚拟机列表
-            vms = client.nodes(self.hs_config.launch_path).qemu.get()
-            # 查找匹配的虚拟机
-            for vm in vms:
-                if vm['name'] == vm_name:
-                    vmid = vm['vmid']
-                    # 缓存到配置中
-                    if not hasattr(vm_conf, 'vm_data'):
-                        vm_conf.vm_data = {}
-                    vm_conf.vm_data['vmid'] = vmid
-                    logger.debug(f"从API获取到虚拟机 {vm_name} 的VMID: {vmid}")
-                    return vmid
+            # 从集群清单中查找
+            vmid = self.inventory.get_vmid(vm_name)
+            if vmid is not None:
+                # 缓存到配置中
+                if not hasattr(vm_conf, 'vm_data'):
+                    vm_conf.vm_data = {}
+                vm_conf.vm_data['vmid'] = vmid
+                logger.debug(f"从清单获取到虚拟机 {vm_name} 的VMID: {vmid}")
+                return vmid
             logger.warning(f"未找到虚拟机 {vm_name} 的VMID")
             return None
         except Exception as e:
@@ -212,7 +222,18 @@ class HostServer(BasicServer):
                 # 保存状态 =====================================================
                 self.host_set(hw_status)
                 logger.debug(f"[{self.hs_config.server_name}] Proxmox主机状态已更新")
-                
+
+            # 采集本节点虚拟机状态并批量保存 ===================================
+            names = {vm_uuid.replace('_', '-'): vm_uuid
+                     for vm_uuid in self.vm_saving}
+            vm_status = self.metrics.collect(self.hs_config.launch_path, names)
+            if vm_status and self.save_data and self.hs_config.server_name:
+                if self.save_data.add_vm_status_batch(
+                        self.hs_config.server_name, vm_status):
+                    logger.debug(f"[{self.hs_config.server_name}] {len(vm_status)} 个虚拟机状态已保存")
+                else:
+                    logger.warning(f"[{self.hs_config.server_name}] 虚拟机状态批量保存失败")
+
         except Exception as e:
             logger.error(f"Crontabs执行失败: {str(e)}")
             traceback.print_exc()
@@ -284,10 +305,74 @@ class HostServer(BasicServer):
 
     # 卸载宿主机 ###############################################################
     def HSUnload(self) -> ZMessage:
+        self.power_exit()
         # 断开 Proxmox 连接
         self.proxmox = None
         return super().HSUnload()
 
+    # 电源事件订阅 #############################################################
+    # PVE没有推送接口，每power_poll秒一次调用 /cluster/tasks 获取全集群任务
+    # 只处理订阅开始后成功结束的电源任务
+    ###########################################################################
+    power_actions = {
+        "qmstart": VMPowers.STARTED,
+        "qmresume": VMPowers.STARTED,
+        "qmreboot": VMPowers.STARTED,
+        "qmreset": VMPowers.STARTED,
+        "qmsuspend": VMPowers.SUSPEND,
+        "qmpause": VMPowers.SUSPEND,
+        "qmstop": VMPowers.STOPPED,
+        "qmshutdown": VMPowers.STOPPED,
+        "qmdestroy": None,
+    }
+
+    def power_event(self, update, stopping) -> None:
+        client, result = self.api_conn()
+        if not result.success:
+            raise ConnectionError(result.message)
+        interval = float(self.hs_config.extend_data.get("power_poll", 5))
+        since = int(time.time())
+        seen = set()
+        while not stopping.wait(interval):
+            vmids = dict(self.power_vmids)
+            for vm_uuid, vm_conf in self.vm_saving.items():
+                vmid = (getattr(vm_conf, 'vm_data', None) or {}).get('vmid')
+                if vmid:
+                    vmids[str(vmid)] = vm_uuid
+            tasks = client.cluster.tasks.get()
+            for task in sorted(tasks, key=lambda t: t.get("endtime", 0)):
+                upid = task.get("upid")
+                if not task.get("endtime") or task["endtime"] < since \
+                        or upid in seen:
+                    continue
+                seen.add(upid)
+                action = task.get("type")
+                vm_uuid = vmids.get(str(task.get("id")))
+                if task.get("status") == "OK" and vm_uuid \
+                        and action in self.power_actions:
+                    update(vm_uuid, self.power_actions[action])
+            # 只保留仍在任务列表中的记录
+            seen &= {task.get("upid") for task in tasks}
+
+    # 电源状态对账 #############################################################
+    def power_check(self) -> dict[str, VMPowers] | None:
+        if not self.inventory.refresh(force=True):
+            return None
+        names = {vm_uuid.replace('_', '-'): vm_uuid
+                 for vm_uuid in self.vm_saving}
+        states, vmids = {}, {}
+        for vm in self.inventory.vms():
+            vm_uuid = names.get(vm.get("name"))
+            if not vm_uuid:
+                continue
+            vmids[str(vm.get("vmid"))] = vm_uuid
+            states[vm_uuid] = {
+                "running": VMPowers.STARTED,
+                "stopped": VMPowers.STOPPED,
+            }.get(vm.get("status"), VMPowers.UNKNOWN)
+        self.power_vmids = vmids
+        return states
+
     # 虚拟机扫描 ###############################################################
     def VMDetect(self) -> ZMessage:
         """扫描并发现虚拟机"""
@@ -297,8 +382,8 @@ class HostServer(BasicServer):
             if not result.success:
                 return result
 
-            # 获取所有虚拟机列表 ===============================================
-            vms = client.nodes(self.hs_config.launch_path).qemu.get()
+            # 获取本节点虚拟机列表（使用清单缓存，过期时刷新）===============
+            vms = self.inventory.vms(node=self.hs_config.launch_path)
 
             # 使用主机配置的filter_name作为前缀过滤 ===========================
             filter_prefix = self.hs_config.filter_name if self.hs_config else ""
@@ -400,8 +485,20 @@ class HostServer(BasicServer):
             }
             # 配置网卡 ------------------------------------------
             config.update(self.net_conf(vm_conf))
-            # 创建虚拟机 --------------------------------------------
-            client.nodes(self.hs_config.launch_path).qemu.create(**config)
+            # 创建虚拟机（VMID已被占用时刷新清单后重新分配）---------
+            for attempt in range(3):
+                try:
+                    client.nodes(self.hs_config.launch_path).qemu.create(**config)
+                    break
+                except Exception as e:
+                    if attempt == 2 or "already exists" not in str(e):
+                        raise
+                    logger.warning(f"VMID {vm_vmid} 已被占用，重新分配: {e}")
+                    self.inventory.conflict(vm_vmid)
+                    vm_vmid = self.new_vmid()
+                    config['vmid'] = vm_vmid
+                    vm_conf.vm_data['vmid'] = vm_vmid
+            self.inventory.invalidate()
             logger.info(f"虚拟机 {vm_conf.vm_uuid} 创建成功")
             # 配置路由器绑定（iKuai层面）----------------------------
             ikuai_result = super().IPBinder(vm_conf, True)
@@ -456,32 +553,20 @@ class HostServer(BasicServer):
             if self.web_flag():
                 # 远程模式：src_file 是远程服务器上的路径，使用 posixpath.join
                 src_file = posixpath.join(self.hs_config.images_path, vm_conf.os_name)
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(
-                    self.hs_config.server_addr,
-                    username=self.hs_config.server_user,
-                    password=self.hs_config.server_pass)
+                ssh = self.ssh_pool()
                 # 检查远程镜像文件是否存在
-                stdin, stdout, stderr = ssh.exec_command(f"test -f {src_file} && echo 'exists' || echo 'not_exists'")
-                file_check = stdout.read().decode().strip()
-                if file_check != 'exists':
-                    ssh.close()
+                file_check, _, error_msg = ssh.execute(f"test -f {src_file}")
+                if not file_check:
                     return ZMessage(
                         success=False, action="VInstall",
-                        message=f"镜像文件不存在: {src_file}")
+                        message=f"镜像文件不存在: {src_file} {error_msg}".strip())
                 # 在远程服务器上复制镜像文件
-                ssh.exec_command(f"mkdir -p {vm_disk_dir}")
-                copy_cmd = f"cp {src_file} {dest_image}"
-                stdin, stdout, stderr = ssh.exec_command(copy_cmd)
-                exit_status = stdout.channel.recv_exit_status()
-                if exit_status != 0:
-                    error_msg = stderr.read().decode()
-                    ssh.close()
+                copy_cmd = f"mkdir -p {vm_disk_dir} && cp {src_file} {dest_image}"
+                success, _, error_msg = ssh.execute(copy_cmd, timeout=3600)
+                if not success:
                     return ZMessage(
                         success=False, action="VInstall",
                         message=f"复制镜像失败: {error_msg}")
-                ssh.close()
                 logger.info(f"通过SSH复制镜像: {src_file} -> {dest_image}")
             # 本地复制 ==========================================================
             else:
@@ -609,6 +694,7 @@ class HostServer(BasicServer):
             
             # 删除虚拟机（会自动删除网卡配置）==================================
             vm.delete()
+            self.inventory.invalidate()
             logger.info(f"虚拟机 {vm_name} (VMID: {vm_vmid}) 删除成功")
             
             # 通用操作 =========================================================
@@ -944,29 +1030,18 @@ class HostServer(BasicServer):
             # 远程模式 =========================================================
             if self.web_flag():
                 # 远程模式：通过SSH创建qcow2文件
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(
-                    self.hs_config.server_addr,
-                    username=self.hs_config.server_user,
-                    password=self.hs_config.server_pass)
+                ssh = self.ssh_pool()
 
-                # 创建目录 =====================================================
-                ssh.exec_command(f"mkdir -p {disk_dir}")
+                # 创建目录和qcow2文件 ==========================================
+                create_cmd = (f"mkdir -p {disk_dir} && "
+                              f"qemu-img create -f qcow2 {disk_dir}/{disk_name} {disk_size}")
+                success, _, error_msg = ssh.execute(create_cmd)
 
-                # 创建qcow2文件 ================================================
-                create_cmd = f"qemu-img create -f qcow2 {disk_dir}/{disk_name} {disk_size}"
-                stdin, stdout, stderr = ssh.exec_command(create_cmd)
-                exit_status = stdout.channel.recv_exit_status()
-
-                if exit_status != 0:
-                    error_msg = stderr.read().decode()
-                    ssh.close()
+                if not success:
                     return ZMessage(
                         success=False, action="CreateQcow2",
                         message=f"创建qcow2文件失败: {error_msg}")
 
-                ssh.close()
                 logger.info(f"通过SSH创建qcow2文件: {disk_dir}/{disk_name}, 大小: {disk_size}")
 
             # 本地模式 =========================================================
@@ -1149,7 +1224,8 @@ class HostServer(BasicServer):
                 message=f"ISO镜像挂载操作失败: {str(e)}")
 
     # 虚拟机控制台 #############################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         try:
             # 获取虚拟机连接 ===================================================
             vm_conn, vmid, vm_conf, result = self._get_vm_connection(vm_uuid)
@@ -1278,24 +1354,15 @@ class HostServer(BasicServer):
             logger.info(f"准备移动磁盘: 从VM {src_vmid}({source_disk}) "
                         f"到VM {dst_vmid}({target_disk})")
             # 通过SSH执行qm move-disk命令 ======================================
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(
-                self.hs_config.server_addr,
-                username=self.hs_config.server_user,
-                password=self.hs_config.server_pass)
+            ssh = self.ssh_pool()
             # 执行qm move-disk命令 =============================================
             move_cmd = (
                 f"qm move-disk {src_vmid} {source_disk} "
                 f"--target-vmid {dst_vmid} --target-disk {target_disk}"
             )
             logger.info(f"执行命令: {move_cmd}")
-            stdin, stdout, stderr = ssh.exec_command(move_cmd)
-            exit_status = stdout.channel.recv_exit_status()
-            output = stdout.read().decode()
-            error_output = stderr.read().decode()
-            ssh.close()
-            if exit_status != 0:
+            success, output, error_output = ssh.execute(move_cmd, timeout=3600)
+            if not success:
                 logger.error(f"移动磁盘失败: {error_output}")
                 return ZMessage(
                     success=False, action="HDDTrans",
@@ -1446,24 +1513,14 @@ class HostServer(BasicServer):
             # 4. 使用Proxmox API获取截图
             # Proxmox VE支持通过vncproxy获取VNC连接，但没有直接的截图API
             # 我们需要通过SSH连接到Proxmox主机，使用qm命令获取截图
-            import paramiko
             import tempfile
             import os
             import base64
             
-            # 5. 建立SSH连接
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            # 5. 借用共享SSH连接（不再每次截图都重新握手）
+            ssh = self.ssh_pool()
             
             try:
-                ssh.connect(
-                    hostname=self.hs_config.server_addr,
-                    port=22,
-                    username=self.hs_config.server_user,
-                    password=self.hs_config.server_pass,
-                    timeout=10
-                )
-                
                 # 6. 生成临时文件路径
                 temp_dir = tempfile.gettempdir()
                 screenshot_path = os.path.join(temp_dir, f"{vm_name}_screenshot.ppm")
@@ -1471,23 +1528,21 @@ class HostServer(BasicServer):
                 
                 # 7. 执行qm命令获取截图（PPM格式）
                 qm_command = f"qm screenshot {vmid} {remote_screenshot_path}"
-                stdin, stdout, stderr = ssh.exec_command(qm_command)
-                exit_status = stdout.channel.recv_exit_status()
+                success, _, error_output = ssh.execute(qm_command, timeout=10)
                 
-                if exit_status != 0:
-                    error_output = stderr.read().decode()
+                if not success:
                     logger.error(f"[{self.hs_config.server_name}] 执行qm screenshot命令失败: {error_output}")
-                    ssh.close()
                     return ""
                 
                 # 8. 使用SFTP下载截图文件
-                sftp = ssh.open_sftp()
-                sftp.get(remote_screenshot_path, screenshot_path)
-                sftp.close()
+                sftp = ssh.open_sftp(timeout=10)
+                try:
+                    sftp.get(remote_screenshot_path, screenshot_path)
+                finally:
+                    sftp.close()
                 
                 # 9. 删除远程临时文件
-                ssh.exec_command(f"rm -f {remote_screenshot_path}")
-                ssh.close()
+                ssh.execute(f"rm -f {remote_screenshot_path}", timeout=10)
                 
                 # 10. 读取截图文件并转换为PNG格式（使用PIL）
                 if os.path.exists(screenshot_path):
@@ -1522,10 +1577,6 @@ class HostServer(BasicServer):
                     
             except Exception as e:
                 logger.error(f"[{self.hs_config.server_name}] SSH连接或文件传输失败: {str(e)}")
-                try:
-                    ssh.close()
-                except:
-                    pass
                 return ""
                 
         except Exception as e:
@@ -0,0 +1,120 @@
+import time
+import threading
+from typing import Callable, Optional
+from loguru import logger
+
+
+# ProxmoxVE 虚拟机清单缓存 ##################################################
+# 通过一次 /cluster/resources?type=vm 调用获取全集群虚拟机，
+# 在内存中维护 名称 -> VMID 索引以及状态、CPU、内存等信息
+# :param fetch: 获取资源列表的函数，返回 /cluster/resources 的结果
+# :param node: 当前宿主机节点名称，同名虚拟机优先匹配本节点
+# :param ttl: 缓存有效期（秒）
+###########################################################################
+class PVEInventory:
+    def __init__(self, fetch: Callable[[], list], node: str = "", ttl: int = 10):
+        self.fetch = fetch
+        self.node = node
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.update = 0.0
+        # {名称: 资源信息}，仅包含QEMU虚拟机
+        self.by_name: dict[str, dict] = {}
+        # {VMID: 资源信息}，包含QEMU和LXC，用于分配VMID
+        self.by_vmid: dict[int, dict] = {}
+        # 已分配但尚未出现在清单中的VMID: {VMID: 分配时间}
+        self.reserved: dict[int, float] = {}
+
+    # 刷新清单 ##################################################################
+    # :param force: 忽略缓存有效期强制刷新
+    # :return: 是否刷新成功（失败时继续使用旧数据）
+    ###########################################################################
+    def refresh(self, force: bool = False) -> bool:
+        with self.lock:
+            if not force and time.time() - self.update < self.ttl:
+                return True
+            try:
+                resources = self.fetch() or []
+            except Exception as e:
+                logger.warning(f"[PVEInventory] 获取集群资源失败: {e}")
+                return False
+            by_name, by_vmid = {}, {}
+            for item in resources:
+                vmid = item.get("vmid")
+                if vmid is None:
+                    continue
+                vmid = int(vmid)
+                by_vmid[vmid] = item
+                name = item.get("name")
+                if item.get("type") != "qemu" or not name:
+                    continue
+                # 同名虚拟机优先使用本节点上的
+                if name in by_name and by_name[name].get("node") == self.node:
+                    continue
+                by_name[name] = item
+            self.by_name, self.by_vmid = by_name, by_vmid
+            now = time.time()
+            self.reserved = {k: v for k, v in self.reserved.items()
+                             if k not in by_vmid and now - v < 300}
+            self.update = now
+            return True
+
+    # 标记缓存失效 ##############################################################
+    # 创建、删除虚拟机后调用，下次访问时重新获取
+    ###########################################################################
+    def invalidate(self):
+        with self.lock:
+            self.update = 0.0
+
+    # 按名称获取虚拟机信息 ######################################################
+    # :param local: 只匹配本节点上的虚拟机（其他节点的同名虚拟机视为不存在）
+    ###########################################################################
+    def get(self, name: str, local: bool = False) -> Optional[dict]:
+        self.refresh()
+        item = self.match(name, local)
+        if item is None and self.refresh(force=True):
+            # 缓存中不存在时强制刷新一次，可能是刚创建的虚拟机
+            item = self.match(name, local)
+        return item
+
+    def match(self, name: str, local: bool) -> Optional[dict]:
+        with self.lock:
+            item = self.by_name.get(name)
+        if item is not None and local and self.node and item.get("node") != self.node:
+            return None
+        return item
+
+    # 按名称获取本节点虚拟机的VMID ##############################################
+    def get_vmid(self, name: str) -> Optional[int]:
+        item = self.get(name, local=True)
+        return int(item["vmid"]) if item else None
+
+    # 分配新的VMID ##############################################################
+    # 从start开始查找第一个未被使用且未被预留的VMID，使用缓存的清单并在本地预留，
+    # 创建时VMID已被占用（清单过期）再调用conflict刷新后重新分配
+    ###########################################################################
+    def new_vmid(self, start: int = 100) -> int:
+        self.refresh()
+        with self.lock:
+            vmid = start
+            while vmid in self.by_vmid or vmid in self.reserved:
+                vmid += 1
+            self.reserved[vmid] = time.time()
+        return vmid
+
+    # VMID冲突：保留该VMID的预留并强制刷新清单 ==================================
+    def conflict(self, vmid: int):
+        with self.lock:
+            self.reserved[vmid] = time.time()
+        self.refresh(force=True)
+
+    # 获取全部QEMU虚拟机 ########################################################
+    # :param node: 只返回指定节点上的虚拟机（为空则返回全部）
+    ###########################################################################
+    def vms(self, node: str = None) -> list[dict]:
+        self.refresh()
+        with self.lock:
+            items = list(self.by_name.values())
+        if node:
+            items = [item for item in items if item.get("node") == node]
+        return items
@@ -0,0 +1,126 @@
+import time
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from MainObject.Config.VMPowers import VMPowers
+from MainObject.Public.HWStatus import HWStatus
+from HostServer.ProxmoxQemuAPI.PVEInventory import PVEInventory
+
+
+# ProxmoxVE 虚拟机性能采集 ##################################################
+# 每个周期只调用一次 /cluster/resources（通过清单缓存）获取全部虚拟机的
+# CPU、内存和累计IO/网络计数，带宽、本周期流量和磁盘IO由两次采集的差值计算；
+# 首次采集（或虚拟机重启后）没有历史计数时，并发查询rrddata补齐带宽
+# :param inventory: 集群清单缓存
+# :param api_get: 请求函数 api_get(路径, **参数)，返回data字段内容
+# :param workers: 查询rrddata的并发数
+###########################################################################
+class PVEMetrics:
+    def __init__(self, inventory: PVEInventory,
+                 api_get: Callable[..., list], workers: int = 4):
+        self.inventory = inventory
+        self.api_get = api_get
+        self.workers = max(1, workers)
+        # 上一次采集的累计计数: {VMID: (时间, netin, netout, uptime, disk)}
+        self.samples: dict[int, tuple] = {}
+
+    # 采集节点上全部虚拟机的状态 ################################################
+    # :param node: 节点名称
+    # :param names: {PVE虚拟机名称: vm_uuid}，只采集其中的虚拟机
+    # :param now: 采集时间（秒），默认为当前时间
+    # :return: {vm_uuid: HWStatus}
+    ###########################################################################
+    def collect(self, node: str, names: dict[str, str],
+                now: float = None) -> dict[str, HWStatus]:
+        now = time.time() if now is None else now
+        if not self.inventory.refresh(force=True):
+            return {}
+        vms = [vm for vm in self.inventory.vms(node=node)
+               if vm.get("name") in names]
+        # 没有历史计数的运行中虚拟机，批量查询rrddata
+        seeds = self.rrd_batch(node, [
+            int(vm["vmid"]) for vm in vms
+            if vm.get("status") == "running"
+            and not self.has_sample(vm, now)])
+        results = {}
+        for vm in vms:
+            vmid = int(vm["vmid"])
+            results[names[vm["name"]]] = self.make_status(
+                vm, seeds.get(vmid), now)
+        # 清理已不存在虚拟机的历史计数
+        current = {int(vm["vmid"]) for vm in vms}
+        for vmid in list(self.samples):
+            if vmid not in current:
+                del self.samples[vmid]
+        return results
+
+    # 是否有可用的历史计数 ======================================================
+    def has_sample(self, vm: dict, now: float) -> bool:
+        last = self.samples.get(int(vm["vmid"]))
+        return last is not None and last[0] < now \
+            and vm.get("uptime", 0) >= last[3]
+
+    # 并发查询rrddata ###########################################################
+    # :return: {VMID: 最近一个采样点}，查询失败的虚拟机不包含在结果中
+    ###########################################################################
+    def rrd_batch(self, node: str, vmids: list[int]) -> dict[int, dict]:
+        if not vmids:
+            return {}
+
+        def fetch(vmid: int):
+            try:
+                points = self.api_get(
+                    f"nodes/{node}/qemu/{vmid}/rrddata",
+                    timeframe="hour", cf="AVERAGE") or []
+                # 最后一个采样点可能尚未计算完成，取最近的有效点
+                for point in reversed(points):
+                    if point.get("netin") is not None:
+                        return vmid, point
+            except Exception as e:
+                logger.debug(f"[PVEMetrics] 获取虚拟机 {vmid} rrddata失败: {e}")
+            return vmid, None
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(vmids)),
+                                thread_name_prefix="pve-rrd") as executor:
+            return {vmid: point for vmid, point
+                    in executor.map(fetch, vmids) if point}
+
+    # 生成HWStatus ##############################################################
+    # :param vm: /cluster/resources 中的虚拟机条目
+    # :param seed: rrddata采样点（没有历史计数时使用）
+    ###########################################################################
+    def make_status(self, vm: dict, seed: dict | None, now: float) -> HWStatus:
+        hw_status = HWStatus()
+        hw_status.on_update = int(now)
+        hw_status.ac_status = {
+            "running": VMPowers.STARTED,
+            "stopped": VMPowers.STOPPED,
+        }.get(vm.get("status"), VMPowers.UNKNOWN)
+        hw_status.cpu_total = int(vm.get("maxcpu", 0))
+        hw_status.cpu_usage = int(float(vm.get("cpu", 0)) * 100)
+        hw_status.mem_total = int(vm.get("maxmem", 0) / (1024 * 1024))
+        hw_status.mem_usage = int(vm.get("mem", 0) / (1024 * 1024))
+        hw_status.hdd_total = int(vm.get("maxdisk", 0) / (1024 * 1024))
+        if hw_status.ac_status != VMPowers.STARTED:
+            return hw_status
+        # 计算带宽、本周期流量和磁盘IO ==========================================
+        vmid = int(vm["vmid"])
+        netin, netout = vm.get("netin", 0), vm.get("netout", 0)
+        disk = vm.get("diskread", 0) + vm.get("diskwrite", 0)
+        last = self.samples.get(vmid)
+        self.samples[vmid] = (now, netin, netout, vm.get("uptime", 0), disk)
+        if last is not None and last[0] < now and netin >= last[1] \
+                and netout >= last[2]:
+            interval = now - last[0]
+            if disk >= last[4]:
+                hw_status.hdd_usage = int((disk - last[4]) / (1024 * 1024))
+            rx_mb = (netin - last[1]) / (1024 * 1024)
+            tx_mb = (netout - last[2]) / (1024 * 1024)
+            hw_status.flu_usage = int(rx_mb + tx_mb)
+            hw_status.network_d = int(rx_mb / interval * 8)
+            hw_status.network_u = int(tx_mb / interval * 8)
+        elif seed is not None:
+            # rrddata为字节/秒的平均值，只用于带宽
+            hw_status.network_d = int(seed.get("netin", 0) / (1024 * 1024) * 8)
+            hw_status.network_u = int(seed.get("netout", 0) / (1024 * 1024) * 8)
+        return hw_status
@@ -0,0 +1,9 @@
+"""
+Proxmox API模块
+提供ProxmoxVE集群资源的缓存与批量查询
+"""
+
+from .PVEInventory import PVEInventory
+from .PVEMetrics import PVEMetrics
+
+__all__ = ['PVEInventory', 'PVEMetrics']
@@ -0,0 +1,78 @@
+"""
+PVEInventory 测试脚本
+复用 test_pve_metrics 中的 ProxmoxVE API 替身，验证VMID在本地预留分配、
+只在冲突时刷新集群清单，以及按名称查找VMID只匹配本节点的虚拟机
+"""
+
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from HostServer.ProxmoxQemuAPI.PVEInventory import PVEInventory
+from HostServer.ProxmoxQemuAPI.test_pve_metrics import FakePVE, api_client
+
+
+def make_inventory(fake: FakePVE, ttl=60) -> PVEInventory:
+    api_get = api_client(fake)
+    return PVEInventory(lambda: api_get("cluster/resources", type="vm"),
+                        node="pve1", ttl=ttl)
+
+
+def test_new_vmid_reserve():
+    """连续分配使用缓存清单并在本地预留，冲突时刷新后跳过被占用的VMID"""
+    fake = FakePVE()
+    try:
+        fake.vm(100, "vm-a")
+        fake.vm(101, "vm-b", node="pve2")
+        inventory = make_inventory(fake)
+        assert [inventory.new_vmid() for _ in range(3)] == [102, 103, 104]
+        assert fake.count("cluster/resources") == 1, fake.records
+        # 其他节点在清单缓存期间创建了105：创建失败后登记冲突并重新分配
+        fake.vm(105, "vm-x", node="pve2")
+        assert inventory.new_vmid() == 105
+        inventory.conflict(105)
+        assert fake.count("cluster/resources") == 2
+        assert inventory.new_vmid() == 106
+        # 已预留但尚未出现在清单中的VMID在刷新后仍保留
+        inventory.refresh(force=True)
+        assert inventory.new_vmid() == 107
+        print("✅ VMID本地预留分配，仅在冲突时刷新清单")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_get_vmid_local():
+    """按名称查找VMID只匹配本节点，同名虚拟机优先本节点"""
+    fake = FakePVE()
+    try:
+        fake.vm(100, "vm-a")
+        fake.vm(200, "vm-a", node="pve2")
+        fake.vm(201, "vm-remote", node="pve2")
+        inventory = make_inventory(fake)
+        assert inventory.get_vmid("vm-a") == 100
+        assert inventory.get_vmid("vm-remote") is None
+        assert inventory.get("vm-remote")["vmid"] == 201  # 不限定节点时仍可查到
+        # 本节点新建的同名虚拟机：缓存命中其他节点时强制刷新一次
+        fake.vm(110, "vm-remote")
+        assert inventory.get_vmid("vm-remote") == 110
+        print("✅ 按名称查找VMID只匹配本节点")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("PVEInventory 集群清单测试")
+    print("=" * 60)
+    test_new_vmid_reserve()
+    test_get_vmid_local()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+PVEMetrics 测试脚本
+使用本地 http.server 模拟 ProxmoxVE API（/cluster/resources 与 rrddata），
+验证每个周期只获取一次集群资源、首次采集并发查询rrddata补齐带宽、
+之后按累计计数差值计算带宽/流量/磁盘IO，以及虚拟机重启和查询失败的处理
+"""
+
+import sys
+import os
+import json
+import time
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from MainObject.Config.VMPowers import VMPowers
+from HostServer.ProxmoxQemuAPI.PVEInventory import PVEInventory
+from HostServer.ProxmoxQemuAPI.PVEMetrics import PVEMetrics
+
+MB = 1024 * 1024
+
+
+class FakePVE(ThreadingHTTPServer):
+    """ProxmoxVE API替身：内存中的集群资源与rrddata，记录请求与并发数"""
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), FakePVEHandler)
+        self.delay = delay  # rrddata的模拟处理耗时(秒)
+        self.resources = []  # /cluster/resources 条目
+        self.rrd = {}  # {VMID: 最近一个采样点}
+        self.records = []  # [(路径, 查询参数)]
+        self.fail = set()  # 需返回500的路径
+        self.inflight = self.max_inflight = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def address(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api2/json"
+
+    def count(self, suffix: str) -> int:
+        return sum(1 for path, _ in self.records if path.endswith(suffix))
+
+    def vm(self, vmid: int, name: str, node="pve1", status="running", uptime=100,
+           netin=0, netout=0, diskread=0, diskwrite=0) -> dict:
+        item = {"id": f"qemu/{vmid}", "type": "qemu", "vmid": vmid, "name": name,
+                "node": node, "status": status, "uptime": uptime, "cpu": 0.25,
+                "maxcpu": 4, "mem": 1024 * MB, "maxmem": 4096 * MB,
+                "maxdisk": 32768 * MB, "netin": netin, "netout": netout,
+                "diskread": diskread, "diskwrite": diskwrite}
+        self.resources = [r for r in self.resources if r["vmid"] != vmid] + [item]
+        return item
+
+    # 处理一次请求，返回(状态码, data字段) ====================================
+    def route(self, path: str, query: dict):
+        parts = path.strip("/").split("/")[2:]  # 去掉api2/json前缀
+        if parts == ["cluster", "resources"]:
+            return 200, [r for r in self.resources
+                         if query.get("type") in (None, "vm")]
+        if len(parts) == 5 and parts[0] == "nodes" and parts[4] == "rrddata":
+            vmid = int(parts[3])
+            if vmid not in self.rrd:
+                return 500, None
+            # 最后一个采样点尚未计算完成
+            return 200, [{"time": 1, "netin": 0, "netout": 0},
+                         self.rrd[vmid], {"time": 3}]
+        return 404, None
+
+
+class FakePVEHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        with server.lock:
+            server.records.append((url.path, query))
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+        try:
+            if server.delay and url.path.endswith("rrddata"):
+                time.sleep(server.delay)
+            with server.lock:
+                status, data = (500, None) if url.path in server.fail \
+                    else server.route(url.path, query)
+        finally:
+            with server.lock:
+                server.inflight -= 1
+        body = json.dumps({"data": data}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def api_client(fake: FakePVE):
+    """与ProxmoxQemu.api_get相同的调用方式：api_get(路径, **参数)，返回data字段"""
+    def api_get(path: str, **params):
+        url = f"{fake.address}/{path}"
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read())["data"]
+    return api_get
+
+
+def make_metrics(fake: FakePVE, workers=4) -> PVEMetrics:
+    api_get = api_client(fake)
+    inventory = PVEInventory(lambda: api_get("cluster/resources", type="vm"),
+                             node="pve1", ttl=60)
+    return PVEMetrics(inventory, api_get, workers=workers)
+
+
+def test_seed_then_delta():
+    """首次采集用rrddata补齐带宽，之后按差值计算，每周期只获取一次集群资源"""
+    fake = FakePVE()
+    try:
+        fake.vm(100, "vm-a", netin=100 * MB, netout=50 * MB, diskread=10 * MB)
+        fake.vm(101, "vm-b")
+        fake.vm(102, "vm-c", status="stopped", uptime=0)
+        fake.vm(200, "vm-a", node="pve2")  # 其他节点上的同名虚拟机
+        fake.rrd = {100: {"time": 2, "netin": 2 * MB, "netout": MB}, 101: {"time": 2, "netin": 0}}
+        metrics = make_metrics(fake)
+        names = {"vm-a": "uuid-a", "vm-b": "uuid-b", "vm-c": "uuid-c"}
+        first = metrics.collect("pve1", names, now=1000.0)
+        assert set(first) == set(names.values()), first
+        assert fake.count("cluster/resources") == 1, fake.records
+        assert fake.count("rrddata") == 2, fake.records
+        assert fake.count("qemu/100/rrddata") == 1 and fake.count("qemu/102/rrddata") == 0
+        a = first["uuid-a"]
+        assert a.network_d == 16 and a.network_u == 8, (a.network_d, a.network_u)
+        assert a.flu_usage == 0 and a.hdd_usage == 0
+        assert a.cpu_usage == 25 and a.mem_usage == 1024 and a.cpu_total == 4
+        assert first["uuid-c"].ac_status == VMPowers.STOPPED
+        # 10秒后：收20MB发10MB，读写30MB，不再查询rrddata ======================
+        fake.vm(100, "vm-a", uptime=110, netin=120 * MB, netout=60 * MB,
+                diskread=30 * MB, diskwrite=10 * MB)
+        second = metrics.collect("pve1", names, now=1010.0)["uuid-a"]
+        assert fake.count("cluster/resources") == 2 and fake.count("rrddata") == 2, fake.records
+        assert second.network_d == 16 and second.network_u == 8
+        assert second.flu_usage == 30 and second.hdd_usage == 30, \
+            (second.flu_usage, second.hdd_usage)
+        print("✅ 首次采集使用rrddata，之后按累计计数差值计算")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_reboot_and_failures():
+    """虚拟机重启后重新查询rrddata，查询失败时带宽为0，已删除虚拟机清理历史"""
+    fake = FakePVE()
+    try:
+        fake.vm(100, "vm-a", uptime=500, netin=500 * MB)
+        fake.vm(101, "vm-b", uptime=500)
+        fake.rrd = {100: {"time": 2, "netin": MB, "netout": 0}}  # 101查询失败
+        metrics = make_metrics(fake)
+        names = {"vm-a": "uuid-a", "vm-b": "uuid-b"}
+        first = metrics.collect("pve1", names, now=1000.0)
+        assert first["uuid-b"].network_d == 0 and set(metrics.samples) == {100, 101}
+        # 虚拟机100重启（uptime变小、计数器归零），101被删除 ==================
+        fake.vm(100, "vm-a", uptime=5, netin=MB)
+        fake.resources = [r for r in fake.resources if r["vmid"] != 101]
+        result = metrics.collect("pve1", names, now=1010.0)
+        assert set(result) == {"uuid-a"} and set(metrics.samples) == {100}
+        assert fake.count("qemu/100/rrddata") == 2, fake.records
+        assert result["uuid-a"].network_d == 8 and result["uuid-a"].flu_usage == 0
+        # 集群资源获取失败时返回空结果 ==========================================
+        fake.fail.add("/api2/json/cluster/resources")
+        assert metrics.collect("pve1", names, now=1020.0) == {}
+        print("✅ 重启后重新查询rrddata，失败与删除处理正确")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_rrd_concurrency():
+    """rrddata按workers并发查询"""
+    fake = FakePVE(delay=0.05)
+    try:
+        names = {}
+        for i in range(12):
+            fake.vm(100 + i, f"vm-{i}")
+            fake.rrd[100 + i] = {"time": 2, "netin": MB, "netout": MB}
+            names[f"vm-{i}"] = f"uuid-{i}"
+        metrics = make_metrics(fake, workers=4)
+        started = time.perf_counter()
+        result = metrics.collect("pve1", names, now=1000.0)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        assert len(result) == 12 and fake.count("rrddata") == 12
+        assert all(status.network_d == 8 for status in result.values())
+        assert fake.max_inflight <= 4, fake.max_inflight
+        print(f"✅ rrddata并发查询: 12台虚拟机耗时{elapsed_ms:.0f}ms，"
+              f"最大并发{fake.max_inflight}")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("PVEMetrics 性能采集测试")
+    print("=" * 60)
+    test_seed_then_delta()
+    test_reboot_and_failures()
+    test_rrd_concurrency()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -1207,7 +1207,8 @@ class HostServer(BasicServer):
             return ""
 
     # 虚拟机控制台 ##################################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         """获取虚拟机远程连接URL"""
         try:
             # 检查虚拟机是否存在
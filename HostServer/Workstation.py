@@ -7,6 +7,7 @@ import subprocess
 import traceback
 import tempfile
 import random
+import time
 import os
 from loguru import logger
 from HostServer.BasicServer import BasicServer
@@ -31,6 +32,7 @@ class HostServer(BasicServer):
             self.hs_config.server_user,
             self.hs_config.server_pass,
             self.hs_config.launch_path,
+            pool_size=int(self.hs_config.extend_data.get("rest_pool", 4)),
         )
 
     # 公共函数 - 获取虚拟机路径 ================================================
@@ -53,9 +55,38 @@ class HostServer(BasicServer):
     # 宿主机任务 ===============================================================
     def Crontabs(self) -> bool:
         # 专用操作 =============================================================
+        # 批量刷新电源状态，供虚拟机列表使用
+        try:
+            self.power_sync()
+        except Exception as e:
+            logger.warning(f"[{self.hs_config.server_name}] 刷新电源状态失败: {str(e)}")
         # 通用操作 =============================================================
         return super().Crontabs()
 
+    # 批量刷新电源状态 =========================================================
+    # :param vms: 已获取的vmrest虚拟机列表（为None时重新获取）
+    # :return: {vm_uuid: VMPowers}
+    # ==========================================================================
+    def power_sync(self, vms: list = None) -> dict[str, VMPowers]:
+        since = time.time()
+        result = self.vmrest_api.powers_all(list(self.vm_saving), vms)
+        if not result.success:
+            return {}
+        states = {vm_name: self.power_state(state)
+                  for vm_name, state in result.results.items()}
+        self.power_cache.sync(states, since)
+        return states
+
+    # vmrest电源状态转换 =======================================================
+    @staticmethod
+    def power_state(state: str) -> VMPowers:
+        return {
+            "poweredOn": VMPowers.STARTED,
+            "poweredOff": VMPowers.STOPPED,
+            "suspended": VMPowers.SUSPEND,
+            "paused": VMPowers.SUSPEND,
+        }.get(state, VMPowers.UNKNOWN)
+
     # 宿主机状态 ===============================================================
     def HSStatus(self) -> HWStatus:
         # 专用操作 =============================================================
@@ -200,6 +231,9 @@ class HostServer(BasicServer):
                 )
                 self.push_log(log_msg)
             
+            # 批量获取电源状态 =================================================
+            self.power_sync(vms_list)
+
             # 保存到数据库 =====================================================
             if added_count > 0:
                 success = self.data_set()
@@ -532,10 +566,11 @@ class HostServer(BasicServer):
             return ""
 
     # 虚拟机控制台 =============================================================
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         try:
             # 检查端口和密码配置 ===============================================
-            result = super().VMRemote(vm_uuid, ip_addr)
+            result = super().VMRemote(vm_uuid, ip_addr, user)
             if not result.success:
                 return result
             
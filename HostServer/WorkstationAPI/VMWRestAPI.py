@@ -1,9 +1,13 @@
 import os
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
 from loguru import logger
 from MainObject.Config.HSConfig import HSConfig
@@ -18,12 +22,40 @@ class VRestAPI:
                  host_user="root",
                  host_pass="password",
                  host_path="",
-                 ver_agent=21):
+                 ver_agent=21,
+                 pool_size=4,
+                 retries=2):
         self.host_addr = host_addr
         self.host_user = host_user
         self.host_pass = host_pass
         self.host_path = host_path
         self.ver_agent = ver_agent
+        self.pool_size = max(1, pool_size)
+        self.session = self.create_ses(retries)
+        # 虚拟机名称到vmrest ID的缓存: {vmx名称: ID}
+        self.vm_ids: dict[str, str] = {}
+        self.vm_list: list = []  # 最近一次获取的虚拟机列表
+        self.ids_lock = threading.Lock()
+
+    # 创建HTTP会话 ########################################################
+    # 复用TCP连接和认证头，连接失败和网关错误自动重试（不重试POST）
+    # :param retries: 重试次数
+    # #####################################################################
+    def create_ses(self, retries: int) -> requests.Session:
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(self.host_user, self.host_pass)
+        session.headers.update(
+            {"Content-Type": "application/vnd.vmware.vmw.rest-v1+json"})
+        retry = Retry(
+            total=retries, backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "PUT", "DELETE"}),
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     @staticmethod
     # 创建vmx文本 #########################################################
@@ -54,18 +86,13 @@ class VRestAPI:
     # #####################################################################
     def vmrest_api(self, url: str, data=None, m: str = "GET") -> ZMessage:
         full_url = f"http://{self.host_addr}/api{url}"
-        auth = HTTPBasicAuth(self.host_user, self.host_pass)
-        # 设置请求头 ======================================================
-        head = {"Content-Type": "application/vnd.vmware.vmw.rest-v1+json"}
-        methods = {"GET": requests.get, "POST": requests.post,
-                   "PUT": requests.put, "DELETE": requests.delete}
         try:  # 无效请求 ==================================================
-            if m.upper() not in methods:
+            if m.upper() not in ("GET", "POST", "PUT", "DELETE"):
                 return ZMessage(success=False, actions="vmrest_api",
                                 message=f"不支持的HTTP方法: {m}")
-            # 发送请求 ====================================================
-            response = methods[m.upper()](
-                full_url, auth=auth, headers=head, json=data, timeout=30)
+            # 发送请求（会话复用连接和认证）==============================
+            response = self.session.request(
+                m.upper(), full_url, json=data, timeout=30)
             response.raise_for_status()
             # 返回成功消息 ================================================
             return ZMessage(
@@ -73,6 +100,8 @@ class VRestAPI:
                 results=response.json() if response.text else {})
         # 处理HTTP错误 ====================================================
         except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                self.vmids_clr()  # 虚拟机可能已被外部删除
             error_msg = f"HTTP错误 {e.response.status_code}: {e.response.reason}"
             try:
                 error_detail = e.response.json()
@@ -106,13 +135,9 @@ class VRestAPI:
     # #####################################################################
     def powers_api(self, url: str, power: str) -> ZMessage:
         full_url = f"http://{self.host_addr}/api{url}"
-        auth = HTTPBasicAuth(self.host_user, self.host_pass)
-        head = {"Content-Type": "application/vnd.vmware.vmw.rest-v1+json"}
         try:
-            response = requests.put(
+            response = self.session.put(
                 full_url,
-                auth=auth,
-                headers=head,
                 data=power,
                 timeout=30  # 添加超时设置
             )
@@ -171,36 +196,87 @@ class VRestAPI:
             )
 
     # 获取所有虚拟机列表 ##################################################
+    # 获取成功时同时刷新名称到ID的缓存
     # return: ZMessage对象
     # #####################################################################
     def return_vmx(self) -> ZMessage:
-        return self.vmrest_api("/vms")
+        result = self.vmrest_api("/vms")
+        if result.success and isinstance(result.results, list):
+            with self.ids_lock:
+                self.vm_list = result.results
+                self.vm_ids = {self.vmx_name(vm.get("path", "")):
+                               vm.get("id", "") for vm in result.results}
+        return result
+
+    # 从vmx路径提取虚拟机名称 ############################################
+    # vmrest运行在Windows上时路径分隔符为反斜杠
+    # #####################################################################
+    @staticmethod
+    def vmx_name(vm_path: str) -> str:
+        return os.path.splitext(vm_path.replace("\\", "/").rsplit("/", 1)[-1])[0]
+
+    # 清空ID缓存 ##########################################################
+    def vmids_clr(self):
+        with self.ids_lock:
+            self.vm_ids = {}
+            self.vm_list = []
 
     # 选择虚拟机ID ########################################################
-    # 根据虚拟机名称获取虚拟机ID
+    # 根据虚拟机名称获取虚拟机ID，优先使用缓存，未命中时刷新一次列表
     # :param vm_name: 虚拟机名称
     # :return: 虚拟机ID，未找到返回空字符串
     # #####################################################################
     def select_vid(self, vm_name: str) -> str:
+        with self.ids_lock:
+            vm_id = self.vm_ids.get(vm_name)
+        if vm_id:
+            return vm_id
         result = self.return_vmx()
         if not result.success:
             return ""
-        vms = result.results if isinstance(result.results, list) else []
-        for vm in vms:
-            # VMRest API返回的虚拟机信息包含id和path字段
-            # 从path中提取虚拟机名称进行匹配
-            vm_path = vm.get("path", "")
-            vm_id = vm.get("id", "")
-            # 方式1：直接匹配路径中的虚拟机名称
-            if vm_name in vm_path:
-                return vm_id
-            # 方式2：提取.vmx文件名进行匹配
-            import os
-            vmx_name = os.path.splitext(os.path.basename(vm_path))[0]
-            if vmx_name == vm_name:
-                return vm_id
+        with self.ids_lock:
+            # 方式1：提取.vmx文件名进行匹配
+            if self.vm_ids.get(vm_name):
+                return self.vm_ids[vm_name]
+            # 方式2：直接匹配路径中的虚拟机名称
+            for vm in self.vm_list:
+                if vm_name in vm.get("path", ""):
+                    return vm.get("id", "")
         return ""
 
+    # 批量获取电源状态 ####################################################
+    # 通过连接池并发查询多台虚拟机的电源状态
+    # :param names: 虚拟机名称列表，为None时查询全部虚拟机
+    # :param vms: 已获取的虚拟机列表（为None时重新获取）
+    # :return: ZMessage对象，results为{vmx名称: power_state}
+    # #####################################################################
+    def powers_all(self, names: list = None, vms: list = None) -> ZMessage:
+        if vms is None:
+            result = self.return_vmx()
+            if not result.success:
+                return result
+            vms = result.results if isinstance(result.results, list) else []
+        targets = {}
+        for vm in vms:
+            vmx_name = self.vmx_name(vm.get("path", ""))
+            if vm.get("id") and (names is None or vmx_name in names):
+                targets[vmx_name] = vm["id"]
+        if not targets:
+            return ZMessage(success=True, actions="powers_all",
+                            message="没有需要查询的虚拟机", results={})
+
+        def fetch(item):
+            return item[0], self.vmrest_api(f"/vms/{item[1]}/power")
+
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(targets)),
+                                thread_name_prefix="vmrest-power") as executor:
+            states = {name: result.results.get("power_state", "")
+                      for name, result in executor.map(fetch, targets.items())
+                      if result.success and isinstance(result.results, dict)}
+        return ZMessage(success=True, actions="powers_all",
+                        message=f"获取{len(states)}台虚拟机电源状态",
+                        results=states)
+
     # 获取虚拟机电源状态 ##################################################
     # 获取指定虚拟机的电源状态
     # :param vm_name: 虚拟机名称
@@ -266,10 +342,13 @@ class VRestAPI:
         if vm_name is None:
             # 从路径中提取虚拟机名称（不含扩展名）
             vm_name = os.path.splitext(os.path.basename(vmx_path))[0]
-        return self.vmrest_api(
+        result = self.vmrest_api(
             "/vms/registration",
             {"name": vm_name, "path": vmx_path},
             "POST")
+        if result.success:
+            self.vmids_clr()
+        return result
 
     # 删除虚拟机 ##########################################################
     # 从VMware Workstation中删除虚拟机
@@ -283,7 +362,10 @@ class VRestAPI:
                 actions="delete_vmx",
                 message=f"未找到虚拟机: {vm_name}"
             )
-        return self.vmrest_api(f"/vms/{vm_id}", m="DELETE")
+        result = self.vmrest_api(f"/vms/{vm_id}", m="DELETE")
+        if result.success:
+            self.vmids_clr()
+        return result
 
     # 获取虚拟机配置 ######################################################
     # 获取虚拟机配置信息
@@ -0,0 +1,224 @@
+"""
+VMware Workstation REST API 测试脚本
+使用本地 http.server 模拟 vmrest（/api/vms、/api/vms/{id}/power 等），
+验证会话复用与认证、名称到ID的缓存、并发查询电源状态及重试行为，并输出简单基准
+
+单独运行伪造服务（供手动测试 Workstation 主机）:
+    python test_vmwrest.py --serve 8697
+"""
+
+import sys
+import os
+import json
+import time
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from MainObject.Config.VMPowers import VMPowers
+from HostServer.WorkstationAPI.VMWRestAPI import VRestAPI
+
+
+class FakeVMRest(ThreadingHTTPServer):
+    """vmrest替身：内存中的虚拟机列表，记录请求并统计TCP连接数"""
+    daemon_threads = True
+
+    def __init__(self, port=0, count=8, delay=0.0, user="root", password="password"):
+        super().__init__(("127.0.0.1", port), FakeVMRestHandler)
+        self.auth = "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+        self.delay = delay  # 每个请求的模拟处理耗时(秒)
+        self.vms = {f"VM{i:04d}": {"path": f"C:\\VMs\\vm-{i}\\vm-{i}.vmx", "power": "poweredOff"}
+                    for i in range(count)}
+        self.next_id = count
+        self.records = []  # [(方法, 路径)]
+        self.fail = {}  # {(方法, 路径): 剩余失败次数}，返回503
+        self.conns = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def count(self, method: str, path: str) -> int:
+        return sum(1 for item in self.records if item == (method, path))
+
+    # 处理一次请求，返回(状态码, 响应对象) ====================================
+    def route(self, method: str, path: str, body: bytes):
+        parts = path.split("?")[0].strip("/").split("/")[1:]  # 去掉api前缀
+        if parts == ["vms"] and method == "GET":
+            return 200, [{"id": vm_id, "path": vm["path"]} for vm_id, vm in self.vms.items()]
+        if parts == ["vms", "registration"] and method == "POST":
+            vm_id, self.next_id = f"VM{self.next_id:04d}", self.next_id + 1
+            self.vms[vm_id] = {"path": json.loads(body)["path"], "power": "poweredOff"}
+            return 201, {"id": vm_id, "path": self.vms[vm_id]["path"]}
+        if len(parts) < 2 or parts[0] != "vms" or parts[1] not in self.vms:
+            return 404, {"code": 104, "message": "The virtual machine is not found"}
+        vm = self.vms[parts[1]]
+        if parts[2:] == ["power"]:
+            if method == "PUT":
+                state = body.decode().strip()
+                vm["power"] = {"on": "poweredOn", "off": "poweredOff",
+                               "shutdown": "poweredOff", "pause": "paused",
+                               "unpause": "poweredOn"}.get(state)
+                if vm["power"] is None:
+                    return 400, {"code": 100, "message": f"invalid state {state}"}
+            return 200, {"power_state": vm["power"]}
+        if not parts[2:]:
+            if method == "DELETE":
+                del self.vms[parts[1]]
+                return 204, None
+            return 200, {"id": parts[1], "cpu": {"processors": 2}, "memory": 2048}
+        return 404, {"code": 100, "message": "not found"}
+
+
+class FakeVMRestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive，以便统计连接复用
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.conns += 1
+
+    def handle_one(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if server.delay:
+            time.sleep(server.delay)
+        with server.lock:
+            server.records.append((self.command, self.path))
+            key = (self.command, self.path)
+            if self.headers.get("Authorization") != server.auth:
+                status, result = 401, {"code": 401, "message": "Authentication failed"}
+            elif server.fail.get(key):
+                server.fail[key] -= 1
+                status, result = 503, {"code": 503, "message": "busy"}
+            else:
+                status, result = server.route(self.command, self.path, body)
+        data = b"" if result is None else json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/vnd.vmware.vmw.rest-v1+json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = handle_one
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_session_reuse():
+    """连续请求复用同一TCP连接，并携带认证头"""
+    fake = FakeVMRest()
+    try:
+        api = VRestAPI(host_addr=fake.address)
+        for _ in range(10):
+            assert api.return_vmx().success
+        assert fake.conns == 1, fake.conns
+        bad = VRestAPI(host_addr=fake.address, host_pass="wrong")
+        result = bad.return_vmx()
+        assert not result.success and "401" in result.message, result.message
+        print("✅ 会话复用TCP连接，认证失败时返回错误")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_id_cache():
+    """名称到ID的映射只在未命中或404时刷新"""
+    fake = FakeVMRest(count=3)
+    try:
+        api = VRestAPI(host_addr=fake.address)
+        assert api.select_vid("vm-1") == "VM0001"
+        assert api.config_get("vm-1").success
+        assert api.powers_get("vm-2").results == {"power_state": "poweredOff"}
+        assert fake.count("GET", "/api/vms") == 1, fake.records
+        # 虚拟机在外部被删除：404后清空缓存，下一次查找重新获取列表
+        del fake.vms["VM0001"]
+        assert not api.config_get("vm-1").success
+        assert api.vm_ids == {}
+        assert api.select_vid("vm-1") == ""
+        assert fake.count("GET", "/api/vms") == 2, fake.records
+        # 注册新虚拟机后缓存失效
+        assert api.loader_vmx("C:\\VMs\\vm-9\\vm-9.vmx").success
+        assert api.select_vid("vm-9") == "VM0003"
+        print("✅ 虚拟机ID缓存命中、404失效和注册后刷新")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_power_set_and_retry():
+    """电源操作以纯字符串请求体提交，网关错误时GET自动重试"""
+    fake = FakeVMRest(count=2)
+    try:
+        api = VRestAPI(host_addr=fake.address)
+        result = api.powers_set("vm-0", VMPowers.S_START)
+        assert result.success and result.results == {"power_state": "poweredOn"}, result.message
+        assert fake.vms["VM0000"]["power"] == "poweredOn"
+        fake.fail[("GET", "/api/vms/VM0001/power")] = 2
+        result = api.powers_get("vm-1")
+        assert result.success, result.message
+        assert fake.count("GET", "/api/vms/VM0001/power") == 3, fake.records
+        print("✅ 电源操作提交成功，503时自动重试")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def test_powers_all():
+    """并发查询全部虚拟机电源状态，结果与逐台查询一致"""
+    fake = FakeVMRest(count=16, delay=0.02)
+    try:
+        api = VRestAPI(host_addr=fake.address, pool_size=4)
+        fake.vms["VM0003"]["power"] = "poweredOn"
+        # 逐台查询（基准）=====================================================
+        started = time.perf_counter()
+        serial = {}
+        for i in range(16):
+            serial[f"vm-{i}"] = api.powers_get(f"vm-{i}").results["power_state"]
+        serial_ms = (time.perf_counter() - started) * 1000
+        assert fake.conns == 1 and fake.count("GET", "/api/vms") == 1, fake.conns
+        # 连接池并发查询 =======================================================
+        started = time.perf_counter()
+        result = api.powers_all()
+        pooled_ms = (time.perf_counter() - started) * 1000
+        assert result.success and result.results == serial, result.results
+        assert result.results["vm-3"] == "poweredOn"
+        # 每台只查询一次，连接数不超过连接池大小（逐台查询的连接被复用）
+        assert all(fake.count("GET", f"/api/vms/VM{i:04d}/power") == 2
+                   for i in range(16)), fake.records
+        assert fake.count("GET", "/api/vms") == 2, fake.records
+        assert fake.conns <= api.pool_size, fake.conns
+        subset = api.powers_all(["vm-1", "vm-3"], vms=api.vm_list)
+        assert subset.results == {"vm-1": "poweredOff", "vm-3": "poweredOn"}
+        print(f"✅ 电源状态批量查询: 逐台{serial_ms:.0f}ms，"
+              f"并发{pooled_ms:.0f}ms，共{fake.conns}个连接")
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+def main():
+    """主测试函数"""
+    if len(sys.argv) > 2 and sys.argv[1] == "--serve":
+        fake = FakeVMRest(port=int(sys.argv[2]))
+        print(f"伪造vmrest服务已启动: http://{fake.address}/api (root/password)")
+        threading.Event().wait()
+    print("\n" + "=" * 60)
+    print("VMware Workstation REST API 测试")
+    print("=" * 60)
+    test_session_reuse()
+    test_id_cache()
+    test_power_set_and_retry()
+    test_powers_all()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
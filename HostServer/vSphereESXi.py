@@ -5,6 +5,7 @@ import datetime
 from loguru import logger
 from HostServer.BasicServer import BasicServer
 from HostServer.vSphereESXiAPI.vSphereAPI import vSphereAPI
+from HostServer.vSphereESXiAPI.vSpherePerf import vSpherePerf
 from HostModule.HttpManager import HttpManager
 from MainObject.Config.HSConfig import HSConfig
 from MainObject.Config.IMConfig import IMConfig
@@ -36,8 +37,11 @@ class HostServer(BasicServer):
             user=self.hs_config.server_user,
             password=self.hs_config.server_pass,
             port=self.hs_config.server_port if hasattr(self.hs_config, 'server_port') else 443,
-            datastore_name=datastore_name
+            datastore_name=datastore_name,
+            pool_size=int(self.hs_config.extend_data.get("session_pool", 4)),
+            keepalive=int(self.hs_config.extend_data.get("session_keepalive", 300))
         )
+        self.esxi_perf = vSpherePerf(self.esxi_api)
 
     # 辅助方法 - 获取虚拟机存储目录 =============================================
     def _get_vm_directory(self) -> str:
@@ -77,6 +81,7 @@ class HostServer(BasicServer):
             logger.error(f"{operation_name}失败: {str(e)}")
             import traceback
             traceback.print_exc()
+            self.esxi_api.recheck()
             try:
                 self.esxi_api.disconnect()
             except:
@@ -104,7 +109,7 @@ class HostServer(BasicServer):
     # ###############################################################################
     def VMLoader_VNC(self) -> bool:
         # ===== 新的WebMKS方式（使用HttpManager） =====
-        cfg_name = "vmk_" + self.hs_config.server_name + ".txt"
+        cfg_name = "vmk_" + self.hs_config.server_name + ".json"
         self.http_manager = HttpManager(
             cfg_name, "vmk",
             self.hs_config.public_addr[0] \
@@ -133,6 +138,11 @@ class HostServer(BasicServer):
                 # 保存状态 =====================================================
                 self.host_set(hs_status)
                 logger.debug(f"[{self.hs_config.server_name}] ESXi远程主机状态已更新")
+            # 采集虚拟机性能并批量保存 =========================================
+            self.VMPerfs()
+            # 会话复用统计 =====================================================
+            logger.debug(f"[{self.hs_config.server_name}] ESXi会话: "
+                         f"{self.esxi_api.session_stats()}")
                 
         except Exception as e:
             # 异常处理 =========================================================
@@ -143,6 +153,30 @@ class HostServer(BasicServer):
         # 通用操作 =============================================================
         return True
 
+    # 虚拟机性能 ===============================================================
+    # 一次批量属性查询和一次QueryPerf获取全部虚拟机状态，一个事务内保存
+    # ==========================================================================
+    def VMPerfs(self) -> dict[str, HWStatus]:
+        if not self.vm_saving:
+            return {}
+        connect_result = self.esxi_api.connect()
+        if not connect_result.success:
+            logger.error(f"无法连接到ESXi获取虚拟机状态: {connect_result.message}")
+            return {}
+        try:
+            # ESXi中的虚拟机名称即vm_uuid
+            vm_status = self.esxi_perf.collect(
+                {vm_uuid: vm_uuid for vm_uuid in self.vm_saving})
+        finally:
+            self.esxi_api.disconnect()
+        if vm_status and self.save_data and self.hs_config.server_name:
+            if self.save_data.add_vm_status_batch(
+                    self.hs_config.server_name, vm_status):
+                logger.debug(f"[{self.hs_config.server_name}] {len(vm_status)} 个虚拟机状态已保存")
+            else:
+                logger.warning(f"[{self.hs_config.server_name}] 虚拟机状态批量保存失败")
+        return vm_status
+
     # 宿主机状态 ===============================================================
     def HSStatus(self) -> HWStatus:
         # 专用操作 =============================================================
@@ -222,8 +256,8 @@ class HostServer(BasicServer):
     def HSUnload(self) -> ZMessage:
         # 专用操作 =============================================================
         try:
-            # 断开ESXi连接 =====================================================
-            self.esxi_api.disconnect()
+            # 注销ESXi会话 =====================================================
+            self.esxi_api.close()
         except Exception as e:
             # 异常处理 =========================================================
             logger.error(f"断开ESXi连接失败: {str(e)}")
@@ -1131,7 +1165,8 @@ class HostServer(BasicServer):
             return ""
 
     # WebMKS远程访问 ###########################################################
-    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1") -> ZMessage:
+    def VMRemote(self, vm_uuid: str, ip_addr: str = "127.0.0.1",
+                 user: str = "") -> ZMessage:
         """
         获取虚拟机WebMKS远程访问链接
         
@@ -4,5 +4,6 @@ ESXi API模块
 """
 
 from .vSphereAPI import vSphereAPI
+from .vSpherePerf import vSpherePerf
 
-__all__ = ['vSphereAPI']
+__all__ = ['vSphereAPI', 'vSpherePerf']
@@ -1,6 +1,7 @@
 import os
 import ssl
 import time
+import threading
 from typing import Optional, List, Dict, Any
 from loguru import logger
 
@@ -22,15 +23,21 @@ class vSphereAPI:
     """vSphere ESXi API封装类"""
 
     def __init__(self, host: str, user: str, password: str, port: int = 443,
-                 datastore_name: str = "datastore1"):
+                 datastore_name: str = "datastore1",
+                 pool_size: int = 4, keepalive: int = 300):
         """
         初始化vSphere API连接
-        
+
+        会话在多次操作之间复用：connect()获取一个使用名额并在需要时登录，
+        disconnect()只归还名额，真正注销由close()完成
+
         :param host: ESXi主机地址
         :param user: 用户名
         :param password: 密码
         :param port: API端口，默认443
         :param datastore_name: 数据存储名称
+        :param pool_size: 同时使用会话的最大操作数
+        :param keepalive: 会话保活间隔（秒）
         """
         self.host = host
         self.user = user
@@ -39,16 +46,86 @@ class vSphereAPI:
         self.datastore_name = datastore_name
         self.si = None  # ServiceInstance
         self.content = None
+        # 会话复用 ==========================================================
+        self.lock = threading.RLock()
+        self.slots = threading.BoundedSemaphore(max(1, pool_size))
+        self.lease = threading.local()
+        self.keepalive = max(30, keepalive)
+        self.verify = 60  # 超过该秒数未确认会话有效时，复用前先检查
+        self.checked = 0.0
+        self.closing = threading.Event()
+        self.pinger = None
+        self.stats = {"login": 0, "reuse": 0, "expired": 0,
+                      "login_ms": 0.0, "login_total_ms": 0.0,
+                      "moref_hit": 0, "moref_miss": 0}
+        # 对象引用缓存 ======================================================
+        self.morefs: Dict[Any, Dict[str, Any]] = {}  # {类型: {名称: 对象}}
+        self.moref_keys: Dict[str, tuple] = {}  # {moId: (类型, 名称)}
+        self.moref_lock = threading.Lock()
+        self.watching = False  # 缓存是否由WaitForUpdatesEx维护
+        self.watch_wait = 60
+        self.watcher = None
 
     def connect(self) -> ZMessage:
-        """连接到ESXi主机"""
+        """获取会话（复用已登录的会话，失效时自动重新登录）"""
+        # 每个线程最多占用一个名额，嵌套调用（如Crontabs中的VMPerfs）只计数，
+        # 由最外层的disconnect归还
+        depth = getattr(self.lease, "depth", 0)
+        if depth == 0 and not self.slots.acquire(timeout=60):
+            return ZMessage(success=False, action="connect",
+                            message="等待ESXi会话超时")
+        self.lease.depth = depth + 1
+        result = self.session()
+        if not result.success:
+            self.disconnect()
+        return result
+
+    def disconnect(self) -> ZMessage:
+        """归还会话名额（不注销会话）"""
+        depth = getattr(self.lease, "depth", 0)
+        if depth > 0:
+            self.lease.depth = depth - 1
+            if depth == 1:
+                self.slots.release()
+        return ZMessage(success=True, action="disconnect",
+                        message="断开连接成功")
+
+    def session(self) -> ZMessage:
+        """返回可用会话，必要时登录"""
+        with self.lock:
+            if self.si is not None and (
+                    time.time() - self.checked < self.verify or self.alive()):
+                self.stats["reuse"] += 1
+                return ZMessage(success=True, action="connect",
+                                message="连接成功")
+            return self.login()
+
+    def alive(self) -> bool:
+        """通过CurrentTime检查会话是否有效"""
+        try:
+            self.si.CurrentTime()
+            self.checked = time.time()
+            return True
+        except Exception as e:
+            logger.info(f"ESXi会话已失效，将重新登录: {str(e)}")
+            self.stats["expired"] += 1
+            self.checked = 0.0
+            return False
+
+    def recheck(self):
+        """下次复用前重新检查会话（操作出现异常时调用）"""
+        self.checked = 0.0
+
+    def login(self) -> ZMessage:
+        """登录ESXi主机"""
         try:
             # 禁用SSL证书验证（生产环境建议启用）
             context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
             context.verify_mode = ssl.CERT_NONE
 
             # 连接到ESXi
-            self.si = SmartConnect(
+            start = time.perf_counter()
+            si = SmartConnect(
                 host=self.host,
                 user=self.user,
                 pwd=self.password,
@@ -56,39 +133,87 @@ class vSphereAPI:
                 sslContext=context
             )
 
-            if not self.si:
+            if not si:
                 return ZMessage(success=False, action="connect",
                                 message="无法连接到ESXi主机")
 
-            self.content = self.si.RetrieveContent()
-            # logger.info(f"成功连接到ESXi主机: {self.host}")
+            # 新会话就绪后再替换，对象引用缓存由start_watcher清空
+            self.si, self.content = si, si.RetrieveContent()
+            elapsed = (time.perf_counter() - start) * 1000
+            self.checked = time.time()
+            self.stats["login"] += 1
+            self.stats["login_ms"] = elapsed
+            self.stats["login_total_ms"] += elapsed
+            logger.debug(f"ESXi登录完成: {self.host}，耗时 {elapsed:.0f}ms")
+            self.start_keepalive()
+            self.start_watcher()
             return ZMessage(success=True, action="connect",
                             message="连接成功")
 
         except Exception as e:
+            # 保留原会话对象，避免正在进行的操作访问到None，下次复用前重新检查
             logger.error(f"连接ESXi失败: {str(e)}")
+            self.checked = 0.0
             return ZMessage(success=False, action="connect",
                             message=f"连接失败: {str(e)}")
 
-    def disconnect(self) -> ZMessage:
-        """断开与ESXi的连接"""
+    def start_keepalive(self):
+        """启动会话保活线程"""
+        if self.pinger is not None and self.pinger.is_alive():
+            return
+        self.closing.clear()
+        self.pinger = threading.Thread(
+            target=self.run_keepalive, daemon=True,
+            name=f"esxi-keepalive-{self.host}")
+        self.pinger.start()
+
+    def run_keepalive(self):
+        """定时调用CurrentTime，避免会话因空闲过期；已失效时持锁重新登录"""
+        while not self.closing.wait(self.keepalive):
+            with self.lock:
+                if self.si is not None and not self.closing.is_set() \
+                        and not self.alive():
+                    self.login()
+
+    def close(self) -> ZMessage:
+        """注销会话并停止保活和缓存维护"""
+        self.closing.set()
         try:
-            if self.si:
-                Disconnect(self.si)
+            with self.lock:
+                if self.si:
+                    Disconnect(self.si)
                 self.si = None
                 self.content = None
-                # logger.info(f"已断开与ESXi主机的连接: {self.host}")
+                self.reset_morefs()
             return ZMessage(success=True, action="disconnect",
                             message="断开连接成功")
         except Exception as e:
             logger.error(f"断开连接失败: {str(e)}")
+            self.si = None
+            self.content = None
             return ZMessage(success=False, action="disconnect",
                             message=f"断开连接失败: {str(e)}")
 
+    def session_stats(self) -> Dict[str, Any]:
+        """会话复用统计"""
+        total = self.stats["login"] + self.stats["reuse"]
+        return {
+            "login": self.stats["login"],
+            "reuse": self.stats["reuse"],
+            "expired": self.stats["expired"],
+            "reuse_rate": round(self.stats["reuse"] / total, 4) if total else 0.0,
+            "login_ms": round(self.stats["login_ms"], 1),
+            "login_avg_ms": round(self.stats["login_total_ms"] / self.stats["login"], 1)
+            if self.stats["login"] else 0.0,
+            "moref_watching": self.watching,
+            "moref_hit": self.stats["moref_hit"],
+            "moref_miss": self.stats["moref_miss"],
+        }
+
     def _get_obj(self, vimtype, name: str = None):
         """
         获取vSphere对象
-        
+
         :param vimtype: 对象类型（如vim.VirtualMachine）
         :param name: 对象名称，如果为None则返回所有对象
         :return: 对象或对象列表
@@ -96,19 +221,192 @@ class vSphereAPI:
         if not self.content:
             return None
 
+        if name:
+            return self.find_obj(vimtype, name)
+
         container = self.content.viewManager.CreateContainerView(
             self.content.rootFolder, [vimtype], True)
 
         obj_list = container.view
         container.Destroy()
-
-        if name:
-            for obj in obj_list:
-                if obj.name == name:
-                    return obj
-            return None
         return obj_list
 
+    def _filter_spec(self, view, vimtypes: list, props: List[str]):
+        """生成遍历容器视图的属性过滤规格"""
+        collector = vmodl.query.PropertyCollector
+        traversal = collector.TraversalSpec(
+            name="traverseView", path="view", skip=False,
+            type=vim.view.ContainerView)
+        obj_spec = collector.ObjectSpec(
+            obj=view, skip=True, selectSet=[traversal])
+        prop_specs = [collector.PropertySpec(type=vimtype, pathSet=props, all=False)
+                      for vimtype in vimtypes]
+        return collector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+    def retrieve(self, vimtype, props: List[str], obj=None) -> List[tuple]:
+        """
+        通过RetrievePropertiesEx批量获取属性（一次请求返回全部对象）
+
+        :param vimtype: 对象类型
+        :param props: 属性路径列表（如runtime.powerState）
+        :param obj: 只获取该对象的属性，为None时获取该类型的全部对象
+        :return: [(对象, {属性路径: 值})]，未设置的属性不包含在字典中
+        """
+        if not self.content:
+            return []
+        collector = vmodl.query.PropertyCollector
+        view = None
+        if obj is None:
+            view = self.content.viewManager.CreateContainerView(
+                self.content.rootFolder, [vimtype], True)
+            filter_spec = self._filter_spec(view, [vimtype], props)
+        else:
+            filter_spec = collector.FilterSpec(
+                objectSet=[collector.ObjectSpec(obj=obj, skip=False)],
+                propSet=[collector.PropertySpec(type=vimtype, pathSet=props, all=False)])
+        try:
+            pc = self.content.propertyCollector
+            result = pc.RetrievePropertiesEx(
+                [filter_spec], collector.RetrieveOptions())
+            items = []
+            while result:
+                for item in result.objects or []:
+                    items.append((item.obj, {prop.name: prop.val
+                                             for prop in item.propSet or []}))
+                if not result.token:
+                    break
+                result = pc.ContinueRetrievePropertiesEx(result.token)
+            return items
+        finally:
+            if view is not None:
+                view.Destroy()
+
+    # 对象引用缓存 ==========================================================
+    # 名称到MoRef的映射由后台线程通过WaitForUpdatesEx维护（首次返回全量，
+    # 之后只返回改名、创建和删除），缓存未命中时用一次批量查询兜底
+    # =======================================================================
+    WATCH_TYPES = (vim.VirtualMachine, vim.Datastore, vim.Network)
+
+    def find_obj(self, vimtype, name: str):
+        """按名称查找对象（优先使用缓存）"""
+        if self.watching:
+            with self.moref_lock:
+                obj = self.morefs.get(vimtype, {}).get(name)
+            if obj is not None:
+                self.stats["moref_hit"] += 1
+                return obj
+        self.stats["moref_miss"] += 1
+        for obj, props in self.retrieve(vimtype, ["name"]):
+            if props.get("name") == name:
+                return obj
+        return None
+
+    def forget(self, vimtype, name: str):
+        """从缓存中移除对象（删除操作完成后调用）"""
+        with self.moref_lock:
+            obj = self.morefs.get(vimtype, {}).pop(name, None)
+            if obj is not None:
+                self.moref_keys.pop(obj._moId, None)
+
+    def reset_morefs(self):
+        """清空缓存（会话变化后原有的对象引用不可用）"""
+        with self.moref_lock:
+            self.watching = False
+            self.morefs = {}
+            self.moref_keys = {}
+
+    def start_watcher(self):
+        """为当前会话启动缓存维护线程"""
+        self.reset_morefs()
+        self.watcher = threading.Thread(
+            target=self.run_watcher, args=(self.si, self.content), daemon=True,
+            name=f"esxi-watcher-{self.host}")
+        self.watcher.start()
+
+    def run_watcher(self, si, content):
+        """WaitForUpdatesEx循环，会话变化或关闭时退出"""
+        pc = view = None
+        try:
+            # 使用独立的PropertyCollector，过滤器不影响其他查询
+            pc = content.propertyCollector.CreatePropertyCollector()
+            view = content.viewManager.CreateContainerView(
+                content.rootFolder, list(self.WATCH_TYPES), True)
+            pc.CreateFilter(self._filter_spec(
+                view, list(self.WATCH_TYPES), ["name"]), partialUpdates=False)
+            options = vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=self.watch_wait)
+            version = ""
+            while not self.closing.is_set() and self.si is si:
+                update = pc.WaitForUpdatesEx(version, options)
+                if update is None:
+                    continue  # 等待超时，没有变化
+                version = update.version
+                self.apply_updates(update, si)
+        except Exception as e:
+            if not self.closing.is_set() and self.si is si:
+                logger.warning(f"ESXi对象缓存更新中断，改为直接查询: {str(e)}")
+        finally:
+            with self.moref_lock:
+                if self.si is si:
+                    self.watching = False
+            for obj in (view, pc):
+                try:
+                    if obj is not None:
+                        obj.Destroy()
+                except Exception:
+                    pass
+
+    def apply_updates(self, update, si):
+        """将WaitForUpdatesEx的变化写入缓存"""
+        with self.moref_lock:
+            if self.si is not si:
+                return
+            for filter_set in update.filterSet or []:
+                for change in filter_set.objectSet or []:
+                    obj = change.obj
+                    kind = next((t for t in self.WATCH_TYPES
+                                 if isinstance(obj, t)), None)
+                    if kind is None:
+                        continue
+                    # 先移除对象原有的名称（改名、删除）
+                    old = self.moref_keys.pop(obj._moId, None)
+                    if old is not None:
+                        self.morefs.get(old[0], {}).pop(old[1], None)
+                    if change.kind == "leave":
+                        continue
+                    name = next((prop.val for prop in change.changeSet or []
+                                 if prop.name == "name" and prop.op == "assign"),
+                                old[1] if old else None)
+                    if name is None:
+                        continue
+                    self.morefs.setdefault(kind, {})[name] = obj
+                    self.moref_keys[obj._moId] = (kind, name)
+            self.watching = True
+
+    # 虚拟机批量查询的属性 ==================================================
+    VM_PROPS = [
+        "name",
+        "runtime.powerState",
+        "summary.config.guestFullName",
+        "summary.config.numCpu",
+        "summary.config.memorySizeMB",
+        "guest.ipAddress",
+        "guest.toolsStatus",
+    ]
+
+    @staticmethod
+    def _vm_info(props: Dict[str, Any]) -> Dict[str, Any]:
+        """将批量查询的属性转换为虚拟机信息"""
+        return {
+            "name": props.get("name", ""),
+            "power_state": props.get("runtime.powerState"),
+            "guest_os": props.get("summary.config.guestFullName") or "Unknown",
+            "cpu": props.get("summary.config.numCpu") or 0,
+            "memory_mb": props.get("summary.config.memorySizeMB") or 0,
+            "ip_address": props.get("guest.ipAddress") or "",
+            "tools_status": str(props.get("guest.toolsStatus") or "Unknown"),
+        }
+
     def _wait_for_task(self, task) -> ZMessage:
         """等待任务完成"""
         try:
@@ -130,25 +428,17 @@ class vSphereAPI:
 
     def list_vms(self, filter_prefix: str = "") -> List[Dict[str, Any]]:
         """
-        列出所有虚拟机
+        列出所有虚拟机（一次RetrievePropertiesEx获取全部属性）
         
         :param filter_prefix: 名称前缀过滤
         :return: 虚拟机信息列表
         """
-        vms = self._get_obj(vim.VirtualMachine)
         vm_list = []
 
-        for vm in vms:
-            if filter_prefix and not vm.name.startswith(filter_prefix):
+        for vm, props in self.retrieve(vim.VirtualMachine, self.VM_PROPS):
+            vm_info = self._vm_info(props)
+            if filter_prefix and not vm_info["name"].startswith(filter_prefix):
                 continue
-
-            vm_info = {
-                "name": vm.name,
-                "power_state": vm.runtime.powerState,
-                "guest_os": vm.config.guestFullName if vm.config else "Unknown",
-                "cpu": vm.config.hardware.numCPU if vm.config else 0,
-                "memory_mb": vm.config.hardware.memoryMB if vm.config else 0,
-            }
             vm_list.append(vm_info)
 
         return vm_list
@@ -167,11 +457,7 @@ class vSphereAPI:
 
     def get_network(self, network_name: str):
         """获取网络对象"""
-        networks = self._get_obj(vim.Network)
-        for network in networks:
-            if network.name == network_name:
-                return network
-        return None
+        return self._get_obj(vim.Network, network_name)
 
     def create_vm(self, vm_conf: VMConfig, hs_config: HSConfig) -> ZMessage:
         """
@@ -456,6 +742,7 @@ class vSphereAPI:
             result = self._wait_for_task(task)
 
             if result.success:
+                self.forget(vim.VirtualMachine, vm_name)
                 logger.info(f"虚拟机 {vm_name} 删除成功")
 
             return result
@@ -1151,15 +1438,11 @@ class vSphereAPI:
             if not vm:
                 return {}
 
-            status = {
-                "name": vm.name,
-                "power_state": str(vm.runtime.powerState),
-                "guest_os": vm.config.guestFullName if vm.config else "Unknown",
-                "cpu": vm.config.hardware.numCPU if vm.config else 0,
-                "memory_mb": vm.config.hardware.memoryMB if vm.config else 0,
-                "ip_address": vm.guest.ipAddress if vm.guest else "",
-                "tools_status": str(vm.guest.toolsStatus) if vm.guest else "Unknown",
-            }
+            items = self.retrieve(vim.VirtualMachine, self.VM_PROPS, obj=vm)
+            if not items:
+                return {}
+            status = self._vm_info(items[0][1])
+            status["power_state"] = str(status["power_state"])
 
             return status
 
@@ -0,0 +1,145 @@
+import time
+from typing import Dict, Optional
+from loguru import logger
+
+try:
+    from pyVmomi import vim
+except ImportError:
+    logger.error("pyvmomi库未安装，请运行: pip install pyvmomi")
+    raise
+
+from MainObject.Config.VMPowers import VMPowers
+from MainObject.Public.HWStatus import HWStatus
+
+
+class vSpherePerf:
+    """vSphere虚拟机性能采集类"""
+
+    # 采集的性能计数器: {字段: 计数器名称(组.名称.汇总方式)}
+    COUNTERS = {
+        "cpu": "cpu.usage.average",  # 百分比*100
+        "mem": "mem.active.average",  # KB
+        "rx": "net.received.average",  # KB/s
+        "tx": "net.transmitted.average",  # KB/s
+        "read": "disk.read.average",  # KB/s
+        "write": "disk.write.average",  # KB/s
+    }
+    # ESXi主机实时统计的采样间隔（秒）
+    INTERVAL = 20
+
+    POWERS = {
+        "poweredOn": VMPowers.STARTED,
+        "poweredOff": VMPowers.STOPPED,
+        "suspended": VMPowers.SUSPEND,
+    }
+
+    def __init__(self, api):
+        """
+        初始化性能采集
+
+        计数器ID只在首次采集时解析一次，之后每个周期对全部运行中的
+        虚拟机只调用一次QueryPerf
+
+        :param api: vSphereAPI实例（调用方负责connect/disconnect）
+        """
+        self.api = api
+        self.counters: Dict[str, int] = {}  # {字段: 计数器ID}
+        self.last: float = 0.0  # 上一次采集时间
+
+    def resolve(self) -> Dict[str, int]:
+        """解析计数器名称对应的ID"""
+        if self.counters:
+            return self.counters
+        keys = {}
+        for counter in self.api.content.perfManager.perfCounter:
+            name = f"{counter.groupInfo.key}.{counter.nameInfo.key}." \
+                   f"{counter.rollupType}"
+            keys[name] = counter.key
+        missing = [name for name in self.COUNTERS.values() if name not in keys]
+        if missing:
+            logger.warning(f"ESXi性能计数器不可用: {missing}")
+        self.counters = {field: keys[name] for field, name
+                         in self.COUNTERS.items() if name in keys}
+        return self.counters
+
+    def query(self, vms: list) -> Dict[str, Dict[str, float]]:
+        """
+        一次QueryPerf获取多个虚拟机的最近一个采样值
+
+        :param vms: 虚拟机对象列表
+        :return: {虚拟机moId: {字段: 值}}
+        """
+        counters = self.resolve()
+        if not vms or not counters:
+            return {}
+        fields = {key: field for field, key in counters.items()}
+        metric_ids = [vim.PerformanceManager.MetricId(counterId=key, instance="")
+                      for key in counters.values()]
+        specs = [vim.PerformanceManager.QuerySpec(
+            entity=vm, metricId=metric_ids, intervalId=self.INTERVAL,
+            maxSample=1, format="normal") for vm in vms]
+        results = {}
+        for entity in self.api.content.perfManager.QueryPerf(querySpec=specs) or []:
+            values = {}
+            for series in entity.value or []:
+                field = fields.get(series.id.counterId)
+                # instance为空的序列是整个虚拟机的汇总值
+                if field is None or series.id.instance or not series.value:
+                    continue
+                values[field] = max(0, series.value[-1])
+            results[entity.entity._moId] = values
+        return results
+
+    def collect(self, names: Dict[str, str],
+                now: Optional[float] = None) -> Dict[str, HWStatus]:
+        """
+        采集虚拟机状态
+
+        :param names: {ESXi虚拟机名称: vm_uuid}，只采集其中的虚拟机
+        :param now: 采集时间（秒），默认为当前时间
+        :return: {vm_uuid: HWStatus}
+        """
+        now = time.time() if now is None else now
+        vms = [(vm, props) for vm, props in self.api.retrieve(
+            vim.VirtualMachine, self.api.VM_PROPS) if props.get("name") in names]
+        running = [vm for vm, props in vms
+                   if str(props.get("runtime.powerState")) == "poweredOn"]
+        try:
+            samples = self.query(running)
+        except Exception as e:
+            # 会话重建后计数器ID可能变化，下次重新解析
+            self.counters = {}
+            logger.warning(f"ESXi性能数据查询失败: {str(e)}")
+            samples = {}
+        interval = now - self.last if 0 < self.last < now else self.INTERVAL
+        self.last = now
+        return {names[props["name"]]: self.make_status(
+            props, samples.get(vm._moId), interval, now) for vm, props in vms}
+
+    def make_status(self, props: dict, sample: Optional[Dict[str, float]],
+                    interval: float, now: float) -> HWStatus:
+        """
+        生成HWStatus
+
+        :param props: 批量查询得到的虚拟机属性
+        :param sample: 性能采样值，虚拟机未运行或无数据时为None
+        :param interval: 距上一次采集的秒数（用于计算本周期流量）
+        """
+        hw_status = HWStatus()
+        hw_status.on_update = int(now)
+        hw_status.ac_status = self.POWERS.get(
+            str(props.get("runtime.powerState")), VMPowers.UNKNOWN)
+        hw_status.cpu_total = props.get("summary.config.numCpu") or 0
+        hw_status.mem_total = props.get("summary.config.memorySizeMB") or 0
+        if not sample:
+            return hw_status
+        hw_status.cpu_usage = int(sample.get("cpu", 0) / 100)
+        hw_status.mem_usage = int(sample.get("mem", 0) / 1024)
+        # 速率为KB/s，带宽换算为 MB/s*8，流量和磁盘IO为本周期的MB
+        rx, tx = sample.get("rx", 0), sample.get("tx", 0)
+        hw_status.network_d = int(rx / 1024 * 8)
+        hw_status.network_u = int(tx / 1024 * 8)
+        hw_status.flu_usage = int((rx + tx) * interval / 1024)
+        hw_status.hdd_usage = int(
+            (sample.get("read", 0) + sample.get("write", 0)) * interval / 1024)
+        return hw_status
@@ -28,7 +28,8 @@ HEConfig = {
         ],
         "Tab_Lock": [
 
-        ]
+        ],
+        "Isolate": {}
     },
     "LxContainer": {
         "Imported": LXContainerModule.HostServer,
@@ -52,7 +53,11 @@ HEConfig = {
         ],
         "Tab_Lock": [
             "hdd", "iso"
-        ]
+        ],
+        "Isolate": {
+            "workers": 2,
+            "methods": ["VMBackup", "Restores"]
+        }
     },
     "OCInterface": {
         "Imported": OCInterfaceModule.HostServer,
@@ -76,7 +81,8 @@ HEConfig = {
         ],
         "Tab_Lock": [
             "hdd", "iso"
-        ]
+        ],
+        "Isolate": {}
     },
     "vSphereESXi": {
         "Imported": vSphereESXiModule.HostServer,
@@ -90,7 +96,11 @@ HEConfig = {
         "Ban_Init": [],
         "Ban_Edit": [],
         "Tab_Lock": [
-        ]
+        ],
+        "Isolate": {
+            "workers": 2,
+            "methods": ["VMDetect", "VMBackup", "Restores"]
+        }
     },
     "HyperVSetup": {
         "Imported": Win64HyperV.HostServer,
@@ -104,7 +114,8 @@ HEConfig = {
         ],
         "Ban_Init": [],
         "Ban_Edit": [],
-        "Tab_Lock": []
+        "Tab_Lock": [],
+        "Isolate": {}
     },
     "PromoxSetup": {
         "Imported": ProxmoxQemu.HostServer,
@@ -116,7 +127,8 @@ HEConfig = {
         "Messages": [],
         "Ban_Init": [],
         "Ban_Edit": [],
-        "Tab_Lock": []
+        "Tab_Lock": [],
+        "Isolate": {}
     },
     # "VirtualBoxs": {
     #     "Descript": "PVE Runtime Platform",
@@ -1,6 +1,8 @@
 import os
+import json
 import time
 import sys
+import socket
 import subprocess
 import urllib.parse
 from pathlib import Path
@@ -12,9 +14,12 @@ from loguru import logger
 class WebsocketUI:
     # Websockify 管理器 ##########################################################
     # :param web_port: Websockify 端口
+    # :param session_idle: 会话无流量超过该秒数时断开，0 为不限制
     # ############################################################################
-    def __init__(self, web_port: int = 6090, cfg_name: str = "websockify"):
+    def __init__(self, web_port: int = 6090, cfg_name: str = "websockify",
+                 session_idle: int = 0):
         self.web_port = web_port
+        self.session_idle = max(0, int(session_idle))
         
         # 获取正确的项目根目录（支持打包后的环境）
         if getattr(sys, 'frozen', False):
@@ -37,6 +42,8 @@ class WebsocketUI:
         else:
             # 开发环境
             self.vnc_save = os.path.join(project_root, "DataSaving", f"{cfg_name}.cfg")
+        # 会话指标文件：websockify 定期写入每个会话的流量、空闲时间与往返延迟
+        self.vnc_stat = os.path.splitext(self.vnc_save)[0] + ".metrics.json"
         
         # Web 资源路径
         self.web_path = os.path.join(project_root, "VNCConsole", "Sources")
@@ -51,7 +58,8 @@ class WebsocketUI:
 
         self.bin_path = os.path.join(project_root, "Websockify", script_name)
         self.process = None
-        self.storage: Dict[str, str] = {}
+        self.storage: Dict[str, str] = {}  # {token: "ip:port"}
+        self.targets: Dict[str, str] = {}  # {"ip:port": token} 反向索引，用于去重
         self.cfg_load()
 
     # 加载配置文件 ###############################################################
@@ -61,7 +69,10 @@ class WebsocketUI:
                 for line in f:
                     if line.strip():
                         token, target = line.strip().split(": ")
+                        if token in self.storage:
+                            self.targets.pop(self.storage[token], None)
                         self.storage[token] = target
+                        self.targets[target] = token
                         logger.info(f"已加载 VNC: {token} -> {target}")
 
     # 将 token 写入配置文件 ######################################################
@@ -71,6 +82,90 @@ class WebsocketUI:
             for token, target in self.storage.items():
                 f.write(f"{token}: {target}\n")
 
+    # 追加单条 token 到配置文件（新增控制台时不重写整个文件）####################
+    def cfg_append(self, token: str, target: str):
+        os.makedirs(os.path.dirname(self.vnc_save), exist_ok=True)
+        with open(self.vnc_save, "a") as f:
+            f.write(f"{token}: {target}\n")
+
+    # 推送 token 变更到 websockify 的 TokenCache 插件 ###########################
+    # 插件将推送地址写入 "<配置文件>.port"（仅属主可读）：POSIX 下为 Unix 套接字路径，
+    # 否则为本地 TCP 端口和随机口令，每条请求需携带口令；
+    # 推送失败时插件仍会按文件修改时间重新加载
+    # :param op: set / del
+    # ############################################################################
+    def cfg_push(self, op: str, token: str, target: str = "") -> bool:
+        try:
+            with open(self.vnc_save + ".port") as f:
+                address = json.load(f)
+            request = {"op": op, "token": token, "target": target}
+            if "unix" in address:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                push_addr = address["unix"]
+            else:
+                conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                push_addr = ("127.0.0.1", int(address["port"]))
+                request["secret"] = address["secret"]
+            with conn:
+                conn.settimeout(1)
+                conn.connect(push_addr)
+                conn.sendall((json.dumps(request) + "\n").encode())
+                return conn.makefile("rb").readline().strip() == b"ok"
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    # 读取会话指标并按 token 汇总 ##############################################
+    # 指标文件超过 max_age 秒未更新（websockify 已退出）时视为无会话
+    # :return: {token: {"target", "sessions", "bytes_in", "bytes_out", "frames_in",
+    #                   "frames_out", "connected", "idle", "rtt_ms"}}
+    #          connected 为最早一条会话的连接时间，idle 为各会话中最短的空闲秒数，
+    #          rtt_ms 为各会话中最大的往返延迟（尚未测得时为 None）
+    # ############################################################################
+    def get_stats(self, max_age: float = 30) -> Dict[str, dict]:
+        try:
+            with open(self.vnc_stat, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if time.time() - data.get("updated", 0) > max_age:
+            return {}
+        result: Dict[str, dict] = {}
+        for item in data.get("sessions", []):
+            token = item.get("token") or item.get("target")
+            stat = result.get(token)
+            if stat is None:
+                stat = result[token] = {
+                    "target": item.get("target"), "sessions": 0,
+                    "bytes_in": 0, "bytes_out": 0, "frames_in": 0, "frames_out": 0,
+                    "connected": item["connected"], "idle": item["idle"], "rtt_ms": None}
+            stat["sessions"] += 1
+            for key in ("bytes_in", "bytes_out", "frames_in", "frames_out"):
+                stat[key] += item[key]
+            stat["connected"] = min(stat["connected"], item["connected"])
+            stat["idle"] = min(stat["idle"], item["idle"])
+            if item.get("rtt_ms") is not None:
+                stat["rtt_ms"] = max(stat["rtt_ms"] or 0, item["rtt_ms"])
+        return result
+
+    # 构建 websockify 启动命令 ###################################################
+    # .py 文件用当前 Python 执行（脚本会优先导入本地 Websockify 包），否则直接执行
+    # ############################################################################
+    def web_cmd(self) -> list:
+        if self.bin_path.endswith('.py'):
+            cmd = [sys.executable, self.bin_path]
+        else:
+            cmd = [self.bin_path]
+        # 单进程事件循环模式：所有控制台会话共用一个进程，不再每连接fork
+        cmd += ["--asyncio",
+                "--token-plugin", "TokenCache",
+                "--token-source", os.path.abspath(self.vnc_save),
+                "--metrics-file", os.path.abspath(self.vnc_stat),
+                str(self.web_port),
+                "--web", os.path.abspath(self.web_path)]
+        if self.session_idle:
+            cmd += ["--session-idle", str(self.session_idle)]
+        return cmd
+
     # 启动 websockify 服务 #######################################################
     def web_open(self):
         # 调试信息：打印所有关键路径
@@ -104,17 +199,7 @@ class WebsocketUI:
             else:
                 return False
 
-        # 构建命令：如果是 .py 文件则用 Python 执行，否则直接执行
-        if self.bin_path.endswith('.py'):
-            cmd = [sys.executable, self.bin_path]
-        else:
-            cmd = [self.bin_path]
-
-        cmd += ["--token-plugin", "TokenFile",
-                "--token-source", os.path.abspath(self.vnc_save),
-                str(self.web_port),
-                "--web", os.path.abspath(self.web_path)]
-
+        cmd = self.web_cmd()
         logger.info(f"启动 websockify: {self.web_port}")
         logger.info(f"执行命令: {' '.join(cmd)}")
         try:
@@ -140,24 +225,30 @@ class WebsocketUI:
     def add_port(self, ip: str, port: int, token: str) -> str:
         target = f"{ip}:{port}"
         # 检查是否已存在相同目标的 token
-        for existing_token, existing_target in self.storage.items():
-            if existing_target == target:
-                logger.info(f"VNC 目标 {target} 已存在，token: {existing_token}")
-                return existing_token
-
+        existing_token = self.targets.get(target)
+        if existing_token is not None:
+            logger.info(f"VNC 目标 {target} 已存在，token: {existing_token}")
+            return existing_token
+
+        # 同一 token 改指向新目标时移除旧的反向索引
+        if token in self.storage:
+            self.targets.pop(self.storage[token], None)
         self.storage[token] = target
-        self.cfg_save()
+        self.targets[target] = token
+        self.cfg_append(token, target)
+        self.cfg_push("set", token, target)
         logger.success(f"已添加 VNC: {target}, token: {token}")
         return token
 
     # 删除 VNC 目标 ##############################################################
     def del_port(self, ip, port):
-        for token, target in self.storage.items():
-            if target == f"{ip}:{port}":
-                del self.storage[token]
-                self.cfg_save()
-                logger.success(f"已删除 VNC: {ip}:{port}")
-                return True
+        token = self.targets.pop(f"{ip}:{port}", None)
+        if token is not None:
+            del self.storage[token]
+            self.cfg_save()
+            self.cfg_push("del", token)
+            logger.success(f"已删除 VNC: {ip}:{port}")
+            return True
         logger.warning(f"未找到 VNC: {ip}:{port}")
         return False
 
@@ -0,0 +1,164 @@
+"""
+WebsocketUI 启动测试脚本
+按 web_open 相同的命令行启动 websockify（--asyncio、TokenCache、--metrics-file、
+--session-idle），并在 PYTHONPATH 中放入缺少 TokenCache/asyncioproxy 的 websockify
+包模拟 pip 安装的版本，验证脚本仍使用本地 Websockify 包、推送令牌并转发数据
+"""
+
+import sys
+import os
+import time
+import base64
+import socket
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from VNCConsole.VNCSManager import WebsocketUI
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def echo_server() -> int:
+    """本地回显服务，作为控制台转发目标"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4)
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=lambda c=conn: [c.sendall(d) for d in iter(
+                lambda: c.recv(65536), b"")], daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def shadow_package(path: str) -> str:
+    """伪造一个与pip版本一样不含TokenCache/asyncioproxy的websockify包"""
+    package = os.path.join(path, "shadow", "websockify")
+    os.makedirs(package)
+    for name in ("__init__.py", "token_plugins.py"):
+        with open(os.path.join(package, name), "w") as f:
+            f.write("")
+    return os.path.dirname(package)
+
+
+def wait_for(check, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if check():
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def ws_echo(port: int, token: str, payload: bytes) -> tuple[socket.socket, bytes]:
+    """完成WebSocket握手，发送一帧二进制数据并读取回显，返回仍打开的连接"""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    key = base64.b64encode(os.urandom(16)).decode()
+    sock.sendall((f"GET /websockify?token={token} HTTP/1.1\r\n"
+                  f"Host: 127.0.0.1:{port}\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\n"
+                  f"Sec-WebSocket-Protocol: binary\r\n\r\n").encode())
+    head = b""
+    while b"\r\n\r\n" not in head:
+        head += sock.recv(4096)
+    assert head.startswith(b"HTTP/1.1 101"), head
+    mask = os.urandom(4)
+    sock.sendall(bytes([0x82, 0x80 | len(payload)]) + mask +
+                 bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+    data = head.split(b"\r\n\r\n", 1)[1]
+    while len(data) < 2 or len(data) < 2 + (data[1] & 0x7F):
+        data += sock.recv(4096)
+    assert data[0] == 0x82, data
+    return sock, data[2:2 + (data[1] & 0x7F)]
+
+
+@contextmanager
+def launched(session_idle=60):
+    """以web_open的命令行启动websockify，PYTHONPATH中放入伪造的pip版本"""
+    with tempfile.TemporaryDirectory() as path:
+        ui = WebsocketUI(web_port=free_port(), cfg_name="vnc-launch-test",
+                         session_idle=session_idle)
+        ui.vnc_save = os.path.join(path, "vnc-launch-test.cfg")
+        ui.vnc_stat = os.path.join(path, "vnc-launch-test.metrics.json")
+        ui.storage, ui.targets = {}, {}
+        ui.cfg_save()
+        env = dict(os.environ, PYTHONPATH=shadow_package(path))
+        proc = subprocess.Popen(ui.web_cmd(), env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        try:
+            ready = wait_for(lambda: proc.poll() is None and os.path.exists(
+                ui.vnc_save + ".port") and socket.create_connection(
+                ("127.0.0.1", ui.web_port), timeout=1).close() is None)
+            if not ready:
+                proc.kill()
+                raise AssertionError(proc.stdout.read().decode(errors="replace"))
+            yield ui
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+
+def test_launch_command_line():
+    """以web_open的命令行启动，确认使用本地包并可推送令牌、转发数据"""
+    with launched() as ui:
+        assert "--asyncio" in ui.web_cmd() and "--session-idle" in ui.web_cmd()
+        # 推送令牌后无需重写文件即可转发
+        target = echo_server()
+        ui.add_port("127.0.0.1", target, "tok1")
+        assert ui.cfg_push("set", "tok1", f"127.0.0.1:{target}")
+        sock, data = ws_echo(ui.web_port, "tok1", b"hello console")
+        sock.close()
+        assert data == b"hello console"
+        print("✅ websockify按web_open命令行启动，使用本地包并转发数据")
+
+
+def test_asyncio_engine():
+    """--asyncio单进程引擎在同一进程内服务多个会话，并发布会话指标"""
+    with launched() as ui:
+        target = echo_server()
+        # 同一目标只保留一个令牌，第二个会话经localhost连接同一回显服务
+        ui.add_port("127.0.0.1", target, "tok1")
+        ui.add_port("localhost", target, "tok2")
+        sessions = [ws_echo(ui.web_port, token, b"ping " + token.encode())
+                    for token in ("tok1", "tok2")]
+        try:
+            assert [data for _, data in sessions] == [b"ping tok1", b"ping tok2"]
+            # 指标文件由asyncio引擎定期写入（默认5秒）
+            assert wait_for(lambda: set(ui.get_stats()) == {"tok1", "tok2"}, 15), \
+                ui.get_stats()
+            stats = ui.get_stats()["tok1"]
+            assert stats["sessions"] == 1 and stats["bytes_in"] > 0, stats
+        finally:
+            for sock, _ in sessions:
+                sock.close()
+        print("✅ asyncio引擎同时服务多个会话并写入会话指标")
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("WebsocketUI 启动测试")
+    print("=" * 60)
+    test_launch_command_line()
+    test_asyncio_engine()
+    print("\n测试完成！")
+
+
+if __name__ == "__main__":
+    main()
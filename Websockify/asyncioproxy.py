@@ -0,0 +1,500 @@
+'''
+Single-process WebSocket to TCP proxy built on asyncio.
+
+The default WebSocketProxy engine forks one process per connection and
+polls each session with select(). This engine serves every session from
+one event loop instead, with per-session flow control:
+
+  * session_buffer bounds how much data may be queued towards either peer;
+    reading from the other side pauses until the queue drains, and
+    frames larger than the limit are refused with close code 1009
+  * session_idle closes sessions that carried no traffic for that many
+    seconds (close code 1000, "Idle timeout")
+  * metrics_file receives a JSON snapshot of every live session (token,
+    bytes and frames each way, connect and idle time, ping/pong RTT) every
+    metrics_interval seconds, so a supervising process can watch console
+    usage without talking to the proxy
+
+Selected with `--asyncio` in websockify_init.
+'''
+
+import asyncio
+import http.client
+import io
+import json
+import logging
+import mimetypes
+import os
+import signal
+import socket
+import ssl
+import struct
+import time
+from base64 import b64encode
+from hashlib import sha1
+from urllib.parse import parse_qs, unquote, urlparse
+
+from websockify import auth_plugins as auth
+from websockify.websocket import WebSocket
+
+
+class SessionClosed(Exception):
+    def __init__(self, code=1000, reason=''):
+        super().__init__(code, reason)
+        self.code = code
+        self.reason = reason
+
+
+class ProxySession:
+    """One WebSocket client proxied to one TCP target."""
+
+    def __init__(self, server, session_id, reader, writer, target_reader, target_writer,
+                 token=None, peer='', target=''):
+        self.server = server
+        self.session_id = session_id
+        self.token = token
+        self.peer = peer
+        self.target = target
+        self.reader = reader
+        self.writer = writer
+        self.target_reader = target_reader
+        self.target_writer = target_writer
+        self.codec = WebSocket()
+        self.connected = time.time()
+        self.started = time.monotonic()
+        self.last_active = self.started  # last data frame, either direction
+        self.bytes_in = 0   # client -> target payload
+        self.bytes_out = 0  # target -> client payload
+        self.frames_in = 0
+        self.frames_out = 0
+        self.rtt = None        # seconds, from the latest answered ping
+        self.ping_sent = None  # monotonic timestamp carried by the pending ping
+        self.closed = None
+
+        for transport in (writer.transport, target_writer.transport):
+            transport.set_write_buffer_limits(high=server.session_buffer)
+
+    async def send_frame(self, opcode, payload):
+        # Header and payload go out as separate buffers (no join copy)
+        self.writer.writelines(self.codec._encode_hybi_parts(opcode, payload))
+        await self.writer.drain()
+
+    async def recv_frame(self):
+        b1, b2 = await self.reader.readexactly(2)
+        length = b2 & 0x7f
+        if length == 126:
+            length, = struct.unpack('>H', await self.reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('>Q', await self.reader.readexactly(8))
+        if length > self.server.session_buffer:
+            raise SessionClosed(1009, "Message too big")
+        if not b2 & 0x80:
+            raise SessionClosed(1002, "Client frame not masked")
+        mask = await self.reader.readexactly(4)
+        payload = await self.reader.readexactly(length) if length else b''
+        if length:
+            payload = self.codec._unmask(payload, mask)
+        return b1 & 0x0f, payload
+
+    async def client_to_target(self):
+        while True:
+            try:
+                opcode, payload = await self.recv_frame()
+            except asyncio.IncompleteReadError:
+                raise SessionClosed(1006, "Client disconnected")
+            if opcode in (0x0, 0x1, 0x2):
+                # Control frames do not count as activity, otherwise
+                # heartbeat pongs would keep idle sessions open forever
+                self.last_active = time.monotonic()
+                self.frames_in += 1
+                if payload:
+                    self.bytes_in += len(payload)
+                    self.target_writer.write(payload)
+                    await self.target_writer.drain()
+            elif opcode == 0x8:
+                code, reason = 1000, ''
+                if len(payload) >= 2:
+                    code, = struct.unpack('>H', payload[:2])
+                    reason = payload[2:].decode('utf-8', 'replace')
+                raise SessionClosed(code, reason)
+            elif opcode == 0x9:
+                await self.send_frame(0xA, payload)
+            elif opcode == 0xA:
+                self.handle_pong(payload)
+            else:
+                raise SessionClosed(1003, "Unsupported opcode %d" % opcode)
+
+    async def target_to_client(self):
+        while True:
+            data = await self.target_reader.read(self.server.buffer_size)
+            if not data:
+                raise SessionClosed(1000, "Target closed")
+            self.last_active = time.monotonic()
+            self.bytes_out += len(data)
+            self.frames_out += 1
+            await self.send_frame(0x2, data)
+
+    def handle_pong(self, payload):
+        # Our pings carry their send time; browsers echo it back unchanged
+        if self.ping_sent is None or len(payload) != 8:
+            return
+        sent, = struct.unpack('>d', payload)
+        if sent == self.ping_sent:
+            self.rtt = time.monotonic() - sent
+            self.ping_sent = None
+
+    async def watchdog(self):
+        ping_interval = self.server.ping_interval
+        interval = min(filter(None, [self.server.session_idle, ping_interval, 5]))
+        next_ping = time.monotonic() + ping_interval
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            if self.server.session_idle and now - self.last_active > self.server.session_idle:
+                raise SessionClosed(1000, "Idle timeout")
+            if ping_interval and now >= next_ping:
+                next_ping = now + ping_interval
+                self.ping_sent = now
+                await self.send_frame(0x9, struct.pack('>d', now))
+
+    def info(self, now):
+        """Metrics record for this session; now is time.monotonic()."""
+        return {'id': self.session_id, 'token': self.token,
+                'peer': self.peer, 'target': self.target,
+                'connected': round(self.connected, 3),
+                'duration': round(now - self.started, 3),
+                'idle': round(now - self.last_active, 3),
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'frames_in': self.frames_in, 'frames_out': self.frames_out,
+                'rtt_ms': round(self.rtt * 1000, 2) if self.rtt is not None else None}
+
+    async def run(self):
+        tasks = [asyncio.ensure_future(coro) for coro in
+                 (self.client_to_target(), self.target_to_client(), self.watchdog())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            exc = next(iter(done)).exception()
+            if isinstance(exc, SessionClosed):
+                self.closed = exc
+            elif exc is not None:
+                self.closed = SessionClosed(1011, str(exc))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        code, reason = self.closed.code, self.closed.reason
+        if code != 1006:
+            try:
+                await asyncio.wait_for(self.send_frame(
+                    0x8, struct.pack('>H', code) + reason.encode('utf-8')[:123]), 1)
+            except (OSError, asyncio.TimeoutError):
+                pass
+        return code, reason
+
+
+class AsyncioProxyServer:
+    """
+    Like WebSocketProxy, but serves all sessions from one asyncio event
+    loop in a single process.
+    """
+
+    buffer_size = 65536
+    handshake_timeout = 10
+    connect_timeout = 10
+
+    def __init__(self, **kwargs):
+        # Proxy specific options
+        self.target_host = kwargs.pop('target_host', None)
+        self.target_port = kwargs.pop('target_port', None)
+        self.unix_target = kwargs.pop('unix_target', None)
+        self.ssl_target = kwargs.pop('ssl_target', None)
+        self.token_plugin = kwargs.pop('token_plugin', None)
+        self.host_token = kwargs.pop('host_token', None)
+        self.auth_plugin = kwargs.pop('auth_plugin', None)
+        self.heartbeat = kwargs.pop('heartbeat', None) or 0
+        self.session_idle = kwargs.pop('session_idle', 0) or 0
+        self.session_buffer = kwargs.pop('session_buffer', 0) or 4 * 1024 * 1024
+        self.metrics_file = kwargs.pop('metrics_file', None)
+        self.metrics_interval = kwargs.pop('metrics_interval', 0) or 5
+        # Pings double as RTT probes when metrics are published
+        self.ping_interval = self.heartbeat or \
+            (self.metrics_interval if self.metrics_file else 0)
+
+        # Server configuration
+        self.listen_host = kwargs.pop('listen_host', '')
+        self.listen_port = kwargs.pop('listen_port', None)
+        self.web = kwargs.pop('web', '') or ''
+        self.file_only = kwargs.pop('file_only', False)
+        self.verbose = kwargs.pop('verbose', False)
+        self.cert = os.path.abspath(kwargs.pop('cert', None) or 'self.pem')
+        self.key = kwargs.pop('key', None)
+        self.key_password = kwargs.pop('key_password', None)
+        self.ssl_only = kwargs.pop('ssl_only', False)
+        self.ssl_options = kwargs.pop('ssl_options', 0)
+        self.ssl_ciphers = kwargs.pop('ssl_ciphers', None)
+
+        # Only meaningful together with wrap_cmd, which is reported below
+        kwargs.pop('wrap_mode', None)
+        for arg, value in kwargs.items():
+            if value:
+                print("warning: option %s ignored when using --asyncio" % arg)
+
+        if self.web:
+            self.web = os.path.abspath(self.web)
+        if self.metrics_file:
+            self.metrics_file = os.path.abspath(self.metrics_file)
+
+        self.handler_id = 0
+        self.sessions = {}
+        self.totals = {'sessions': 0, 'bytes_in': 0, 'bytes_out': 0,
+                       'frames_in': 0, 'frames_out': 0}
+        self.logger = logging.getLogger("websocket.%s" % self.__class__.__name__)
+
+    def msg(self, *args, **kwargs):
+        self.logger.info(*args, **kwargs)
+
+    def vmsg(self, *args, **kwargs):
+        self.logger.debug(*args, **kwargs)
+
+    def stats(self):
+        """Current session count and transferred payload bytes and frames."""
+        result = {'active': len(self.sessions)}
+        result.update(self.totals)
+        for session in self.sessions.values():
+            for key in ('bytes_in', 'bytes_out', 'frames_in', 'frames_out'):
+                result[key] += getattr(session, key)
+        return result
+
+    def snapshot(self):
+        """Totals plus one record per live session."""
+        now = time.monotonic()
+        return {'pid': os.getpid(), 'updated': round(time.time(), 3),
+                'interval': self.metrics_interval, 'totals': self.stats(),
+                'sessions': [s.info(now) for s in self.sessions.values()]}
+
+    def write_metrics(self):
+        # Write aside and rename so readers never see a partial file
+        temp = "%s.%d.tmp" % (self.metrics_file, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp, self.metrics_file)
+
+    async def publish_metrics(self):
+        while True:
+            try:
+                self.write_metrics()
+            except OSError as e:
+                self.msg("Failed to write metrics to %s: %s", self.metrics_file, e)
+            await asyncio.sleep(self.metrics_interval)
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            self.msg("In exit")
+
+    async def serve(self, started=None):
+        ssl_context = None
+        if self.ssl_only:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.options |= self.ssl_options
+            if self.ssl_ciphers:
+                ssl_context.set_ciphers(self.ssl_ciphers)
+            ssl_context.load_cert_chain(self.cert, self.key, self.key_password)
+
+        server = await asyncio.start_server(
+            self.handle_client, self.listen_host or None, self.listen_port,
+            ssl=ssl_context, limit=self.buffer_size, reuse_address=True)
+        self.listen_port = server.sockets[0].getsockname()[1]
+        if self.token_plugin:
+            self.msg("  - proxying from %s:%s to targets generated by %s (asyncio)",
+                     self.listen_host, self.listen_port, type(self.token_plugin).__name__)
+        else:
+            self.msg("  - proxying from %s:%s to %s:%s (asyncio)", self.listen_host,
+                     self.listen_port, self.target_host, self.target_port)
+        if started is not None:
+            started.set()
+        try:
+            # Unwind normally on SIGTERM so the cleanup below runs
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+        publisher = None
+        if self.metrics_file:
+            publisher = asyncio.ensure_future(self.publish_metrics())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if publisher is not None:
+                publisher.cancel()
+                # A stale file would report sessions that no longer exist
+                try:
+                    os.unlink(self.metrics_file)
+                except OSError:
+                    pass
+
+    # HTTP handling
+
+    async def respond(self, writer, code, message, body=b'', headers=None):
+        head = "HTTP/1.1 %d %s\r\n" % (code, message)
+        for name, value in (headers or {}).items():
+            head += "%s: %s\r\n" % (name, value)
+        head += "Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body)
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve_file(self, writer, method, path):
+        if not self.web or method not in ('GET', 'HEAD'):
+            await self.respond(writer, 405, "Method Not Allowed")
+            return
+        relative = unquote(urlparse(path).path).lstrip('/') or 'index.html'
+        full = os.path.abspath(os.path.join(self.web, relative))
+        if os.path.isdir(full) and not self.file_only:
+            full = os.path.join(full, 'index.html')
+        if not full.startswith(self.web + os.sep) or not os.path.isfile(full):
+            await self.respond(writer, 404, "File not found")
+            return
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, lambda: open(full, 'rb').read())
+        ctype = mimetypes.guess_type(full)[0] or 'application/octet-stream'
+        await self.respond(writer, 200, "OK", b'' if method == 'HEAD' else body,
+                           {'Content-Type': ctype})
+
+    def get_token(self, path, headers):
+        if self.host_token:
+            token = headers.get('Host')
+            return token.partition(':')[0] if token else None
+        args = parse_qs(urlparse(path)[4])
+        if 'token' in args and len(args['token']):
+            return args['token'][0].rstrip('\n')
+        return None
+
+    async def get_target(self, token):
+        """Returns (host, port, unix_socket) or raises SessionClosed."""
+        if not self.token_plugin:
+            return self.target_host, self.target_port, self.unix_target
+        if token is None:
+            raise SessionClosed(403, "Token not present")
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self.token_plugin.lookup, token)
+        if result is None:
+            raise SessionClosed(403, "Token '%s' not found" % token)
+        host, port = result
+        if host == 'unix_socket':
+            return None, None, port
+        return host, port, None
+
+    async def handle_client(self, reader, writer):
+        self.handler_id += 1
+        session_id = self.handler_id
+        peer = writer.get_extra_info('peername') or ('', '')
+        try:
+            sock = writer.get_extra_info('socket')
+            if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                              self.handshake_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                return
+            except asyncio.LimitOverrunError:
+                await self.respond(writer, 431, "Request Header Fields Too Large")
+                return
+            request_line, _, rest = head.partition(b'\r\n')
+            try:
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                await self.respond(writer, 400, "Bad Request")
+                return
+            headers = http.client.parse_headers(io.BytesIO(rest))
+
+            if headers.get('upgrade', '').lower() != 'websocket':
+                await self.serve_file(writer, method, path)
+                return
+            await self.new_websocket_client(session_id, peer, reader, writer, path, headers)
+        except (OSError, ConnectionError) as e:
+            self.vmsg("%d: connection error: %s", session_id, e)
+        except asyncio.CancelledError:
+            # Server shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def new_websocket_client(self, session_id, peer, reader, writer, path, headers):
+        # Check the WebSocket handshake
+        key = headers.get('Sec-WebSocket-Key')
+        if headers.get('Sec-WebSocket-Version') not in ('7', '8', '13') or key is None:
+            await self.respond(writer, 400, "Bad Request")
+            return
+
+        token = self.get_token(path, headers) if self.token_plugin else None
+        try:
+            host, port, unix_socket = await self.get_target(token)
+        except SessionClosed as e:
+            self.msg("%s: %s", peer[0], e.reason)
+            await self.respond(writer, e.code, e.reason)
+            return
+
+        if self.auth_plugin:
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, lambda: self.auth_plugin.authenticate(
+                    headers=headers, target_host=host, target_port=port))
+            except auth.AuthenticationError as ex:
+                await self.respond(writer, ex.code, ex.msg, headers=ex.headers)
+                return
+
+        accept = b64encode(sha1((key + WebSocket.GUID).encode('ascii')).digest())
+        response = ("HTTP/1.1 101 Switching Protocols\r\n"
+                    "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                    "Sec-WebSocket-Accept: %s\r\n" % accept.decode('ascii'))
+        protocols = [p.strip() for p in headers.get('Sec-WebSocket-Protocol', '').split(',')]
+        if 'binary' in protocols:
+            response += "Sec-WebSocket-Protocol: binary\r\n"
+        writer.write((response + "\r\n").encode('latin-1'))
+        await writer.drain()
+
+        # Connect to the target
+        msg = "connecting to unix socket: %s" % unix_socket if unix_socket \
+            else "connecting to: %s:%s" % (host, port)
+        self.msg("%s: %s%s", peer[0], msg, " (using SSL)" if self.ssl_target else "")
+        target_ssl = None
+        if self.ssl_target:
+            target_ssl = ssl.create_default_context()
+            target_ssl.check_hostname = False
+            target_ssl.verify_mode = ssl.CERT_NONE
+        try:
+            if unix_socket:
+                connect = asyncio.open_unix_connection(unix_socket, ssl=target_ssl,
+                                                       limit=self.buffer_size)
+            else:
+                connect = asyncio.open_connection(host, int(port), ssl=target_ssl,
+                                                  limit=self.buffer_size)
+            target_reader, target_writer = await asyncio.wait_for(connect, self.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.msg("Failed to connect to %s:%s: %s", host, port, e)
+            writer.write(WebSocket()._encode_hybi(
+                0x8, struct.pack('>H', 1011) + b"Failed to connect to downstream server"))
+            await writer.drain()
+            return
+        if not unix_socket:
+            target_writer.get_extra_info('socket').setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        session = ProxySession(self, session_id, reader, writer, target_reader, target_writer,
+                               token=token, peer=peer[0],
+                               target=unix_socket or "%s:%s" % (host, port))
+        self.sessions[session_id] = session
+        self.totals['sessions'] += 1
+        try:
+            code, reason = await session.run()
+            self.vmsg("%s: session %d closed (%s %s), in=%d out=%d", peer[0], session_id,
+                      code, reason, session.bytes_in, session.bytes_out)
+        finally:
+            del self.sessions[session_id]
+            for key in ('bytes_in', 'bytes_out', 'frames_in', 'frames_out'):
+                self.totals[key] += getattr(session, key)
+            target_writer.close()
@@ -0,0 +1,265 @@
+'''
+Concurrent-session benchmark for the websockify proxy engines.
+
+Starts a local TCP echo target, then for each engine (the default
+fork-per-connection server and --asyncio) launches a proxy subprocess,
+opens SESSIONS WebSocket clients at once and streams BYTES through each
+one (client -> proxy -> echo -> proxy -> client). Reports throughput,
+setup time, and the process count and RSS of the proxy (needs psutil).
+
+    python -m websockify.benchmark --sessions 200 --bytes 1048576
+
+With --frames it instead runs a framing microbenchmark: unmasking and a
+WebSocket send/recv round trip over a socket pair for 64KiB and 1MiB
+frames, in both directions (masked client frames, unmasked server frames).
+
+    python -m websockify.benchmark --frames
+'''
+
+import asyncio
+import optparse
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from base64 import b64encode
+
+from websockify.websocket import WebSocket, WebSocketWantReadError, WebSocketWantWriteError
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+async def echo_handler(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def ws_session(port, token, total, chunk):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 20)
+    key = b64encode(os.urandom(16)).decode('ascii')
+    writer.write(("GET /websockify?token=%s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\n"
+                  "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                  "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n"
+                  "Sec-WebSocket-Protocol: binary\r\n\r\n" % (token, port, key)).encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    if not head.startswith(b'HTTP/1.1 101'):
+        raise RuntimeError(head.split(b'\r\n', 1)[0].decode())
+    codec = WebSocket()
+    payload = os.urandom(chunk)
+
+    async def send():
+        sent = 0
+        while sent < total:
+            part = payload[:min(chunk, total - sent)]
+            writer.write(codec._encode_hybi(0x2, part, mask_key=os.urandom(4)))
+            await writer.drain()
+            sent += len(part)
+
+    async def recv():
+        received = 0
+        while received < total:
+            b1, b2 = await reader.readexactly(2)
+            length = b2 & 0x7f
+            if length == 126:
+                length, = struct.unpack('>H', await reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack('>Q', await reader.readexactly(8))
+            data = await reader.readexactly(length)
+            if b1 & 0x0f == 0x8:
+                raise RuntimeError("closed by proxy: %r" % data[2:])
+            received += len(data)
+        return received
+
+    try:
+        _, received = await asyncio.gather(send(), recv())
+    finally:
+        writer.close()
+    return received
+
+
+def proxy_usage(proc):
+    if psutil is None:
+        return None, None
+    try:
+        parent = psutil.Process(proc.pid)
+        procs = [parent] + parent.children(recursive=True)
+        return len(procs), sum(p.memory_info().rss for p in procs)
+    except psutil.Error:
+        return None, None
+
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_engine(engine, token_file, sessions, total, chunk):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'websockify', '--token-plugin', 'TokenFile',
+           '--token-source', token_file, str(port)]
+    if engine == 'asyncio':
+        cmd.insert(3, '--asyncio')
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_port(port):
+            raise RuntimeError("%s proxy did not start" % engine)
+        started = time.perf_counter()
+        peak = [None, None]
+
+        async def sample():
+            while True:
+                count, rss = proxy_usage(proc)
+                if count and (peak[0] is None or count > peak[0]):
+                    peak[0] = count
+                if rss and (peak[1] is None or rss > peak[1]):
+                    peak[1] = rss
+                await asyncio.sleep(0.2)
+
+        sampler = asyncio.ensure_future(sample())
+        results = await asyncio.gather(
+            *[ws_session(port, 'bench', total, chunk) for _ in range(sessions)],
+            return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        ok = [r for r in results if not isinstance(r, Exception)]
+        errors = [r for r in results if isinstance(r, Exception)]
+        return {'engine': engine, 'sessions': len(ok), 'errors': len(errors),
+                'first_error': str(errors[0]) if errors else '',
+                'seconds': elapsed, 'mbps': sum(ok) / elapsed / 1e6,
+                'processes': peak[0], 'rss_mb': peak[1] / 1e6 if peak[1] else None}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def frame_pair():
+    a, b = socket.socketpair()
+    for sock in (a, b):
+        sock.setblocking(False)
+    server, client = WebSocket(), WebSocket()
+    server.socket, server.client, server._state = a, False, "done"
+    client.socket, client.client, client._state = b, True, "done"
+    return server, client
+
+
+def frame_transfer(sender, receiver, msg, count):
+    sent = received = 0
+    retry = False
+    while received < count:
+        if sent < count:
+            try:
+                sender.sendmsg(msg)
+                sent += 1
+                retry = False
+            except WebSocketWantWriteError:
+                retry = True
+        try:
+            while True:
+                if receiver.recvmsg() is not None:
+                    received += 1
+                if not receiver.pending():
+                    break
+        except WebSocketWantReadError:
+            pass
+    return retry
+
+
+def frame_benchmark(seconds=1.0):
+    for size in (64 * 1024, 1024 * 1024):
+        msg = os.urandom(size)
+        mask = os.urandom(4)
+        codec = WebSocket()
+        rows = []
+
+        count, started = 0, time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            codec._unmask(msg, mask)
+            count += 1
+        rows.append(('unmask', count * size / (time.perf_counter() - started)))
+
+        server, client = frame_pair()
+        for name, sender, receiver in (('client->server', client, server),
+                                       ('server->client', server, client)):
+            frames, started = 0, time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                frame_transfer(sender, receiver, msg, 8)
+                frames += 8
+            rows.append((name, frames * size / (time.perf_counter() - started)))
+        server.socket.close()
+        client.socket.close()
+
+        for name, rate in rows:
+            print("%5dKiB %-15s %8.1f MB/s" % (size // 1024, name, rate / 1e6))
+
+
+async def main_async(opts):
+    echo = await asyncio.start_server(echo_handler, '127.0.0.1', 0)
+    echo_port = echo.sockets[0].getsockname()[1]
+    with tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False) as f:
+        f.write("bench: 127.0.0.1:%d\n" % echo_port)
+        token_file = f.name
+    try:
+        for engine in opts.engines.split(','):
+            r = await run_engine(engine, token_file, opts.sessions, opts.bytes, opts.chunk)
+            print("%-8s sessions=%d errors=%d time=%.2fs throughput=%.1fMB/s "
+                  "processes=%s rss=%s%s" % (
+                      r['engine'], r['sessions'], r['errors'], r['seconds'], r['mbps'],
+                      r['processes'] if r['processes'] is not None else '-',
+                      '%.0fMB' % r['rss_mb'] if r['rss_mb'] is not None else '-',
+                      ' (%s)' % r['first_error'] if r['errors'] else ''))
+    finally:
+        echo.close()
+        os.unlink(token_file)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--sessions", type=int, default=100,
+                      help="concurrent WebSocket sessions (default 100)")
+    parser.add_option("--bytes", type=int, default=1024 * 1024,
+                      help="payload bytes echoed per session (default 1MiB)")
+    parser.add_option("--chunk", type=int, default=16384,
+                      help="WebSocket frame payload size (default 16KiB)")
+    parser.add_option("--engines", default="fork,asyncio",
+                      help="comma separated engines to compare (fork, asyncio)")
+    parser.add_option("--frames", action="store_true",
+                      help="run the frame encode/decode microbenchmark instead")
+    opts, _ = parser.parse_args()
+    if opts.frames:
+        frame_benchmark()
+    else:
+        asyncio.run(main_async(opts))
+
+
+if __name__ == '__main__':
+    main()
@@ -54,7 +54,9 @@ class ReadOnlyTokenFile(BasePlugin):
         else:
             cfg_files = [source]
 
-        self._targets = {}
+        # Build the new map aside and swap it in, so a concurrent lookup
+        # (or a fork) never sees a half-loaded map
+        targets = {}
         index = 1
         for f in cfg_files:
             with f.open() as file:
@@ -62,10 +64,11 @@ class ReadOnlyTokenFile(BasePlugin):
                     if line and not line.startswith('#'):
                         try:
                             tok, target = re.split(r':\s', line)
-                            self._targets[tok] = target.strip().rsplit(':', 1)
+                            targets[tok] = target.strip().rsplit(':', 1)
                         except ValueError:
                             logger.error("Syntax error in %s on line %d" % (self.source, index))
                     index += 1
+        self._targets = targets
 
     def lookup(self, token):
         if self._targets is None:
@@ -90,6 +93,147 @@ class TokenFile(ReadOnlyTokenFile):
         return super().lookup(token)
 
 
+class TokenCache(ReadOnlyTokenFile):
+    # source is a token file (or directory) like TokenFile, but the
+    # token map is kept in memory:
+    #   * lookups are a single dict access; the file is only re-read
+    #     when its mtime changes (checked on a miss and by a watcher
+    #     thread in the listening process, so forked handlers inherit
+    #     an up-to-date map)
+    #   * the manager can push changes over a local socket instead of
+    #     rewriting the file; each request is one JSON line:
+    #       {"op": "set", "token": "abc", "target": "host:port"}
+    #       {"op": "del", "token": "abc"}
+    #       {"op": "ping"}
+    #     The address is written to "<source>.port" (mode 0600) as JSON.
+    #     On POSIX it is a Unix socket "<source>.sock" with mode 0600:
+    #       {"unix": "/path/to/source.sock"}
+    #     elsewhere it is a loopback TCP port plus a random secret that
+    #     every request must carry in its "secret" field:
+    #       {"port": 12345, "secret": "..."}
+    watch_interval = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stamp = None
+        self._refresh()
+        self._listener = None
+        self._secret = None
+        try:
+            self._listen()
+        except OSError as e:
+            logger.warning("TokenCache push socket unavailable: %s" % e)
+
+    def __getstate__(self):
+        # Handlers started with the "spawn" method get a copy of the map
+        # but not the listener socket or threads
+        state = self.__dict__.copy()
+        state['_listener'] = None
+        return state
+
+    def _signature(self):
+        source = Path(self.source)
+        try:
+            if source.is_dir():
+                return tuple(sorted((f.name, f.stat().st_mtime_ns, f.stat().st_size)
+                                    for f in source.iterdir() if f.is_file()))
+            stat = source.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _refresh(self):
+        stamp = self._signature()
+        if self._targets is not None and stamp == self._stamp:
+            return False
+        if stamp is None:
+            self._targets = {}
+        else:
+            self._load_targets()
+        self._stamp = stamp
+        return True
+
+    def lookup(self, token):
+        target = self._targets.get(token)
+        if target is None and self._refresh():
+            target = self._targets.get(token)
+        return target
+
+    def _listen(self):
+        import os
+        import socket
+        import secrets
+        import threading
+
+        if hasattr(socket, 'AF_UNIX') and os.name != 'nt':
+            path = os.path.abspath(str(self.source) + '.sock')
+            if os.path.exists(path):
+                os.unlink(path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+            # Restrict access before listen() so nobody can connect in between
+            os.chmod(path, 0o600)
+            address = {'unix': path}
+        else:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            self._secret = secrets.token_hex(16)
+            address = {'port': listener.getsockname()[1], 'secret': self._secret}
+        listener.listen(16)
+        self._listener = listener
+        port_file = str(self.source) + '.port'
+        fd = os.open(port_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(address))
+        os.chmod(port_file, 0o600)
+        threading.Thread(target=self._serve, daemon=True).start()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        while self._listener is not None:
+            time.sleep(self.watch_interval)
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error("TokenCache reload failed: %s" % e)
+
+    def _serve(self):
+        while self._listener is not None:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            with conn:
+                conn.settimeout(5)
+                try:
+                    for line in conn.makefile('rb'):
+                        request = json.loads(line)
+                        if not self._authorized(request):
+                            conn.sendall(b'error unauthorized\n')
+                            break
+                        conn.sendall((self.apply(request) + '\n').encode())
+                except (OSError, ValueError) as e:
+                    logger.debug("TokenCache push connection closed: %s" % e)
+
+    def _authorized(self, request):
+        import hmac
+
+        if self._secret is None:
+            return True
+        secret = request.get('secret')
+        return isinstance(secret, str) and hmac.compare_digest(secret, self._secret)
+
+    def apply(self, request):
+        op = request.get('op')
+        if op == 'set':
+            self._targets[request['token']] = request['target'].strip().rsplit(':', 1)
+        elif op == 'del':
+            self._targets.pop(request['token'], None)
+        elif op != 'ping':
+            return 'error unknown op'
+        return 'ok'
+
+
 class TokenFileName(BasePlugin):
     # source is a directory
     # token is filename
@@ -13,13 +13,14 @@ Supports following protocol versions:
 '''
 
 import sys
-import array
 import email
 import errno
 import random
 import socket
 import ssl
 import struct
+from collections import deque
+from itertools import islice
 from base64 import b64encode
 from hashlib import sha1
 from urllib.parse import urlparse
@@ -27,10 +28,11 @@ from urllib.parse import urlparse
 try:
     import numpy
 except ImportError:
-    import warnings
-    warnings.warn("no 'numpy' module, HyBi protocol will be slower")
     numpy = None
 
+# XOR lookup tables for unmasking without numpy, one per mask byte
+_XOR_TABLES = [bytes(b ^ k for b in range(256)) for k in range(256)]
+
 
 class WebSocketWantReadError(ssl.SSLWantReadError):
     pass
@@ -72,6 +74,12 @@ class WebSocket:
 
     GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
+    # Initial size of the preallocated receive buffer; it grows to fit
+    # the largest frame seen on the connection
+    recv_size = 65536
+    # Most buffers handed to a single sendmsg() call
+    iov_max = 64
+
     def __init__(self):
         """Creates an unconnected WebSocket"""
 
@@ -79,9 +87,14 @@ class WebSocket:
 
         self._partial_msg = b''
 
-        self._recv_buffer = b''
-        self._recv_queue = []
-        self._send_buffer = b''
+        # Unread data is _recv_buffer[_recv_start:_recv_end]
+        self._recv_buffer = bytearray(self.recv_size)
+        self._recv_start = 0
+        self._recv_end = 0
+        self._recv_queue = deque()
+        # Queued output as memoryviews, sent with sendmsg() when possible
+        self._send_queue = deque()
+        self._scatter = None
 
         self._previous_sendmsg = None
 
@@ -188,10 +201,11 @@ class WebSocket:
             if not self._recv():
                 raise Exception("Socket closed unexpectedly")
 
-            if self._recv_buffer.find(b'\r\n\r\n') == -1:
+            data = bytes(self._recv_buffer[self._recv_start:self._recv_end])
+            if data.find(b'\r\n\r\n') == -1:
                 raise WebSocketWantReadError
 
-            (request, self._recv_buffer) = self._recv_buffer.split(b'\r\n', 1)
+            (request, rest) = data.split(b'\r\n', 1)
             request = request.decode("latin-1")
 
             words = request.split()
@@ -200,7 +214,8 @@ class WebSocket:
             if words[1] != "101":
                 raise Exception("WebSocket request denied: %s" % " ".join(words[1:]))
 
-            (headers, self._recv_buffer) = self._recv_buffer.split(b'\r\n\r\n', 1)
+            (headers, rest) = rest.split(b'\r\n\r\n', 1)
+            self._recv_start += len(data) - len(rest)
             headers = headers.decode('latin-1') + '\r\n'
             headers = email.message_from_string(headers)
 
@@ -566,22 +581,46 @@ class WebSocket:
         self.shutdown(socket.SHUT_RDWR, code, reason)
         self._close()
 
+    def _recv_reserve(self):
+        # Makes room at the end of the receive buffer, moving unread
+        # data to the front or growing the buffer when it is full
+        buf = self._recv_buffer
+        if self._recv_start == self._recv_end:
+            self._recv_start = self._recv_end = 0
+        if len(buf) - self._recv_end >= len(buf) // 4:
+            return
+        unread = self._recv_end - self._recv_start
+        if self._recv_start:
+            buf[:unread] = buf[self._recv_start:self._recv_end]
+            self._recv_start, self._recv_end = 0, unread
+        if len(buf) - unread < len(buf) // 4:
+            buf.extend(bytes(len(buf)))
+
     def _recv(self):
-        # Fetches more data from the socket to the buffer
+        # Fetches more data from the socket straight into the buffer
         assert self.socket is not None
 
         while True:
+            self._recv_reserve()
+            view = memoryview(self._recv_buffer)[self._recv_end:]
             try:
-                data = self.socket.recv(4096)
+                if hasattr(self.socket, "recv_into"):
+                    size = self.socket.recv_into(view)
+                else:
+                    data = self.socket.recv(len(view))
+                    size = len(data)
+                    view[:size] = data
             except OSError as exc:
                 if exc.errno == errno.EWOULDBLOCK:
                     raise WebSocketWantReadError
                 raise
+            finally:
+                view.release()
 
-            if len(data) == 0:
+            if size == 0:
                 return False
 
-            self._recv_buffer += data
+            self._recv_end += size
 
             # Support for SSLSocket like objects
             if hasattr(self.socket, "pending"):
@@ -602,19 +641,25 @@ class WebSocket:
             self._close()
             return False
 
-        while True:
-            frame = self._decode_hybi(self._recv_buffer)
-            if frame is None:
-                break
-            self._recv_buffer = self._recv_buffer[frame['length']:]
-            self._recv_queue.append(frame)
+        # Decode frames in place; payloads are copied out by the
+        # unmask (or bytes()) so the buffer can be reused
+        view = memoryview(self._recv_buffer)
+        try:
+            while True:
+                frame = self._decode_hybi(view[self._recv_start:self._recv_end])
+                if frame is None:
+                    break
+                self._recv_start += frame['length']
+                self._recv_queue.append(frame)
+        finally:
+            view.release()
 
         return True
 
     def _recvmsg(self):
         # Process pending frames and returns any application data
         while self._recv_queue:
-            frame = self._recv_queue.pop(0)
+            frame = self._recv_queue.popleft()
 
             if not self.client and not frame['masked']:
                 self.shutdown(socket.SHUT_RDWR, 1002, "Procotol error: Frame not masked")
@@ -699,38 +744,59 @@ class WebSocket:
         raise WebSocketWantReadError
 
     def _flush(self):
-        # Writes pending data to the socket
-        if not self._send_buffer:
+        # Writes pending data to the socket, handing several queued
+        # buffers to one sendmsg() call where the socket supports it
+        if not self._send_queue:
             return
 
         assert self.socket is not None
 
-        try:
-            sent = self.socket.send(self._send_buffer)
-        except OSError as exc:
-            if exc.errno == errno.EWOULDBLOCK:
-                raise WebSocketWantWriteError
-            raise
+        if self._scatter is None:
+            # SSL sockets and Windows have no usable sendmsg()
+            self._scatter = (hasattr(self.socket, "sendmsg") and
+                             not isinstance(self.socket, ssl.SSLSocket))
 
-        self._send_buffer = self._send_buffer[sent:]
+        while self._send_queue:
+            try:
+                if self._scatter:
+                    parts = list(islice(self._send_queue, self.iov_max))
+                    sent = self.socket.sendmsg(parts)
+                else:
+                    parts = [self._send_queue[0]]
+                    sent = self.socket.send(parts[0])
+            except OSError as exc:
+                if exc.errno == errno.EWOULDBLOCK:
+                    raise WebSocketWantWriteError
+                raise
 
-        if self._send_buffer:
-            raise WebSocketWantWriteError
+            offered = sum(len(part) for part in parts)
+            while sent:
+                head = self._send_queue[0]
+                if len(head) > sent:
+                    self._send_queue[0] = head[sent:]
+                    break
+                sent -= len(head)
+                self._send_queue.popleft()
+
+            if sent < offered and self._send_queue:
+                raise WebSocketWantWriteError
 
         # We had a pending close and we've flushed the buffer,
         # time to end things
         if self._received_close and self._sent_close:
             self._close()
 
-    def _send(self, data):
-        # Queues data and attempts to send it
-        self._send_buffer += data
+    def _send(self, *parts):
+        # Queues data without copying it and attempts to send it
+        for part in parts:
+            if part:
+                self._send_queue.append(memoryview(part).cast("B"))
         self._flush()
 
     def _queue_str(self, string):
         # Queue some data to be sent later.
         # Only used by the connecting methods.
-        self._send_buffer += string.encode("latin-1")
+        self._send_queue.append(memoryview(string.encode("latin-1")))
 
     def _sendmsg(self, opcode, msg):
         # Sends a standard data message
@@ -738,11 +804,11 @@ class WebSocket:
             mask = b''
             for i in range(4):
                 mask += random.randrange(256).to_bytes()
-            frame = self._encode_hybi(opcode, msg, mask)
+            parts = self._encode_hybi_parts(opcode, msg, mask)
         else:
-            frame = self._encode_hybi(opcode, msg)
+            parts = self._encode_hybi_parts(opcode, msg)
 
-        return self._send(frame)
+        return self._send(*parts)
 
     def _close(self):
         # Close the underlying socket
@@ -754,45 +820,45 @@ class WebSocket:
         return self._unmask(buf, mask)
 
     def _unmask(self, buf, mask):
-        # Unmask a frame
+        # Unmask a frame; buf may be any bytes-like object (including a
+        # memoryview into the receive buffer), the result is new bytes
+        plen = len(buf)
+        if plen == 0:
+            return b''
+        mask = bytes(mask)
         if numpy:
-            plen = len(buf)
             b = c = b''
             if plen >= 4:
                 dtype = numpy.dtype('<u4')
                 if sys.byteorder == 'big':
                     dtype = dtype.newbyteorder('>')
-                mask = numpy.frombuffer(mask, dtype, count=1)
+                mask_u4 = numpy.frombuffer(mask, dtype, count=1)
                 data = numpy.frombuffer(buf, dtype, count=int(plen / 4))
-                b = numpy.bitwise_xor(data, mask).tobytes()
+                b = numpy.bitwise_xor(data, mask_u4).tobytes()
 
             if plen % 4:
-                dtype = numpy.dtype('B')
-                if sys.byteorder == 'big':
-                    dtype = dtype.newbyteorder('>')
-                mask = numpy.frombuffer(mask, dtype, count=(plen % 4))
-                data = numpy.frombuffer(buf, dtype,
+                data = numpy.frombuffer(buf, numpy.uint8,
                                         offset=plen - (plen % 4), count=(plen % 4))
-                c = numpy.bitwise_xor(data, mask).tobytes()
+                mask_u1 = numpy.frombuffer(mask, numpy.uint8, count=(plen % 4))
+                c = numpy.bitwise_xor(data, mask_u1).tobytes()
             return b + c
+        elif plen < 1024:
+            # Small frames: XOR the whole payload as one integer
+            key = (mask * (plen // 4 + 1))[:plen]
+            return (int.from_bytes(buf, 'little') ^
+                    int.from_bytes(key, 'little')).to_bytes(plen, 'little')
         else:
-            # Slower fallback
-            data = array.array('B')
-            data.frombytes(buf)
-            for i in range(len(data)):
-                data[i] ^= mask[i % 4]
-            return data.tobytes()
+            # Large frames: every 4th byte shares a mask byte, so each
+            # of the four lanes is a single translate()
+            data = bytearray(buf)
+            for i in range(4):
+                data[i::4] = data[i::4].translate(_XOR_TABLES[mask[i]])
+            return bytes(data)
 
-    def _encode_hybi(self, opcode, buf, mask_key=None, fin=True):
-        """ Encode a HyBi style WebSocket frame.
-        Optional opcode:
-            0x0 - continuation
-            0x1 - text frame
-            0x2 - binary frame
-            0x8 - connection close
-            0x9 - ping
-            0xA - pong
-        """
+    def _encode_hybi_parts(self, opcode, buf, mask_key=None, fin=True):
+        """ Encode a HyBi style WebSocket frame as [header, payload]
+        so the payload can be sent without being copied next to the
+        header. Arguments as for _encode_hybi(). """
 
         b1 = opcode & 0x0f
         if fin:
@@ -812,12 +878,24 @@ class WebSocket:
             header = struct.pack('>BBQ', b1, 127 | mask_bit, payload_len)
 
         if mask_key is not None:
-            return header + mask_key + buf
-        else:
-            return header + buf
+            header += bytes(mask_key)
+        return [header, buf]
+
+    def _encode_hybi(self, opcode, buf, mask_key=None, fin=True):
+        """ Encode a HyBi style WebSocket frame.
+        Optional opcode:
+            0x0 - continuation
+            0x1 - text frame
+            0x2 - binary frame
+            0x8 - connection close
+            0x9 - ping
+            0xA - pong
+        """
+        return b''.join(self._encode_hybi_parts(opcode, buf, mask_key, fin))
 
     def _decode_hybi(self, buf):
         """ Decode HyBi style WebSocket packets.
+        buf may be a memoryview; the returned payload is always bytes.
         Returns:
             {'fin'          : boolean,
              'opcode'       : number,
@@ -838,7 +916,7 @@ class WebSocket:
         if blen < hlen:
             return None
 
-        b1, b2 = struct.unpack(">BB", buf[:2])
+        b1, b2 = struct.unpack_from(">BB", buf)
         f['opcode'] = b1 & 0x0f
         f['fin'] = not not (b1 & 0x80)
         f['masked'] = not not (b2 & 0x80)
@@ -854,12 +932,12 @@ class WebSocket:
             hlen += 2
             if blen < hlen:
                 return None
-            length, = struct.unpack('>H', buf[2:4])
+            length, = struct.unpack_from('>H', buf, 2)
         elif length == 127:
             hlen += 8
             if blen < hlen:
                 return None
-            length, = struct.unpack('>Q', buf[2:10])
+            length, = struct.unpack_from('>Q', buf, 2)
 
         f['length'] = hlen + length
 
@@ -871,6 +949,6 @@ class WebSocket:
             mask_key = buf[hlen - 4:hlen]
             f['payload'] = self._unmask(buf[hlen:(hlen + length)], mask_key)
         else:
-            f['payload'] = buf[hlen:(hlen + length)]
+            f['payload'] = bytes(buf[hlen:(hlen + length)])
 
         return f
@@ -28,6 +28,26 @@ import time
 from urllib.parse import parse_qs
 from urllib.parse import urlparse
 
+if not __package__:
+    # Run as a script (e.g. "python Websockify/websocketproxy.py"): import
+    # the bundled copy next to this file under the "websockify" name, so a
+    # pip-installed websockify without TokenCache/asyncioproxy does not
+    # shadow it.  Frozen builds ship the package separately and skip this.
+    _pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    _pkg_init = os.path.join(_pkg_dir, '__init__.py')
+    _loaded = sys.modules.get('websockify')
+    if os.path.exists(_pkg_init) and (
+            _loaded is None or _pkg_dir not in list(getattr(_loaded, '__path__', []))):
+        import importlib.util
+        _spec = importlib.util.spec_from_file_location(
+            'websockify', _pkg_init, submodule_search_locations=[_pkg_dir])
+        _module = importlib.util.module_from_spec(_spec)
+        for _name in [name for name in sys.modules
+                      if name == 'websockify' or name.startswith('websockify.')]:
+            del sys.modules[_name]
+        sys.modules['websockify'] = _module
+        _spec.loader.exec_module(_module)
+
 from websockify import websockifyserver
 from websockify import auth_plugins as auth
 
@@ -540,6 +560,20 @@ def websockify_init():
                       help="prefer IPv6 when resolving source_addr")
     parser.add_option("--libserver", action="store_true",
                       help="use Python library SocketServer engine")
+    parser.add_option("--asyncio", action="store_true",
+                      help="serve all sessions from one asyncio event loop "
+                      "instead of forking a process per connection")
+    parser.add_option("--session-idle", type=int, default=0, metavar="SECONDS",
+                      help="with --asyncio, close sessions idle for SECONDS")
+    parser.add_option("--session-buffer", type=int, default=4 * 1024 * 1024,
+                      metavar="BYTES",
+                      help="with --asyncio, bytes queued per session direction "
+                      "before reading from the other peer pauses (default 4MiB)")
+    parser.add_option("--metrics-file", default=None, metavar="FILE",
+                      help="with --asyncio, periodically write per-session "
+                      "metrics (bytes, frames, idle time, RTT) to FILE as JSON")
+    parser.add_option("--metrics-interval", type=int, default=5, metavar="SECONDS",
+                      help="seconds between --metrics-file updates (default 5)")
     parser.add_option("--target-config", metavar="FILE",
                       dest="target_cfg",
                       help="Configuration file containing valid targets "
@@ -752,7 +786,24 @@ def websockify_init():
     # Create and start the WebSockets proxy
     libserver = opts.libserver
     del opts.libserver
-    if libserver:
+    asyncio_mode = opts.asyncio
+    session_opts = {'session_idle': opts.session_idle,
+                    'session_buffer': opts.session_buffer,
+                    'metrics_file': opts.metrics_file,
+                    'metrics_interval': opts.metrics_interval}
+    if opts.metrics_file and not asyncio_mode:
+        parser.error("--metrics-file requires --asyncio")
+    del opts.asyncio
+    del opts.session_idle
+    del opts.session_buffer
+    del opts.metrics_file
+    del opts.metrics_interval
+    if asyncio_mode:
+        # Use a single-process asyncio event loop
+        from websockify.asyncioproxy import AsyncioProxyServer
+        server = AsyncioProxyServer(**opts.__dict__, **session_opts)
+        server.serve_forever()
+    elif libserver:
         # Use standard Python SocketServer framework
         server = LibProxyServer(**opts.__dict__)
         server.serve_forever()